@@ -1,45 +1,243 @@
 import argparse
 import binascii
+import hashlib
+import logging
 import sys
-from typing import List, Optional, Type, Union, cast
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple, Type, Union, cast
 
 import pyevmasm
 from moonstreamdb.models import ESDEventSignature, ESDFunctionSignature
 from sqlalchemy.orm.session import Session
-from sqlalchemy.sql.expression import text
 
-from moonstreamdb.db import yield_db_session
+from moonstreamdb.db import yield_db_session, yield_db_session_ctx
 
 from .data import ContractABI, EVMEventSignature, EVMFunctionSignature
+from .settings import (
+    MOONSTREAM_SIGNATURES_PRELOAD,
+    MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS,
+)
 
+logger = logging.getLogger(__name__)
 
-def query_for_text_signatures(
-    session: Session,
-    hex_signature: str,
-    db_model: Union[ESDFunctionSignature, ESDEventSignature],
-) -> List[str]:
-    query = session.query(db_model)
-    query = query.filter(db_model.hex_signature == hex_signature)
-    results = query.all()
-    text_signatures = []
-    for el in results:
-        text_signatures.append(el.text_signature)
-    return text_signatures
+# Number of bytecodes with memoized disassembly results
+DISASSEMBLY_CACHE_SIZE = 1024
+# Number of signatures loaded from database and added to index at once by refresh
+SIGNATURES_REFRESH_CHUNK_SIZE = 10000
+
+
+class SignaturesIndex:
+    """
+    In-memory index of ESD text signatures by integer value of hex signature.
+
+    Index is filled by refresh, usually from background thread started by
+    start_signatures_refresh. Signatures which are not in index yet, e.g. while
+    index is loading, are loaded from database with single IN query per lookup.
+    """
+
+    def __init__(
+        self,
+        db_model: Type[Union[ESDFunctionSignature, ESDEventSignature]],
+        hex_length: int,
+        refresh_interval: float = MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS,
+    ) -> None:
+        self.db_model = db_model
+        self.hex_length = hex_length
+        self.refresh_interval = refresh_interval
+
+        self._signatures: Dict[int, Tuple[str, ...]] = {}
+        # Signatures not found in database since last refresh
+        self._missing: Set[int] = set()
+        self._max_loaded_id: Optional[int] = None
+        self._refreshed_at = time.time()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def format(self, signature: int) -> str:
+        return f"0x{signature:0{self.hex_length}x}"
+
+    def _add(self, hex_signature: str, text_signature: str) -> None:
+        signature = int(hex_signature, 16)
+        text_signatures = self._signatures.get(signature, ())
+        if text_signature not in text_signatures:
+            self._signatures[signature] = text_signatures + (text_signature,)
+
+    def _add_loaded_rows(self, rows: List[Any]) -> None:
+        with self._lock:
+            for row in rows:
+                self._add(row.hex_signature, row.text_signature)
+                self._max_loaded_id = row.id
+
+    def refresh(self, session: Session) -> int:
+        """
+        Loads signatures added to database since previous refresh, or all signatures
+        on first refresh. Signatures are added to index by chunks, so lookups are not
+        blocked while whole table is loading.
+
+        Returns number of loaded signatures.
+        """
+        with self._refresh_lock:
+            query = session.query(
+                self.db_model.id,
+                self.db_model.hex_signature,
+                self.db_model.text_signature,
+            )
+            if self._max_loaded_id is not None:
+                query = query.filter(self.db_model.id > self._max_loaded_id)
+
+            loaded = 0
+            rows: List[Any] = []
+            for row in query.order_by(self.db_model.id).yield_per(
+                SIGNATURES_REFRESH_CHUNK_SIZE
+            ):
+                rows.append(row)
+                if len(rows) >= SIGNATURES_REFRESH_CHUNK_SIZE:
+                    self._add_loaded_rows(rows)
+                    loaded += len(rows)
+                    rows = []
+            self._add_loaded_rows(rows)
+            loaded += len(rows)
+
+            with self._lock:
+                self._missing.clear()
+                self._refreshed_at = time.time()
+            return loaded
+
+    def lookup(self, session: Session, signatures: List[int]) -> Dict[int, List[str]]:
+        """
+        Returns text signature candidates of each of given signatures.
+        """
+        with self._lock:
+            # Signatures could be added to database since they were looked up
+            if time.time() - self._refreshed_at > self.refresh_interval:
+                self._missing.clear()
+                self._refreshed_at = time.time()
+            misses = [
+                signature
+                for signature in signatures
+                if signature not in self._signatures and signature not in self._missing
+            ]
+
+        if misses:
+            rows = (
+                session.query(self.db_model.hex_signature, self.db_model.text_signature)
+                .filter(
+                    self.db_model.hex_signature.in_(
+                        [self.format(signature) for signature in misses]
+                    )
+                )
+                .order_by(self.db_model.id)
+                .all()
+            )
+            with self._lock:
+                for row in rows:
+                    self._add(row.hex_signature, row.text_signature)
+                self._missing.update(
+                    signature
+                    for signature in misses
+                    if signature not in self._signatures
+                )
+
+        with self._lock:
+            return {
+                signature: list(self._signatures.get(signature, ()))
+                for signature in signatures
+            }
+
+
+function_signatures_index = SignaturesIndex(ESDFunctionSignature, 8)
+event_signatures_index = SignaturesIndex(ESDEventSignature, 64)
+
+
+def _refresh_signatures_indexes(interval: float) -> None:
+    while True:
+        for index in [function_signatures_index, event_signatures_index]:
+            try:
+                with yield_db_session_ctx() as session:
+                    loaded = index.refresh(session)
+                logger.info(
+                    f"Loaded {loaded} {index.db_model.__tablename__} to signatures index, total: {len(index)}"
+                )
+            except Exception as e:
+                logger.error(
+                    f"Failed to refresh {index.db_model.__tablename__} signatures index: {e}"
+                )
+        time.sleep(interval)
+
+
+def start_signatures_refresh(
+    preload: bool = MOONSTREAM_SIGNATURES_PRELOAD,
+    interval: float = MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS,
+) -> Optional[threading.Thread]:
+    """
+    Starts daemon thread which loads all signatures to indexes and then loads
+    signatures added to database every interval seconds.
+
+    If preload is false, indexes keep only signatures of decoded contracts.
+    """
+    if not preload:
+        return None
+    thread = threading.Thread(
+        target=_refresh_signatures_indexes,
+        args=(interval,),
+        name="signatures-refresh",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+_disassembled: "OrderedDict[bytes, Tuple[Tuple[int, ...], Tuple[int, ...]]]" = (
+    OrderedDict()
+)
+_disassembled_lock = threading.Lock()
+
+
+def extract_signatures(bytecode: bytes) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """
+    Returns unique PUSH4 (function selectors) and PUSH32 (event topics) operands of
+    bytecode in order of appearance. Results are memoized by hash of bytecode.
+    """
+    code_hash = hashlib.sha256(bytecode).digest()
+    with _disassembled_lock:
+        signatures = _disassembled.get(code_hash)
+        if signatures is not None:
+            _disassembled.move_to_end(code_hash)
+            return signatures
+
+    function_signatures: Dict[int, None] = {}
+    event_signatures: Dict[int, None] = {}
+    for instruction in pyevmasm.disassemble_all(bytecode):
+        if instruction.name == "PUSH4":
+            function_signatures[instruction.operand] = None
+        elif instruction.name == "PUSH32":
+            event_signatures[instruction.operand] = None
+    signatures = (tuple(function_signatures), tuple(event_signatures))
+
+    with _disassembled_lock:
+        _disassembled[code_hash] = signatures
+        while len(_disassembled) > DISASSEMBLY_CACHE_SIZE:
+            _disassembled.popitem(last=False)
+    return signatures
 
 
 def decode_signatures(
     session: Session,
-    hex_signatures: List[str],
+    signatures: Tuple[int, ...],
     data_model: Union[Type[EVMEventSignature], Type[EVMFunctionSignature]],
-    db_model: Union[ESDEventSignature, ESDFunctionSignature],
+    signatures_index: SignaturesIndex,
 ) -> List[Union[EVMEventSignature, EVMFunctionSignature]]:
+    text_signatures = signatures_index.lookup(session, list(signatures))
     decoded_signatures = []
-    for hex_signature in hex_signatures:
-        signature = data_model(hex_signature=hex_signature)
-        signature.text_signature_candidates = query_for_text_signatures(
-            session, hex_signature, db_model
-        )
-        decoded_signatures.append(signature)
+    for signature in signatures:
+        decoded_signature = data_model(hex_signature=signatures_index.format(signature))
+        decoded_signature.text_signature_candidates = text_signatures[signature]
+        decoded_signatures.append(decoded_signature)
     return decoded_signatures
 
 
@@ -47,31 +245,24 @@ def decode_abi(source: str, session: Optional[Session] = None) -> ContractABI:
     normalized_source = source
     if normalized_source[:2] == "0x":
         normalized_source = normalized_source[2:]
-    disassembled = pyevmasm.disassemble_all(binascii.unhexlify(normalized_source))
-    function_hex_signatures = []
-    event_hex_signatures = []
+    function_hex_signatures, event_hex_signatures = extract_signatures(
+        binascii.unhexlify(normalized_source)
+    )
 
     should_close_session = False
     if session is None:
         should_close_session = True
         session = next(yield_db_session())
 
-    for instruction in disassembled:
-        if instruction.name == "PUSH4":
-            hex_signature = "0x{:x}".format(instruction.operand)
-            if hex_signature not in function_hex_signatures:
-                function_hex_signatures.append(hex_signature)
-        elif instruction.name == "PUSH32":
-            hex_signature = "0x{:x}".format(instruction.operand)
-            if hex_signature not in event_hex_signatures:
-                event_hex_signatures.append(hex_signature)
-
     try:
         function_signatures = decode_signatures(
-            session, function_hex_signatures, EVMFunctionSignature, ESDFunctionSignature
+            session,
+            function_hex_signatures,
+            EVMFunctionSignature,
+            function_signatures_index,
         )
         event_signatures = decode_signatures(
-            session, event_hex_signatures, EVMEventSignature, ESDEventSignature
+            session, event_hex_signatures, EVMEventSignature, event_signatures_index
         )
     finally:
         if should_close_session:
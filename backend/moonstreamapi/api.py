@@ -9,6 +9,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from . import actions, data
+from .abi_decoder import start_signatures_refresh
 from .middleware import BroodAuthMiddleware, MoonstreamHTTPException
 from .routes.address_info import router as addressinfo_router
 from .routes.dashboards import router as dashboards_router
@@ -78,6 +79,12 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def startup_event() -> None:
+    # Load ESD signatures for ABI decoder without blocking requests
+    start_signatures_refresh()
+
+
 @app.get("/ping", response_model=data.PingResponse)
 async def ping_handler() -> data.PingResponse:
     """
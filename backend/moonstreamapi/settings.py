@@ -111,3 +111,22 @@ if MOONSTREAM_S3_QUERIES_BUCKET_PREFIX == "":
     raise ValueError(
         "MOONSTREAM_S3_QUERIES_BUCKET_PREFIX environment variable must be set"
     )
+
+# ABI decoder
+# How often signatures indexes load signatures added to database
+MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS_RAW = os.environ.get(
+    "MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS", "600"
+)
+try:
+    MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS = int(
+        MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS_RAW
+    )
+except ValueError:
+    raise ValueError(
+        f"MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS must be an integer: {MOONSTREAM_SIGNATURES_REFRESH_INTERVAL_SECONDS_RAW}"
+    )
+# If true, every API worker process loads whole signatures database to memory,
+# otherwise indexes keep only signatures of decoded contracts
+MOONSTREAM_SIGNATURES_PRELOAD = os.environ.get(
+    "MOONSTREAM_SIGNATURES_PRELOAD", "false"
+).lower() in {"true", "t", "1"}
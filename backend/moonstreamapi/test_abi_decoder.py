@@ -0,0 +1,124 @@
+"""
+Tests for ABI decoder.
+"""
+import unittest
+from collections import namedtuple
+from typing import List
+
+from moonstreamdb.models import ESDFunctionSignature
+
+from . import abi_decoder
+
+TRANSFER_TOPIC = bytes.fromhex(
+    "ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+)
+
+
+class TestExtractSignatures(unittest.TestCase):
+    def test_extract_signatures(self):
+        bytecode = (
+            # PUSH4 name(), PUSH1, PUSH32 Transfer topic, PUSH4 name() again, PUSH4 0x0000abcd
+            b"\x63\x06\xfd\xde\x03"
+            + b"\x60\x00"
+            + b"\x7f"
+            + TRANSFER_TOPIC
+            + b"\x63\x06\xfd\xde\x03"
+            + b"\x63\x00\x00\xab\xcd"
+        )
+        function_signatures, event_signatures = abi_decoder.extract_signatures(bytecode)
+        self.assertTupleEqual(function_signatures, (0x06FDDE03, 0xABCD))
+        self.assertTupleEqual(
+            event_signatures, (int.from_bytes(TRANSFER_TOPIC, "big"),)
+        )
+        self.assertIs(abi_decoder.extract_signatures(bytecode)[0], function_signatures)
+        self.assertEqual(
+            abi_decoder.function_signatures_index.format(0xABCD), "0x0000abcd"
+        )
+
+
+SignatureRow = namedtuple("SignatureRow", ["id", "hex_signature", "text_signature"])
+
+
+class StubQuery:
+    def __init__(self, session: "StubSession") -> None:
+        self.session = session
+        self.rows = session.rows
+
+    def filter(self, expression):
+        self.session.filters.append((expression.left.key, expression.right.value))
+        if expression.left.key == "id":
+            self.rows = [row for row in self.rows if row.id > expression.right.value]
+        else:
+            self.rows = [
+                row for row in self.rows if row.hex_signature in expression.right.value
+            ]
+        return self
+
+    def order_by(self, *args):
+        return self
+
+    def yield_per(self, count):
+        return iter(self.rows)
+
+    def all(self):
+        return list(self.rows)
+
+
+class StubSession:
+    """
+    Serves ESD function signatures from rows and records filters of queries.
+    """
+
+    def __init__(self, rows: List[SignatureRow]) -> None:
+        self.rows = rows
+        self.filters: list = []
+
+    def query(self, *columns):
+        return StubQuery(self)
+
+
+class TestSignaturesIndex(unittest.TestCase):
+    def setUp(self):
+        self.session = StubSession(
+            [
+                SignatureRow(1, "0x06fdde03", "name()"),
+                SignatureRow(2, "0x95d89b41", "symbol()"),
+            ]
+        )
+        self.index = abi_decoder.SignaturesIndex(ESDFunctionSignature, 8)
+
+    def test_lookup_without_preload(self):
+        result = self.index.lookup(self.session, [0x06FDDE03, 0x95D89B41, 0xABCD])
+        self.assertDictEqual(
+            result, {0x06FDDE03: ["name()"], 0x95D89B41: ["symbol()"], 0xABCD: []}
+        )
+        # One IN query for all misses
+        self.assertListEqual(
+            self.session.filters,
+            [("hex_signature", ["0x06fdde03", "0x95d89b41", "0x0000abcd"])],
+        )
+
+        # Found and missing signatures are remembered
+        self.index.lookup(self.session, [0x06FDDE03, 0xABCD])
+        self.assertEqual(len(self.session.filters), 1)
+
+    def test_refresh(self):
+        self.assertEqual(self.index.refresh(self.session), 2)
+        self.assertEqual(len(self.index), 2)
+        self.assertDictEqual(
+            self.index.lookup(self.session, [0x06FDDE03]), {0x06FDDE03: ["name()"]}
+        )
+        self.assertListEqual(self.session.filters, [])
+
+        self.index.lookup(self.session, [0xABCD])
+        self.session.rows.append(SignatureRow(3, "0x0000abcd", "abcd()"))
+        self.session.rows.append(SignatureRow(4, "0x06fdde03", "collision()"))
+
+        # Refresh loads only new signatures and forgets missing ones
+        self.assertEqual(self.index.refresh(self.session), 2)
+        self.assertEqual(self.session.filters[-1], ("id", 2))
+        self.assertDictEqual(
+            self.index.lookup(self.session, [0x06FDDE03, 0xABCD]),
+            {0x06FDDE03: ["name()", "collision()"], 0xABCD: ["abcd()"]},
+        )
+        self.assertEqual(len(self.session.filters), 2)
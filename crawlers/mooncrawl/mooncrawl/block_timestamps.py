@@ -0,0 +1,219 @@
+"""
+Block timestamps cache shared by crawlers.
+"""
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+from web3 import Web3
+from web3._utils.rpc_abi import RPC
+
+from .blockchain import BatchRequestError, get_block_model, make_batch_request
+from .data import AvailableBlockchainType
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits number of variables in one statement by 999 in old versions
+SQLITE_MAX_VARIABLES = 900
+
+
+class BlockTimestampsCache:
+    """
+    Bounded LRU cache of block timestamps.
+
+    Timestamps missing in memory are looked up in optional on-disk SQLite store,
+    then in blocks table of database with one query and then at blockchain
+    with JSON-RPC batch requests. Timestamps from database and blockchain are
+    written to on-disk store, so they survive crawler restarts.
+
+    Cache could be shared by threads, each thread should pass its own db_session.
+    """
+
+    def __init__(
+        self,
+        blockchain_type: AvailableBlockchainType,
+        web3: Optional[Web3] = None,
+        max_size: int = 100000,
+        store_path: Optional[str] = None,
+        rpc_batch_size: int = 100,
+    ) -> None:
+        assert max_size > 0, "max_size must be greater than 0"
+        assert rpc_batch_size > 0, "rpc_batch_size must be greater than 0"
+
+        self.blockchain_type = blockchain_type
+        self.web3 = web3
+        self.max_size = max_size
+        self.rpc_batch_size = rpc_batch_size
+
+        self._timestamps: "OrderedDict[int, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._store: Optional[sqlite3.Connection] = None
+        if store_path is not None:
+            self._store = sqlite3.connect(store_path, check_same_thread=False)
+            self._store.execute(
+                "CREATE TABLE IF NOT EXISTS block_timestamps (block_number INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL)"
+            )
+            self._store.commit()
+
+        self.metrics = {
+            "memory_hits": 0,
+            "store_hits": 0,
+            "db_hits": 0,
+            "web3_hits": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def close(self) -> None:
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def _remember(self, timestamps: Dict[int, int]) -> None:
+        with self._lock:
+            for block_number, timestamp in timestamps.items():
+                self._timestamps[block_number] = timestamp
+                self._timestamps.move_to_end(block_number)
+            while len(self._timestamps) > self.max_size:
+                self._timestamps.popitem(last=False)
+
+    def _save_to_store(self, timestamps: Dict[int, int]) -> None:
+        if self._store is None or len(timestamps) == 0:
+            return
+        with self._lock:
+            self._store.executemany(
+                "INSERT OR REPLACE INTO block_timestamps (block_number, timestamp) VALUES (?, ?)",
+                list(timestamps.items()),
+            )
+            self._store.commit()
+
+    def _get_from_store(self, block_numbers: List[int]) -> Dict[int, int]:
+        timestamps: Dict[int, int] = {}
+        if self._store is None:
+            return timestamps
+        with self._lock:
+            for i in range(0, len(block_numbers), SQLITE_MAX_VARIABLES):
+                chunk = block_numbers[i : i + SQLITE_MAX_VARIABLES]
+                rows = self._store.execute(
+                    f"SELECT block_number, timestamp FROM block_timestamps WHERE block_number IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                timestamps.update({row[0]: row[1] for row in rows})
+        return timestamps
+
+    def _get_from_db(
+        self, db_session: Session, block_numbers: List[int]
+    ) -> Dict[int, int]:
+        block_model = get_block_model(self.blockchain_type)
+        rows = (
+            db_session.query(block_model.block_number, block_model.timestamp)
+            .filter(block_model.block_number.in_(block_numbers))
+            .all()
+        )
+        return {row[0]: row[1] for row in rows}
+
+    def _get_from_web3(self, block_numbers: List[int]) -> Dict[int, int]:
+        if self.web3 is None:
+            raise ValueError(
+                f"Timestamps of {len(block_numbers)} blocks not found and web3 client is not provided"
+            )
+
+        timestamps: Dict[int, int] = {}
+        for i in range(0, len(block_numbers), self.rpc_batch_size):
+            chunk = block_numbers[i : i + self.rpc_batch_size]
+            try:
+                raw_blocks = make_batch_request(
+                    self.web3,
+                    RPC.eth_getBlockByNumber,
+                    [[hex(block_number), False] for block_number in chunk],
+                )
+            except BatchRequestError:
+                # Provider doesn't support batch requests, fetch blocks one by one
+                raw_blocks = [
+                    {"timestamp": self.web3.eth.get_block(block_number)["timestamp"]}
+                    for block_number in chunk
+                ]
+            for block_number, raw_block in zip(chunk, raw_blocks):
+                if raw_block is None:
+                    raise ValueError(f"Block (number={block_number}) not found")
+                timestamp = raw_block["timestamp"]
+                timestamps[block_number] = (
+                    int(timestamp, 16) if isinstance(timestamp, str) else timestamp
+                )
+        return timestamps
+
+    def prefill(self, db_session: Session, from_block: int, to_block: int) -> None:
+        """
+        Load timestamps of all blocks between from_block and to_block (inclusive)
+        stored in database with one query.
+        """
+        block_model = get_block_model(self.blockchain_type)
+        rows = (
+            db_session.query(block_model.block_number, block_model.timestamp)
+            .filter(block_model.block_number >= from_block)
+            .filter(block_model.block_number <= to_block)
+            .all()
+        )
+        self._remember({row[0]: row[1] for row in rows})
+
+    def get_many(
+        self,
+        db_session: Optional[Session],
+        block_numbers: Iterable[int],
+        use_web3: bool = True,
+    ) -> Dict[int, int]:
+        """
+        Get timestamps of blocks, returns block_number -> timestamp mapping.
+
+        If db_session is None, database lookup is skipped. If use_web3 is False,
+        blocks not found in cache or database are left out of result.
+        """
+        timestamps: Dict[int, int] = {}
+        missing: List[int] = []
+        with self._lock:
+            for block_number in set(block_numbers):
+                timestamp = self._timestamps.get(block_number)
+                if timestamp is None:
+                    missing.append(block_number)
+                else:
+                    self._timestamps.move_to_end(block_number)
+                    timestamps[block_number] = timestamp
+        self.metrics["memory_hits"] += len(timestamps)
+        if len(missing) == 0:
+            return timestamps
+
+        found = self._get_from_store(missing)
+        self.metrics["store_hits"] += len(found)
+        missing = [
+            block_number for block_number in missing if block_number not in found
+        ]
+
+        fetched: Dict[int, int] = {}
+        if len(missing) > 0 and db_session is not None:
+            fetched = self._get_from_db(db_session, missing)
+            self.metrics["db_hits"] += len(fetched)
+            missing = [
+                block_number for block_number in missing if block_number not in fetched
+            ]
+        if len(missing) > 0 and use_web3:
+            from_web3 = self._get_from_web3(missing)
+            self.metrics["web3_hits"] += len(from_web3)
+            fetched.update(from_web3)
+
+        self._save_to_store(fetched)
+        found.update(fetched)
+        self._remember(found)
+        timestamps.update(found)
+
+        return timestamps
+
+    def get(self, db_session: Optional[Session], block_number: int) -> int:
+        """
+        Get timestamp of block.
+        """
+        return self.get_many(db_session, [block_number])[block_number]
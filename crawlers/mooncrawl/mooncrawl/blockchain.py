@@ -1,8 +1,32 @@
+import io
+import json
 import logging
+import math
+import time
+from collections import deque
 from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
-from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
+from contextlib import nullcontext
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
 
-from moonstreamdb.db import yield_db_session, yield_db_session_ctx
+from eth_typing import URI
+from moonstreamdb.db import (
+    SessionLocal,
+    dispose_engines_after_fork,
+    yield_db_session,
+    yield_db_session_ctx,
+)
 from moonstreamdb.models import (
     EthereumBlock,
     EthereumLabel,
@@ -12,16 +36,22 @@ from moonstreamdb.models import (
     PolygonTransaction,
 )
 from psycopg2.errors import UniqueViolation  # type: ignore
-from sqlalchemy import Column, desc, func
+from sqlalchemy import Column, desc, func, text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Query, Session
 from tqdm import tqdm
 from web3 import HTTPProvider, IPCProvider, Web3
+from web3._utils.method_formatters import get_result_formatters
+from web3._utils.request import make_post_request
+from web3._utils.rpc_abi import RPC
 from web3.middleware import geth_poa_middleware
+from web3.middleware.geth_poa import geth_poa_cleanup
 from web3.types import BlockData
 
-from .data import AvailableBlockchainType, DateRange
+from .data import AvailableBlockchainType, BlocksLoader, DateRange
 from .settings import (
+    MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT,
+    MOONSTREAM_CRAWL_SHARDS_PER_WORKER,
     MOONSTREAM_CRAWL_WORKERS,
     MOONSTREAM_ETHEREUM_WEB3_PROVIDER_URI,
     MOONSTREAM_POLYGON_WEB3_PROVIDER_URI,
@@ -37,6 +67,12 @@ class BlockCrawlError(Exception):
     """
 
 
+class BatchRequestError(Exception):
+    """
+    Raised when JSON-RPC batch request could not be completed by node.
+    """
+
+
 def connect(blockchain_type: AvailableBlockchainType, web3_uri: Optional[str] = None):
     web3_provider: Union[IPCProvider, HTTPProvider] = Web3.IPCProvider()
 
@@ -116,39 +152,71 @@ def get_transaction_model(
     return transaction_model
 
 
-def add_block(db_session, block: Any, blockchain_type: AvailableBlockchainType) -> None:
+def get_block_row(block: Any) -> Dict[str, Any]:
     """
-    Add block if doesn't presented in database.
+    Prepare block columns values for blocks table.
 
     block: web3.types.BlockData
     """
-    block_model = get_block_model(blockchain_type)
-
     # BlockData.extraData doesn't exist at Polygon mainnet
     extra_data = None
     if block.get("extraData", None) is not None:
         extra_data = block.get("extraData").hex()
 
-    block_obj = block_model(
-        block_number=block.number,
-        difficulty=block.difficulty,
-        extra_data=extra_data,
-        gas_limit=block.gasLimit,
-        gas_used=block.gasUsed,
-        base_fee_per_gas=block.get("baseFeePerGas", None),
-        hash=block.hash.hex(),
-        logs_bloom=block.logsBloom.hex(),
-        miner=block.miner,
-        nonce=block.nonce.hex(),
-        parent_hash=block.parentHash.hex(),
-        receipt_root=block.get("receiptRoot", ""),
-        uncles=block.sha3Uncles.hex(),
-        size=block.size,
-        state_root=block.stateRoot.hex(),
-        timestamp=block.timestamp,
-        total_difficulty=block.totalDifficulty,
-        transactions_root=block.transactionsRoot.hex(),
-    )
+    return {
+        "block_number": block.number,
+        "difficulty": block.difficulty,
+        "extra_data": extra_data,
+        "gas_limit": block.gasLimit,
+        "gas_used": block.gasUsed,
+        "base_fee_per_gas": block.get("baseFeePerGas", None),
+        "hash": block.hash.hex(),
+        "logs_bloom": block.logsBloom.hex(),
+        "miner": block.miner,
+        "nonce": block.nonce.hex(),
+        "parent_hash": block.parentHash.hex(),
+        "receipt_root": block.get("receiptRoot", ""),
+        "uncles": block.sha3Uncles.hex(),
+        "size": block.size,
+        "state_root": block.stateRoot.hex(),
+        "timestamp": block.timestamp,
+        "total_difficulty": block.totalDifficulty,
+        "transactions_root": block.transactionsRoot.hex(),
+    }
+
+
+def get_transaction_row(block: Any, tx: Any) -> Dict[str, Any]:
+    """
+    Prepare transaction columns values for transactions table.
+
+    block: web3.types.BlockData
+    tx: web3.types.TxData
+    """
+    return {
+        "hash": tx.hash.hex(),
+        "block_number": block.number,
+        "from_address": tx["from"],
+        "to_address": tx.to,
+        "gas": tx.gas,
+        "gas_price": tx.gasPrice,
+        "max_fee_per_gas": tx.get("maxFeePerGas", None),
+        "max_priority_fee_per_gas": tx.get("maxPriorityFeePerGas", None),
+        "input": tx.input,
+        "nonce": tx.nonce,
+        "transaction_index": tx.transactionIndex,
+        "transaction_type": int(tx["type"], 0) if tx["type"] is not None else None,
+        "value": tx.value,
+    }
+
+
+def add_block(db_session, block: Any, blockchain_type: AvailableBlockchainType) -> None:
+    """
+    Add block if doesn't presented in database.
+
+    block: web3.types.BlockData
+    """
+    block_model = get_block_model(blockchain_type)
+    block_obj = block_model(**get_block_row(block))
     db_session.add(block_obj)
 
 
@@ -162,24 +230,220 @@ def add_block_transactions(
     """
     transaction_model = get_transaction_model(blockchain_type)
     for tx in block.transactions:
-        tx_obj = transaction_model(
-            hash=tx.hash.hex(),
-            block_number=block.number,
-            from_address=tx["from"],
-            to_address=tx.to,
-            gas=tx.gas,
-            gas_price=tx.gasPrice,
-            max_fee_per_gas=tx.get("maxFeePerGas", None),
-            max_priority_fee_per_gas=tx.get("maxPriorityFeePerGas", None),
-            input=tx.input,
-            nonce=tx.nonce,
-            transaction_index=tx.transactionIndex,
-            transaction_type=int(tx["type"], 0) if tx["type"] is not None else None,
-            value=tx.value,
-        )
+        tx_obj = transaction_model(**get_transaction_row(block, tx))
         db_session.add(tx_obj)
 
 
+def _copy_value(value: Any) -> str:
+    """
+    Format value for PostgreSQL COPY text format.
+    """
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_rows_into_table(
+    cursor: Any, table_name: str, columns: List[str], rows: List[Dict[str, Any]]
+) -> int:
+    """
+    Stream rows into staging table with COPY and move them to target table
+    skipping rows which already exist.
+
+    Staging table lives until the end of database transaction.
+
+    Returns number of inserted rows.
+    """
+    if len(rows) == 0:
+        return 0
+
+    staging_table_name = f"{table_name}_staging"
+    columns_str = ", ".join(columns)
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[column]) for column in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging_table_name} "
+        f"(LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP"
+    )
+    cursor.copy_expert(
+        f"COPY {staging_table_name} ({columns_str}) FROM STDIN WITH (FORMAT text)",
+        buffer,
+    )
+    cursor.execute(
+        f"INSERT INTO {table_name} ({columns_str}) "
+        f"SELECT {columns_str} FROM {staging_table_name} "
+        "ON CONFLICT DO NOTHING"
+    )
+    inserted = cursor.rowcount
+    cursor.execute(f"TRUNCATE {staging_table_name}")
+
+    return inserted
+
+
+def add_blocks_copy(
+    db_session: Session,
+    blocks: List[BlockData],
+    blockchain_type: AvailableBlockchainType,
+    with_transactions: bool = False,
+) -> Tuple[int, int]:
+    """
+    Add blocks and their transactions with PostgreSQL COPY into staging tables
+    followed by single INSERT ... ON CONFLICT DO NOTHING for each table.
+
+    Blocks and transactions which already exist in database are skipped.
+    Commit is left to caller.
+
+    Returns number of inserted blocks and transactions.
+    """
+    block_model = get_block_model(blockchain_type)
+    transaction_model = get_transaction_model(blockchain_type)
+
+    block_rows = [get_block_row(block) for block in blocks]
+    transaction_rows: List[Dict[str, Any]] = []
+    if with_transactions:
+        transaction_rows = [
+            get_transaction_row(block, tx)
+            for block in blocks
+            for tx in block["transactions"]
+        ]
+
+    cursor = db_session.connection().connection.cursor()
+    try:
+        blocks_inserted = _copy_rows_into_table(
+            cursor,
+            block_model.__tablename__,
+            list(block_rows[0].keys()) if block_rows else [],
+            block_rows,
+        )
+        transactions_inserted = _copy_rows_into_table(
+            cursor,
+            transaction_model.__tablename__,
+            list(transaction_rows[0].keys()) if transaction_rows else [],
+            transaction_rows,
+        )
+    finally:
+        cursor.close()
+
+    return blocks_inserted, transactions_inserted
+
+
+def make_raw_batch_request(
+    web3_client: Web3,
+    method: str,
+    params_list: List[List[Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Pack calls of one JSON-RPC method into single batch request and send it to node.
+
+    Returns JSON-RPC response objects with result or error of each call in the same
+    order as params_list. Batch requests are supported only for HTTP providers.
+    """
+    provider = web3_client.provider
+    if not isinstance(provider, HTTPProvider):
+        raise BatchRequestError(
+            f"JSON-RPC batch requests are not supported by {type(provider).__name__}"
+        )
+    if len(params_list) == 0:
+        return []
+
+    payload = [
+        {"jsonrpc": "2.0", "id": index, "method": method, "params": params}
+        for index, params in enumerate(params_list)
+    ]
+    raw_response = make_post_request(
+        cast(URI, provider.endpoint_uri),
+        json.dumps(payload).encode("utf8"),
+        **provider.get_request_kwargs(),
+    )
+    response = json.loads(raw_response)
+
+    # Node responds with single error object if whole batch was rejected
+    if not isinstance(response, list):
+        raise BatchRequestError(
+            f"Batch request with {len(params_list)} {method} calls failed: {response.get('error', response)}"
+        )
+
+    responses: List[Dict[str, Any]] = [{} for _ in params_list]
+    for item in response:
+        responses[item["id"]] = item
+
+    return responses
+
+
+def make_batch_request(
+    web3_client: Web3,
+    method: str,
+    params_list: List[List[Any]],
+    allow_errors: bool = False,
+) -> List[Any]:
+    """
+    Pack calls of one JSON-RPC method into single batch request and send it to node.
+
+    Returns raw results in the same order as params_list. Batch requests are
+    supported only for HTTP providers. With allow_errors failed calls return None
+    instead of failing the whole batch, e.g. for reverted eth_call.
+    """
+    results: List[Any] = []
+    for params, response in zip(
+        params_list, make_raw_batch_request(web3_client, method, params_list)
+    ):
+        if response.get("error") is not None:
+            if allow_errors:
+                results.append(None)
+                continue
+            raise BatchRequestError(
+                f"Call {method} with params {params} failed: {response['error']}"
+            )
+        results.append(response.get("result"))
+
+    return results
+
+
+def get_blocks_batch(
+    web3_client: Web3,
+    blockchain_type: AvailableBlockchainType,
+    blocks_numbers: List[int],
+    with_transactions: bool = False,
+) -> List[BlockData]:
+    """
+    Fetch list of blocks with one eth_getBlockByNumber JSON-RPC batch request.
+
+    Blocks are formatted the same way as web3_client.eth.get_block does it.
+    """
+    raw_blocks = make_batch_request(
+        web3_client,
+        RPC.eth_getBlockByNumber,
+        [[hex(block_number), with_transactions] for block_number in blocks_numbers],
+    )
+
+    # Annotation of get_result_formatters doesn't match, it returns composed formatter
+    result_formatter = cast(
+        Callable[[Any], BlockData],
+        get_result_formatters(RPC.eth_getBlockByNumber, web3_client.eth),
+    )
+    blocks: List[BlockData] = []
+    for block_number, raw_block in zip(blocks_numbers, raw_blocks):
+        if raw_block is None:
+            raise BlockCrawlError(f"Block (number={block_number}) not found at node")
+        # Keep blocks structure consistent with geth_poa_middleware from connect()
+        if blockchain_type != AvailableBlockchainType.ETHEREUM:
+            raw_block = geth_poa_cleanup(raw_block)
+        blocks.append(result_formatter(raw_block))
+
+    return blocks
+
+
 def get_latest_blocks(
     blockchain_type: AvailableBlockchainType, confirmations: int = 0
 ) -> Tuple[Optional[int], int]:
@@ -208,16 +472,49 @@ def get_latest_blocks(
     return latest_stored_block_number, latest_block_number
 
 
+def _db_session_ctx(db_session: Optional[Session] = None) -> ContextManager[Session]:
+    """
+    Open new database session or reuse provided one without closing it.
+    """
+    if db_session is None:
+        return yield_db_session_ctx()
+    return nullcontext(db_session)
+
+
 def crawl_blocks(
     blockchain_type: AvailableBlockchainType,
     blocks_numbers: List[int],
     with_transactions: bool = False,
+    batch_size: int = 1,
+    batches_in_flight: int = MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT,
+    loader: BlocksLoader = BlocksLoader.ORM,
+    web3_client: Optional[Web3] = None,
+    db_session: Optional[Session] = None,
 ) -> None:
     """
     Open database and geth sessions and fetch block data from blockchain.
+
+    If batch_size > 1, blocks are fetched with JSON-RPC batch requests of batch_size
+    blocks, no more than batches_in_flight batches are requested from node at a time.
+
+    Already opened web3_client and db_session could be passed to reuse connections,
+    db_session is not closed at the end in this case.
     """
-    web3_client = connect(blockchain_type)
-    with yield_db_session_ctx() as db_session:
+    if batch_size > 1:
+        return crawl_blocks_batches(
+            blockchain_type,
+            blocks_numbers,
+            with_transactions,
+            batch_size,
+            batches_in_flight,
+            loader,
+            web3_client,
+            db_session,
+        )
+
+    if web3_client is None:
+        web3_client = connect(blockchain_type)
+    with _db_session_ctx(db_session) as db_session:
         pbar = tqdm(total=len(blocks_numbers))
         for block_number in blocks_numbers:
             pbar.set_description(
@@ -227,10 +524,15 @@ def crawl_blocks(
                 block: BlockData = web3_client.eth.get_block(
                     block_number, full_transactions=with_transactions
                 )
-                add_block(db_session, block, blockchain_type)
+                if loader == BlocksLoader.COPY:
+                    add_blocks_copy(
+                        db_session, [block], blockchain_type, with_transactions
+                    )
+                else:
+                    add_block(db_session, block, blockchain_type)
 
-                if with_transactions:
-                    add_block_transactions(db_session, block, blockchain_type)
+                    if with_transactions:
+                        add_block_transactions(db_session, block, blockchain_type)
 
                 db_session.commit()
             except IntegrityError as err:
@@ -252,83 +554,405 @@ def crawl_blocks(
         pbar.close()
 
 
-def check_missing_blocks(
+def add_blocks_batch(
+    db_session: Session,
+    blocks: List[BlockData],
+    blockchain_type: AvailableBlockchainType,
+    with_transactions: bool = False,
+) -> None:
+    """
+    Add batch of blocks in one database transaction.
+
+    If some of blocks already exist, batch is rolled back and blocks are
+    added one by one skipping existing ones.
+    """
+    try:
+        for block in blocks:
+            add_block(db_session, block, blockchain_type)
+            if with_transactions:
+                add_block_transactions(db_session, block, blockchain_type)
+        db_session.commit()
+        return
+    except IntegrityError as err:
+        assert isinstance(err.orig, UniqueViolation)
+        db_session.rollback()
+        logger.warning(
+            "UniqueViolation error occurred in batch, adding blocks one by one"
+        )
+
+    for block in blocks:
+        try:
+            add_block(db_session, block, blockchain_type)
+            if with_transactions:
+                add_block_transactions(db_session, block, blockchain_type)
+            db_session.commit()
+        except IntegrityError as err:
+            assert isinstance(err.orig, UniqueViolation)
+            db_session.rollback()
+            logger.warning(
+                f"UniqueViolation error occurred, block (number={block['number']}) already exists"
+            )
+
+
+def crawl_blocks_batches(
     blockchain_type: AvailableBlockchainType,
     blocks_numbers: List[int],
-    notransactions=False,
-) -> List[int]:
+    with_transactions: bool = False,
+    batch_size: int = 100,
+    batches_in_flight: int = MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT,
+    loader: BlocksLoader = BlocksLoader.ORM,
+    web3_client: Optional[Web3] = None,
+    db_session: Optional[Session] = None,
+) -> None:
     """
-    Query block from postgres. If block does not presented in database,
-    add to missing blocks numbers list.
-    If arg notransactions=False, it checks correct number of transactions in
-    database according to blockchain.
+    Fetch blocks from blockchain with JSON-RPC batch requests and write them to database.
+
+    Next batches are requested from node while current batch is being written to database,
+    no more than batches_in_flight batches are requested at a time.
+    """
+    assert batch_size > 0, f"Batch size must be positive (received {batch_size})"
+    assert (
+        batches_in_flight > 0
+    ), f"Number of batches in flight must be positive (received {batches_in_flight})"
+
+    if web3_client is None:
+        web3_client = connect(blockchain_type)
+    batches = [
+        blocks_numbers[i : i + batch_size]
+        for i in range(0, len(blocks_numbers), batch_size)
+    ]
+
+    with _db_session_ctx(db_session) as db_session, ThreadPoolExecutor(
+        max_workers=batches_in_flight
+    ) as executor:
+        pbar = tqdm(total=len(blocks_numbers))
+        pending: Deque[Tuple[List[int], Future]] = deque()
+
+        def submit_next_batch(batch_index: int) -> None:
+            if batch_index < len(batches):
+                batch = batches[batch_index]
+                pending.append(
+                    (
+                        batch,
+                        executor.submit(
+                            get_blocks_batch,
+                            web3_client,
+                            blockchain_type,
+                            batch,
+                            with_transactions,
+                        ),
+                    )
+                )
+
+        for batch_index in range(batches_in_flight):
+            submit_next_batch(batch_index)
+        next_batch_index = batches_in_flight
+
+        while pending:
+            batch, future = pending.popleft()
+            pbar.set_description(
+                f"Crawling blocks {batch[0]}-{batch[-1]} with txs: {with_transactions}"
+            )
+            try:
+                blocks = future.result()
+                submit_next_batch(next_batch_index)
+                next_batch_index += 1
+
+                if loader == BlocksLoader.COPY:
+                    add_blocks_copy(
+                        db_session, blocks, blockchain_type, with_transactions
+                    )
+                    db_session.commit()
+                else:
+                    add_blocks_batch(
+                        db_session, blocks, blockchain_type, with_transactions
+                    )
+            except Exception as err:
+                db_session.rollback()
+                for _, pending_future in pending:
+                    pending_future.cancel()
+                message = f"Error adding blocks (numbers={batch[0]}-{batch[-1]}) to database:\n{repr(err)}"
+                raise BlockCrawlError(message)
+            except:
+                db_session.rollback()
+                for _, pending_future in pending:
+                    pending_future.cancel()
+                logger.error(
+                    f"Interrupted while adding blocks (numbers={batch[0]}-{batch[-1]}) to database."
+                )
+                raise
+            pbar.update(len(batch))
+        pbar.close()
+
+
+def benchmark_blocks_loaders(
+    blockchain_type: AvailableBlockchainType,
+    blocks: List[BlockData],
+    with_transactions: bool = True,
+) -> Dict[str, Any]:
     """
-    bottom_block = min(blocks_numbers[-1], blocks_numbers[0])
-    top_block = max(blocks_numbers[-1], blocks_numbers[0])
+    Write the same blocks to database with each of loaders and measure rows/sec.
 
+    Blocks should not be presented in database, they are removed after each loader run,
+    so run it against development database.
+    """
     block_model = get_block_model(blockchain_type)
     transaction_model = get_transaction_model(blockchain_type)
+    blocks_numbers = [block["number"] for block in blocks]
+
+    results: Dict[str, Any] = {
+        "blocks": len(blocks),
+        "transactions": sum(len(block["transactions"]) for block in blocks)
+        if with_transactions
+        else 0,
+    }
     with yield_db_session_ctx() as db_session:
-        if notransactions:
-            blocks_exist_raw_query = (
-                db_session.query(block_model.block_number)
-                .filter(block_model.block_number >= bottom_block)
-                .filter(block_model.block_number <= top_block)
+        existing_blocks = (
+            db_session.query(func.count(block_model.block_number))
+            .filter(block_model.block_number.in_(blocks_numbers))
+            .scalar()
+        )
+        if existing_blocks > 0:
+            raise BlockCrawlError(
+                f"{existing_blocks} of benchmark blocks already exist in database"
             )
-            blocks_exist = [[block[0]] for block in blocks_exist_raw_query.all()]
+
+        for loader in BlocksLoader:
+            started_at = time.time()
+            if loader == BlocksLoader.COPY:
+                add_blocks_copy(db_session, blocks, blockchain_type, with_transactions)
+                db_session.commit()
+            else:
+                add_blocks_batch(db_session, blocks, blockchain_type, with_transactions)
+            duration = time.time() - started_at
+
+            results[loader.value] = {
+                "seconds": duration,
+                "rows_per_second": (results["blocks"] + results["transactions"])
+                / duration,
+            }
+            logger.info(f"Loader {loader.value} finished in {duration} seconds")
+
+            db_session.query(transaction_model).filter(
+                transaction_model.block_number.in_(blocks_numbers)
+            ).delete(synchronize_session=False)
+            db_session.query(block_model).filter(
+                block_model.block_number.in_(blocks_numbers)
+            ).delete(synchronize_session=False)
+            db_session.commit()
+
+    return results
+
+
+def merge_blocks_ranges(blocks_ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Merge overlapping and adjacent inclusive blocks ranges into compact sorted list.
+    """
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(blocks_ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
         else:
-            corrupted_blocks = []
-            blocks_exist_raw_query = (
-                db_session.query(
-                    block_model.block_number, func.count(transaction_model.hash)
-                )
-                .join(
-                    transaction_model,
-                    transaction_model.block_number == block_model.block_number,
-                )
-                .filter(block_model.block_number >= bottom_block)
-                .filter(block_model.block_number <= top_block)
-                .group_by(block_model.block_number)
+            merged.append((start, end))
+    return merged
+
+
+def count_blocks_in_ranges(blocks_ranges: List[Tuple[int, int]]) -> int:
+    """
+    Count blocks in inclusive blocks ranges.
+    """
+    return sum(end - start + 1 for start, end in blocks_ranges)
+
+
+def get_missing_blocks_ranges(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    bottom_block: int,
+    top_block: int,
+) -> List[Tuple[int, int]]:
+    """
+    Find blocks absent in database between bottom_block and top_block (inclusive).
+
+    Anti-join against generate_series and grouping of consecutive numbers are done
+    in database, so only compact ranges are returned.
+    """
+    block_model = get_block_model(blockchain_type)
+    query = text(
+        f"""
+        SELECT min(missing.block_number), max(missing.block_number)
+        FROM (
+            SELECT series.block_number,
+                series.block_number - row_number() OVER (ORDER BY series.block_number) AS island
+            FROM generate_series(
+                CAST(:bottom_block AS BIGINT), CAST(:top_block AS BIGINT)
+            ) AS series(block_number)
+            LEFT JOIN {block_model.__tablename__} AS blocks
+                ON blocks.block_number = series.block_number
+            WHERE blocks.block_number IS NULL
+        ) AS missing
+        GROUP BY missing.island
+        ORDER BY 1
+        """
+    )
+    rows = db_session.execute(
+        query, {"bottom_block": bottom_block, "top_block": top_block}
+    )
+    return [(row[0], row[1]) for row in rows]
+
+
+def get_corrupted_blocks(
+    db_session: Session,
+    web3_client: Web3,
+    blockchain_type: AvailableBlockchainType,
+    bottom_block: int,
+    top_block: int,
+    batch_size: int = 100,
+) -> List[int]:
+    """
+    Compare number of transactions stored in database with number of transactions
+    at blockchain for each stored block between bottom_block and top_block.
+
+    Blockchain counts are requested with eth_getBlockTransactionCountByNumber
+    JSON-RPC batches of batch_size blocks, or block by block if provider doesn't
+    support batch requests.
+    """
+    block_model = get_block_model(blockchain_type)
+    transaction_model = get_transaction_model(blockchain_type)
+
+    stored_counts = (
+        db_session.query(block_model.block_number, func.count(transaction_model.hash))
+        .outerjoin(
+            transaction_model,
+            transaction_model.block_number == block_model.block_number,
+        )
+        .filter(block_model.block_number >= bottom_block)
+        .filter(block_model.block_number <= top_block)
+        .group_by(block_model.block_number)
+        .order_by(block_model.block_number)
+        .all()
+    )
+
+    corrupted_blocks: List[int] = []
+    pbar = tqdm(total=len(stored_counts))
+    pbar.set_description(f"Checking txs in {len(stored_counts)} blocks")
+    for i in range(0, len(stored_counts), batch_size):
+        batch = stored_counts[i : i + batch_size]
+        node_counts: List[Optional[int]]
+        try:
+            raw_counts = make_batch_request(
+                web3_client,
+                RPC.eth_getBlockTransactionCountByNumber,
+                [[hex(block_number)] for block_number, _ in batch],
             )
-            blocks_exist = [
-                [block[0], block[1]] for block in blocks_exist_raw_query.all()
+            node_counts = [
+                None if raw_count is None else int(raw_count, 16)
+                for raw_count in raw_counts
+            ]
+        except BatchRequestError:
+            # Provider doesn't support batch requests, fetch blocks one by one
+            node_counts = [
+                len(web3_client.eth.get_block(block_number)["transactions"])
+                for block_number, _ in batch
             ]
+        for (block_number, stored_count), node_count in zip(batch, node_counts):
+            if node_count != stored_count:
+                corrupted_blocks.append(block_number)
+        pbar.update(len(batch))
+    pbar.close()
 
-            web3_client = connect(blockchain_type)
+    return corrupted_blocks
 
-            blocks_exist_len = len(blocks_exist)
-            pbar = tqdm(total=blocks_exist_len)
-            pbar.set_description(f"Checking txs in {blocks_exist_len} blocks")
 
-            for i, block_in_db in enumerate(blocks_exist):
-                block = web3_client.eth.get_block(
-                    block_in_db[0], full_transactions=True
-                )
-                if len(block.transactions) != block_in_db[1]:
-                    corrupted_blocks.append(block_in_db[0])
-                    # Delete existing corrupted block and add to missing list
-                    del_block = (
-                        db_session.query(block_model)
-                        .filter(block_model.block_number == block_in_db[0])
-                        .one()
-                    )
-                    db_session.delete(del_block)
-                    del blocks_exist[i]
-                pbar.update()
-            pbar.close()
+def check_missing_blocks(
+    blockchain_type: AvailableBlockchainType,
+    bottom_block: int,
+    top_block: int,
+    notransactions=False,
+    batch_size: int = 100,
+) -> List[Tuple[int, int]]:
+    """
+    Find ranges of blocks between bottom_block and top_block (inclusive)
+    which are not presented in database.
+    If arg notransactions=False, it checks correct number of transactions in
+    database according to blockchain, corrupted blocks are removed from database
+    and added to missing ranges.
+    """
+    with yield_db_session_ctx() as db_session:
+        missing_blocks_ranges = get_missing_blocks_ranges(
+            db_session, blockchain_type, bottom_block, top_block
+        )
 
-            db_session.commit()
+        if not notransactions:
+            web3_client = connect(blockchain_type)
+            corrupted_blocks = get_corrupted_blocks(
+                db_session,
+                web3_client,
+                blockchain_type,
+                bottom_block,
+                top_block,
+                batch_size,
+            )
 
             corrupted_blocks_len = len(corrupted_blocks)
             if corrupted_blocks_len > 0:
+                # Transactions are removed by ON DELETE CASCADE
+                block_model = get_block_model(blockchain_type)
+                db_session.query(block_model).filter(
+                    block_model.block_number.in_(corrupted_blocks)
+                ).delete(synchronize_session=False)
+                db_session.commit()
+
                 logger.warning(
                     f"Removed {corrupted_blocks_len} corrupted blocks: {corrupted_blocks if corrupted_blocks_len <= 10 else '...'}"
                 )
+                missing_blocks_ranges = merge_blocks_ranges(
+                    missing_blocks_ranges
+                    + [
+                        (block_number, block_number)
+                        for block_number in corrupted_blocks
+                    ]
+                )
 
-    missing_blocks_numbers = [
-        block for block in blocks_numbers if block not in [i[0] for i in blocks_exist]
-    ]
-    return missing_blocks_numbers
+    return missing_blocks_ranges
+
+
+# Connections opened once per block crawler worker process, see _init_crawl_blocks_worker
+_worker_web3_client: Optional[Web3] = None
+_worker_db_session: Optional[Session] = None
+
+
+def _init_crawl_blocks_worker(blockchain_type: AvailableBlockchainType) -> None:
+    """
+    Open web3 and database connections for block crawler worker process.
+    """
+    global _worker_web3_client, _worker_db_session
+
+    dispose_engines_after_fork()
+    _worker_web3_client = connect(blockchain_type)
+    _worker_db_session = SessionLocal()
+
+
+def _crawl_blocks_shard(
+    blockchain_type: AvailableBlockchainType,
+    blocks_numbers: List[int],
+    with_transactions: bool,
+    batch_size: int,
+    batches_in_flight: int,
+    loader: BlocksLoader,
+) -> None:
+    """
+    Crawl contiguous shard of blocks in worker process with its own connections.
+    """
+    crawl_blocks(
+        blockchain_type,
+        blocks_numbers,
+        with_transactions,
+        batch_size,
+        batches_in_flight,
+        loader,
+        web3_client=_worker_web3_client,
+        db_session=_worker_db_session,
+    )
 
 
 def crawl_blocks_executor(
@@ -336,14 +960,27 @@ def crawl_blocks_executor(
     block_numbers_list: List[int],
     with_transactions: bool = False,
     num_processes: int = MOONSTREAM_CRAWL_WORKERS,
+    batch_size: int = 1,
+    batches_in_flight: int = MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT,
+    loader: BlocksLoader = BlocksLoader.ORM,
+    shards_per_process: int = MOONSTREAM_CRAWL_SHARDS_PER_WORKER,
 ) -> None:
     """
     Execute crawler in processes.
 
+    Block numbers list is split into contiguous shards, several shards per process.
+    Worker processes take shards from shared queue, so worker which finished its shard
+    early takes the next one instead of waiting for the slowest worker. Each worker
+    process keeps its own web3 and database connections for all shards it crawls.
+
     Args:
     block_numbers_list - List of block numbers to add to database.
     with_transactions - If True, also adds transactions from those blocks to the ethereum_transactions table.
     num_processes - Number of processes to use to feed blocks into database.
+    batch_size - Number of blocks to fetch in one JSON-RPC batch request, 1 means fetch blocks one by one.
+    batches_in_flight - Maximum number of batch requests each process keeps in flight.
+    loader - Write blocks to database with ORM objects or with PostgreSQL COPY.
+    shards_per_process - Number of contiguous shards to create per process.
 
     Returns nothing, but if there was an error processing the given blocks it raises an EthereumBlocksCrawlError.
     The error message is a list of all the things that went wrong in the crawl.
@@ -355,22 +992,43 @@ def crawl_blocks_executor(
         if error is not None:
             errors.append(error)
 
-    worker_indices = range(MOONSTREAM_CRAWL_WORKERS)
-    worker_job_lists: List[List[Any]] = [[] for _ in worker_indices]
-    for i, block_number in enumerate(block_numbers_list):
-        worker_job_lists[i % MOONSTREAM_CRAWL_WORKERS].append(block_number)
-
     results: List[Future] = []
     if num_processes == 1:
         logger.warning("Executing block crawler in lazy mod")
-        return crawl_blocks(blockchain_type, block_numbers_list, with_transactions)
+        return crawl_blocks(
+            blockchain_type,
+            block_numbers_list,
+            with_transactions,
+            batch_size,
+            batches_in_flight,
+            loader,
+        )
     else:
-        with ThreadPoolExecutor(max_workers=MOONSTREAM_CRAWL_WORKERS) as executor:
-            for worker in worker_indices:
-                block_chunk = worker_job_lists[worker]
-                logger.info(f"Spawned process for {len(block_chunk)} blocks")
+        shard_size = max(
+            batch_size,
+            math.ceil(len(block_numbers_list) / (num_processes * shards_per_process)),
+        )
+        shards = [
+            block_numbers_list[i : i + shard_size]
+            for i in range(0, len(block_numbers_list), shard_size)
+        ]
+        logger.info(
+            f"Spawning {num_processes} processes for {len(shards)} shards of {shard_size} blocks"
+        )
+        with ProcessPoolExecutor(
+            max_workers=num_processes,
+            initializer=_init_crawl_blocks_worker,
+            initargs=(blockchain_type,),
+        ) as executor:
+            for shard in shards:
                 result = executor.submit(
-                    crawl_blocks, blockchain_type, block_chunk, with_transactions
+                    _crawl_blocks_shard,
+                    blockchain_type,
+                    shard,
+                    with_transactions,
+                    batch_size,
+                    batches_in_flight,
+                    loader,
                 )
                 result.add_done_callback(record_error)
                 results.append(result)
@@ -8,9 +8,14 @@ from moonstreamdb.db import yield_db_session_ctx
 from sqlalchemy.orm.session import Session
 from web3 import Web3
 
+from ..block_timestamps import BlockTimestampsCache
 from ..blockchain import connect
 from ..data import AvailableBlockchainType
-from .deployment_crawler import ContractDeploymentCrawler, MoonstreamDataStore
+from .deployment_crawler import (
+    ContractDeploymentCrawler,
+    MoonstreamDataStore,
+    ReceiptsFetcher,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,12 +30,17 @@ def run_crawler_asc(
     batch_size: int,
     respect_state: bool,
     sleep_time: int,
+    receipts_fetcher: Optional[ReceiptsFetcher] = None,
 ):
     """
     Runs crawler in ascending order
     """
-    moonstream_data_store = MoonstreamDataStore(session)
-    contract_deployment_crawler = ContractDeploymentCrawler(w3, moonstream_data_store)
+    moonstream_data_store = MoonstreamDataStore(
+        session, BlockTimestampsCache(AvailableBlockchainType.ETHEREUM, w3)
+    )
+    contract_deployment_crawler = ContractDeploymentCrawler(
+        w3, moonstream_data_store, receipts_fetcher
+    )
 
     if respect_state:
         from_block = moonstream_data_store.get_last_labeled_block_number() + 1
@@ -74,12 +84,17 @@ def run_crawler_desc(
     batch_size: int,
     respect_state: bool,
     sleep_time: int,
+    receipts_fetcher: Optional[ReceiptsFetcher] = None,
 ):
     """
     Runs crawler in descending order
     """
-    moonstream_data_store = MoonstreamDataStore(session)
-    contract_deployment_crawler = ContractDeploymentCrawler(w3, moonstream_data_store)
+    moonstream_data_store = MoonstreamDataStore(
+        session, BlockTimestampsCache(AvailableBlockchainType.ETHEREUM, w3)
+    )
+    contract_deployment_crawler = ContractDeploymentCrawler(
+        w3, moonstream_data_store, receipts_fetcher
+    )
 
     if respect_state:
         to_block = moonstream_data_store.get_first_block_number() - 1
@@ -118,28 +133,39 @@ def run_crawler_desc(
 def handle_parser(args: argparse.Namespace):
     with yield_db_session_ctx() as session:
         w3 = connect(AvailableBlockchainType.ETHEREUM)
-        if args.order == "asc":
-            run_crawler_asc(
-                w3=w3,
-                session=session,
-                from_block=args.start,
-                to_block=args.to,
-                synchronize=args.synchronize,
-                batch_size=args.batch,
-                respect_state=args.respect_state,
-                sleep_time=args.sleep,
-            )
-        elif args.order == "desc":
-            run_crawler_desc(
-                w3=w3,
-                session=session,
-                from_block=args.start,
-                to_block=args.to,
-                synchronize=args.synchronize,
-                batch_size=args.batch,
-                respect_state=args.respect_state,
-                sleep_time=args.sleep,
-            )
+        receipts_fetcher = ReceiptsFetcher(
+            w3,
+            batch_size=args.receipts_batch,
+            max_workers=args.workers,
+            use_block_receipts=args.block_receipts,
+        )
+        try:
+            if args.order == "asc":
+                run_crawler_asc(
+                    w3=w3,
+                    session=session,
+                    from_block=args.start,
+                    to_block=args.to,
+                    synchronize=args.synchronize,
+                    batch_size=args.batch,
+                    respect_state=args.respect_state,
+                    sleep_time=args.sleep,
+                    receipts_fetcher=receipts_fetcher,
+                )
+            elif args.order == "desc":
+                run_crawler_desc(
+                    w3=w3,
+                    session=session,
+                    from_block=args.start,
+                    to_block=args.to,
+                    synchronize=args.synchronize,
+                    batch_size=args.batch,
+                    respect_state=args.respect_state,
+                    sleep_time=args.sleep,
+                    receipts_fetcher=receipts_fetcher,
+                )
+        finally:
+            receipts_fetcher.close()
 
 
 def generate_parser():
@@ -150,6 +176,9 @@ def generate_parser():
     --synchronize: Continious crawling, default: False
     --batch, -b : batch size, default: 10
     --respect-state: If set to True:\n If order is asc: start=last_labeled_block+1\n If order is desc: start=first_labeled_block-1
+    --receipts-batch: receipts in one JSON-RPC batch request, default: 100
+    --workers, -w: concurrent receipts batch requests, default: 4
+    --block-receipts: fetch receipts with eth_getBlockReceipts if node supports it
     """
 
     parser = argparse.ArgumentParser(description="Moonstream Deployment Crawler")
@@ -185,6 +214,25 @@ def generate_parser():
         default=3 * 60,
         help="time to sleep synzhronize mode waiting for new block crawled to db",
     )
+    parser.add_argument(
+        "--receipts-batch",
+        type=int,
+        default=100,
+        help="Number of receipts to fetch in one JSON-RPC batch request",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=4,
+        help="Number of receipts batch requests sent concurrently",
+    )
+    parser.add_argument(
+        "--block-receipts",
+        action="store_true",
+        default=False,
+        help="Fetch receipts of whole blocks with eth_getBlockReceipts if node supports it",
+    )
     parser.set_defaults(func=handle_parser)
     return parser
 
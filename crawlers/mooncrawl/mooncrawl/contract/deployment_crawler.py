@@ -1,13 +1,21 @@
 import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Iterator, List, Optional, Tuple, cast
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, cast
 
 from hexbytes import HexBytes
 from moonstreamdb.models import EthereumBlock, EthereumLabel, EthereumTransaction
 from sqlalchemy.orm import Query, Session
-from web3 import Web3
+from web3 import HTTPProvider, Web3
+from web3._utils.method_formatters import get_result_formatters
+from web3._utils.rpc_abi import RPC
 from web3.types import TxReceipt
 
+from ..block_timestamps import BlockTimestampsCache
+from ..blockchain import BatchRequestError, make_batch_request
+from ..data import AvailableBlockchainType
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -29,12 +37,23 @@ class RawDeploymentTx:
     transaction_hash: str
     gas_price: int
     timestamp: int
+    block_number: int
 
 
 class MoonstreamDataStore:
-    def __init__(self, db_session: Session) -> None:
+    def __init__(
+        self,
+        db_session: Session,
+        timestamps_cache: Optional[BlockTimestampsCache] = None,
+        web3: Optional[Web3] = None,
+    ) -> None:
         self.db_session = db_session
         self.label = "contract_deployment"
+        if timestamps_cache is None:
+            timestamps_cache = BlockTimestampsCache(
+                AvailableBlockchainType.ETHEREUM, web3
+            )
+        self.timestamps_cache = timestamps_cache
 
     def get_last_labeled_block_number(
         self,
@@ -99,29 +118,35 @@ class MoonstreamDataStore:
     ) -> List[RawDeploymentTx]:
         """
         Returns a list of raw contract deployment transactions.
+
+        Block timestamps are resolved with timestamps cache. If cache has no web3
+        client, transactions of blocks missing in database are skipped.
         """
         result = (
             self.db_session.query(
                 EthereumTransaction.hash,
                 EthereumTransaction.gas_price,
-                EthereumBlock.timestamp,
-            )
-            .join(
-                EthereumBlock,
-                EthereumTransaction.block_number == EthereumBlock.block_number,
+                EthereumTransaction.block_number,
             )
-            .filter(EthereumBlock.block_number >= from_block)
-            .filter(EthereumBlock.block_number <= to_block)
+            .filter(EthereumTransaction.block_number >= from_block)
+            .filter(EthereumTransaction.block_number <= to_block)
             .filter(EthereumTransaction.to_address == None)
             .all()
         )
+        timestamps = self.timestamps_cache.get_many(
+            self.db_session,
+            [row[2] for row in result],
+            use_web3=self.timestamps_cache.web3 is not None,
+        )
         return [
             RawDeploymentTx(
                 transaction_hash=row[0],
                 gas_price=row[1],
-                timestamp=row[2],
+                timestamp=timestamps[row[2]],
+                block_number=row[2],
             )
             for row in result
+            if row[2] in timestamps
         ]
 
     def save_contract_deployment_labels(
@@ -179,23 +204,168 @@ def get_transaction_receipt(web3: Web3, tx_hash: str) -> TxReceipt:
     return web3.eth.get_transaction_receipt(cast(HexBytes, tx_hash))
 
 
-def get_contract_deployment_transactions(
-    web3: Web3,
-    datastore: MoonstreamDataStore,
-    from_block: int,
-    to_block: int,
+# Method of Erigon and recent Geth nodes returning all receipts of block
+ETH_GET_BLOCK_RECEIPTS = "eth_getBlockReceipts"
+# JSON-RPC error code of unknown method
+METHOD_NOT_FOUND_ERROR_CODE = -32601
+
+
+class ReceiptsFetcher:
+    """
+    Fetches transaction receipts with JSON-RPC batch requests sent by max_workers threads,
+    retrying failed batches.
+
+    With use_block_receipts, receipts of whole blocks are fetched with eth_getBlockReceipts
+    if node supports it. It is cheaper only when most of blocks transactions are needed.
+    """
+
+    def __init__(
+        self,
+        web3: Web3,
+        batch_size: int = 100,
+        max_workers: int = 4,
+        attempts: int = 3,
+        use_block_receipts: bool = False,
+    ) -> None:
+        assert batch_size > 0, "batch_size must be greater than 0"
+        assert attempts > 0, "attempts must be greater than 0"
+        self.web3 = web3
+        self.batch_size = batch_size
+        self.attempts = attempts
+        self.use_block_receipts = use_block_receipts
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._batch_requests_supported = isinstance(web3.provider, HTTPProvider)
+        self._block_receipts_checked = False
+        # Annotation of get_result_formatters doesn't match, it returns composed formatter
+        self._receipt_formatter = cast(
+            Callable[[Any], TxReceipt],
+            get_result_formatters(RPC.eth_getTransactionReceipt, web3.eth),
+        )
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def _request_batch(self, method: str, params_list: List[List[Any]]) -> List[Any]:
+        current_interval = 1.0
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return make_batch_request(self.web3, method, params_list)
+            except Exception as e:
+                if attempt == self.attempts:
+                    raise
+                logger.warning(
+                    f"Batch of {len(params_list)} {method} calls failed, retrying in {current_interval}s: {e}"
+                )
+                time.sleep(current_interval)
+                current_interval *= 2
+        raise BatchRequestError(f"Batch of {method} calls failed")
+
+    def _block_receipts_supported(self, block_number: int) -> bool:
+        response = self.web3.provider.make_request(
+            cast(Any, ETH_GET_BLOCK_RECEIPTS), [hex(block_number)]
+        )
+        error = response.get("error")
+        if error is None:
+            return True
+        if isinstance(error, dict) and error.get("code") == METHOD_NOT_FOUND_ERROR_CODE:
+            logger.warning(
+                f"Node does not support {ETH_GET_BLOCK_RECEIPTS}, fetching receipts by transaction"
+            )
+            return False
+        raise BatchRequestError(f"{ETH_GET_BLOCK_RECEIPTS} call failed: {error}")
+
+    def _get_receipts_by_blocks(
+        self, transactions: List[RawDeploymentTx]
+    ) -> Dict[str, Optional[TxReceipt]]:
+        block_numbers = sorted(
+            {transaction.block_number for transaction in transactions}
+        )
+        transaction_hashes = {
+            transaction.transaction_hash for transaction in transactions
+        }
+        batches = [
+            block_numbers[i : i + self.batch_size]
+            for i in range(0, len(block_numbers), self.batch_size)
+        ]
+        receipts: Dict[str, Optional[TxReceipt]] = {
+            transaction_hash: None for transaction_hash in transaction_hashes
+        }
+        for raw_blocks_receipts in self.executor.map(
+            lambda batch: self._request_batch(
+                ETH_GET_BLOCK_RECEIPTS, [[hex(block_number)] for block_number in batch]
+            ),
+            batches,
+        ):
+            for raw_block_receipts in raw_blocks_receipts:
+                for raw_receipt in raw_block_receipts or []:
+                    if raw_receipt["transactionHash"] in transaction_hashes:
+                        receipts[
+                            raw_receipt["transactionHash"]
+                        ] = self._receipt_formatter(raw_receipt)
+        return receipts
+
+    def get_receipts(
+        self, transactions: List[RawDeploymentTx]
+    ) -> Dict[str, Optional[TxReceipt]]:
+        """
+        Returns receipts by transaction hash, None for transactions unknown to node.
+        """
+        if not transactions:
+            return {}
+        if not self._batch_requests_supported:
+            return {
+                transaction.transaction_hash: get_transaction_receipt(
+                    self.web3, transaction.transaction_hash
+                )
+                for transaction in transactions
+            }
+
+        if self.use_block_receipts and not self._block_receipts_checked:
+            self.use_block_receipts = self._block_receipts_supported(
+                transactions[0].block_number
+            )
+            self._block_receipts_checked = True
+        if self.use_block_receipts:
+            return self._get_receipts_by_blocks(transactions)
+
+        transaction_hashes = [
+            transaction.transaction_hash for transaction in transactions
+        ]
+        batches = [
+            transaction_hashes[i : i + self.batch_size]
+            for i in range(0, len(transaction_hashes), self.batch_size)
+        ]
+        receipts: Dict[str, Optional[TxReceipt]] = {}
+        for batch, raw_receipts in zip(
+            batches,
+            self.executor.map(
+                lambda batch: self._request_batch(
+                    RPC.eth_getTransactionReceipt,
+                    [[transaction_hash] for transaction_hash in batch],
+                ),
+                batches,
+            ),
+        ):
+            for transaction_hash, raw_receipt in zip(batch, raw_receipts):
+                receipts[transaction_hash] = (
+                    None
+                    if raw_receipt is None
+                    else self._receipt_formatter(raw_receipt)
+                )
+        return receipts
+
+
+def get_contract_deployments(
+    receipts_fetcher: ReceiptsFetcher,
+    raw_deployment_transactions: List[RawDeploymentTx],
 ) -> List[ContractDeployment]:
     """
-    Returns a list of ContractDeployment objects for all contract deployment transactions in the given block range.
+    Returns a list of ContractDeployment objects for given contract deployment transactions.
     """
-    logger.info(
-        f"Getting contract deployment transactions from {from_block} to {to_block}"
-    )
+    receipts = receipts_fetcher.get_receipts(raw_deployment_transactions)
     contract_deployment_transactions = []
-    for raw_deployment_tx in datastore.get_raw_contract_deployment_transactions(
-        from_block, to_block
-    ):
-        receipt = get_transaction_receipt(web3, raw_deployment_tx.transaction_hash)
+    for raw_deployment_tx in raw_deployment_transactions:
+        receipt = receipts.get(raw_deployment_tx.transaction_hash)
         if receipt is None:
             continue
 
@@ -214,6 +384,32 @@ def get_contract_deployment_transactions(
     return contract_deployment_transactions
 
 
+def get_contract_deployment_transactions(
+    web3: Web3,
+    datastore: MoonstreamDataStore,
+    from_block: int,
+    to_block: int,
+    receipts_fetcher: Optional[ReceiptsFetcher] = None,
+) -> List[ContractDeployment]:
+    """
+    Returns a list of ContractDeployment objects for all contract deployment transactions in the given block range.
+    """
+    logger.info(
+        f"Getting contract deployment transactions from {from_block} to {to_block}"
+    )
+    owns_receipts_fetcher = receipts_fetcher is None
+    if receipts_fetcher is None:
+        receipts_fetcher = ReceiptsFetcher(web3)
+    try:
+        return get_contract_deployments(
+            receipts_fetcher,
+            datastore.get_raw_contract_deployment_transactions(from_block, to_block),
+        )
+    finally:
+        if owns_receipts_fetcher:
+            receipts_fetcher.close()
+
+
 # Function Fully Generated by copilot, looks correct, lol
 def get_batch_block_range(
     from_block: int, to_block: int, batch_size: int
@@ -235,11 +431,27 @@ class ContractDeploymentCrawler:
     """
     Crawls contract deployments from MoonstreamDB transactions with the usage of web3
     to get transaction recipts
+
+    Receipts fetcher created by crawler is shut down by close(), passed one is closed
+    by its owner.
     """
 
-    def __init__(self, web3: Web3, datastore: MoonstreamDataStore):
+    def __init__(
+        self,
+        web3: Web3,
+        datastore: MoonstreamDataStore,
+        receipts_fetcher: Optional[ReceiptsFetcher] = None,
+    ):
         self.web3 = web3
         self.datastore = datastore
+        self._owns_receipts_fetcher = receipts_fetcher is None
+        if receipts_fetcher is None:
+            receipts_fetcher = ReceiptsFetcher(web3)
+        self.receipts_fetcher = receipts_fetcher
+
+    def close(self) -> None:
+        if self._owns_receipts_fetcher:
+            self.receipts_fetcher.close()
 
     def crawl(
         self, from_block: Optional[int], to_block: Optional[int], batch_size: int = 200
@@ -248,18 +460,38 @@ class ContractDeploymentCrawler:
         Crawls contract deployments in batches with the given batch size
         If from_block is None then the first block from datastore is used as start
         If to_block is None then the latest block from datastore is used
+
+        Receipts of batch are fetched in background while transactions of next batch
+        are read and labels of previous batch are written to database.
         """
         if from_block is None:
             from_block = self.datastore.get_first_block_number()
         if to_block is None:
             to_block = self.datastore.get_last_block_number()
 
-        for batch_from_block, batch_to_block in get_batch_block_range(
-            from_block, to_block, batch_size
-        ):
-            contract_deployment_transactions = get_contract_deployment_transactions(
-                self.web3, self.datastore, batch_from_block, batch_to_block
-            )
-            self.datastore.save_contract_deployment_labels(
-                contract_deployment_transactions
-            )
+        pending: Optional[Future] = None
+        # Single background thread keeps one batch of receipts in flight, database
+        # session is used only by this thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for batch_from_block, batch_to_block in get_batch_block_range(
+                from_block, to_block, batch_size
+            ):
+                logger.info(
+                    f"Getting contract deployment transactions from {batch_from_block} to {batch_to_block}"
+                )
+                raw_deployment_transactions = (
+                    self.datastore.get_raw_contract_deployment_transactions(
+                        min(batch_from_block, batch_to_block),
+                        max(batch_from_block, batch_to_block),
+                    )
+                )
+                next_pending = executor.submit(
+                    get_contract_deployments,
+                    self.receipts_fetcher,
+                    raw_deployment_transactions,
+                )
+                if pending is not None:
+                    self.datastore.save_contract_deployment_labels(pending.result())
+                pending = next_pending
+            if pending is not None:
+                self.datastore.save_contract_deployment_labels(pending.result())
@@ -1,9 +1,292 @@
-from typing import Optional
-from unittest import TestCase
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, List, Optional, Tuple, cast
+from unittest import TestCase, mock
 
+from web3 import HTTPProvider
 from web3.main import Web3
 
-from .deployment_crawler import get_batch_block_range
+from . import deployment_crawler
+from .deployment_crawler import (
+    ContractDeployment,
+    ContractDeploymentCrawler,
+    MoonstreamDataStore,
+    RawDeploymentTx,
+    ReceiptsFetcher,
+    get_batch_block_range,
+)
+
+# Deployment transactions 1..20, transaction n is in block 100 + n // 2
+TRANSACTIONS = {
+    n: RawDeploymentTx(
+        transaction_hash=f"0x{n:064x}",
+        gas_price=n,
+        timestamp=1000 + n,
+        block_number=100 + n // 2,
+    )
+    for n in range(1, 21)
+}
+
+
+def raw_receipt(n: int) -> Dict[str, Any]:
+    transaction = TRANSACTIONS[n]
+    return {
+        "blockHash": "0x" + "ab" * 32,
+        "blockNumber": hex(transaction.block_number),
+        "contractAddress": f"0x{n:040x}",
+        "cumulativeGasUsed": hex(21000 * n),
+        "from": f"0x{n + 1000:040x}",
+        "gasUsed": hex(21000),
+        "logs": [],
+        "logsBloom": "0x" + "00" * 256,
+        "status": "0x1",
+        "to": None,
+        "transactionHash": transaction.transaction_hash,
+        "transactionIndex": hex(n % 2),
+        "type": "0x0",
+    }
+
+
+class NodeHandler(BaseHTTPRequestHandler):
+    """
+    Serves receipts of TRANSACTIONS, answers batches in reversed order and rejects
+    first fail_requests requests. eth_getBlockReceipts is answered only if
+    block_receipts is True.
+    """
+
+    block_receipts = True
+    fail_requests = 0
+    payloads: List[Any] = []
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, request):
+        if request["method"] == "eth_getTransactionReceipt":
+            n = int(request["params"][0], 16)
+            return {"result": raw_receipt(n) if n in TRANSACTIONS else None}
+        if request["method"] == "eth_getBlockReceipts" and NodeHandler.block_receipts:
+            block_number = int(request["params"][0], 16)
+            return {
+                "result": [
+                    raw_receipt(n)
+                    for n, transaction in TRANSACTIONS.items()
+                    if transaction.block_number == block_number
+                ]
+            }
+        return {"error": {"code": -32601, "message": "method not found"}}
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        NodeHandler.payloads.append(payload)
+        response: Any
+        if NodeHandler.fail_requests > 0:
+            NodeHandler.fail_requests -= 1
+            response = {
+                "jsonrpc": "2.0",
+                "id": None,
+                "error": {"code": -32005, "message": "rate limited"},
+            }
+        elif isinstance(payload, list):
+            response = [
+                {"jsonrpc": "2.0", "id": item["id"], **self.respond(item)}
+                for item in reversed(payload)
+            ]
+        else:
+            response = {"jsonrpc": "2.0", "id": payload["id"], **self.respond(payload)}
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubDataStore:
+    """
+    Serves TRANSACTIONS by blocks range and records saved deployments.
+    """
+
+    def __init__(self) -> None:
+        self.requested_ranges: List[Tuple[int, int]] = []
+        self.saved: List[List[ContractDeployment]] = []
+
+    def get_raw_contract_deployment_transactions(
+        self, from_block: int, to_block: int
+    ) -> List[RawDeploymentTx]:
+        self.requested_ranges.append((from_block, to_block))
+        return [
+            transaction
+            for transaction in TRANSACTIONS.values()
+            if from_block <= transaction.block_number <= to_block
+        ]
+
+    def save_contract_deployment_labels(
+        self, contract_deployments: List[ContractDeployment]
+    ) -> None:
+        self.saved.append(contract_deployments)
+
+
+class TestReceiptsFetcher(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), NodeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.web3 = Web3(
+            HTTPProvider(f"http://127.0.0.1:{self.server.server_address[1]}")
+        )
+        NodeHandler.block_receipts = True
+        NodeHandler.fail_requests = 0
+        NodeHandler.payloads = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def assert_receipts(self, receipts, numbers):
+        self.assertSetEqual(
+            set(receipts), {TRANSACTIONS[n].transaction_hash for n in numbers}
+        )
+        for n in numbers:
+            receipt = receipts[TRANSACTIONS[n].transaction_hash]
+            self.assertEqual(receipt["blockNumber"], TRANSACTIONS[n].block_number)
+            self.assertEqual(
+                receipt["contractAddress"], Web3.toChecksumAddress(f"0x{n:040x}")
+            )
+
+    def test_batches_order(self):
+        fetcher = ReceiptsFetcher(self.web3, batch_size=3, max_workers=2)
+        try:
+            transactions = [TRANSACTIONS[n] for n in range(1, 11)]
+            transactions.append(
+                RawDeploymentTx(
+                    f"0x{99:064x}", gas_price=1, timestamp=1, block_number=1
+                )
+            )
+            receipts = fetcher.get_receipts(transactions)
+        finally:
+            fetcher.close()
+
+        self.assertEqual(len(NodeHandler.payloads), 4)
+        self.assertTrue(all(len(payload) <= 3 for payload in NodeHandler.payloads))
+        self.assertIsNone(receipts.pop(f"0x{99:064x}"))
+        self.assert_receipts(receipts, range(1, 11))
+
+    def test_block_receipts(self):
+        fetcher = ReceiptsFetcher(self.web3, batch_size=2, use_block_receipts=True)
+        try:
+            receipts = fetcher.get_receipts([TRANSACTIONS[n] for n in [2, 3, 7, 12]])
+        finally:
+            fetcher.close()
+
+        self.assertTrue(fetcher.use_block_receipts)
+        self.assert_receipts(receipts, [2, 3, 7, 12])
+        # Support check and blocks 101, 103, 106 in two concurrent batches
+        self.assertEqual(NodeHandler.payloads[0]["method"], "eth_getBlockReceipts")
+        self.assertListEqual(
+            sorted(
+                [item["method"], item["params"][0]]
+                for payload in NodeHandler.payloads[1:]
+                for item in payload
+            ),
+            [["eth_getBlockReceipts", hex(block)] for block in [101, 103, 106]],
+        )
+        self.assertEqual(len(NodeHandler.payloads), 3)
+
+    def test_block_receipts_not_supported(self):
+        NodeHandler.block_receipts = False
+        fetcher = ReceiptsFetcher(self.web3, batch_size=2, use_block_receipts=True)
+        try:
+            receipts = fetcher.get_receipts([TRANSACTIONS[n] for n in [2, 3, 7]])
+            self.assertFalse(fetcher.use_block_receipts)
+            self.assert_receipts(receipts, [2, 3, 7])
+
+            # Support is checked only once
+            fetcher.get_receipts([TRANSACTIONS[1]])
+        finally:
+            fetcher.close()
+
+        self.assertListEqual(
+            [item["method"] for item in NodeHandler.payloads[-1]],
+            ["eth_getTransactionReceipt"],
+        )
+        self.assertEqual(len(NodeHandler.payloads), 4)
+
+    def test_retries(self):
+        NodeHandler.fail_requests = 2
+        fetcher = ReceiptsFetcher(self.web3, batch_size=10, max_workers=1, attempts=3)
+        try:
+            with mock.patch.object(deployment_crawler.time, "sleep") as sleep:
+                receipts = fetcher.get_receipts([TRANSACTIONS[n] for n in [1, 2]])
+        finally:
+            fetcher.close()
+
+        self.assert_receipts(receipts, [1, 2])
+        self.assertListEqual([call.args[0] for call in sleep.call_args_list], [1, 2])
+
+        NodeHandler.fail_requests = 3
+        fetcher = ReceiptsFetcher(self.web3, max_workers=1, attempts=3)
+        try:
+            with mock.patch.object(deployment_crawler.time, "sleep"):
+                with self.assertRaises(deployment_crawler.BatchRequestError):
+                    fetcher.get_receipts([TRANSACTIONS[1]])
+        finally:
+            fetcher.close()
+
+    def test_crawl_descending(self):
+        datastore = StubDataStore()
+        fetcher = ReceiptsFetcher(self.web3, batch_size=4)
+        try:
+            crawler = ContractDeploymentCrawler(
+                self.web3, cast(MoonstreamDataStore, datastore), fetcher
+            )
+            crawler.crawl(from_block=110, to_block=100, batch_size=4)
+        finally:
+            fetcher.close()
+
+        self.assertListEqual(
+            datastore.requested_ranges, [(107, 110), (103, 106), (100, 102)]
+        )
+        self.assertListEqual(
+            [
+                sorted(deployment.block_number for deployment in deployments)
+                for deployments in datastore.saved
+            ],
+            [
+                [107, 107, 108, 108, 109, 109, 110],
+                [103, 103, 104, 104, 105, 105, 106, 106],
+                [100, 101, 101, 102, 102],
+            ],
+        )
+        deployment = datastore.saved[0][0]
+        self.assertEqual(deployment.gas_used, 21000)
+        self.assertEqual(
+            deployment.transaction_fee,
+            21000 * TRANSACTIONS[int(deployment.transaction_hash, 16)].gas_price,
+        )
+
+    def test_receipts_fetcher_ownership(self):
+        datastore = cast(MoonstreamDataStore, StubDataStore())
+        with mock.patch.object(ReceiptsFetcher, "close", autospec=True) as close:
+            deployments = deployment_crawler.get_contract_deployment_transactions(
+                self.web3, datastore, 100, 101
+            )
+            self.assertEqual(len(deployments), 3)
+            self.assertEqual(close.call_count, 1)
+
+            fetcher = ReceiptsFetcher(self.web3)
+            deployment_crawler.get_contract_deployment_transactions(
+                self.web3, datastore, 100, 101, fetcher
+            )
+            ContractDeploymentCrawler(self.web3, datastore, fetcher).close()
+            self.assertEqual(close.call_count, 1)
+
+            crawler = ContractDeploymentCrawler(self.web3, datastore)
+            crawler.close()
+            close.assert_called_with(crawler.receipts_fetcher)
+            self.assertEqual(close.call_count, 2)
+        fetcher.close()
+        crawler.receipts_fetcher.close()
 
 
 class TestDeploymentCrawler(TestCase):
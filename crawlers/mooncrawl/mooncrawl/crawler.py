@@ -9,20 +9,29 @@ import sys
 import time
 from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Iterator, List
+from typing import Iterator, List, Tuple
 
 import dateutil.parser
 
 from .blockchain import (
     DateRange,
+    benchmark_blocks_loaders,
     check_missing_blocks,
+    connect,
+    count_blocks_in_ranges,
     crawl_blocks_executor,
+    get_blocks_batch,
     get_latest_blocks,
+    merge_blocks_ranges,
     trending,
 )
-from .data import AvailableBlockchainType
+from .data import AvailableBlockchainType, BlocksLoader
 from .publish import publish_json
-from .settings import MOONSTREAM_CRAWL_WORKERS
+from .settings import (
+    MOONSTREAM_CRAWL_BATCH_SIZE,
+    MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT,
+    MOONSTREAM_CRAWL_WORKERS,
+)
 from .version import MOONCRAWL_VERSION
 
 logging.basicConfig(level=logging.INFO)
@@ -137,6 +146,9 @@ def crawler_blocks_sync_handler(args: argparse.Namespace) -> None:
                 block_numbers_list=blocks_numbers_list,
                 with_transactions=True,
                 num_processes=args.jobs,
+                batch_size=args.batch_size,
+                batches_in_flight=args.batches_in_flight,
+                loader=args.loader,
             )
         logger.info(
             f"Synchronized blocks from {latest_stored_block_number} to {latest_block_number}"
@@ -155,6 +167,9 @@ def crawler_blocks_add_handler(args: argparse.Namespace) -> None:
             blockchain_type=AvailableBlockchainType(args.blockchain),
             block_numbers_list=blocks_numbers_list,
             with_transactions=True,
+            batch_size=args.batch_size,
+            batches_in_flight=args.batches_in_flight,
+            loader=args.loader,
         )
 
     logger.info(
@@ -170,7 +185,7 @@ def crawler_blocks_missing_handler(args: argparse.Namespace) -> None:
     """
     startTime = time.time()
 
-    missing_blocks_numbers_total = []
+    missing_blocks_ranges_total: List[Tuple[int, int]] = []
 
     block_range = args.blocks
     if block_range is None:
@@ -181,38 +196,83 @@ def crawler_blocks_missing_handler(args: argparse.Namespace) -> None:
         )
         block_range = f"{latest_block_number-shift}-{latest_block_number}"
 
-    for blocks_numbers_list in yield_blocks_numbers_lists(block_range):
+    for blocks_numbers_list in yield_blocks_numbers_lists(
+        block_range, block_step=args.step
+    ):
         logger.info(
             f"Checking missing blocks {blocks_numbers_list[-1]}-{blocks_numbers_list[0]} "
             f"with comparing transactions: {not args.notransactions}"
         )
-        missing_blocks_numbers = check_missing_blocks(
+        missing_blocks_ranges = check_missing_blocks(
             blockchain_type=AvailableBlockchainType(args.blockchain),
-            blocks_numbers=blocks_numbers_list,
+            bottom_block=blocks_numbers_list[-1],
+            top_block=blocks_numbers_list[0],
             notransactions=args.notransactions,
+            batch_size=args.batch_size,
         )
-        if len(missing_blocks_numbers) > 0:
-            logger.info(f"Found {len(missing_blocks_numbers)} missing blocks")
-        missing_blocks_numbers_total.extend(missing_blocks_numbers)
+        if len(missing_blocks_ranges) > 0:
+            logger.info(
+                f"Found {count_blocks_in_ranges(missing_blocks_ranges)} missing blocks "
+                f"in {len(missing_blocks_ranges)} ranges"
+            )
+        missing_blocks_ranges_total.extend(missing_blocks_ranges)
+
+    missing_blocks_ranges_total = merge_blocks_ranges(missing_blocks_ranges_total)
+    missing_blocks_total = count_blocks_in_ranges(missing_blocks_ranges_total)
     logger.info(
-        f"Found {len(missing_blocks_numbers_total)} missing blocks total: "
-        f"{missing_blocks_numbers_total if len(missing_blocks_numbers_total) <= 10 else '...'}"
+        f"Found {missing_blocks_total} missing blocks total: "
+        f"{missing_blocks_ranges_total if len(missing_blocks_ranges_total) <= 10 else '...'}"
     )
 
-    if (len(missing_blocks_numbers_total)) > 0:
+    if missing_blocks_total > 0:
         time.sleep(5)
         crawl_blocks_executor(
             blockchain_type=AvailableBlockchainType(args.blockchain),
-            block_numbers_list=missing_blocks_numbers_total,
+            block_numbers_list=[
+                block_number
+                for start, end in missing_blocks_ranges_total
+                for block_number in range(start, end + 1)
+            ],
             with_transactions=True,
             num_processes=1 if args.lazy else MOONSTREAM_CRAWL_WORKERS,
+            batch_size=args.batch_size,
+            batches_in_flight=args.batches_in_flight,
+            loader=args.loader,
         )
     logger.info(
         f"Required {time.time() - startTime} with {MOONSTREAM_CRAWL_WORKERS} workers "
-        f"for {len(missing_blocks_numbers_total)} missing blocks"
+        f"for {missing_blocks_total} missing blocks"
     )
 
 
+def crawler_blocks_benchmark_handler(args: argparse.Namespace) -> None:
+    """
+    Compare rows/sec of blocks loaders on the same blocks.
+    """
+    blockchain_type = AvailableBlockchainType(args.blockchain)
+    web3_client = connect(blockchain_type)
+
+    blocks = []
+    for blocks_numbers_list in yield_blocks_numbers_lists(
+        args.blocks, order=ProcessingOrder.ASCENDING, block_step=100
+    ):
+        logger.info(
+            f"Fetching blocks {blocks_numbers_list[0]}-{blocks_numbers_list[-1]}"
+        )
+        blocks.extend(
+            get_blocks_batch(
+                web3_client,
+                blockchain_type,
+                blocks_numbers_list,
+                with_transactions=True,
+            )
+        )
+
+    results = benchmark_blocks_loaders(blockchain_type, blocks, with_transactions=True)
+    with args.outfile as ofp:
+        json.dump(results, ofp)
+
+
 def crawler_trending_handler(args: argparse.Namespace) -> None:
     date_range = DateRange(
         start_time=args.start,
@@ -306,6 +366,27 @@ def main() -> None:
         required=True,
         help=f"Available blockchain types: {[member.value for member in AvailableBlockchainType]}",
     )
+    parser_crawler_blocks_sync.add_argument(
+        "--batch-size",
+        type=int,
+        default=MOONSTREAM_CRAWL_BATCH_SIZE,
+        help=(
+            f"Number of blocks to fetch in one JSON-RPC batch request (default: {MOONSTREAM_CRAWL_BATCH_SIZE})."
+            " If you set to 1, blocks are fetched one by one."
+        ),
+    )
+    parser_crawler_blocks_sync.add_argument(
+        "--batches-in-flight",
+        type=int,
+        default=MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT,
+        help=f"Maximum number of batch requests in flight per process (default: {MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT})",
+    )
+    parser_crawler_blocks_sync.add_argument(
+        "--loader",
+        type=BlocksLoader,
+        default=BlocksLoader.ORM,
+        help=f"Way to write blocks to database (choices: {[member.value for member in BlocksLoader]}; default: {BlocksLoader.ORM.value})",
+    )
     parser_crawler_blocks_sync.set_defaults(func=crawler_blocks_sync_handler)
 
     parser_crawler_blocks_add = subcommands_crawler_blocks.add_parser(
@@ -322,6 +403,27 @@ def main() -> None:
         required=True,
         help=f"Available blockchain types: {[member.value for member in AvailableBlockchainType]}",
     )
+    parser_crawler_blocks_add.add_argument(
+        "--batch-size",
+        type=int,
+        default=MOONSTREAM_CRAWL_BATCH_SIZE,
+        help=(
+            f"Number of blocks to fetch in one JSON-RPC batch request (default: {MOONSTREAM_CRAWL_BATCH_SIZE})."
+            " If you set to 1, blocks are fetched one by one."
+        ),
+    )
+    parser_crawler_blocks_add.add_argument(
+        "--batches-in-flight",
+        type=int,
+        default=MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT,
+        help=f"Maximum number of batch requests in flight per process (default: {MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT})",
+    )
+    parser_crawler_blocks_add.add_argument(
+        "--loader",
+        type=BlocksLoader,
+        default=BlocksLoader.ORM,
+        help=f"Way to write blocks to database (choices: {[member.value for member in BlocksLoader]}; default: {BlocksLoader.ORM.value})",
+    )
     parser_crawler_blocks_add.set_defaults(func=crawler_blocks_add_handler)
 
     parser_crawler_blocks_missing = subcommands_crawler_blocks.add_parser(
@@ -345,6 +447,34 @@ def main() -> None:
         action="store_true",
         help="Lazy block adding one by one",
     )
+    parser_crawler_blocks_missing.add_argument(
+        "-s",
+        "--step",
+        type=int,
+        default=10000,
+        help="Number of blocks to check for gaps in one database query (default: 10000)",
+    )
+    parser_crawler_blocks_missing.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help=(
+            "Number of blocks to request transactions count for and to fetch missing blocks"
+            " in one JSON-RPC batch request (default: 100). If you set to 1, blocks are fetched one by one."
+        ),
+    )
+    parser_crawler_blocks_missing.add_argument(
+        "--batches-in-flight",
+        type=int,
+        default=MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT,
+        help=f"Maximum number of batch requests in flight per process (default: {MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT})",
+    )
+    parser_crawler_blocks_missing.add_argument(
+        "--loader",
+        type=BlocksLoader,
+        default=BlocksLoader.ORM,
+        help=f"Way to write blocks to database (choices: {[member.value for member in BlocksLoader]}; default: {BlocksLoader.ORM.value})",
+    )
     parser_crawler_blocks_missing.add_argument(
         "--blockchain",
         required=True,
@@ -352,6 +482,30 @@ def main() -> None:
     )
     parser_crawler_blocks_missing.set_defaults(func=crawler_blocks_missing_handler)
 
+    parser_crawler_blocks_benchmark = subcommands_crawler_blocks.add_parser(
+        "benchmark",
+        description="Compare rows/sec of blocks loaders, run it against development database",
+    )
+    parser_crawler_blocks_benchmark.add_argument(
+        "-b",
+        "--blocks",
+        required=True,
+        help="List of blocks range in format {bottom_block}-{top_block}, blocks should not be presented in database",
+    )
+    parser_crawler_blocks_benchmark.add_argument(
+        "--blockchain",
+        required=True,
+        help=f"Available blockchain types: {[member.value for member in AvailableBlockchainType]}",
+    )
+    parser_crawler_blocks_benchmark.add_argument(
+        "-o",
+        "--outfile",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Optional file to write output to. By default, prints to stdout.",
+    )
+    parser_crawler_blocks_benchmark.set_defaults(func=crawler_blocks_benchmark_handler)
+
     parser_crawler_trending = subcommands.add_parser(
         "trending", description="Trending addresses on the Blockchain blockchain"
     )
@@ -11,6 +11,16 @@ class AvailableBlockchainType(Enum):
     POLYGON = "polygon"
 
 
+class BlocksLoader(Enum):
+    """
+    Way blocks and transactions are written to database: ORM objects added
+    one by one to session or PostgreSQL COPY into staging table.
+    """
+
+    ORM = "orm"
+    COPY = "copy"
+
+
 class StatsUpdateRequest(BaseModel):
     dashboard_id: str
     timescales: List[str]
@@ -1,13 +1,23 @@
 import argparse
-import sys
+import json
+import logging
+import math
+import os
 import time
-from typing import Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Type, Union
 
 import requests
 from moonstreamdb.db import yield_db_session_ctx
 from moonstreamdb.models import ESDEventSignature, ESDFunctionSignature
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 CRAWL_URLS = {
     "functions": "https://www.4byte.directory/api/v1/signatures/",
     "events": "https://www.4byte.directory/api/v1/event-signatures/",
@@ -18,57 +28,243 @@ DB_MODELS = {
     "events": ESDEventSignature,
 }
 
+UPSERT_BATCH_SIZE = 1000
 
-def crawl_step(
-    db_session: Session,
+
+class ESDCrawlError(Exception):
+    """
+    Raised when some pages of the Ethereum Signature Database could not be crawled.
+    """
+
+
+def fetch_page(
     crawl_url: str,
-    db_model: Union[ESDEventSignature, ESDFunctionSignature],
-) -> Optional[str]:
-    attempt = 0
-    current_interval = 2
-    success = False
-
-    response: Optional[requests.Response] = None
-    while (not success) and attempt < 3:
-        attempt += 1
+    page: int,
+    ordering: str,
+    interval: float = 0,
+    attempts: int = 3,
+) -> Dict[str, Any]:
+    """
+    Fetches one page of signatures, retrying failed requests with exponential backoff.
+    """
+    params: Dict[str, Union[int, str]] = {"page": page, "ordering": ordering}
+    current_interval = 2.0
+    for attempt in range(1, attempts + 1):
         try:
-            response = requests.get(crawl_url)
+            response = requests.get(crawl_url, params=params, timeout=30)
             response.raise_for_status()
-            success = True
-        except:
-            current_interval *= 2
+            return response.json()
+        except Exception as e:
+            if attempt == attempts:
+                raise ESDCrawlError(f"Could not fetch page {page} of {crawl_url}: {e}")
             time.sleep(current_interval)
+            current_interval *= 2
+        finally:
+            # Keeps requests rate of each worker below ESD limits
+            time.sleep(interval)
+    raise ESDCrawlError(f"Could not fetch page {page} of {crawl_url}")
+
+
+def parse_signatures(page: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": row["id"],
+            "text_signature": row["text_signature"],
+            "hex_signature": row["hex_signature"],
+            "created_at": datetime.fromisoformat(
+                row["created_at"].replace("Z", "+00:00")
+            ),
+        }
+        for row in page.get("results", [])
+    ]
 
-    if response is None:
-        print(f"Could not process URL: {crawl_url}", file=sys.stderr)
-        return None
 
-    page = response.json()
-    results = page.get("results", [])
+def iterate_signature_pages(
+    crawl_url: str,
+    start_page: int = 1,
+    num_workers: int = 4,
+    interval: float = 0,
+) -> Iterator[Tuple[int, Optional[List[Dict[str, Any]]]]]:
+    """
+    Yields (page, signatures) of all pages from start_page in order of completion,
+    fetching them with num_workers threads. Pages are ordered by id, so signatures
+    added during the crawl go to the last pages.
 
-    rows = [
-        db_model(
-            id=row.get("id"),
-            text_signature=row.get("text_signature"),
-            hex_signature=row.get("hex_signature"),
-            created_at=row.get("created_at"),
+    Signatures of pages which could not be fetched are None.
+    """
+    # First page tells number of pages
+    first_page = fetch_page(crawl_url, 1, "id", interval)
+    first_rows = parse_signatures(first_page)
+    if start_page <= 1:
+        yield 1, first_rows
+    if first_page.get("next") is None:
+        return
+
+    last_page = math.ceil(first_page["count"] / len(first_rows))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures: Dict[Future, int] = {
+            executor.submit(fetch_page, crawl_url, page, "id", interval): page
+            for page in range(max(start_page, 2), last_page + 1)
+        }
+        for future in as_completed(futures):
+            page = futures[future]
+            error = future.exception()
+            if error is not None:
+                logger.error(error)
+                yield page, None
+                continue
+            yield page, parse_signatures(future.result())
+
+
+def fetch_new_signatures(
+    crawl_url: str,
+    since: datetime,
+    num_workers: int = 4,
+    interval: float = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Returns signatures created after since, walking pages from the newest ones
+    num_workers pages at a time until older signatures are reached.
+    """
+    new_rows: List[Dict[str, Any]] = []
+
+    def add_new_rows(raw_page: Dict[str, Any]) -> bool:
+        """
+        Returns True if next pages may have new signatures.
+        """
+        rows = parse_signatures(raw_page)
+        new_rows.extend(row for row in rows if row["created_at"] > since)
+        return (
+            raw_page.get("next") is not None
+            and len(rows) > 0
+            and rows[-1]["created_at"] > since
         )
-        for row in results
-    ]
-    db_session.bulk_save_objects(rows)
+
+    first_page = fetch_page(crawl_url, 1, "-created_at", interval)
+    if not add_new_rows(first_page):
+        return new_rows
+
+    last_page = math.ceil(first_page["count"] / len(first_page["results"]))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for batch_start in range(2, last_page + 1, num_workers):
+            raw_pages = executor.map(
+                lambda page: fetch_page(crawl_url, page, "-created_at", interval),
+                range(batch_start, min(batch_start + num_workers, last_page + 1)),
+            )
+            for raw_page in raw_pages:
+                if not add_new_rows(raw_page):
+                    return new_rows
+    return new_rows
+
+
+def upsert_signatures(
+    db_session: Session,
+    db_model: Type[Union[ESDEventSignature, ESDFunctionSignature]],
+    rows: List[Dict[str, Any]],
+) -> None:
+    if not rows:
+        return
+    statement = insert(db_model).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[db_model.id],
+        set_={
+            "text_signature": statement.excluded.text_signature,
+            "hex_signature": statement.excluded.hex_signature,
+            "created_at": statement.excluded.created_at,
+        },
+    )
+    db_session.execute(statement)
     db_session.commit()
 
-    return page.get("next")
 
+def load_cursor(cursor_path: str, crawl_type: str) -> int:
+    """
+    Returns last page before which all pages were crawled by previous runs.
+    """
+    if not os.path.exists(cursor_path):
+        return 0
+    with open(cursor_path, "r") as ifp:
+        cursor = json.load(ifp)
+    if cursor["crawl_type"] != crawl_type:
+        raise ValueError(
+            f"Cursor {cursor_path} was created for {cursor['crawl_type']} crawl, use another cursor file"
+        )
+    return cursor["page"]
+
+
+def save_cursor(cursor_path: str, crawl_type: str, page: int) -> None:
+    # Write to temporary file first to not corrupt cursor if crawler is killed
+    temp_cursor_path = f"{cursor_path}.tmp"
+    with open(temp_cursor_path, "w") as ofp:
+        json.dump({"crawl_type": crawl_type, "page": page}, ofp)
+    os.replace(temp_cursor_path, cursor_path)
+
+
+def crawl(
+    crawl_type: str,
+    interval: float,
+    num_workers: int = 4,
+    cursor_path: Optional[str] = None,
+    incremental: bool = False,
+    crawl_url: Optional[str] = None,
+) -> None:
+    """
+    Crawls signatures from the Ethereum Signature Database and upserts them to database.
 
-def crawl(crawl_type: str, interval: float) -> None:
-    crawl_url: Optional[str] = CRAWL_URLS[crawl_type]
+    Full crawl resumes from page stored in cursor_path file. Incremental crawl pulls only
+    signatures created after the newest stored one.
+    """
+    assert num_workers > 0, "num_workers must be greater than 0"
+    if crawl_url is None:
+        crawl_url = CRAWL_URLS[crawl_type]
     db_model = DB_MODELS[crawl_type]
+
     with yield_db_session_ctx() as db_session:
-        while crawl_url is not None:
-            print(f"Crawling: {crawl_url}")
-            crawl_url = crawl_step(db_session, crawl_url, db_model)
-            time.sleep(interval)
+        if incremental:
+            since = db_session.query(func.max(db_model.created_at)).scalar()
+            if since is not None:
+                logger.info(f"Crawling {crawl_type} signatures created after {since}")
+                new_rows = fetch_new_signatures(crawl_url, since, num_workers, interval)
+                # Oldest signatures are saved first, so interrupted crawl resumes
+                # from the newest saved one without gaps
+                new_rows.sort(key=lambda row: row["created_at"])
+                for i in range(0, len(new_rows), UPSERT_BATCH_SIZE):
+                    upsert_signatures(
+                        db_session, db_model, new_rows[i : i + UPSERT_BATCH_SIZE]
+                    )
+                logger.info(f"Saved {len(new_rows)} new {crawl_type} signatures")
+                return
+            logger.info(f"There are no {crawl_type} signatures in database yet")
+
+        cursor = 0
+        if cursor_path is not None:
+            cursor = load_cursor(cursor_path, crawl_type)
+        logger.info(f"Crawling {crawl_type} signatures from page {cursor + 1}")
+
+        completed_pages: Set[int] = set()
+        failed_pages: List[int] = []
+        for page, rows in iterate_signature_pages(
+            crawl_url, cursor + 1, num_workers, interval
+        ):
+            if rows is None:
+                failed_pages.append(page)
+                continue
+            upsert_signatures(db_session, db_model, rows)
+            completed_pages.add(page)
+
+            # Cursor moves only over contiguous completed pages
+            while cursor + 1 in completed_pages:
+                cursor += 1
+                completed_pages.remove(cursor)
+            if cursor_path is not None:
+                save_cursor(cursor_path, crawl_type, cursor)
+            logger.info(f"Saved {len(rows)} signatures from page {page}")
+
+    if failed_pages:
+        raise ESDCrawlError(
+            f"Failed to crawl {len(failed_pages)} pages, rerun to retry from page {cursor + 1}: "
+            f"{sorted(failed_pages)}"
+        )
 
 
 def main():
@@ -84,11 +280,42 @@ def main():
         "--interval",
         type=float,
         default=0.1,
-        help="Number of seconds to wait between requests to the Ethereum Signature Database API",
+        help="Number of seconds each worker waits between requests to the Ethereum Signature Database API",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of pages to fetch concurrently",
+    )
+    parser.add_argument(
+        "--cursor",
+        type=str,
+        default=None,
+        help="(Optional) JSON file to store crawled pages cursor in, crawl resumes from it",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Crawl only signatures created after the newest signature in database",
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        default=None,
+        help="(Optional) Signatures API URL, overrides the Ethereum Signature Database one",
     )
     args = parser.parse_args()
 
-    crawl(args.crawl_type, args.interval)
+    crawl(
+        args.crawl_type,
+        args.interval,
+        args.workers,
+        args.cursor,
+        args.incremental,
+        args.url,
+    )
 
 
 if __name__ == "__main__":
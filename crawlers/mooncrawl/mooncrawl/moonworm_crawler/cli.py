@@ -7,15 +7,21 @@ from web3 import Web3
 from web3.middleware import geth_poa_middleware
 
 from ..blockchain import AvailableBlockchainType
-from ..settings import MOONSTREAM_MOONWORM_TASKS_JOURNAL, bugout_client
+from ..settings import (
+    MOONSTREAM_CRAWL_WORKERS,
+    MOONSTREAM_MOONWORM_TASKS_JOURNAL,
+    bugout_client,
+)
 from .continuous_crawler import _retry_connect_web3, continuous_crawler
 from .crawler import (
     SubscriptionTypes,
+    blockchain_type_to_subscription_type,
     get_crawl_job_entries,
     make_event_crawl_jobs,
     make_function_call_crawl_jobs,
 )
-from .db import get_last_labeled_block_number
+from .db import benchmark_labels_writer, get_last_labeled_block_number
+from .historical_crawler import filter_crawl_jobs, historical_crawler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -109,6 +115,74 @@ def handle_crawl(args: argparse.Namespace) -> None:
             args.min_sleep_time,
             args.heartbeat_interval,
             args.new_jobs_refetch_interval,
+            args.pipeline_queue_size,
+            args.timestamps_cache_size,
+            args.timestamps_store,
+        )
+
+
+def handle_historical_crawl(args: argparse.Namespace) -> None:
+    blockchain_type = AvailableBlockchainType(args.blockchain_type)
+    subscription_type = blockchain_type_to_subscription_type(blockchain_type)
+
+    event_crawl_jobs = []
+    if not args.only_functions:
+        event_crawl_jobs = make_event_crawl_jobs(
+            get_crawl_job_entries(
+                subscription_type,
+                "event",
+                MOONSTREAM_MOONWORM_TASKS_JOURNAL,
+            )
+        )
+    function_call_crawl_jobs = []
+    if not args.only_events:
+        function_call_crawl_jobs = make_function_call_crawl_jobs(
+            get_crawl_job_entries(
+                subscription_type,
+                "function",
+                MOONSTREAM_MOONWORM_TASKS_JOURNAL,
+            )
+        )
+
+    if args.address:
+        event_crawl_jobs, function_call_crawl_jobs = filter_crawl_jobs(
+            event_crawl_jobs,
+            function_call_crawl_jobs,
+            [Web3.toChecksumAddress(address) for address in args.address],
+        )
+    logger.info(
+        f"Historical crawl jobs count: {len(event_crawl_jobs)} event jobs, "
+        f"{len(function_call_crawl_jobs)} function call jobs"
+    )
+    if not event_crawl_jobs and not function_call_crawl_jobs:
+        logger.info("No crawl jobs to run")
+        return
+
+    historical_crawler(
+        blockchain_type,
+        event_crawl_jobs,
+        function_call_crawl_jobs,
+        args.start,
+        args.end,
+        args.chunk_size,
+        args.max_blocks_batch,
+        args.workers,
+        args.checkpoint,
+        args.web3,
+    )
+
+
+def handle_benchmark_labels(args: argparse.Namespace) -> None:
+    blockchain_type = AvailableBlockchainType(args.blockchain_type)
+    with yield_db_session_ctx() as db_session:
+        results = benchmark_labels_writer(
+            db_session, blockchain_type, args.labels_counts, args.batch_size
+        )
+    for labels_count, result in results.items():
+        print(
+            f"{labels_count} labels: "
+            f"{result['inserted_labels_per_second']:.0f} inserted labels/sec, "
+            f"{result['skipped_labels_per_second']:.0f} skipped existing labels/sec"
         )
 
 
@@ -195,6 +269,28 @@ def main() -> None:
         help="Time to wait before refetching new jobs",
     )
 
+    crawl_parser.add_argument(
+        "--pipeline-queue-size",
+        "-q",
+        type=int,
+        default=2,
+        help="Maximum number of blocks ranges waiting between fetch, decode and persist stages",
+    )
+
+    crawl_parser.add_argument(
+        "--timestamps-cache-size",
+        type=int,
+        default=100000,
+        help="Maximum number of block timestamps kept in memory",
+    )
+
+    crawl_parser.add_argument(
+        "--timestamps-store",
+        type=str,
+        default=None,
+        help="Path to SQLite file to persist block timestamps between crawler restarts",
+    )
+
     crawl_parser.add_argument(
         "--force",
         action="store_true",
@@ -204,6 +300,118 @@ def main() -> None:
 
     crawl_parser.set_defaults(func=handle_crawl)
 
+    historical_crawl_parser = subparsers.add_parser(
+        "historical-crawl",
+        help="Crawl blocks range in parallel, does not move continuous crawler position",
+    )
+    historical_crawl_parser.add_argument(
+        "--blockchain-type",
+        "-b",
+        type=str,
+        choices=[
+            AvailableBlockchainType.ETHEREUM.value,
+            AvailableBlockchainType.POLYGON.value,
+        ],
+        required=True,
+    )
+    historical_crawl_parser.add_argument(
+        "--start",
+        "-s",
+        type=int,
+        required=True,
+        help="First block to crawl",
+    )
+    historical_crawl_parser.add_argument(
+        "--end",
+        "-e",
+        type=int,
+        default=None,
+        help="Last block to crawl, limited by the last block labeled by continuous crawler",
+    )
+    historical_crawl_parser.add_argument(
+        "--address",
+        "-a",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Crawl only jobs of these contract addresses",
+    )
+    historical_crawl_parser.add_argument(
+        "--only-events",
+        action="store_true",
+        default=False,
+        help="Crawl only event jobs",
+    )
+    historical_crawl_parser.add_argument(
+        "--only-functions",
+        action="store_true",
+        default=False,
+        help="Crawl only function call jobs",
+    )
+    historical_crawl_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Number of blocks in chunk crawled and checkpointed by one worker",
+    )
+    historical_crawl_parser.add_argument(
+        "--max-blocks-batch",
+        "-m",
+        type=int,
+        default=100,
+        help="Maximum number of blocks to crawl in a single batch",
+    )
+    historical_crawl_parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=MOONSTREAM_CRAWL_WORKERS,
+        help="Number of worker processes",
+    )
+    historical_crawl_parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="Path to JSON file with completed chunks to resume crawl",
+    )
+    historical_crawl_parser.add_argument(
+        "--web3",
+        type=str,
+        default=None,
+        help="Web3 provider URL",
+    )
+    historical_crawl_parser.set_defaults(func=handle_historical_crawl)
+
+    benchmark_labels_parser = subparsers.add_parser(
+        "benchmark-labels",
+        help="Measure labels/sec of labels writer, database is left unchanged",
+    )
+    benchmark_labels_parser.add_argument(
+        "--blockchain-type",
+        "-b",
+        type=str,
+        choices=[
+            AvailableBlockchainType.ETHEREUM.value,
+            AvailableBlockchainType.POLYGON.value,
+        ],
+        required=True,
+    )
+    benchmark_labels_parser.add_argument(
+        "--labels-counts",
+        "-l",
+        type=int,
+        nargs="+",
+        default=[10000, 100000, 1000000],
+        help="Numbers of labels written per commit",
+    )
+    benchmark_labels_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Number of labels in one INSERT statement",
+    )
+    benchmark_labels_parser.set_defaults(func=handle_benchmark_labels)
+
     args = parser.parse_args()
     args.func(args)
 
@@ -1,32 +1,35 @@
 import logging
+import threading
 import time
 import traceback
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from queue import Empty, Full, Queue
+from typing import Any, Dict, List, Optional, Tuple
 
-from moonworm.crawler.moonstream_ethereum_state_provider import (  # type: ignore
-    MoonstreamEthereumStateProvider,
-)
+from moonstreamdb.db import yield_db_session_ctx
+from moonworm.crawler.function_call_crawler import ContractFunctionCall  # type: ignore
 from moonworm.crawler.networks import Network  # type: ignore
 from sqlalchemy.orm.session import Session
 from web3 import Web3
 
+from ..block_timestamps import BlockTimestampsCache
 from ..blockchain import connect
 from ..data import AvailableBlockchainType
 from .crawler import (
+    CrawlJobRegistry,
     EventCrawlJob,
     FunctionCallCrawlJob,
+    _generate_reporter_callback,
     blockchain_type_to_subscription_type,
     get_crawl_job_entries,
     heartbeat,
     make_event_crawl_jobs,
     make_function_call_crawl_jobs,
-    merge_event_crawl_jobs,
-    merge_function_call_crawl_jobs,
 )
 from .db import add_events_to_session, add_function_calls_to_session, commit_session
-from .event_crawler import _crawl_events
-from .function_call_crawler import _crawl_functions
+from .event_crawler import Event, _fetch_events, _raw_events_to_events
+from .function_call_crawler import CachedTimestampsStateProvider, _crawl_functions
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,50 +39,65 @@ def _date_to_str(date: datetime) -> str:
     return date.strftime("%Y-%m-%d %H:%M:%S")
 
 
-def _refetch_new_jobs(
-    old_event_jobs: List[EventCrawlJob],
-    old_function_call_jobs: List[FunctionCallCrawlJob],
+def _refresh_crawl_jobs(
+    registry: CrawlJobRegistry,
     blockchain_type: AvailableBlockchainType,
-) -> Tuple[List[EventCrawlJob], List[FunctionCallCrawlJob]]:
+    refreshed_at: datetime,
+) -> None:
     """
-    Refetches new jobs from bugout journal, merges, and returns new jobs.
+    Fetches jobs activated and deactivated since the last refresh from bugout journal
+    and applies them to registry. Jobs are found by update time, so reactivated
+    subscriptions are added back.
     """
-
-    max_created_at_event_job = max(job.created_at for job in old_event_jobs)
-    max_created_at_function_call_job = max(
-        job.created_at for job in old_function_call_jobs
-    )
+    subscription_type = blockchain_type_to_subscription_type(blockchain_type)
+    updated_at_filter = int(refreshed_at.replace(tzinfo=timezone.utc).timestamp())
 
     logger.info("Looking for new event crawl jobs.")
-    old_event_jobs_length = len(old_event_jobs)
-    new_event_entries = get_crawl_job_entries(
-        subscription_type=blockchain_type_to_subscription_type(blockchain_type),
-        crawler_type="event",
-        created_at_filter=max_created_at_event_job,
+    new_event_jobs = make_event_crawl_jobs(
+        get_crawl_job_entries(
+            subscription_type=subscription_type,
+            crawler_type="event",
+            updated_at_filter=updated_at_filter,
+        )
     )
-    new_event_jobs = make_event_crawl_jobs(new_event_entries)
-    event_crawl_jobs = merge_event_crawl_jobs(old_event_jobs, new_event_jobs)
+    deactivated_event_jobs = make_event_crawl_jobs(
+        get_crawl_job_entries(
+            subscription_type=subscription_type,
+            crawler_type="event",
+            status="inactive",
+            updated_at_filter=updated_at_filter,
+        )
+    )
+    added_count = registry.add_event_crawl_jobs(new_event_jobs)
+    removed_count = registry.remove_event_crawl_jobs(deactivated_event_jobs)
     logger.info(
-        f"Found {len(event_crawl_jobs) - old_event_jobs_length} new event crawl jobs. "
+        f"Added {added_count} and removed {removed_count} event crawl job contracts."
     )
 
     logger.info("Looking for new function call crawl jobs.")
-    old_function_call_jobs_length = len(old_function_call_jobs)
-    new_function_entries = get_crawl_job_entries(
-        subscription_type=blockchain_type_to_subscription_type(blockchain_type),
-        crawler_type="function",
-        created_at_filter=max_created_at_function_call_job,
+    new_function_call_jobs = make_function_call_crawl_jobs(
+        get_crawl_job_entries(
+            subscription_type=subscription_type,
+            crawler_type="function",
+            updated_at_filter=updated_at_filter,
+        )
+    )
+    deactivated_function_call_jobs = make_function_call_crawl_jobs(
+        get_crawl_job_entries(
+            subscription_type=subscription_type,
+            crawler_type="function",
+            status="inactive",
+            updated_at_filter=updated_at_filter,
+        )
     )
-    new_function_call_jobs = make_function_call_crawl_jobs(new_function_entries)
-    function_call_crawl_jobs = merge_function_call_crawl_jobs(
-        old_function_call_jobs, new_function_call_jobs
+    added_count = registry.add_function_call_crawl_jobs(new_function_call_jobs)
+    removed_count = registry.remove_function_call_crawl_jobs(
+        deactivated_function_call_jobs
     )
     logger.info(
-        f"Found {len(function_call_crawl_jobs) - old_function_call_jobs_length} new function call crawl jobs. "
+        f"Added {added_count} and removed {removed_count} function call crawl job ABIs."
     )
 
-    return event_crawl_jobs, function_call_crawl_jobs
-
 
 def _retry_connect_web3(
     blockchain_type: AvailableBlockchainType,
@@ -108,6 +126,261 @@ def _retry_connect_web3(
     )
 
 
+@dataclass
+class _CrawledRange:
+    """
+    Blocks range passed between continuous crawler pipeline stages.
+    """
+
+    from_block: int
+    to_block: int
+    raw_events: List[Dict[str, Any]]
+    function_calls: List[ContractFunctionCall]
+    event_jobs_length: int
+    function_call_jobs_length: int
+    jobs_refetched_at: datetime
+    function_call_metrics: Dict[str, Any]
+    events: List[Event] = field(default_factory=list)
+
+
+def _put_to_stage_queue(
+    stage_queue: Queue, item: Any, stop_event: threading.Event
+) -> bool:
+    """
+    Put item to bounded queue of next stage, waiting while queue is full.
+
+    Returns False if pipeline was stopped before item was put.
+    """
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _get_from_stage_queue(
+    stage_queue: Queue, stop_event: threading.Event, producer: threading.Thread
+) -> Any:
+    """
+    Get item from queue of previous stage, returns None if pipeline was stopped.
+
+    Raises exception if producer stage thread exited without passing item to queue.
+    """
+    while not stop_event.is_set():
+        try:
+            return stage_queue.get(timeout=1)
+        except Empty:
+            if producer.is_alive():
+                continue
+            # Producer could put item to queue right before exit
+            try:
+                return stage_queue.get_nowait()
+            except Empty:
+                raise Exception(f"Crawler stage {producer.name} stopped unexpectedly")
+    return None
+
+
+def _fetch_stage(
+    blockchain_type: AvailableBlockchainType,
+    web3: Web3,
+    event_crawl_jobs: List[EventCrawlJob],
+    function_call_crawl_jobs: List[FunctionCallCrawlJob],
+    start_block: int,
+    max_blocks_batch: int,
+    min_blocks_batch: int,
+    confirmations: int,
+    min_sleep_time: float,
+    new_jobs_refetch_interval: float,
+    jobs_refetchet_time: datetime,
+    timestamps_cache: BlockTimestampsCache,
+    output_queue: Queue,
+    stop_event: threading.Event,
+) -> None:
+    """
+    First stage of continuous crawler pipeline, moves forward by blocks ranges
+    and fetches events and function calls of crawl jobs from blockchain.
+
+    Uses its own database session for function call crawler state provider.
+    """
+    network = (
+        Network.ethereum
+        if blockchain_type == AvailableBlockchainType.ETHEREUM
+        else Network.polygon
+    )
+    registry = CrawlJobRegistry(event_crawl_jobs, function_call_crawl_jobs)
+    try:
+        with yield_db_session_ctx() as db_session:
+            ethereum_state_provider = CachedTimestampsStateProvider(
+                web3,
+                network,
+                timestamps_cache,
+                db_session,
+            )
+            failed_count = 0
+            while not stop_event.is_set():
+                try:
+                    # query db  with limit 1, to avoid session closing
+                    db_session.execute("SELECT 1")
+                    time.sleep(min_sleep_time)
+
+                    end_block = min(
+                        web3.eth.blockNumber - confirmations,
+                        start_block + max_blocks_batch,
+                    )
+
+                    if start_block + min_blocks_batch > end_block:
+                        min_sleep_time += 0.1
+                        logger.info(
+                            f"Sleeping for {min_sleep_time} seconds because of low block count"
+                        )
+                        continue
+                    min_sleep_time = max(0, min_sleep_time - 0.1)
+
+                    logger.info(f"Crawling events from {start_block} to {end_block}")
+                    raw_events = _fetch_events(
+                        web3,
+                        registry,
+                        start_block,
+                        end_block,
+                        on_decode_error=_generate_reporter_callback(
+                            "event", blockchain_type
+                        ),
+                    )
+                    logger.info(
+                        f"Crawled {len(raw_events)} events from {start_block} to {end_block}."
+                    )
+
+                    logger.info(
+                        f"Crawling function calls from {start_block} to {end_block}"
+                    )
+                    function_calls = _crawl_functions(
+                        blockchain_type,
+                        ethereum_state_provider,
+                        registry.function_call_crawl_jobs,
+                        start_block,
+                        end_block,
+                    )
+                    logger.info(
+                        f"Crawled {len(function_calls)} function calls from {start_block} to {end_block}."
+                    )
+
+                    current_time = datetime.utcnow()
+                    if current_time - jobs_refetchet_time > timedelta(
+                        seconds=new_jobs_refetch_interval
+                    ):
+                        logger.info(
+                            f"Refetching new jobs from bugout journal since {jobs_refetchet_time}"
+                        )
+                        _refresh_crawl_jobs(
+                            registry, blockchain_type, jobs_refetchet_time
+                        )
+                        jobs_refetchet_time = current_time
+
+                    crawled_range = _CrawledRange(
+                        from_block=start_block,
+                        to_block=end_block,
+                        raw_events=raw_events,
+                        function_calls=function_calls,
+                        event_jobs_length=len(registry.event_crawl_jobs),
+                        function_call_jobs_length=len(
+                            registry.function_call_crawl_jobs
+                        ),
+                        jobs_refetched_at=jobs_refetchet_time,
+                        function_call_metrics=dict(ethereum_state_provider.metrics),
+                    )
+                    if not _put_to_stage_queue(output_queue, crawled_range, stop_event):
+                        break
+
+                    start_block = end_block + 1
+                    failed_count = 0
+                except Exception as e:
+                    logger.error(f"Internal error in fetch stage: {e}")
+                    logger.exception(e)
+                    failed_count += 1
+                    if failed_count > 10:
+                        logger.error("Too many failures, exiting")
+                        raise e
+                    try:
+                        web3 = _retry_connect_web3(blockchain_type)
+                        ethereum_state_provider.w3 = web3
+                    except Exception as err:
+                        logger.error(f"Failed to reconnect: {err}")
+                        logger.exception(err)
+                        raise err
+    except BaseException as e:
+        _put_to_stage_queue(output_queue, e, stop_event)
+
+
+def _decode_stage(
+    blockchain_type: AvailableBlockchainType,
+    web3: Web3,
+    timestamps_cache: BlockTimestampsCache,
+    input_queue: Queue,
+    output_queue: Queue,
+    stop_event: threading.Event,
+    producer: threading.Thread,
+) -> None:
+    """
+    Second stage of continuous crawler pipeline, resolves block timestamps
+    of fetched events and converts them to Event objects.
+
+    Uses its own database session to look up blocks.
+    """
+    try:
+        with yield_db_session_ctx() as db_session:
+            while not stop_event.is_set():
+                item = _get_from_stage_queue(input_queue, stop_event, producer)
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    _put_to_stage_queue(output_queue, item, stop_event)
+                    break
+
+                failed_count = 0
+                while True:
+                    try:
+                        item.events = _raw_events_to_events(
+                            db_session, item.raw_events, timestamps_cache
+                        )
+                        # Release snapshot of read only transaction
+                        db_session.rollback()
+                        break
+                    except Exception as e:
+                        logger.error(f"Internal error in decode stage: {e}")
+                        logger.exception(e)
+                        db_session.rollback()
+                        failed_count += 1
+                        if failed_count > 10:
+                            logger.error("Too many failures, exiting")
+                            raise e
+                        timestamps_cache.web3 = _retry_connect_web3(blockchain_type)
+
+                if not _put_to_stage_queue(output_queue, item, stop_event):
+                    break
+    except BaseException as e:
+        _put_to_stage_queue(output_queue, e, stop_event)
+
+
+def _persist_crawled_ranges(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    crawled_ranges: List[_CrawledRange],
+    commit: bool,
+) -> None:
+    """
+    Add labels of crawled ranges to session and commit them if commit is True.
+    """
+    for crawled_range in crawled_ranges:
+        add_events_to_session(db_session, crawled_range.events, blockchain_type)
+        add_function_calls_to_session(
+            db_session, crawled_range.function_calls, blockchain_type
+        )
+    if commit:
+        commit_session(db_session)
+
+
 def continuous_crawler(
     db_session: Session,
     blockchain_type: AvailableBlockchainType,
@@ -121,7 +394,22 @@ def continuous_crawler(
     min_sleep_time: float = 0.1,
     heartbeat_interval: float = 60,
     new_jobs_refetch_interval: float = 120,
+    pipeline_queue_size: int = 2,
+    timestamps_cache_size: int = 100000,
+    timestamps_store: Optional[str] = None,
 ):
+    """
+    Crawl events and function calls of crawl jobs moving forward to the blockchain head.
+
+    Crawler runs as pipeline of three stages connected by bounded queues:
+    fetch (thread) -> decode (thread) -> persist (current thread), so next blocks range
+    is fetched from node while previous one is being written to database.
+    pipeline_queue_size limits number of ranges waiting between stages.
+
+    Block timestamps are resolved by stages with one shared LRU cache of
+    timestamps_cache_size blocks, backed by on-disk SQLite store at
+    timestamps_store path if it is provided.
+    """
     crawler_type = "continuous"
     assert (
         min_blocks_batch < max_blocks_batch
@@ -134,6 +422,7 @@ def continuous_crawler(
     assert (
         new_jobs_refetch_interval > 0
     ), "new_jobs_refetch_interval must be greater than 0"
+    assert pipeline_queue_size > 0, "pipeline_queue_size must be greater than 0"
 
     crawl_start_time = datetime.utcnow()
 
@@ -141,17 +430,6 @@ def continuous_crawler(
     if web3 is None:
         web3 = _retry_connect_web3(blockchain_type)
 
-    network = (
-        Network.ethereum
-        if blockchain_type == AvailableBlockchainType.ETHEREUM
-        else Network.polygon
-    )
-    ethereum_state_provider = MoonstreamEthereumStateProvider(
-        web3,
-        network,
-        db_session,
-    )
-
     heartbeat_template = {
         "status": "crawling",
         "start_block": start_block,
@@ -171,127 +449,133 @@ def continuous_crawler(
         crawler_status=heartbeat_template,
     )
     last_heartbeat_time = datetime.utcnow()
-    blocks_cache: Dict[int, int] = {}
 
-    failed_count = 0
-    try:
-        while True:
-            try:
-                # query db  with limit 1, to avoid session closing
-                db_session.execute("SELECT 1")
-                time.sleep(min_sleep_time)
+    timestamps_cache = BlockTimestampsCache(
+        blockchain_type,
+        web3,
+        max_size=timestamps_cache_size,
+        store_path=timestamps_store,
+    )
 
-                end_block = min(
-                    web3.eth.blockNumber - confirmations,
-                    start_block + max_blocks_batch,
-                )
+    stop_event = threading.Event()
+    decode_queue: Queue = Queue(maxsize=pipeline_queue_size)
+    persist_queue: Queue = Queue(maxsize=pipeline_queue_size)
+    fetch_stage = threading.Thread(
+        target=_fetch_stage,
+        name="continuous-crawler-fetch",
+        args=(
+            blockchain_type,
+            web3,
+            event_crawl_jobs,
+            function_call_crawl_jobs,
+            start_block,
+            max_blocks_batch,
+            min_blocks_batch,
+            confirmations,
+            min_sleep_time,
+            new_jobs_refetch_interval,
+            jobs_refetchet_time,
+            timestamps_cache,
+            decode_queue,
+            stop_event,
+        ),
+        daemon=True,
+    )
+    decode_stage = threading.Thread(
+        target=_decode_stage,
+        name="continuous-crawler-decode",
+        args=(
+            blockchain_type,
+            web3,
+            timestamps_cache,
+            decode_queue,
+            persist_queue,
+            stop_event,
+            fetch_stage,
+        ),
+        daemon=True,
+    )
+    stages = [fetch_stage, decode_stage]
+    for stage in stages:
+        stage.start()
 
-                if start_block + min_blocks_batch > end_block:
-                    min_sleep_time += 0.1
-                    logger.info(
-                        f"Sleeping for {min_sleep_time} seconds because of low block count"
+    end_block = start_block
+    # Ranges added to session since the last commit, rollback drops their labels
+    uncommitted_ranges: List[_CrawledRange] = []
+    try:
+        while True:
+            crawled_range = _get_from_stage_queue(
+                persist_queue, stop_event, decode_stage
+            )
+            if isinstance(crawled_range, BaseException):
+                raise crawled_range
+            uncommitted_ranges.append(crawled_range)
+
+            current_time = datetime.utcnow()
+            commit = current_time - last_heartbeat_time > timedelta(
+                seconds=heartbeat_interval
+            )
+
+            ranges_to_persist = [crawled_range]
+            failed_count = 0
+            while True:
+                try:
+                    _persist_crawled_ranges(
+                        db_session, blockchain_type, ranges_to_persist, commit
                     )
-                    continue
-                min_sleep_time = max(0, min_sleep_time - 0.1)
-
-                logger.info(f"Crawling events from {start_block} to {end_block}")
-                all_events = _crawl_events(
-                    db_session=db_session,
-                    blockchain_type=blockchain_type,
-                    web3=web3,
-                    jobs=event_crawl_jobs,
-                    from_block=start_block,
-                    to_block=end_block,
-                    blocks_cache=blocks_cache,
-                    db_block_query_batch=min_blocks_batch * 2,
-                )
-                logger.info(
-                    f"Crawled {len(all_events)} events from {start_block} to {end_block}."
-                )
-
-                add_events_to_session(db_session, all_events, blockchain_type)
-
-                logger.info(
-                    f"Crawling function calls from {start_block} to {end_block}"
-                )
-                all_function_calls = _crawl_functions(
-                    blockchain_type,
-                    ethereum_state_provider,
-                    function_call_crawl_jobs,
-                    start_block,
-                    end_block,
+                    break
+                except Exception as e:
+                    logger.error(f"Internal error in persist stage: {e}")
+                    logger.exception(e)
+                    db_session.rollback()
+                    failed_count += 1
+                    if failed_count > 10:
+                        logger.error("Too many failures, exiting")
+                        raise e
+                    time.sleep(failed_count)
+                    ranges_to_persist = uncommitted_ranges
+
+            end_block = crawled_range.to_block
+            jobs_refetchet_time = crawled_range.jobs_refetched_at
+
+            if commit:
+                uncommitted_ranges = []
+
+                # Update heartbeat
+                heartbeat_template["last_block"] = end_block
+                heartbeat_template["current_time"] = _date_to_str(current_time)
+                heartbeat_template[
+                    "current_event_jobs_length"
+                ] = crawled_range.event_jobs_length
+                heartbeat_template["jobs_last_refetched_at"] = _date_to_str(
+                    jobs_refetchet_time
                 )
-                logger.info(
-                    f"Crawled {len(all_function_calls)} function calls from {start_block} to {end_block}."
-                )
-
-                add_function_calls_to_session(
-                    db_session, all_function_calls, blockchain_type
+                heartbeat_template[
+                    "current_function_call_jobs_length"
+                ] = crawled_range.function_call_jobs_length
+                heartbeat_template[
+                    "function_call metrics"
+                ] = crawled_range.function_call_metrics
+                heartbeat_template["pipeline_queues"] = {
+                    "decode": decode_queue.qsize(),
+                    "persist": persist_queue.qsize(),
+                }
+                heartbeat_template["block_timestamps_cache"] = {
+                    "size": len(timestamps_cache),
+                    **timestamps_cache.metrics,
+                }
+                heartbeat(
+                    crawler_type=crawler_type,
+                    blockchain_type=blockchain_type,
+                    crawler_status=heartbeat_template,
                 )
-
-                current_time = datetime.utcnow()
-
-                if current_time - jobs_refetchet_time > timedelta(
-                    seconds=new_jobs_refetch_interval
-                ):
-                    logger.info(
-                        f"Refetching new jobs from bugout journal since {jobs_refetchet_time}"
-                    )
-                    event_crawl_jobs, function_call_crawl_jobs = _refetch_new_jobs(
-                        event_crawl_jobs, function_call_crawl_jobs, blockchain_type
-                    )
-                    jobs_refetchet_time = current_time
-
-                if current_time - last_heartbeat_time > timedelta(
-                    seconds=heartbeat_interval
-                ):
-                    # Commiting to db
-                    commit_session(db_session)
-
-                    # Update heartbeat
-                    heartbeat_template["last_block"] = end_block
-                    heartbeat_template["current_time"] = _date_to_str(current_time)
-                    heartbeat_template["current_event_jobs_length"] = len(
-                        event_crawl_jobs
-                    )
-                    heartbeat_template["jobs_last_refetched_at"] = _date_to_str(
-                        jobs_refetchet_time
-                    )
-                    heartbeat_template["current_function_call_jobs_length"] = len(
-                        function_call_crawl_jobs
-                    )
-                    heartbeat_template[
-                        "function_call metrics"
-                    ] = ethereum_state_provider.metrics
-                    heartbeat(
-                        crawler_type=crawler_type,
-                        blockchain_type=blockchain_type,
-                        crawler_status=heartbeat_template,
-                    )
-                    logger.info("Sending heartbeat.", heartbeat_template)
-                    last_heartbeat_time = datetime.utcnow()
-
-                start_block = end_block + 1
-                failed_count = 0
-            except Exception as e:
-                logger.error(f"Internal error: {e}")
-                logger.exception(e)
-                failed_count += 1
-                if failed_count > 10:
-                    logger.error("Too many failures, exiting")
-                    raise e
-                try:
-                    web3 = _retry_connect_web3(blockchain_type)
-                except Exception as err:
-                    logger.error(f"Failed to reconnect: {err}")
-                    logger.exception(err)
-                    raise err
+                logger.info("Sending heartbeat.", heartbeat_template)
+                last_heartbeat_time = datetime.utcnow()
 
     except BaseException as e:
         logger.error(f"!!!!Crawler Died!!!!")
         heartbeat_template["status"] = "dead"
         heartbeat_template["current_time"] = _date_to_str(datetime.utcnow())
-        heartbeat_template["current_event_jobs_length"] = len(event_crawl_jobs)
         heartbeat_template["jobs_last_refetched_at"] = _date_to_str(jobs_refetchet_time)
         error_summary = (repr(e),)
         error_traceback = (
@@ -316,3 +600,8 @@ def continuous_crawler(
 
         logger.exception(e)
         raise e
+    finally:
+        stop_event.set()
+        for stage in stages:
+            stage.join()
+        timestamps_cache.close()
@@ -2,16 +2,19 @@ import json
 import logging
 import re
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import Any, Callable, Dict, List, Optional, cast
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, cast
 
 from bugout.data import BugoutSearchResult
+from eth_typing import HexStr
 from eth_typing.evm import ChecksumAddress
+from eth_utils import encode_hex, event_abi_to_log_topic
 from moonstreamdb.models import Base
 from sqlalchemy.orm.session import Session
 from web3.main import Web3
+from web3.types import FilterParams
 
 from mooncrawl.data import AvailableBlockchainType
 
@@ -109,6 +112,8 @@ class EventCrawlJob:
     event_abi: Dict[str, Any]
     contracts: List[ChecksumAddress]
     created_at: int
+    # Ids of subscriptions entries by contract
+    entry_ids: Dict[ChecksumAddress, Set[str]] = field(default_factory=dict)
 
 
 @dataclass
@@ -116,24 +121,28 @@ class FunctionCallCrawlJob:
     contract_abi: List[Dict[str, Any]]
     contract_address: ChecksumAddress
     created_at: int
+    # Ids of subscriptions entries by function selector
+    entry_ids: Dict[Optional[str], Set[str]] = field(default_factory=dict)
 
 
 def get_crawl_job_entries(
     subscription_type: SubscriptionTypes,
     crawler_type: str,
     journal_id: str = MOONSTREAM_MOONWORM_TASKS_JOURNAL,
-    created_at_filter: int = None,
+    created_at_filter: Optional[int] = None,
     limit: int = 200,
+    status: str = "active",
+    updated_at_filter: Optional[int] = None,
 ) -> List[BugoutSearchResult]:
     """
     Get all event ABIs from bugout journal
     where tags are:
     - #crawler_type:crawler_type (either event or function)
-    - #status:active
+    - #status:status (active by default, inactive for deactivated jobs)
     - #subscription_type:subscription_type (either polygon_blockchain or ethereum_blockchain)
 
     """
-    query = f"#status:active #type:{crawler_type} #subscription_type:{subscription_type.value}"
+    query = f"#status:{status} #type:{crawler_type} #subscription_type:{subscription_type.value}"
 
     if created_at_filter is not None:
         # Filtering by created_at
@@ -144,6 +153,11 @@ def get_crawl_job_entries(
         #
         query += f" created_at:>={created_at_filter}"
 
+    if updated_at_filter is not None:
+        # Jobs are deactivated by changing status tag of old entries,
+        # so they are found by update time
+        query += f" updated_at:>={updated_at_filter}"
+
     current_offset = 0
     entries = []
     while True:
@@ -170,6 +184,10 @@ def _get_tag(entry: BugoutSearchResult, tag: str) -> str:
     raise ValueError(f"Tag {tag} not found in {entry}")
 
 
+def _get_entry_id(entry: BugoutSearchResult) -> str:
+    return entry.entry_url.split("/")[-1]
+
+
 def make_event_crawl_jobs(entries: List[BugoutSearchResult]) -> List[EventCrawlJob]:
     """
     Create EventCrawlJob objects from bugout entries.
@@ -187,13 +205,16 @@ def make_event_crawl_jobs(entries: List[BugoutSearchResult]) -> List[EventCrawlJ
                 existing_crawl_job.contracts.append(contract_address)
         else:
             abi = cast(str, entry.content)
-            new_crawl_job = EventCrawlJob(
+            existing_crawl_job = EventCrawlJob(
                 event_abi_hash=abi_hash,
                 event_abi=json.loads(abi),
                 contracts=[contract_address],
                 created_at=int(datetime.fromisoformat(entry.created_at).timestamp()),
             )
-            crawl_job_by_hash[abi_hash] = new_crawl_job
+            crawl_job_by_hash[abi_hash] = existing_crawl_job
+        existing_crawl_job.entry_ids.setdefault(contract_address, set()).add(
+            _get_entry_id(entry)
+        )
 
     return [crawl_job for crawl_job in crawl_job_by_hash.values()]
 
@@ -209,19 +230,334 @@ def make_function_call_crawl_jobs(
 
     for entry in entries:
         contract_address = Web3().toChecksumAddress(_get_tag(entry, "address"))
-        abi = cast(str, entry.content)
-        if contract_address not in crawl_job_by_address:
-            crawl_job_by_address[contract_address] = FunctionCallCrawlJob(
-                contract_abi=[json.loads(abi)],
+        abi = json.loads(cast(str, entry.content))
+        selector = encode_function_signature(abi)
+        crawl_job = crawl_job_by_address.get(contract_address)
+        if crawl_job is None:
+            crawl_job = FunctionCallCrawlJob(
+                contract_abi=[abi],
                 contract_address=contract_address,
                 created_at=int(datetime.fromisoformat(entry.created_at).timestamp()),
             )
-        else:
-            crawl_job_by_address[contract_address].contract_abi.append(json.loads(abi))
+            crawl_job_by_address[contract_address] = crawl_job
+        elif selector not in crawl_job.entry_ids:
+            crawl_job.contract_abi.append(abi)
+        crawl_job.entry_ids.setdefault(selector, set()).add(_get_entry_id(entry))
 
     return [crawl_job for crawl_job in crawl_job_by_address.values()]
 
 
+class CrawlJobRegistry:
+    """
+    Indexed collection of crawl jobs.
+
+    Event crawl jobs are indexed by ABI hash, log topic and contract address,
+    function call crawl jobs by contract address with cached function selectors.
+    Additions and deactivations are applied in time proportional to their size,
+    merged eth_getLogs filter is rebuilt only after jobs change.
+
+    Subscriptions entries ids are kept for each (ABI, contract) pair, pair is removed
+    only when all entries using it are deactivated.
+    """
+
+    def __init__(
+        self,
+        event_crawl_jobs: Optional[List[EventCrawlJob]] = None,
+        function_call_crawl_jobs: Optional[List[FunctionCallCrawlJob]] = None,
+    ) -> None:
+        self._event_jobs: Dict[str, EventCrawlJob] = {}
+        self._event_contracts: Dict[str, Set[ChecksumAddress]] = {}
+        self._event_topics: Dict[str, str] = {}
+        self._event_hashes_by_topic: Dict[str, Set[str]] = {}
+        self._event_hashes_by_address: Dict[ChecksumAddress, Set[str]] = {}
+        self._function_call_jobs: Dict[ChecksumAddress, FunctionCallCrawlJob] = {}
+        self._function_selectors: Dict[ChecksumAddress, Set[Optional[str]]] = {}
+        self._event_entry_ids: Dict[Tuple[str, ChecksumAddress], Set[str]] = {}
+        self._function_entry_ids: Dict[
+            Tuple[ChecksumAddress, Optional[str]], Set[str]
+        ] = {}
+
+        self._event_crawl_jobs_list: Optional[List[EventCrawlJob]] = None
+        self._function_call_crawl_jobs_list: Optional[List[FunctionCallCrawlJob]] = None
+        self._event_logs_filter: Optional[FilterParams] = None
+        self._event_jobs_by_topic: Optional[
+            Dict[str, List[Tuple[EventCrawlJob, Set[ChecksumAddress]]]]
+        ] = None
+
+        if event_crawl_jobs is not None:
+            self.add_event_crawl_jobs(event_crawl_jobs)
+        if function_call_crawl_jobs is not None:
+            self.add_function_call_crawl_jobs(function_call_crawl_jobs)
+
+    def _event_jobs_changed(self) -> None:
+        self._event_crawl_jobs_list = None
+        self._event_logs_filter = None
+        self._event_jobs_by_topic = None
+
+    @staticmethod
+    def _release_entries(
+        entry_ids_index: Dict[Any, Set[str]], key: Any, removed_entry_ids: Set[str]
+    ) -> bool:
+        """
+        Forgets deactivated entries of key, returns True if no active entries use it.
+        Jobs without entries ids are released at once.
+        """
+        entry_ids = entry_ids_index.get(key)
+        if removed_entry_ids and entry_ids:
+            entry_ids.difference_update(removed_entry_ids)
+            if entry_ids:
+                return False
+        entry_ids_index.pop(key, None)
+        return True
+
+    def _index_event_contract(self, abi_hash: str, contract: ChecksumAddress) -> bool:
+        contracts = self._event_contracts[abi_hash]
+        if contract in contracts:
+            return False
+        contracts.add(contract)
+        self._event_hashes_by_address.setdefault(contract, set()).add(abi_hash)
+        return True
+
+    def _unindex_event_contract(self, abi_hash: str, contract: ChecksumAddress) -> bool:
+        contracts = self._event_contracts[abi_hash]
+        if contract not in contracts:
+            return False
+        contracts.remove(contract)
+        abi_hashes = self._event_hashes_by_address[contract]
+        abi_hashes.remove(abi_hash)
+        if not abi_hashes:
+            del self._event_hashes_by_address[contract]
+        return True
+
+    def _remove_event_job(self, abi_hash: str) -> None:
+        for contract in list(self._event_contracts[abi_hash]):
+            self._unindex_event_contract(abi_hash, contract)
+        del self._event_contracts[abi_hash]
+        del self._event_jobs[abi_hash]
+        topic = self._event_topics.pop(abi_hash)
+        abi_hashes = self._event_hashes_by_topic[topic]
+        abi_hashes.remove(abi_hash)
+        if not abi_hashes:
+            del self._event_hashes_by_topic[topic]
+
+    def add_event_crawl_jobs(self, event_crawl_jobs: List[EventCrawlJob]) -> int:
+        """
+        Adds new jobs and new contracts of existing jobs.
+
+        Existing jobs are modified in place. Returns number of added (ABI, contract) pairs.
+        """
+        added_count = 0
+        for new_job in event_crawl_jobs:
+            for contract in new_job.contracts:
+                self._event_entry_ids.setdefault(
+                    (new_job.event_abi_hash, contract), set()
+                ).update(new_job.entry_ids.get(contract, set()))
+
+            existing_job = self._event_jobs.get(new_job.event_abi_hash)
+            if existing_job is None:
+                abi_hash = new_job.event_abi_hash
+                topic = encode_hex(event_abi_to_log_topic(new_job.event_abi))
+                self._event_jobs[abi_hash] = new_job
+                self._event_contracts[abi_hash] = set()
+                self._event_topics[abi_hash] = topic
+                self._event_hashes_by_topic.setdefault(topic, set()).add(abi_hash)
+                contracts = list(new_job.contracts)
+                new_job.contracts.clear()
+                for contract in contracts:
+                    if self._index_event_contract(abi_hash, contract):
+                        new_job.contracts.append(contract)
+                added_count += max(len(new_job.contracts), 1)
+            else:
+                for contract in new_job.contracts:
+                    if self._index_event_contract(
+                        existing_job.event_abi_hash, contract
+                    ):
+                        existing_job.contracts.append(contract)
+                        added_count += 1
+
+        if added_count > 0:
+            self._event_jobs_changed()
+        return added_count
+
+    def remove_event_crawl_jobs(self, event_crawl_jobs: List[EventCrawlJob]) -> int:
+        """
+        Removes deactivated contracts from jobs, job without contracts left is removed.
+        Contracts still used by active subscriptions entries are kept.
+
+        Returns number of removed (ABI, contract) pairs.
+        """
+        removed_count = 0
+        for removed_job in event_crawl_jobs:
+            abi_hash = removed_job.event_abi_hash
+            existing_job = self._event_jobs.get(abi_hash)
+            if existing_job is None:
+                continue
+            removed_contracts = set()
+            for contract in removed_job.contracts:
+                if self._release_entries(
+                    self._event_entry_ids,
+                    (abi_hash, contract),
+                    removed_job.entry_ids.get(contract, set()),
+                ) and self._unindex_event_contract(abi_hash, contract):
+                    removed_contracts.add(contract)
+            if removed_contracts:
+                existing_job.contracts = [
+                    contract
+                    for contract in existing_job.contracts
+                    if contract not in removed_contracts
+                ]
+                removed_count += len(removed_contracts)
+                if not existing_job.contracts:
+                    self._remove_event_job(abi_hash)
+
+        if removed_count > 0:
+            self._event_jobs_changed()
+        return removed_count
+
+    def add_function_call_crawl_jobs(
+        self, function_call_crawl_jobs: List[FunctionCallCrawlJob]
+    ) -> int:
+        """
+        Adds new jobs and new function ABIs of existing jobs.
+
+        Existing jobs are modified in place. Returns number of added function ABIs.
+        """
+        added_count = 0
+        for new_job in function_call_crawl_jobs:
+            address = new_job.contract_address
+            for function_abi in new_job.contract_abi:
+                selector = encode_function_signature(function_abi)
+                self._function_entry_ids.setdefault((address, selector), set()).update(
+                    new_job.entry_ids.get(selector, set())
+                )
+
+            existing_job = self._function_call_jobs.get(address)
+            if existing_job is None:
+                self._function_call_jobs[address] = new_job
+                self._function_selectors[address] = {
+                    encode_function_signature(function_abi)
+                    for function_abi in new_job.contract_abi
+                }
+                added_count += len(new_job.contract_abi)
+                continue
+
+            selectors = self._function_selectors[address]
+            for function_abi in new_job.contract_abi:
+                selector = encode_function_signature(function_abi)
+                if selector not in selectors:
+                    selectors.add(selector)
+                    existing_job.contract_abi.append(function_abi)
+                    added_count += 1
+
+        if added_count > 0:
+            self._function_call_crawl_jobs_list = None
+        return added_count
+
+    def remove_function_call_crawl_jobs(
+        self, function_call_crawl_jobs: List[FunctionCallCrawlJob]
+    ) -> int:
+        """
+        Removes deactivated function ABIs from jobs, job without ABIs left is removed.
+        Function ABIs still used by active subscriptions entries are kept.
+
+        Returns number of removed function ABIs.
+        """
+        removed_count = 0
+        for removed_job in function_call_crawl_jobs:
+            address = removed_job.contract_address
+            existing_job = self._function_call_jobs.get(address)
+            if existing_job is None:
+                continue
+            selectors = self._function_selectors[address]
+            removed_selectors = set()
+            for function_abi in removed_job.contract_abi:
+                selector = encode_function_signature(function_abi)
+                if selector in selectors and self._release_entries(
+                    self._function_entry_ids,
+                    (address, selector),
+                    removed_job.entry_ids.get(selector, set()),
+                ):
+                    removed_selectors.add(selector)
+            if not removed_selectors:
+                continue
+            selectors.difference_update(removed_selectors)
+            existing_job.contract_abi = [
+                function_abi
+                for function_abi in existing_job.contract_abi
+                if encode_function_signature(function_abi) not in removed_selectors
+            ]
+            removed_count += len(removed_selectors)
+            if not existing_job.contract_abi:
+                del self._function_call_jobs[address]
+                del self._function_selectors[address]
+
+        if removed_count > 0:
+            self._function_call_crawl_jobs_list = None
+        return removed_count
+
+    @property
+    def event_crawl_jobs(self) -> List[EventCrawlJob]:
+        if self._event_crawl_jobs_list is None:
+            self._event_crawl_jobs_list = list(self._event_jobs.values())
+        return self._event_crawl_jobs_list
+
+    @property
+    def function_call_crawl_jobs(self) -> List[FunctionCallCrawlJob]:
+        if self._function_call_crawl_jobs_list is None:
+            self._function_call_crawl_jobs_list = list(
+                self._function_call_jobs.values()
+            )
+        return self._function_call_crawl_jobs_list
+
+    @property
+    def event_topics(self) -> Set[str]:
+        """
+        Log topics of all event crawl jobs.
+        """
+        return set(self._event_hashes_by_topic)
+
+    @property
+    def event_addresses(self) -> Set[ChecksumAddress]:
+        """
+        Contracts addresses of all event crawl jobs.
+        """
+        return set(self._event_hashes_by_address)
+
+    def event_logs_filter(self) -> FilterParams:
+        """
+        Single eth_getLogs filter for all event crawl jobs: topics of all event ABIs
+        OR-ed together and union of contracts addresses. Address filter is omitted
+        if some job crawls events of any address.
+        """
+        if self._event_logs_filter is None:
+            filter_params: FilterParams = {
+                "topics": [
+                    [HexStr(topic) for topic in sorted(self._event_hashes_by_topic)]
+                ],
+            }
+            # Job without contracts crawls events of any address
+            if all(self._event_contracts.values()):
+                filter_params["address"] = sorted(self._event_hashes_by_address)
+            self._event_logs_filter = filter_params
+        return self._event_logs_filter
+
+    def event_jobs_by_topic(
+        self,
+    ) -> Dict[str, List[Tuple[EventCrawlJob, Set[ChecksumAddress]]]]:
+        """
+        Topic -> (job, job contracts) index to dispatch fetched logs to decoders.
+        """
+        if self._event_jobs_by_topic is None:
+            self._event_jobs_by_topic = {
+                topic: [
+                    (self._event_jobs[abi_hash], self._event_contracts[abi_hash])
+                    for abi_hash in abi_hashes
+                ]
+                for topic, abi_hashes in self._event_hashes_by_topic.items()
+            }
+        return self._event_jobs_by_topic
+
+
 def merge_event_crawl_jobs(
     old_crawl_jobs: List[EventCrawlJob], new_event_crawl_jobs: List[EventCrawlJob]
 ) -> List[EventCrawlJob]:
@@ -236,19 +572,9 @@ def merge_event_crawl_jobs(
     Returns:
         Merged list of event crawl jobs
     """
-    for new_crawl_job in new_event_crawl_jobs:
-        for old_crawl_job in old_crawl_jobs:
-            if new_crawl_job.event_abi_hash == old_crawl_job.event_abi_hash:
-                old_crawl_job.contracts.extend(
-                    [
-                        contract
-                        for contract in new_crawl_job.contracts
-                        if contract not in old_crawl_job.contracts
-                    ]
-                )
-                break
-        else:
-            old_crawl_jobs.append(new_crawl_job)
+    registry = CrawlJobRegistry(event_crawl_jobs=old_crawl_jobs)
+    registry.add_event_crawl_jobs(new_event_crawl_jobs)
+    old_crawl_jobs[:] = registry.event_crawl_jobs
     return old_crawl_jobs
 
 
@@ -267,23 +593,9 @@ def merge_function_call_crawl_jobs(
     Returns:
         Merged list of function call crawl jobs
     """
-    for new_crawl_job in new_function_call_crawl_jobs:
-        for old_crawl_job in old_crawl_jobs:
-            if new_crawl_job.contract_address == old_crawl_job.contract_address:
-                old_selectors = [
-                    encode_function_signature(function_abi)
-                    for function_abi in old_crawl_job.contract_abi
-                ]
-                old_crawl_job.contract_abi.extend(
-                    [
-                        function_abi
-                        for function_abi in new_crawl_job.contract_abi
-                        if encode_function_signature(function_abi) not in old_selectors
-                    ]
-                )
-                break
-        else:
-            old_crawl_jobs.append(new_crawl_job)
+    registry = CrawlJobRegistry(function_call_crawl_jobs=old_crawl_jobs)
+    registry.add_function_call_crawl_jobs(new_function_call_crawl_jobs)
+    old_crawl_jobs[:] = registry.function_call_crawl_jobs
     return old_crawl_jobs
 
 
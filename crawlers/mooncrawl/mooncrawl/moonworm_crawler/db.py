@@ -1,22 +1,25 @@
 import logging
-from typing import Any, Dict, List, Optional, Union
+import time
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 from eth_typing.evm import ChecksumAddress
 from hexbytes.main import HexBytes
 from moonstreamdb.db import yield_db_session_ctx
 from moonstreamdb.models import (
-    Base,
     EthereumLabel,
     EthereumTransaction,
     PolygonLabel,
     PolygonTransaction,
 )
 from moonworm.crawler.function_call_crawler import ContractFunctionCall  # type: ignore
+from psycopg2.extras import Json, execute_values  # type: ignore
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.expression import label
 
 from ..blockchain import connect, get_block_model, get_label_model
 from ..data import AvailableBlockchainType
+from ..rollups import update_rollups
 from ..settings import CRAWLER_LABEL
 from .crawler import FunctionCallCrawlJob, _generate_reporter_callback
 from .event_crawler import Event
@@ -25,37 +28,34 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def _event_to_label(blockchain_type: AvailableBlockchainType, event: Event) -> Base:
+def _event_to_label_row(event: Event) -> Dict[str, Any]:
     """
-    Creates a label model.
+    Creates a label row for bulk insert.
     """
-    label_model = get_label_model(blockchain_type)
-    label = label_model(
-        label=CRAWLER_LABEL,
-        label_data={
+    return {
+        "id": uuid.uuid4(),
+        "label": CRAWLER_LABEL,
+        "label_data": {
             "type": "event",
             "name": event.event_name,
             "args": event.args,
         },
-        address=event.address,
-        block_number=event.block_number,
-        block_timestamp=event.block_timestamp,
-        transaction_hash=event.transaction_hash,
-        log_index=event.log_index,
-    )
-    return label
+        "address": event.address,
+        "block_number": event.block_number,
+        "block_timestamp": event.block_timestamp,
+        "transaction_hash": event.transaction_hash,
+        "log_index": event.log_index,
+    }
 
 
-def _function_call_to_label(
-    blockchain_type: AvailableBlockchainType, function_call: ContractFunctionCall
-) -> Base:
+def _function_call_to_label_row(function_call: ContractFunctionCall) -> Dict[str, Any]:
     """
-    Creates a label model.
+    Creates a label row for bulk insert.
     """
-    label_model = get_label_model(blockchain_type)
-    label = label_model(
-        label=CRAWLER_LABEL,
-        label_data={
+    return {
+        "id": uuid.uuid4(),
+        "label": CRAWLER_LABEL,
+        "label_data": {
             "type": "tx_call",
             "name": function_call.function_name,
             "caller": function_call.caller_address,
@@ -63,13 +63,12 @@ def _function_call_to_label(
             "status": function_call.status,
             "gasUsed": function_call.gas_used,
         },
-        address=function_call.contract_address,
-        block_number=function_call.block_number,
-        transaction_hash=function_call.transaction_hash,
-        block_timestamp=function_call.block_timestamp,
-    )
-
-    return label
+        "address": function_call.contract_address,
+        "block_number": function_call.block_number,
+        "block_timestamp": function_call.block_timestamp,
+        "transaction_hash": function_call.transaction_hash,
+        "log_index": None,
+    }
 
 
 def get_last_labeled_block_number(
@@ -100,42 +99,99 @@ def commit_session(db_session: Session) -> None:
         raise e
 
 
-def add_events_to_session(
-    db_session: Session, events: List[Event], blockchain_type: AvailableBlockchainType
-) -> None:
-    label_model = get_label_model(blockchain_type)
+LABEL_COLUMNS = [
+    "id",
+    "label",
+    "label_data",
+    "address",
+    "block_number",
+    "block_timestamp",
+    "transaction_hash",
+    "log_index",
+]
 
-    events_hashes_to_save = [event.transaction_hash for event in events]
 
-    existing_labels = (
-        db_session.query(label_model.transaction_hash, label_model.log_index)
-        .filter(
-            label_model.label == CRAWLER_LABEL,
-            label_model.log_index != None,
-            label_model.transaction_hash.in_(events_hashes_to_save),
-        )
-        .all()
+def _insert_labels_batch(
+    cursor: Any, table_name: str, batch: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Returns rows which were inserted.
+    """
+    inserted_ids = execute_values(
+        cursor,
+        f"INSERT INTO {table_name} ({', '.join(LABEL_COLUMNS)}) VALUES %s ON CONFLICT DO NOTHING RETURNING id",
+        [
+            (
+                str(row["id"]),
+                row["label"],
+                Json(row["label_data"]),
+                row["address"],
+                row["block_number"],
+                row["block_timestamp"],
+                row["transaction_hash"],
+                row["log_index"],
+            )
+            for row in batch
+        ],
+        page_size=len(batch),
+        fetch=True,
     )
+    inserted_ids_set = {str(inserted_id) for (inserted_id,) in inserted_ids}
+    return [row for row in batch if str(row["id"]) in inserted_ids_set]
+
+
+def insert_labels(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    label_rows: Iterable[Dict[str, Any]],
+    batch_size: int = 1000,
+) -> int:
+    """
+    Inserts label rows in batches with INSERT ... ON CONFLICT DO NOTHING, labels
+    which already exist in database are skipped by unique indexes on
+    (transaction_hash, log_index) of moonworm labels.
+
+    Rows are deduplicated by (transaction_hash, log_index) before insert. Inserted
+    labels are added to labels rollups.
+    Commit is left to the caller, returns number of inserted labels.
+    """
+    assert batch_size > 0, "batch_size must be greater than 0"
+
+    table_name = get_label_model(blockchain_type).__tablename__
+    cursor = db_session.connection().connection.cursor()
 
-    existing_labels_transactions = []
-    existing_log_index_by_tx_hash: Dict[str, List[int]] = {}
-    for label in existing_labels:
-        if label[0] not in existing_labels_transactions:
-            existing_labels_transactions.append(label[0])
-            existing_log_index_by_tx_hash[label[0]] = []
-        existing_log_index_by_tx_hash[label[0]].append(label[1])
+    inserted = 0
 
-    labels_to_save = []
-    for event in events:
-        if event.transaction_hash not in existing_labels_transactions:
-            labels_to_save.append(_event_to_label(blockchain_type, event))
-        elif (
-            event.log_index not in existing_log_index_by_tx_hash[event.transaction_hash]
-        ):
-            labels_to_save.append(_event_to_label(blockchain_type, event))
+    def insert_batch(batch: List[Dict[str, Any]]) -> int:
+        inserted_rows = _insert_labels_batch(cursor, table_name, batch)
+        update_rollups(db_session, blockchain_type, inserted_rows)
+        return len(inserted_rows)
 
-    logger.info(f"Saving {len(labels_to_save)} labels to session")
-    db_session.add_all(labels_to_save)
+    seen_keys: Set[Tuple[str, Optional[int]]] = set()
+    batch: List[Dict[str, Any]] = []
+    for row in label_rows:
+        key = (row["transaction_hash"], row["log_index"])
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        batch.append(row)
+        if len(batch) >= batch_size:
+            inserted += insert_batch(batch)
+            batch = []
+    if batch:
+        inserted += insert_batch(batch)
+    return inserted
+
+
+def add_events_to_session(
+    db_session: Session, events: List[Event], blockchain_type: AvailableBlockchainType
+) -> None:
+    inserted = insert_labels(
+        db_session,
+        blockchain_type,
+        [_event_to_label_row(event) for event in events],
+    )
+    logger.info(f"Saved {inserted} of {len(events)} event labels to session")
 
 
 def add_function_calls_to_session(
@@ -143,29 +199,81 @@ def add_function_calls_to_session(
     function_calls: List[ContractFunctionCall],
     blockchain_type: AvailableBlockchainType,
 ) -> None:
+    inserted = insert_labels(
+        db_session,
+        blockchain_type,
+        [
+            _function_call_to_label_row(function_call)
+            for function_call in function_calls
+        ],
+    )
+    logger.info(
+        f"Saved {inserted} of {len(function_calls)} function call labels to session"
+    )
 
-    label_model = get_label_model(blockchain_type)
-    transactions_hashes_to_save = [
-        function_call.transaction_hash for function_call in function_calls
-    ]
-
-    existing_labels = (
-        db_session.query(label_model.transaction_hash)
-        .filter(
-            label_model.label == CRAWLER_LABEL,
-            label_model.log_index == None,
-            label_model.transaction_hash.in_(transactions_hashes_to_save),
+
+def _generate_benchmark_label_rows(labels_count: int) -> Iterator[Dict[str, Any]]:
+    for i in range(labels_count):
+        yield _event_to_label_row(
+            Event(
+                event_name="Transfer",
+                args={"from": "0x" + "00" * 20, "to": "0x" + "00" * 20, "value": i},
+                address="0x" + "00" * 20,
+                block_number=i // 100,
+                block_timestamp=i // 100,
+                transaction_hash=f"0x{i // 4:064x}",
+                log_index=i % 4,
+            )
         )
-        .all()
-    )
 
-    existing_labels_transactions = [label[0] for label in existing_labels]
 
-    labels_to_save = [
-        _function_call_to_label(blockchain_type, function_call)
-        for function_call in function_calls
-        if function_call.transaction_hash not in existing_labels_transactions
-    ]
+def benchmark_labels_writer(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    labels_counts: List[int],
+    batch_size: int = 1000,
+) -> Dict[int, Dict[str, float]]:
+    """
+    Measures labels/sec of insert_labels for each number of labels per commit.
+
+    Synthetic labels are inserted, then inserted again to measure skipping of
+    existing labels by unique index. Transaction is rolled back after each run,
+    so database is left unchanged.
+    """
+    results: Dict[int, Dict[str, float]] = {}
+    for labels_count in labels_counts:
+        try:
+            started_at = time.perf_counter()
+            inserted = insert_labels(
+                db_session,
+                blockchain_type,
+                _generate_benchmark_label_rows(labels_count),
+                batch_size,
+            )
+            insert_time = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            reinserted = insert_labels(
+                db_session,
+                blockchain_type,
+                _generate_benchmark_label_rows(labels_count),
+                batch_size,
+            )
+            duplicates_time = time.perf_counter() - started_at
+        finally:
+            db_session.rollback()
+
+        if inserted != labels_count or reinserted != 0:
+            raise Exception(
+                f"Unexpected benchmark result: inserted {inserted} and reinserted {reinserted} of {labels_count} labels"
+            )
+
+        results[labels_count] = {
+            "insert_seconds": insert_time,
+            "inserted_labels_per_second": labels_count / insert_time,
+            "duplicates_seconds": duplicates_time,
+            "skipped_labels_per_second": labels_count / duplicates_time,
+        }
+        logger.info(f"Labels writer benchmark for {labels_count} labels: {results}")
 
-    logger.info(f"Saving {len(labels_to_save)} labels to session")
-    db_session.add_all(labels_to_save)
+    return results
@@ -1,19 +1,24 @@
+import json
 import logging
 import traceback
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Union, cast
+from typing import Any, Callable, Dict, List, Optional, Union, cast
 
+import requests
 from eth_typing.evm import ChecksumAddress
+from eth_utils import encode_hex
 from moonstreamdb.models import Base
-from moonworm.crawler.log_scanner import _fetch_events_chunk  # type: ignore
+from moonworm.crawler.function_call_crawler import utfy_dict  # type: ignore
 from sqlalchemy.orm.session import Session
-from sqlalchemy.sql.expression import and_
 from web3 import Web3
+from web3._utils.events import get_event_data
+from web3.types import FilterParams, LogReceipt
 
-from ..blockchain import connect, get_block_model, get_label_model
+from ..block_timestamps import BlockTimestampsCache
+from ..blockchain import connect, get_label_model
 from ..data import AvailableBlockchainType
 from ..settings import CRAWLER_LABEL
-from .crawler import EventCrawlJob
+from .crawler import CrawlJobRegistry, EventCrawlJob, _generate_reporter_callback
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,117 +35,184 @@ class Event:
     log_index: int
 
 
-def _get_block_timestamp_from_web3(
+# Substrings of node error messages meaning that eth_getLogs response is too large
+# and blocks range should be split
+LOGS_RESPONSE_TOO_LARGE_ERRORS = [
+    "more than",
+    "too large",
+    "too many",
+    "size exceeded",
+    "limit exceeded",
+    "block range",
+]
+
+
+def _is_logs_response_too_large(error: Exception) -> bool:
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    if isinstance(error, ValueError):
+        message = str(error).lower()
+        return any(substring in message for substring in LOGS_RESPONSE_TOO_LARGE_ERRORS)
+    return False
+
+
+def _get_logs_adaptive(
     web3: Web3,
-    block_number: int,
-) -> int:
+    filter_params: FilterParams,
+    from_block: int,
+    to_block: int,
+) -> List[LogReceipt]:
     """
-    Gets the timestamp of a block from the blockchain.
-    will raise an exception if the block is not found.
+    Request logs with eth_getLogs, if node rejects response as too large,
+    blocks range is split in half until single block.
     """
-    return web3.eth.getBlock(block_number).timestamp
+    try:
+        return web3.eth.get_logs(
+            {**filter_params, "fromBlock": from_block, "toBlock": to_block}
+        )
+    except Exception as e:
+        if from_block >= to_block or not _is_logs_response_too_large(e):
+            raise
+        middle_block = (from_block + to_block) // 2
+        logger.warning(
+            f"Logs response for blocks {from_block}-{to_block} is too large, "
+            f"splitting to {from_block}-{middle_block} and {middle_block + 1}-{to_block}"
+        )
+        return _get_logs_adaptive(
+            web3, filter_params, from_block, middle_block
+        ) + _get_logs_adaptive(web3, filter_params, middle_block + 1, to_block)
 
 
-# I am using blocks_cache as the argument, to reuse this function in tx_call crawler
-# and support one cashe for both tx_call and event_crawler
-def get_block_timestamp(
-    db_session: Session,
-    web3: Web3,
-    blockchain_type: AvailableBlockchainType,
-    block_number: int,
-    blocks_cache: Dict[int, int],
-    max_blocks_batch: int = 30,
-) -> int:
+def _decode_log(web3: Web3, job: EventCrawlJob, log: LogReceipt) -> Dict[str, Any]:
     """
-    Get the timestamp of a block.
-    First tries to get the block from the cache,
-    then tries to get the block from the db,
-    then tries to get it from the blockchain.
-
-    After the call cache is updated.
-    If the cache grows too large, it is cleared.
-
-    :param block_number: The block number.
-    :param max_blocks_batch: The maximum number of blocks to fetch in a single batch from db query.
-    :param blocks_cache: The cache of blocks.
-    :return: The timestamp of the block.
+    Decode log with event ABI of job to the same structure moonworm returns.
     """
-    assert max_blocks_batch > 0
-
-    if block_number in blocks_cache:
-        return blocks_cache[block_number]
+    raw_event = get_event_data(web3.codec, job.event_abi, log)
+    return {
+        "event": raw_event["event"],
+        "args": json.loads(Web3.toJSON(utfy_dict(dict(raw_event["args"])))),
+        "address": raw_event["address"],
+        "blockNumber": raw_event["blockNumber"],
+        "transactionHash": raw_event["transactionHash"].hex(),
+        "logIndex": raw_event["logIndex"],
+    }
+
+
+def _fetch_events(
+    web3: Web3,
+    jobs: Union[List[EventCrawlJob], CrawlJobRegistry],
+    from_block: int,
+    to_block: int,
+    on_decode_error: Optional[Callable[[Exception], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Fetch and decode events of all jobs from blockchain, events are returned
+    without block timestamps.
 
-    block_model = get_block_model(blockchain_type)
+    Logs of all jobs are requested with one eth_getLogs call per blocks range
+    and dispatched locally to decoders by topic0 and contract address.
+    Pass CrawlJobRegistry to reuse its merged filter between calls.
 
-    blocks = (
-        db_session.query(block_model)
-        .filter(
-            and_(
-                block_model.block_number >= block_number,
-                block_model.block_number <= block_number + max_blocks_batch - 1,
+    Logs which no job of their topic and contract could decode are passed to
+    on_decode_error. Logs which only matched merged filter, without job of their
+    topic and contract, are skipped.
+    """
+    if not isinstance(jobs, CrawlJobRegistry):
+        jobs = CrawlJobRegistry(event_crawl_jobs=jobs)
+    if len(jobs.event_crawl_jobs) == 0:
+        return []
+
+    jobs_by_topic = jobs.event_jobs_by_topic()
+    logs = _get_logs_adaptive(web3, jobs.event_logs_filter(), from_block, to_block)
+
+    decoded_counts: Dict[str, int] = {}
+    decode_errors_count = 0
+    all_raw_events = []
+    for log in logs:
+        if len(log["topics"]) == 0:
+            continue
+        candidate_jobs = jobs_by_topic.get(encode_hex(log["topics"][0]), [])
+        decoded = False
+        decode_error: Optional[Exception] = None
+        for job, job_contracts in candidate_jobs:
+            if job_contracts and log["address"] not in job_contracts:
+                continue
+            # Jobs with the same topic0 could differ by indexed arguments,
+            # try next candidate if log doesn't match ABI
+            try:
+                raw_event = _decode_log(web3, job, log)
+            except Exception as e:
+                decode_error = e
+                continue
+            all_raw_events.append(raw_event)
+            decoded_counts[job.event_abi_hash] = (
+                decoded_counts.get(job.event_abi_hash, 0) + 1
+            )
+            decoded = True
+            break
+        if not decoded and decode_error is not None:
+            decode_errors_count += 1
+            if on_decode_error is not None:
+                on_decode_error(decode_error)
+
+    for job in jobs.event_crawl_jobs:
+        if job.event_abi_hash in decoded_counts:
+            logger.info(
+                f"Decoded {decoded_counts[job.event_abi_hash]} {job.event_abi.get('name')} "
+                f"events of job {job.event_abi_hash}"
             )
+    if decode_errors_count > 0:
+        logger.warning(
+            f"Could not decode {decode_errors_count} of {len(logs)} logs from {from_block} to {to_block}"
         )
-        .order_by(block_model.block_number.asc())
-        .all()
-    )
-
-    target_block_timestamp: Optional[int] = None
-    if blocks and blocks[0].block_number == block_number:
-        target_block_timestamp = blocks[0].timestamp
 
-    if target_block_timestamp is None:
-        target_block_timestamp = _get_block_timestamp_from_web3(web3, block_number)
+    return all_raw_events
 
-    if len(blocks_cache) > max_blocks_batch * 2:
-        blocks_cache.clear()
 
-    blocks_cache[block_number] = target_block_timestamp
-    for block in blocks:
-        blocks_cache[block.block_number] = block.timestamp
+def _raw_events_to_events(
+    db_session: Session,
+    raw_events: List[Dict[str, Any]],
+    timestamps_cache: BlockTimestampsCache,
+) -> List[Event]:
+    """
+    Resolve block timestamps of fetched events and convert them to Event objects.
+    """
+    timestamps = timestamps_cache.get_many(
+        db_session, [raw_event["blockNumber"] for raw_event in raw_events]
+    )
+    all_events = []
+    for raw_event in raw_events:
+        raw_event["blockTimestamp"] = timestamps[raw_event["blockNumber"]]
+        event = Event(
+            event_name=raw_event["event"],
+            args=raw_event["args"],
+            address=raw_event["address"],
+            block_number=raw_event["blockNumber"],
+            block_timestamp=raw_event["blockTimestamp"],
+            transaction_hash=raw_event["transactionHash"],
+            log_index=raw_event["logIndex"],
+        )
+        all_events.append(event)
 
-    return target_block_timestamp
+    return all_events
 
 
 def _crawl_events(
     db_session: Session,
     blockchain_type: AvailableBlockchainType,
     web3: Web3,
-    jobs: List[EventCrawlJob],
+    jobs: Union[List[EventCrawlJob], CrawlJobRegistry],
     from_block: int,
     to_block: int,
-    blocks_cache: Dict[int, int] = {},
-    db_block_query_batch=10,
+    timestamps_cache: Optional[BlockTimestampsCache] = None,
 ) -> List[Event]:
-    all_events = []
-    for job in jobs:
-        raw_events = _fetch_events_chunk(
-            web3,
-            job.event_abi,
-            from_block,
-            to_block,
-            job.contracts,
-            on_decode_error=lambda e: print(
-                f"Error decoding event: {e}"
-            ),  # TODO report via humbug
-        )
-        for raw_event in raw_events:
-            raw_event["blockTimestamp"] = get_block_timestamp(
-                db_session,
-                web3,
-                blockchain_type,
-                raw_event["blockNumber"],
-                blocks_cache,
-                db_block_query_batch,
-            )
-            event = Event(
-                event_name=raw_event["event"],
-                args=raw_event["args"],
-                address=raw_event["address"],
-                block_number=raw_event["blockNumber"],
-                block_timestamp=raw_event["blockTimestamp"],
-                transaction_hash=raw_event["transactionHash"],
-                log_index=raw_event["logIndex"],
-            )
-            all_events.append(event)
-
-    return all_events
+    if timestamps_cache is None:
+        timestamps_cache = BlockTimestampsCache(blockchain_type, web3)
+    raw_events = _fetch_events(
+        web3,
+        jobs,
+        from_block,
+        to_block,
+        on_decode_error=_generate_reporter_callback("event", blockchain_type),
+    )
+    return _raw_events_to_events(db_session, raw_events, timestamps_cache)
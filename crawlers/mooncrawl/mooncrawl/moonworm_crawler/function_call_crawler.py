@@ -23,6 +23,7 @@ from moonworm.cu_watch import MockState  # type: ignore
 from sqlalchemy.orm import Session
 from web3 import Web3
 
+from ..block_timestamps import BlockTimestampsCache
 from ..blockchain import connect, get_block_model, get_label_model
 from ..data import AvailableBlockchainType
 from ..settings import CRAWLER_LABEL
@@ -32,6 +33,31 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class CachedTimestampsStateProvider(MoonstreamEthereumStateProvider):
+    """
+    Moonstream state provider which resolves block timestamps with
+    BlockTimestampsCache shared with other crawlers.
+    """
+
+    def __init__(
+        self,
+        w3: Web3,
+        network: Network,
+        timestamps_cache: BlockTimestampsCache,
+        db_session: Optional[Session] = None,
+        batch_load_count: int = 100,
+    ):
+        super().__init__(w3, network, db_session, batch_load_count)
+        self.timestamps_cache = timestamps_cache
+
+    def get_block_timestamp(self, block_number: int) -> int:
+        block = self.blocks_cache.get(block_number)
+        if block is not None:
+            self.metrics["block_found_in_cache"] += 1
+            return block["timestamp"]
+        return self.timestamps_cache.get(self.db_session, block_number)
+
+
 def _crawl_functions(
     blockchain_type: AvailableBlockchainType,
     ethereum_state_provider: MoonstreamEthereumStateProvider,
@@ -76,9 +102,10 @@ def function_call_crawler(
         if blockchain_type == AvailableBlockchainType.ETHEREUM
         else Network.polygon
     )
-    ethereum_state_provider = MoonstreamEthereumStateProvider(
+    ethereum_state_provider = CachedTimestampsStateProvider(
         web3,
         network,
+        BlockTimestampsCache(blockchain_type, web3),
         db_session,
     )
 
@@ -0,0 +1,321 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set, Tuple
+
+from eth_typing.evm import ChecksumAddress
+from moonstreamdb.db import (
+    SessionLocal,
+    dispose_engines_after_fork,
+    yield_db_session_ctx,
+)
+from moonworm.crawler.networks import Network  # type: ignore
+from sqlalchemy.orm.session import Session
+from web3 import Web3
+
+from ..block_timestamps import BlockTimestampsCache
+from ..blockchain import connect
+from ..data import AvailableBlockchainType
+from .crawler import EventCrawlJob, FunctionCallCrawlJob
+from .db import (
+    add_events_to_session,
+    add_function_calls_to_session,
+    commit_session,
+    get_last_labeled_block_number,
+)
+from .event_crawler import _crawl_events
+from .function_call_crawler import CachedTimestampsStateProvider, _crawl_functions
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class HistoricalCrawlError(Exception):
+    """
+    Raised when some chunks of historical crawl failed.
+    """
+
+
+def filter_crawl_jobs(
+    event_crawl_jobs: List[EventCrawlJob],
+    function_call_crawl_jobs: List[FunctionCallCrawlJob],
+    addresses: List[ChecksumAddress],
+) -> Tuple[List[EventCrawlJob], List[FunctionCallCrawlJob]]:
+    """
+    Leave only crawl jobs of given contract addresses.
+    """
+    addresses_set = set(addresses)
+    filtered_event_crawl_jobs = []
+    for job in event_crawl_jobs:
+        contracts = [
+            contract for contract in job.contracts if contract in addresses_set
+        ]
+        if contracts:
+            filtered_event_crawl_jobs.append(
+                EventCrawlJob(
+                    event_abi_hash=job.event_abi_hash,
+                    event_abi=job.event_abi,
+                    contracts=contracts,
+                    created_at=job.created_at,
+                )
+            )
+    filtered_function_call_crawl_jobs = [
+        job for job in function_call_crawl_jobs if job.contract_address in addresses_set
+    ]
+    return filtered_event_crawl_jobs, filtered_function_call_crawl_jobs
+
+
+def split_blocks_range(
+    start_block: int, end_block: int, chunk_size: int
+) -> List[Tuple[int, int]]:
+    """
+    Split blocks range from start_block to end_block (inclusive) to chunks.
+    """
+    assert chunk_size > 0, "chunk_size must be greater than 0"
+    return [
+        (chunk_start, min(chunk_start + chunk_size - 1, end_block))
+        for chunk_start in range(start_block, end_block + 1, chunk_size)
+    ]
+
+
+def _crawl_jobs_fingerprint(
+    blockchain_type: AvailableBlockchainType,
+    event_crawl_jobs: List[EventCrawlJob],
+    function_call_crawl_jobs: List[FunctionCallCrawlJob],
+) -> str:
+    jobs_description = {
+        "blockchain_type": blockchain_type.value,
+        "events": sorted(
+            [job.event_abi_hash, sorted(job.contracts)] for job in event_crawl_jobs
+        ),
+        "function_calls": sorted(
+            job.contract_address for job in function_call_crawl_jobs
+        ),
+    }
+    return hashlib.md5(
+        json.dumps(jobs_description, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _load_checkpoint(
+    checkpoint_path: str, jobs_fingerprint: str
+) -> Set[Tuple[int, int]]:
+    """
+    Returns chunks completed by previous runs of historical crawler with the same jobs.
+    """
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, "r") as ifp:
+        checkpoint = json.load(ifp)
+    if checkpoint["jobs_fingerprint"] != jobs_fingerprint:
+        raise ValueError(
+            f"Checkpoint {checkpoint_path} was created for other crawl jobs, use another checkpoint file"
+        )
+    return {(chunk[0], chunk[1]) for chunk in checkpoint["completed_chunks"]}
+
+
+def _save_checkpoint(
+    checkpoint_path: str,
+    jobs_fingerprint: str,
+    completed_chunks: Set[Tuple[int, int]],
+) -> None:
+    checkpoint = {
+        "jobs_fingerprint": jobs_fingerprint,
+        "completed_chunks": sorted(completed_chunks),
+    }
+    # Write to temporary file first to not corrupt checkpoint if crawler is killed
+    temp_checkpoint_path = f"{checkpoint_path}.tmp"
+    with open(temp_checkpoint_path, "w") as ofp:
+        json.dump(checkpoint, ofp)
+    os.replace(temp_checkpoint_path, checkpoint_path)
+
+
+# Connections opened once per historical crawler worker process, see _init_historical_crawler_worker
+_worker_web3: Optional[Web3] = None
+_worker_db_session: Optional[Session] = None
+_worker_timestamps_cache: Optional[BlockTimestampsCache] = None
+
+
+def _init_historical_crawler_worker(
+    blockchain_type: AvailableBlockchainType, web3_uri: Optional[str]
+) -> None:
+    """
+    Open web3 and database connections for historical crawler worker process.
+    """
+    global _worker_web3, _worker_db_session, _worker_timestamps_cache
+
+    dispose_engines_after_fork()
+    _worker_web3 = connect(blockchain_type, web3_uri)
+    _worker_db_session = SessionLocal()
+    _worker_timestamps_cache = BlockTimestampsCache(blockchain_type, _worker_web3)
+
+
+def _crawl_chunk(
+    blockchain_type: AvailableBlockchainType,
+    event_crawl_jobs: List[EventCrawlJob],
+    function_call_crawl_jobs: List[FunctionCallCrawlJob],
+    from_block: int,
+    to_block: int,
+    max_blocks_batch: int,
+) -> Tuple[int, int]:
+    """
+    Crawl chunk of blocks in worker process and commit its labels at once,
+    so chunk is either saved completely or should be crawled again.
+
+    Returns number of crawled events and function calls.
+    """
+    assert (
+        _worker_web3 is not None
+        and _worker_db_session is not None
+        and _worker_timestamps_cache is not None
+    ), "Historical crawler worker is not initialized"
+
+    network = (
+        Network.ethereum
+        if blockchain_type == AvailableBlockchainType.ETHEREUM
+        else Network.polygon
+    )
+    ethereum_state_provider = CachedTimestampsStateProvider(
+        _worker_web3,
+        network,
+        _worker_timestamps_cache,
+        _worker_db_session,
+    )
+
+    events_count = 0
+    function_calls_count = 0
+    try:
+        for batch_start in range(from_block, to_block + 1, max_blocks_batch):
+            batch_end = min(batch_start + max_blocks_batch - 1, to_block)
+            if event_crawl_jobs:
+                events = _crawl_events(
+                    _worker_db_session,
+                    blockchain_type,
+                    _worker_web3,
+                    event_crawl_jobs,
+                    batch_start,
+                    batch_end,
+                    _worker_timestamps_cache,
+                )
+                add_events_to_session(_worker_db_session, events, blockchain_type)
+                events_count += len(events)
+            if function_call_crawl_jobs:
+                function_calls = _crawl_functions(
+                    blockchain_type,
+                    ethereum_state_provider,
+                    function_call_crawl_jobs,
+                    batch_start,
+                    batch_end,
+                )
+                add_function_calls_to_session(
+                    _worker_db_session, function_calls, blockchain_type
+                )
+                function_calls_count += len(function_calls)
+        commit_session(_worker_db_session)
+    except Exception:
+        _worker_db_session.rollback()
+        raise
+
+    return events_count, function_calls_count
+
+
+def historical_crawler(
+    blockchain_type: AvailableBlockchainType,
+    event_crawl_jobs: List[EventCrawlJob],
+    function_call_crawl_jobs: List[FunctionCallCrawlJob],
+    start_block: int,
+    end_block: Optional[int] = None,
+    chunk_size: int = 10000,
+    max_blocks_batch: int = 100,
+    num_processes: int = 1,
+    checkpoint_path: Optional[str] = None,
+    web3_uri: Optional[str] = None,
+) -> None:
+    """
+    Crawl events and function calls of given crawl jobs from start_block to end_block
+    in chunks of chunk_size blocks distributed between num_processes worker processes.
+
+    Completed chunks are recorded in JSON file at checkpoint_path, rerun with the same
+    checkpoint skips them.
+
+    Continuous crawler resumes from the last moonworm label, so historical crawler
+    never writes labels above it: end_block is limited by the last labeled block.
+    """
+    assert chunk_size > 0, "chunk_size must be greater than 0"
+    assert max_blocks_batch > 0, "max_blocks_batch must be greater than 0"
+    assert num_processes > 0, "num_processes must be greater than 0"
+
+    with yield_db_session_ctx() as db_session:
+        last_labeled_block = get_last_labeled_block_number(db_session, blockchain_type)
+    if last_labeled_block is None:
+        raise ValueError(
+            "No labels of continuous crawler found, historical crawl would move its position"
+        )
+    if end_block is None or end_block > last_labeled_block:
+        logger.info(
+            f"Using last labeled block {last_labeled_block} of continuous crawler as end block"
+        )
+        end_block = last_labeled_block
+    if start_block > end_block:
+        logger.info(f"Nothing to crawl from {start_block} to {end_block}")
+        return
+
+    jobs_fingerprint = _crawl_jobs_fingerprint(
+        blockchain_type, event_crawl_jobs, function_call_crawl_jobs
+    )
+    completed_chunks: Set[Tuple[int, int]] = set()
+    if checkpoint_path is not None:
+        completed_chunks = _load_checkpoint(checkpoint_path, jobs_fingerprint)
+
+    chunks = [
+        chunk
+        for chunk in split_blocks_range(start_block, end_block, chunk_size)
+        if chunk not in completed_chunks
+    ]
+    logger.info(
+        f"Crawling {len(chunks)} chunks from {start_block} to {end_block} "
+        f"with {num_processes} processes, {len(completed_chunks)} chunks completed before"
+    )
+
+    errors: List[str] = []
+    with ProcessPoolExecutor(
+        max_workers=num_processes,
+        initializer=_init_historical_crawler_worker,
+        initargs=(blockchain_type, web3_uri),
+    ) as executor:
+        futures: Dict[Future, Tuple[int, int]] = {
+            executor.submit(
+                _crawl_chunk,
+                blockchain_type,
+                event_crawl_jobs,
+                function_call_crawl_jobs,
+                chunk[0],
+                chunk[1],
+                max_blocks_batch,
+            ): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Failed to crawl chunk {chunk[0]}-{chunk[1]}: {error}")
+                errors.append(f"{chunk[0]}-{chunk[1]}: {error}")
+                continue
+
+            events_count, function_calls_count = future.result()
+            logger.info(
+                f"Crawled {events_count} events and {function_calls_count} function calls "
+                f"from {chunk[0]} to {chunk[1]}"
+            )
+            completed_chunks.add(chunk)
+            if checkpoint_path is not None:
+                _save_checkpoint(checkpoint_path, jobs_fingerprint, completed_chunks)
+
+    if errors:
+        error_messages = "\n".join([f"- {error}" for error in errors])
+        raise HistoricalCrawlError(
+            f"Failed to crawl {len(errors)} chunks, rerun to retry them:\n{error_messages}"
+        )
@@ -0,0 +1,36 @@
+import threading
+import unittest
+from queue import Queue
+
+from .continuous_crawler import _get_from_stage_queue
+
+
+class TestGetFromStageQueue(unittest.TestCase):
+    def setUp(self):
+        self.stage_queue = Queue(maxsize=1)
+        self.stop_event = threading.Event()
+
+    def test_item_put_before_producer_exit(self):
+        producer = threading.Thread(target=self.stage_queue.put, args=("range",))
+        producer.start()
+        producer.join()
+        self.assertEqual(
+            _get_from_stage_queue(self.stage_queue, self.stop_event, producer),
+            "range",
+        )
+
+    def test_dead_producer(self):
+        producer = threading.Thread(target=lambda: None, name="fetch")
+        producer.start()
+        producer.join()
+        with self.assertRaisesRegex(Exception, "fetch stopped unexpectedly"):
+            _get_from_stage_queue(self.stage_queue, self.stop_event, producer)
+
+    def test_stopped_pipeline(self):
+        producer = threading.Thread(target=self.stop_event.wait)
+        producer.start()
+        self.stop_event.set()
+        self.assertIsNone(
+            _get_from_stage_queue(self.stage_queue, self.stop_event, producer)
+        )
+        producer.join()
@@ -0,0 +1,216 @@
+import json
+import unittest
+
+from bugout.data import BugoutSearchResult
+from web3 import Web3
+
+from .crawler import (
+    CrawlJobRegistry,
+    EventCrawlJob,
+    FunctionCallCrawlJob,
+    encode_function_signature,
+    make_event_crawl_jobs,
+    make_function_call_crawl_jobs,
+)
+
+TRANSFER_ABI = {
+    "anonymous": False,
+    "inputs": [
+        {"indexed": True, "name": "from", "type": "address"},
+        {"indexed": True, "name": "to", "type": "address"},
+        {"indexed": False, "name": "value", "type": "uint256"},
+    ],
+    "name": "Transfer",
+    "type": "event",
+}
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+MINT_ABI = {
+    "inputs": [{"name": "amount", "type": "uint256"}],
+    "name": "mint",
+    "outputs": [],
+    "stateMutability": "nonpayable",
+    "type": "function",
+}
+BURN_ABI = {
+    "inputs": [{"name": "amount", "type": "uint256"}],
+    "name": "burn",
+    "outputs": [],
+    "stateMutability": "nonpayable",
+    "type": "function",
+}
+
+ADDRESS_1 = Web3.toChecksumAddress("0x" + "11" * 20)
+ADDRESS_2 = Web3.toChecksumAddress("0x" + "22" * 20)
+
+
+def transfer_job(*contracts, created_at=0):
+    return EventCrawlJob(
+        event_abi_hash="transfer",
+        event_abi=TRANSFER_ABI,
+        contracts=list(contracts),
+        created_at=created_at,
+    )
+
+
+def job_entry(entry_id, address, abi, abi_hash="transfer"):
+    return BugoutSearchResult(
+        entry_url=f"https://spire.bugout.dev/journals/tasks/entries/{entry_id}",
+        content_url=f"https://spire.bugout.dev/journals/tasks/entries/{entry_id}/content",
+        title=address,
+        content=json.dumps(abi),
+        tags=[f"address:{address}", f"abi_method_hash:{abi_hash}"],
+        created_at="2022-01-01T00:00:00",
+        updated_at="2022-01-01T00:00:00",
+        score=0,
+    )
+
+
+class TestCrawlJobRegistry(unittest.TestCase):
+    def test_add_event_jobs_merges_contracts(self):
+        registry = CrawlJobRegistry(event_crawl_jobs=[transfer_job(ADDRESS_1)])
+        self.assertEqual(
+            registry.add_event_crawl_jobs(
+                [transfer_job(ADDRESS_1, ADDRESS_2, created_at=10)]
+            ),
+            1,
+        )
+        self.assertEqual(len(registry.event_crawl_jobs), 1)
+        self.assertListEqual(
+            registry.event_crawl_jobs[0].contracts, [ADDRESS_1, ADDRESS_2]
+        )
+        self.assertDictEqual(
+            dict(registry.event_logs_filter()),
+            {"topics": [[TRANSFER_TOPIC]], "address": [ADDRESS_1, ADDRESS_2]},
+        )
+
+    def test_remove_event_jobs(self):
+        registry = CrawlJobRegistry(
+            event_crawl_jobs=[transfer_job(ADDRESS_1, ADDRESS_2)]
+        )
+        registry.event_logs_filter()
+
+        self.assertEqual(registry.remove_event_crawl_jobs([transfer_job(ADDRESS_1)]), 1)
+        self.assertSetEqual(registry.event_addresses, {ADDRESS_2})
+        self.assertListEqual(registry.event_logs_filter()["address"], [ADDRESS_2])
+
+        self.assertEqual(registry.remove_event_crawl_jobs([transfer_job(ADDRESS_2)]), 1)
+        self.assertListEqual(registry.event_crawl_jobs, [])
+        self.assertSetEqual(registry.event_topics, set())
+
+    def test_event_job_without_contracts_drops_address_filter(self):
+        registry = CrawlJobRegistry(
+            event_crawl_jobs=[
+                transfer_job(ADDRESS_1),
+                EventCrawlJob(
+                    event_abi_hash="other",
+                    event_abi={**TRANSFER_ABI, "name": "Other"},
+                    contracts=[],
+                    created_at=0,
+                ),
+            ]
+        )
+        self.assertNotIn("address", registry.event_logs_filter())
+        self.assertEqual(len(registry.event_jobs_by_topic()), 2)
+
+    def test_function_call_jobs(self):
+        registry = CrawlJobRegistry(
+            function_call_crawl_jobs=[
+                FunctionCallCrawlJob(
+                    contract_abi=[MINT_ABI], contract_address=ADDRESS_1, created_at=0
+                )
+            ]
+        )
+        self.assertEqual(
+            registry.add_function_call_crawl_jobs(
+                [
+                    FunctionCallCrawlJob(
+                        contract_abi=[MINT_ABI, BURN_ABI],
+                        contract_address=ADDRESS_1,
+                        created_at=5,
+                    )
+                ]
+            ),
+            1,
+        )
+        (job,) = registry.function_call_crawl_jobs
+        self.assertListEqual(
+            [encode_function_signature(abi) for abi in job.contract_abi],
+            [encode_function_signature(MINT_ABI), encode_function_signature(BURN_ABI)],
+        )
+
+        self.assertEqual(
+            registry.remove_function_call_crawl_jobs(
+                [
+                    FunctionCallCrawlJob(
+                        contract_abi=[MINT_ABI, BURN_ABI],
+                        contract_address=ADDRESS_1,
+                        created_at=5,
+                    )
+                ]
+            ),
+            2,
+        )
+        self.assertListEqual(registry.function_call_crawl_jobs, [])
+
+    def test_shared_event_contract(self):
+        registry = CrawlJobRegistry(
+            event_crawl_jobs=make_event_crawl_jobs(
+                [
+                    job_entry("a", ADDRESS_1, TRANSFER_ABI),
+                    job_entry("b", ADDRESS_1, TRANSFER_ABI),
+                    job_entry("c", ADDRESS_2, TRANSFER_ABI),
+                ]
+            )
+        )
+
+        # Contract is still used by active subscription b
+        deactivated = make_event_crawl_jobs([job_entry("a", ADDRESS_1, TRANSFER_ABI)])
+        self.assertEqual(registry.remove_event_crawl_jobs(deactivated), 0)
+        self.assertSetEqual(registry.event_addresses, {ADDRESS_1, ADDRESS_2})
+
+        deactivated = make_event_crawl_jobs([job_entry("b", ADDRESS_1, TRANSFER_ABI)])
+        self.assertEqual(registry.remove_event_crawl_jobs(deactivated), 1)
+        self.assertSetEqual(registry.event_addresses, {ADDRESS_2})
+
+        # Reactivated subscription is added back
+        reactivated = make_event_crawl_jobs([job_entry("a", ADDRESS_1, TRANSFER_ABI)])
+        self.assertEqual(registry.add_event_crawl_jobs(reactivated), 1)
+        self.assertSetEqual(registry.event_addresses, {ADDRESS_1, ADDRESS_2})
+        self.assertListEqual(
+            registry.event_logs_filter()["address"], [ADDRESS_1, ADDRESS_2]
+        )
+
+        deactivated = make_event_crawl_jobs([job_entry("a", ADDRESS_1, TRANSFER_ABI)])
+        self.assertEqual(registry.remove_event_crawl_jobs(deactivated), 1)
+        self.assertSetEqual(registry.event_addresses, {ADDRESS_2})
+
+    def test_shared_function_call_abi(self):
+        registry = CrawlJobRegistry(
+            function_call_crawl_jobs=make_function_call_crawl_jobs(
+                [
+                    job_entry("a", ADDRESS_1, MINT_ABI),
+                    job_entry("b", ADDRESS_1, MINT_ABI),
+                    job_entry("c", ADDRESS_1, BURN_ABI),
+                ]
+            )
+        )
+
+        deactivated = make_function_call_crawl_jobs(
+            [job_entry("a", ADDRESS_1, MINT_ABI), job_entry("c", ADDRESS_1, BURN_ABI)]
+        )
+        self.assertEqual(registry.remove_function_call_crawl_jobs(deactivated), 1)
+        (job,) = registry.function_call_crawl_jobs
+        self.assertListEqual(job.contract_abi, [MINT_ABI])
+
+        reactivated = make_function_call_crawl_jobs(
+            [job_entry("c", ADDRESS_1, BURN_ABI)]
+        )
+        self.assertEqual(registry.add_function_call_crawl_jobs(reactivated), 1)
+
+        deactivated = make_function_call_crawl_jobs(
+            [job_entry("b", ADDRESS_1, MINT_ABI)]
+        )
+        self.assertEqual(registry.remove_function_call_crawl_jobs(deactivated), 1)
+        (job,) = registry.function_call_crawl_jobs
+        self.assertListEqual(job.contract_abi, [BURN_ABI])
@@ -0,0 +1,75 @@
+import time
+import unittest
+
+from moonstreamdb.db import yield_db_session_ctx
+from moonstreamdb.models import EthereumLabel, LabelCountRollup
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from ..data import AvailableBlockchainType
+from ..rollups import DAY
+from .db import _event_to_label_row, insert_labels
+from .event_crawler import Event
+
+ADDRESS = "0xTestInsertLabels"
+
+
+def event(transaction_hash: str, log_index: int, block_timestamp: int) -> Event:
+    return Event(
+        event_name="Transfer",
+        args={"to": "0x1"},
+        address=ADDRESS,
+        block_number=1,
+        block_timestamp=block_timestamp,
+        transaction_hash=transaction_hash,
+        log_index=log_index,
+    )
+
+
+class TestInsertLabels(unittest.TestCase):
+    def setUp(self):
+        try:
+            with yield_db_session_ctx() as db_session:
+                db_session.execute(text("SELECT 1"))
+        except OperationalError:
+            self.skipTest("Database is not available")
+
+    def test_insert_duplicates(self):
+        now = int(time.time())
+        blockchain_type = AvailableBlockchainType.ETHEREUM
+        with yield_db_session_ctx() as db_session:
+            rows = [
+                _event_to_label_row(event("0xTestTx1", 0, now)),
+                _event_to_label_row(event("0xTestTx1", 1, now)),
+                # Duplicate in the same batch
+                _event_to_label_row(event("0xTestTx1", 1, now)),
+                _event_to_label_row(event("0xTestTx2", 0, now)),
+            ]
+            self.assertEqual(
+                insert_labels(db_session, blockchain_type, rows, batch_size=2), 3
+            )
+
+            # Labels already in database are not inserted and not counted in rollups
+            rows = [
+                _event_to_label_row(event("0xTestTx1", 0, now)),
+                _event_to_label_row(event("0xTestTx2", 0, now)),
+                _event_to_label_row(event("0xTestTx3", 0, now)),
+            ]
+            self.assertEqual(insert_labels(db_session, blockchain_type, rows), 1)
+            self.assertEqual(insert_labels(db_session, blockchain_type, rows[:2]), 0)
+
+            self.assertEqual(
+                db_session.query(EthereumLabel)
+                .filter(EthereumLabel.address == ADDRESS)
+                .count(),
+                4,
+            )
+            day_count = (
+                db_session.query(LabelCountRollup.count)
+                .filter(LabelCountRollup.blockchain == blockchain_type.value)
+                .filter(LabelCountRollup.address == ADDRESS)
+                .filter(LabelCountRollup.timestep == DAY)
+                .one()
+            )
+            self.assertEqual(day_count[0], 4)
+            db_session.rollback()
@@ -0,0 +1,214 @@
+import unittest
+from typing import Any, Dict, List, Optional, Tuple
+
+from eth_abi import encode_abi
+from eth_utils import encode_hex, event_abi_to_log_topic
+from web3 import Web3
+from web3.providers.base import BaseProvider
+
+from .crawler import EventCrawlJob
+from .event_crawler import _fetch_events, _get_logs_adaptive
+
+ERC20_TRANSFER_ABI = {
+    "anonymous": False,
+    "inputs": [
+        {"indexed": True, "name": "from", "type": "address"},
+        {"indexed": True, "name": "to", "type": "address"},
+        {"indexed": False, "name": "value", "type": "uint256"},
+    ],
+    "name": "Transfer",
+    "type": "event",
+}
+ERC721_TRANSFER_ABI = {
+    "anonymous": False,
+    "inputs": [
+        {"indexed": True, "name": "from", "type": "address"},
+        {"indexed": True, "name": "to", "type": "address"},
+        {"indexed": True, "name": "tokenId", "type": "uint256"},
+    ],
+    "name": "Transfer",
+    "type": "event",
+}
+APPROVAL_ABI = {
+    "anonymous": False,
+    "inputs": [
+        {"indexed": True, "name": "owner", "type": "address"},
+        {"indexed": True, "name": "spender", "type": "address"},
+        {"indexed": False, "name": "value", "type": "uint256"},
+    ],
+    "name": "Approval",
+    "type": "event",
+}
+TRANSFER_TOPIC = encode_hex(event_abi_to_log_topic(ERC20_TRANSFER_ABI))
+APPROVAL_TOPIC = encode_hex(event_abi_to_log_topic(APPROVAL_ABI))
+
+ADDRESS_1 = Web3.toChecksumAddress("0x" + "11" * 20)
+ADDRESS_2 = Web3.toChecksumAddress("0x" + "22" * 20)
+
+
+def word(value: int) -> str:
+    return "0x" + f"{value:064x}"
+
+
+def raw_log(
+    address: str, topics: List[str], data: str, block_number: int, log_index: int
+) -> Dict[str, Any]:
+    return {
+        "address": address,
+        "topics": topics,
+        "data": data,
+        "blockNumber": hex(block_number),
+        "blockHash": "0x" + "ab" * 32,
+        "transactionHash": word(block_number * 100 + log_index),
+        "transactionIndex": "0x0",
+        "logIndex": hex(log_index),
+        "removed": False,
+    }
+
+
+class LogsProvider(BaseProvider):
+    """
+    Answers eth_getLogs with logs in requested blocks range, rejects ranges longer
+    than max_range blocks as too large.
+    """
+
+    def __init__(self, logs: List[Dict[str, Any]], max_range: Optional[int] = None):
+        self.logs = logs
+        self.max_range = max_range
+        self.error: Optional[str] = None
+        self.requested_ranges: List[Tuple[int, int]] = []
+
+    def make_request(self, method, params):
+        assert method == "eth_getLogs"
+        filter_params = params[0]
+        from_block = int(filter_params["fromBlock"], 16)
+        to_block = int(filter_params["toBlock"], 16)
+        self.requested_ranges.append((from_block, to_block))
+        if self.error is not None:
+            return {
+                "jsonrpc": "2.0",
+                "id": 0,
+                "error": {"code": -32000, "message": self.error},
+            }
+        if self.max_range is not None and to_block - from_block + 1 > self.max_range:
+            return {
+                "jsonrpc": "2.0",
+                "id": 0,
+                "error": {
+                    "code": -32005,
+                    "message": "query returned more than 10000 results",
+                },
+            }
+        return {
+            "jsonrpc": "2.0",
+            "id": 0,
+            "result": [
+                log
+                for log in self.logs
+                if from_block <= int(log["blockNumber"], 16) <= to_block
+            ],
+        }
+
+
+class TestGetLogsAdaptive(unittest.TestCase):
+    def setUp(self):
+        self.logs = [
+            raw_log(ADDRESS_1, [APPROVAL_TOPIC], word(0), block_number, 0)
+            for block_number in range(10)
+        ]
+
+    def test_split_range(self):
+        provider = LogsProvider(self.logs, max_range=3)
+        logs = _get_logs_adaptive(Web3(provider), {}, 0, 9)
+
+        self.assertListEqual([log["blockNumber"] for log in logs], list(range(10)))
+        self.assertListEqual(
+            provider.requested_ranges,
+            [(0, 9), (0, 4), (0, 2), (3, 4), (5, 9), (5, 7), (8, 9)],
+        )
+
+    def test_other_errors_not_split(self):
+        provider = LogsProvider(self.logs)
+        provider.error = "header not found"
+        with self.assertRaises(ValueError):
+            _get_logs_adaptive(Web3(provider), {}, 0, 9)
+        self.assertListEqual(provider.requested_ranges, [(0, 9)])
+
+    def test_single_block_too_large(self):
+        provider = LogsProvider(self.logs, max_range=0)
+        with self.assertRaises(ValueError):
+            _get_logs_adaptive(Web3(provider), {}, 0, 1)
+        self.assertListEqual(provider.requested_ranges, [(0, 1), (0, 0)])
+
+
+class TestFetchEvents(unittest.TestCase):
+    def test_dispatch_by_topic_and_address(self):
+        from_1 = word(int(ADDRESS_1, 16))
+        to_2 = word(int(ADDRESS_2, 16))
+        logs = [
+            # ERC20 transfer, ERC721 job of the same contract doesn't match ABI
+            raw_log(
+                ADDRESS_1,
+                [TRANSFER_TOPIC, from_1, to_2],
+                encode_hex(encode_abi(["uint256"], [5])),
+                1,
+                0,
+            ),
+            # ERC721 transfer
+            raw_log(ADDRESS_2, [TRANSFER_TOPIC, from_1, to_2, word(7)], "0x", 1, 1),
+            # Approval of contract crawled only for transfers, matched merged filter
+            raw_log(ADDRESS_1, [APPROVAL_TOPIC, from_1, to_2], word(3), 2, 0),
+            # Transfer without arguments is not decoded by any job
+            raw_log(ADDRESS_1, [TRANSFER_TOPIC], "0x", 2, 1),
+        ]
+        jobs = [
+            EventCrawlJob(
+                event_abi_hash="erc20_transfer",
+                event_abi=ERC20_TRANSFER_ABI,
+                contracts=[ADDRESS_1],
+                created_at=0,
+            ),
+            EventCrawlJob(
+                event_abi_hash="erc721_transfer",
+                event_abi=ERC721_TRANSFER_ABI,
+                contracts=[ADDRESS_1, ADDRESS_2],
+                created_at=0,
+            ),
+            EventCrawlJob(
+                event_abi_hash="approval",
+                event_abi=APPROVAL_ABI,
+                contracts=[ADDRESS_2],
+                created_at=0,
+            ),
+        ]
+        decode_errors: List[Exception] = []
+
+        events = _fetch_events(
+            Web3(LogsProvider(logs)), jobs, 0, 10, on_decode_error=decode_errors.append
+        )
+
+        self.assertListEqual(
+            [(event["event"], event["address"], event["args"]) for event in events],
+            [
+                (
+                    "Transfer",
+                    ADDRESS_1,
+                    {"from": ADDRESS_1, "to": ADDRESS_2, "value": 5},
+                ),
+                (
+                    "Transfer",
+                    ADDRESS_2,
+                    {"from": ADDRESS_1, "to": ADDRESS_2, "tokenId": 7},
+                ),
+            ],
+        )
+        self.assertListEqual(
+            [(event["blockNumber"], event["logIndex"]) for event in events],
+            [(1, 0), (1, 1)],
+        )
+        self.assertEqual(len(decode_errors), 1)
+
+    def test_no_jobs(self):
+        provider = LogsProvider([])
+        self.assertListEqual(_fetch_events(Web3(provider), [], 0, 10), [])
+        self.assertListEqual(provider.requested_ranges, [])
@@ -0,0 +1,213 @@
+import contextlib
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, cast
+from unittest import mock
+
+from eth_typing.evm import ChecksumAddress
+
+from ..data import AvailableBlockchainType
+from . import historical_crawler
+from .crawler import EventCrawlJob, FunctionCallCrawlJob
+from .historical_crawler import (
+    HistoricalCrawlError,
+    _crawl_jobs_fingerprint,
+    _load_checkpoint,
+    _save_checkpoint,
+    split_blocks_range,
+)
+
+ADDRESS_A = cast(ChecksumAddress, "0x" + "a" * 40)
+ADDRESS_B = cast(ChecksumAddress, "0x" + "b" * 40)
+
+EVENT_CRAWL_JOBS = [
+    EventCrawlJob(
+        event_abi_hash="transfer",
+        event_abi={"name": "Transfer", "type": "event"},
+        contracts=[ADDRESS_A, ADDRESS_B],
+        created_at=0,
+    ),
+    EventCrawlJob(
+        event_abi_hash="approval",
+        event_abi={"name": "Approval", "type": "event"},
+        contracts=[ADDRESS_A],
+        created_at=0,
+    ),
+]
+FUNCTION_CALL_CRAWL_JOBS = [
+    FunctionCallCrawlJob(contract_abi=[], contract_address=ADDRESS_A, created_at=0)
+]
+
+
+class TestSplitBlocksRange(unittest.TestCase):
+    def test_chunks(self):
+        self.assertListEqual(
+            split_blocks_range(0, 25, 10), [(0, 9), (10, 19), (20, 25)]
+        )
+        self.assertListEqual(split_blocks_range(10, 29, 10), [(10, 19), (20, 29)])
+        self.assertListEqual(split_blocks_range(5, 5, 10), [(5, 5)])
+        self.assertListEqual(split_blocks_range(5, 7, 1), [(5, 5), (6, 6), (7, 7)])
+        self.assertListEqual(split_blocks_range(6, 5, 10), [])
+
+    def test_chunks_cover_range(self):
+        chunks = split_blocks_range(17, 1003, 64)
+        self.assertEqual(chunks[0][0], 17)
+        self.assertEqual(chunks[-1][1], 1003)
+        for (_, previous_end), (start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(start, previous_end + 1)
+        self.assertTrue(all(end - start + 1 <= 64 for start, end in chunks))
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(AssertionError):
+            split_blocks_range(0, 10, 0)
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_save_and_load(self):
+        fingerprint = _crawl_jobs_fingerprint(
+            AvailableBlockchainType.POLYGON, EVENT_CRAWL_JOBS, FUNCTION_CALL_CRAWL_JOBS
+        )
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            checkpoint_path = os.path.join(checkpoint_dir, "checkpoint.json")
+            self.assertSetEqual(_load_checkpoint(checkpoint_path, fingerprint), set())
+
+            _save_checkpoint(checkpoint_path, fingerprint, {(10, 19), (0, 9)})
+            self.assertSetEqual(
+                _load_checkpoint(checkpoint_path, fingerprint), {(0, 9), (10, 19)}
+            )
+            self.assertListEqual(os.listdir(checkpoint_dir), ["checkpoint.json"])
+
+            with self.assertRaises(ValueError):
+                _load_checkpoint(checkpoint_path, "other jobs")
+
+    def test_fingerprint(self):
+        fingerprint = _crawl_jobs_fingerprint(
+            AvailableBlockchainType.POLYGON, EVENT_CRAWL_JOBS, FUNCTION_CALL_CRAWL_JOBS
+        )
+        self.assertEqual(
+            _crawl_jobs_fingerprint(
+                AvailableBlockchainType.POLYGON,
+                list(reversed(EVENT_CRAWL_JOBS)),
+                FUNCTION_CALL_CRAWL_JOBS,
+            ),
+            fingerprint,
+        )
+        self.assertNotEqual(
+            _crawl_jobs_fingerprint(
+                AvailableBlockchainType.ETHEREUM,
+                EVENT_CRAWL_JOBS,
+                FUNCTION_CALL_CRAWL_JOBS,
+            ),
+            fingerprint,
+        )
+        self.assertNotEqual(
+            _crawl_jobs_fingerprint(
+                AvailableBlockchainType.POLYGON, EVENT_CRAWL_JOBS[:1], []
+            ),
+            fingerprint,
+        )
+
+
+class TestHistoricalCrawler(unittest.TestCase):
+    """
+    Runs historical crawler with chunks crawled in threads instead of worker processes.
+    """
+
+    def setUp(self):
+        self.crawled_chunks: List[Tuple[int, int]] = []
+        self.failing_chunks: List[Tuple[int, int]] = []
+        self.last_labeled_block = 25
+
+        patches = [
+            mock.patch.object(
+                historical_crawler, "ProcessPoolExecutor", ThreadPoolExecutor
+            ),
+            mock.patch.object(historical_crawler, "_init_historical_crawler_worker"),
+            mock.patch.object(
+                historical_crawler, "_crawl_chunk", side_effect=self.crawl_chunk
+            ),
+            mock.patch.object(
+                historical_crawler,
+                "yield_db_session_ctx",
+                side_effect=lambda: contextlib.nullcontext(None),
+            ),
+            mock.patch.object(
+                historical_crawler,
+                "get_last_labeled_block_number",
+                side_effect=lambda *_: self.last_labeled_block,
+            ),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def crawl_chunk(
+        self,
+        blockchain_type,
+        event_crawl_jobs,
+        function_call_crawl_jobs,
+        from_block,
+        to_block,
+        max_blocks_batch,
+    ):
+        self.crawled_chunks.append((from_block, to_block))
+        if (from_block, to_block) in self.failing_chunks:
+            raise Exception("Node is not available")
+        return to_block - from_block + 1, 0
+
+    def crawl(self, checkpoint_path, **kwargs):
+        historical_crawler.historical_crawler(
+            AvailableBlockchainType.POLYGON,
+            kwargs.pop("event_crawl_jobs", EVENT_CRAWL_JOBS),
+            FUNCTION_CALL_CRAWL_JOBS,
+            start_block=0,
+            chunk_size=10,
+            num_processes=2,
+            checkpoint_path=checkpoint_path,
+            **kwargs,
+        )
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            checkpoint_path = os.path.join(checkpoint_dir, "checkpoint.json")
+
+            self.failing_chunks = [(10, 19)]
+            with self.assertRaises(HistoricalCrawlError):
+                self.crawl(checkpoint_path, end_block=100)
+            self.assertListEqual(
+                sorted(self.crawled_chunks), [(0, 9), (10, 19), (20, 25)]
+            )
+            with open(checkpoint_path) as ifp:
+                self.assertListEqual(
+                    json.load(ifp)["completed_chunks"], [[0, 9], [20, 25]]
+                )
+
+            # Rerun crawls only failed chunk
+            self.failing_chunks = []
+            self.crawled_chunks = []
+            self.crawl(checkpoint_path)
+            self.assertListEqual(self.crawled_chunks, [(10, 19)])
+
+            with open(checkpoint_path) as ifp:
+                self.assertListEqual(
+                    json.load(ifp)["completed_chunks"], [[0, 9], [10, 19], [20, 25]]
+                )
+
+            # Nothing is left to crawl
+            self.crawled_chunks = []
+            self.crawl(checkpoint_path)
+            self.assertListEqual(self.crawled_chunks, [])
+
+            with self.assertRaises(ValueError):
+                self.crawl(checkpoint_path, event_crawl_jobs=EVENT_CRAWL_JOBS[:1])
+
+    def test_without_checkpoint(self):
+        self.crawl(None, end_block=12)
+        self.assertListEqual(sorted(self.crawled_chunks), [(0, 9), (10, 12)])
+
+        self.last_labeled_block = None
+        with self.assertRaises(ValueError):
+            self.crawl(None)
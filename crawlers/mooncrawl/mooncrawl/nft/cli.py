@@ -32,7 +32,11 @@ from .ethereum import (
     SUMMARY_KEY_ID,
     SUMMARY_KEY_NUM_BLOCKS,
     SUMMARY_KEY_START_BLOCK,
+    NFTSummaryPartialsStore,
     add_labels,
+    benchmark_nft_transfers_decoding,
+    get_transfer_logs,
+    load_logs,
 )
 from .ethereum import summary as ethereum_summary
 
@@ -40,6 +44,8 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BLOCKS_PER_SUMMARY = 40
+# Summary partials of older blocks are removed from partials store by synchronize
+SUMMARY_PARTIALS_RETENTION_BLOCKS = 50000
 
 
 def web3_client_from_cli_or_env(args: argparse.Namespace) -> Web3:
@@ -128,6 +134,7 @@ def sync_summaries(
     db_session: Session,
     start: Optional[int],
     end: int,
+    partials_store: Optional[NFTSummaryPartialsStore] = None,
 ) -> int:
     if start is None:
         logger.info(
@@ -154,12 +161,16 @@ def sync_summaries(
     if batch_end > end:
         logger.warn("Syncing summaries is not required")
     while batch_end <= end:
-        summary_result = ethereum_summary(db_session, start, batch_end)
+        summary_result = ethereum_summary(db_session, start, batch_end, partials_store)
         push_summary(summary_result)
         logger.info(f"Pushed summary of blocks : {start}-{batch_end}")
         start = batch_end + 1
         batch_end += BLOCKS_PER_SUMMARY
 
+    if partials_store is not None:
+        partials_store.prune(start - SUMMARY_PARTIALS_RETENTION_BLOCKS)
+        logger.info(f"Summary partials store: {partials_store.metrics}")
+
     if start == end:
         return end
     else:
@@ -169,26 +180,35 @@ def sync_summaries(
 def ethereum_sync_handler(args: argparse.Namespace) -> None:
     web3_client = web3_client_from_cli_or_env(args)
 
-    with yield_db_session_ctx() as db_session:
-        logger.info("Initial labeling:")
-        last_labeled = sync_labels(db_session, web3_client, args.start)
-        logger.info("Initial summary creation:")
-        last_summary_created = sync_summaries(
-            db_session,
-            args.start,
-            last_labeled,
-        )
-        while True:
-            logger.info("Syncing")
-            last_labeled = sync_labels(db_session, web3_client, last_labeled + 1)
+    partials_store: Optional[NFTSummaryPartialsStore] = None
+    if args.partials_store is not None:
+        partials_store = NFTSummaryPartialsStore(args.partials_store)
+    try:
+        with yield_db_session_ctx() as db_session:
+            logger.info("Initial labeling:")
+            last_labeled = sync_labels(db_session, web3_client, args.start)
+            logger.info("Initial summary creation:")
             last_summary_created = sync_summaries(
                 db_session,
-                last_summary_created + 1,
+                args.start,
                 last_labeled,
+                partials_store,
             )
-            sleep_time = 10 * 60
-            logger.info(f"Going to sleep for {sleep_time}s")
-            time.sleep(sleep_time)
+            while True:
+                logger.info("Syncing")
+                last_labeled = sync_labels(db_session, web3_client, last_labeled + 1)
+                last_summary_created = sync_summaries(
+                    db_session,
+                    last_summary_created + 1,
+                    last_labeled,
+                    partials_store,
+                )
+                sleep_time = 10 * 60
+                logger.info(f"Going to sleep for {sleep_time}s")
+                time.sleep(sleep_time)
+    finally:
+        if partials_store is not None:
+            partials_store.close()
 
 
 def ethereum_label_handler(args: argparse.Namespace) -> None:
@@ -197,6 +217,22 @@ def ethereum_label_handler(args: argparse.Namespace) -> None:
         add_labels(web3_client, db_session, args.start, args.end, args.address)
 
 
+def ethereum_record_logs_handler(args: argparse.Namespace) -> None:
+    web3_client = web3_client_from_cli_or_env(args)
+    logs = get_transfer_logs(web3_client, args.start, args.end, args.address)
+    with args.outfile as ofp:
+        ofp.write(Web3.toJSON(logs))
+    logger.info(
+        f"Recorded {len(logs)} Transfer logs from blocks {args.start}-{args.end}"
+    )
+
+
+def ethereum_benchmark_decode_handler(args: argparse.Namespace) -> None:
+    logs = load_logs(args.logs)
+    result = benchmark_nft_transfers_decoding(Web3(), logs, args.repeat)
+    print(json.dumps(result, indent=2))
+
+
 def push_summary(result: Dict[str, Any], humbug_token: Optional[str] = None):
     if humbug_token is None:
         humbug_token = NFT_HUMBUG_TOKEN
@@ -246,8 +282,15 @@ def push_summary(result: Dict[str, Any], humbug_token: Optional[str] = None):
 
 def ethereum_summary_handler(args: argparse.Namespace) -> None:
 
-    with yield_db_session_ctx() as db_session:
-        result = ethereum_summary(db_session, args.start, args.end)
+    partials_store: Optional[NFTSummaryPartialsStore] = None
+    if args.partials_store is not None:
+        partials_store = NFTSummaryPartialsStore(args.partials_store)
+    try:
+        with yield_db_session_ctx() as db_session:
+            result = ethereum_summary(db_session, args.start, args.end, partials_store)
+    finally:
+        if partials_store is not None:
+            partials_store.close()
     push_summary(result, args.humbug)
     with args.outfile as ofp:
         json.dump(result, ofp)
@@ -332,6 +375,11 @@ def main() -> None:
             "MOONSTREAM_HUMBUG_TOKEN environment variable)"
         ),
     )
+    parser_ethereum_summary.add_argument(
+        "--partials-store",
+        default=None,
+        help="(Optional) Path to SQLite file to store and reuse summary partial aggregates of blocks segments",
+    )
     parser_ethereum_summary.set_defaults(func=ethereum_summary_handler)
 
     parser_ethereum_sync = subparsers_ethereum.add_parser(
@@ -345,8 +393,75 @@ def main() -> None:
         required=False,
         help="Starting block number (inclusive if block available)",
     )
+    parser_ethereum_sync.add_argument(
+        "--partials-store",
+        default=None,
+        help="(Optional) Path to SQLite file to store and reuse summary partial aggregates of blocks segments",
+    )
     parser_ethereum_sync.set_defaults(func=ethereum_sync_handler)
 
+    parser_ethereum_record_logs = subparsers_ethereum.add_parser(
+        "record-logs",
+        description="Save raw Transfer logs from blocks range to use as decoding benchmark fixture",
+    )
+    parser_ethereum_record_logs.add_argument(
+        "-s",
+        "--start",
+        type=int,
+        required=True,
+        help="Starting block number (inclusive)",
+    )
+    parser_ethereum_record_logs.add_argument(
+        "-e",
+        "--end",
+        type=int,
+        required=True,
+        help="Ending block number (inclusive)",
+    )
+    parser_ethereum_record_logs.add_argument(
+        "-a",
+        "--address",
+        type=str,
+        default=None,
+        help="(Optional) Contract address to record logs of",
+    )
+    parser_ethereum_record_logs.add_argument(
+        "-o",
+        "--outfile",
+        type=argparse.FileType("w"),
+        required=True,
+        help="File to write logs to",
+    )
+    parser_ethereum_record_logs.add_argument(
+        "--web3",
+        type=str,
+        default=None,
+        help="(Optional) Web3 connection string. If not provided, uses the value specified by MOONSTREAM_ETHEREUM_WEB3_PROVIDER_URI environment variable.",
+    )
+    parser_ethereum_record_logs.set_defaults(func=ethereum_record_logs_handler)
+
+    parser_ethereum_benchmark_decode = subparsers_ethereum.add_parser(
+        "benchmark-decode",
+        description="Compare speed of NFT Transfer decoding with and without web3 ABI codec",
+    )
+    parser_ethereum_benchmark_decode.add_argument(
+        "-i",
+        "--logs",
+        type=str,
+        required=True,
+        help="File with logs saved by record-logs command",
+    )
+    parser_ethereum_benchmark_decode.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of runs of each decoder, the best run is reported",
+    )
+    parser_ethereum_benchmark_decode.set_defaults(
+        func=ethereum_benchmark_decode_handler
+    )
+
     args = parser.parse_args()
     args.func(args)
 
@@ -1,19 +1,27 @@
 import json
 import logging
-from dataclasses import asdict, dataclass
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Set, Tuple, cast
 
 from eth_typing.encoding import HexStr
 from hexbytes.main import HexBytes
-from moonstreamdb.models import EthereumBlock, EthereumLabel, EthereumTransaction
-from sqlalchemy import and_, func, text
-from sqlalchemy.orm import Query, Session
+from moonstreamdb.models import EthereumLabel
+from sqlalchemy import text
+from sqlalchemy.orm import Session
 from tqdm import tqdm
 from web3 import Web3
 from web3._utils.events import get_event_data
+from web3._utils.method_formatters import raise_solidity_error_on_revert
+from web3._utils.rpc_abi import RPC
+from web3.exceptions import ContractLogicError
 from web3.types import FilterParams, LogReceipt
 
+from ..blockchain import BatchRequestError, make_raw_batch_request
 from ..reporter import reporter
 
 # Default length (in blocks) of an Ethereum NFT crawl.
@@ -158,6 +166,172 @@ def get_erc721_contract_info(w3: Web3, address: str) -> NFTContract:
     )
 
 
+# Selectors of name() and symbol() ERC-721 metadata functions
+ERC721_NAME_SELECTOR = "0x06fdde03"
+ERC721_SYMBOL_SELECTOR = "0x95d89b41"
+
+# Process level cache of resolved contracts metadata. Contracts which reverted name()
+# and symbol() calls or returned empty result are cached as well with None values, they
+# will not answer later. Contracts with other call errors are not cached.
+_erc721_contracts: Dict[str, NFTContract] = {}
+# Contracts with "erc721" label in database
+_erc721_labelled_addresses: Set[str] = set()
+_erc721_cache_lock = threading.Lock()
+
+
+def _decode_string_result(w3: Web3, raw_result: Optional[str]) -> Optional[str]:
+    if raw_result is None:
+        return None
+    try:
+        return w3.codec.decode_abi(["string"], HexBytes(raw_result))[0]
+    except:
+        return None
+
+
+def _is_revert_error(error: Any) -> bool:
+    """
+    Checks if JSON-RPC error of eth_call is contract revert the same way web3 does.
+    """
+    try:
+        raise_solidity_error_on_revert({"error": error})
+    except ContractLogicError:
+        return True
+    except Exception:
+        return False
+    return False
+
+
+def _call_string_function(
+    w3: Web3, address: str, selector: str
+) -> Tuple[Optional[str], bool]:
+    """
+    Calls contract function returning string without batch request.
+
+    Returns decoded string and True if call succeeded or reverted, so result is final.
+    """
+    try:
+        raw_result = w3.eth.call(
+            {"to": w3.toChecksumAddress(address), "data": selector}
+        )
+        return _decode_string_result(w3, HexBytes(raw_result).hex()), True
+    except ContractLogicError:
+        return None, True
+    except Exception as e:
+        logger.warning(f"Call {selector} of contract {address} failed: {e}")
+        return None, False
+
+
+def _string_call_response_result(
+    w3: Web3, response: Dict[str, Any]
+) -> Tuple[Optional[str], bool]:
+    """
+    Returns decoded string from eth_call JSON-RPC response and True if call succeeded
+    or reverted, so result is final. Other errors like rate limits and timeouts are
+    not final.
+    """
+    error = response.get("error")
+    if error is None:
+        return _decode_string_result(w3, response.get("result")), True
+    if _is_revert_error(error):
+        return None, True
+    logger.warning(f"eth_call failed: {error}")
+    return None, False
+
+
+def get_erc721_contracts_info_batch(
+    w3: Web3, addresses: List[str]
+) -> List[Tuple[NFTContract, bool]]:
+    """
+    Calls name() and symbol() of all given contracts in one JSON-RPC batch request.
+
+    Falls back to separate calls for providers without batch requests support.
+    Returns contracts with flag which is False if any of calls failed with error other
+    than revert, so contract metadata could be resolved later.
+    """
+    params_list: List[List[Any]] = []
+    for address in addresses:
+        checksum_address = w3.toChecksumAddress(address)
+        params_list.append(
+            [{"to": checksum_address, "data": ERC721_NAME_SELECTOR}, "latest"]
+        )
+        params_list.append(
+            [{"to": checksum_address, "data": ERC721_SYMBOL_SELECTOR}, "latest"]
+        )
+
+    results: List[Tuple[Optional[str], bool]] = []
+    try:
+        responses = make_raw_batch_request(w3, RPC.eth_call, params_list)
+        results = [_string_call_response_result(w3, response) for response in responses]
+    except BatchRequestError as e:
+        logger.warning(f"Batch request failed, calling contracts one by one: {e}")
+        for address in addresses:
+            results.append(_call_string_function(w3, address, ERC721_NAME_SELECTOR))
+            results.append(_call_string_function(w3, address, ERC721_SYMBOL_SELECTOR))
+
+    contracts: List[Tuple[NFTContract, bool]] = []
+    for index, address in enumerate(addresses):
+        name, name_final = results[2 * index]
+        if name is None:
+            logger.error(f"Could not get name for potential NFT contract: {address}")
+        symbol, symbol_final = results[2 * index + 1]
+        if symbol is None:
+            logger.error(f"Could not get symbol for potential NFT contract: {address}")
+        contracts.append(
+            (
+                NFTContract(address=address, name=name, symbol=symbol),
+                name_final and symbol_final,
+            )
+        )
+    return contracts
+
+
+def resolve_erc721_contracts_info(
+    w3: Web3, addresses: List[str], batch_size: int = 50, max_workers: int = 4
+) -> Dict[str, NFTContract]:
+    """
+    Returns metadata of given contracts, querying node only for contracts which were not
+    resolved by this process before. Batches of batch_size contracts are requested
+    concurrently by max_workers threads.
+
+    Contracts with failed calls other than reverts are returned without name and symbol
+    and are not cached, they are queried again by the next call.
+    """
+    assert batch_size > 0, f"Batch size must be positive (received {batch_size})"
+
+    contracts: Dict[str, NFTContract] = {}
+    missing_addresses: List[str] = []
+    with _erc721_cache_lock:
+        for address in addresses:
+            contract = _erc721_contracts.get(address)
+            if contract is not None:
+                contracts[address] = contract
+            elif address not in contracts:
+                missing_addresses.append(address)
+    if not missing_addresses:
+        return contracts
+
+    batches = [
+        missing_addresses[i : i + batch_size]
+        for i in range(0, len(missing_addresses), batch_size)
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(get_erc721_contracts_info_batch, w3, batch)
+            for batch in batches
+        ]
+        for future in as_completed(futures):
+            # Node errors are raised here, metadata of completed batches stays cached
+            batch_contracts = future.result()
+            with _erc721_cache_lock:
+                for contract, final in batch_contracts:
+                    if final:
+                        _erc721_contracts[contract.address] = contract
+            for contract, _ in batch_contracts:
+                contracts[contract.address] = contract
+
+    return contracts
+
+
 # SHA3 hash of the string "Transfer(address,address,uint256)"
 TRANSFER_EVENT_SIGNATURE = HexBytes(
     "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
@@ -184,7 +358,16 @@ class NFTTransfer:
     is_mint: bool = False
 
 
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+ADDRESS_WORD_PADDING = b"\x00" * 12
+
+
 def decode_nft_transfer_data(w3: Web3, log: LogReceipt) -> Optional[NFTTransferRaw]:
+    """
+    Decodes Transfer log with web3 ABI codec trying each of ERC-721 Transfer ABIs.
+
+    Slow, use decode_nft_transfers to decode many logs.
+    """
     for abi in erc721_transfer_event_abis:
         try:
             transfer_data = get_event_data(w3.codec, abi, log)
@@ -201,12 +384,130 @@ def decode_nft_transfer_data(w3: Web3, log: LogReceipt) -> Optional[NFTTransferR
     return None
 
 
-def get_nft_transfers(
+def decode_nft_transfers(logs: List[LogReceipt]) -> List[NFTTransfer]:
+    """
+    Decodes ERC-721 Transfer events from raw Transfer logs without web3 ABI codec.
+
+    ERC-721 Transfer has all arguments indexed, so its log has 4 topics. Old NFTs like
+    CryptoKitties emit Transfer with arguments in data: 1 topic and 3 words of data.
+    ERC-20 Transfer logs have 3 topics and are skipped. Arguments are sliced from
+    raw topics and data, logs with non zero address padding are skipped as web3
+    codec does.
+    """
+    checksum_addresses: Dict[bytes, str] = {}
+
+    def word_to_address(word: bytes) -> Optional[str]:
+        if word[:12] != ADDRESS_WORD_PADDING:
+            return None
+        address = checksum_addresses.get(word)
+        if address is None:
+            address = Web3.toChecksumAddress(word[12:])
+            checksum_addresses[word] = address
+        return address
+
+    nft_transfers: List[NFTTransfer] = []
+    for log in logs:
+        topics = log["topics"]
+        if len(topics) == 4:
+            words = [HexBytes(topic) for topic in topics[1:]]
+        elif len(topics) == 1:
+            data = HexBytes(log["data"])
+            if len(data) < 96:
+                continue
+            words = [data[0:32], data[32:64], data[64:96]]
+        else:
+            continue
+        if HexBytes(topics[0]) != TRANSFER_EVENT_SIGNATURE:
+            continue
+
+        transfer_from = word_to_address(words[0])
+        transfer_to = word_to_address(words[1])
+        if transfer_from is None or transfer_to is None or len(words[2]) != 32:
+            continue
+
+        nft_transfers.append(
+            NFTTransfer(
+                contract_address=log["address"],
+                transfer_from=transfer_from,
+                transfer_to=transfer_to,
+                tokenId=int.from_bytes(words[2], "big"),
+                transfer_tx=HexBytes(log["transactionHash"]).hex(),
+                is_mint=transfer_from == ZERO_ADDRESS,
+            )
+        )
+    return nft_transfers
+
+
+def benchmark_nft_transfers_decoding(
+    w3: Web3, logs: List[LogReceipt], repeat: int = 3
+) -> Dict[str, float]:
+    """
+    Measures logs/sec of decode_nft_transfers and of decoding with web3 ABI codec
+    over the same logs, checking that both decoders return the same transfers.
+    """
+    assert repeat > 0, "repeat must be greater than 0"
+
+    codec_time = float("inf")
+    codec_transfers: List[NFTTransfer] = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        codec_transfers = []
+        for log in logs:
+            nft_transfer = decode_nft_transfer_data(w3, log)
+            if nft_transfer is not None:
+                codec_transfers.append(
+                    NFTTransfer(
+                        contract_address=nft_transfer.contract_address,
+                        transfer_from=nft_transfer.transfer_from,
+                        transfer_to=nft_transfer.transfer_to,
+                        tokenId=nft_transfer.tokenId,
+                        transfer_tx=nft_transfer.transfer_tx.hex(),
+                        is_mint=nft_transfer.transfer_from == ZERO_ADDRESS,
+                    )
+                )
+        codec_time = min(codec_time, time.perf_counter() - started_at)
+
+    raw_time = float("inf")
+    raw_transfers: List[NFTTransfer] = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        raw_transfers = decode_nft_transfers(logs)
+        raw_time = min(raw_time, time.perf_counter() - started_at)
+
+    if raw_transfers != codec_transfers:
+        raise Exception("Raw logs decoder and web3 codec returned different transfers")
+
+    return {
+        "logs": len(logs),
+        "nft_transfers": len(raw_transfers),
+        "codec_logs_per_second": len(logs) / codec_time,
+        "raw_logs_per_second": len(logs) / raw_time,
+        "speedup": codec_time / raw_time,
+    }
+
+
+def load_logs(path: str) -> List[LogReceipt]:
+    """
+    Loads logs saved by Web3.toJSON, restoring bytes fields.
+    """
+    with open(path, "r") as ifp:
+        raw_logs = json.load(ifp)
+    logs = []
+    for raw_log in raw_logs:
+        log = dict(raw_log)
+        log["topics"] = [HexBytes(topic) for topic in raw_log["topics"]]
+        log["transactionHash"] = HexBytes(raw_log["transactionHash"])
+        log["blockHash"] = HexBytes(raw_log["blockHash"])
+        logs.append(cast(LogReceipt, log))
+    return logs
+
+
+def get_transfer_logs(
     w3: Web3,
     from_block: Optional[int] = None,
     to_block: Optional[int] = None,
     contract_address: Optional[str] = None,
-) -> List[NFTTransfer]:
+) -> List[LogReceipt]:
     filter_params = FilterParams(topics=[cast(HexStr, TRANSFER_EVENT_SIGNATURE.hex())])
 
     if from_block is not None:
@@ -217,22 +518,17 @@ def get_nft_transfers(
     if contract_address is not None:
         filter_params["address"] = w3.toChecksumAddress(contract_address)
 
-    logs = w3.eth.get_logs(filter_params)
+    return w3.eth.get_logs(filter_params)
 
-    nft_transfers: List[NFTTransfer] = []
-    for log in tqdm(logs, desc=f"Processing logs for blocks {from_block}-{to_block}"):
-        nft_transfer = decode_nft_transfer_data(w3, log)
-        if nft_transfer is not None:
-            kwargs = {
-                **asdict(nft_transfer),
-                "transfer_tx": nft_transfer.transfer_tx.hex(),
-                "is_mint": nft_transfer.transfer_from
-                == "0x0000000000000000000000000000000000000000",
-            }
 
-            parsed_transfer = NFTTransfer(**kwargs)  # type: ignore
-            nft_transfers.append(parsed_transfer)
-    return nft_transfers
+def get_nft_transfers(
+    w3: Web3,
+    from_block: Optional[int] = None,
+    to_block: Optional[int] = None,
+    contract_address: Optional[str] = None,
+) -> List[NFTTransfer]:
+    logs = get_transfer_logs(w3, from_block, to_block, contract_address)
+    return decode_nft_transfers(logs)
 
 
 def get_block_bounds(
@@ -255,10 +551,11 @@ def get_block_bounds(
 
 
 def label_erc721_addresses(w3: Web3, db_session: Session, addresses: List[str]) -> None:
+    contracts_info = resolve_erc721_contracts_info(w3, addresses)
     labels: List[EthereumLabel] = []
     for address in addresses:
         try:
-            contract_info = get_erc721_contract_info(w3, address)
+            contract_info = contracts_info[address]
 
             # Postgres cannot store the following unicode code point in a string: \u0000
             # Therefore, we replace that code point with the empty string to avoid errors:
@@ -295,6 +592,9 @@ def label_erc721_addresses(w3: Web3, db_session: Session, addresses: List[str])
         logger.error(f"Failed to save erc721 labels to db:\n{e}")
         raise e
 
+    with _erc721_cache_lock:
+        _erc721_labelled_addresses.update(label.address for label in labels)
+
 
 def label_key(label: EthereumLabel) -> Tuple[str, int, int, str, str]:
     return (
@@ -411,12 +711,6 @@ def add_labels(
     batch_start = start
     batch_end = min(start + batch_size - 1, end)
 
-    # TODO(yhtiyar): Make address_ids as global cache to fast up crawling
-    # address_ids: Dict[str, int] = {}
-    # For now quitting this idea because some contracts have unicode escapes
-    # in their names, and global cache will fuck up not only that batch labeling
-    # but later ones as well
-
     pbar = tqdm(total=(end - start + 1))
     pbar.set_description(f"Labeling blocks {start}-{end}")
     while batch_start <= batch_end:
@@ -428,17 +722,24 @@ def add_labels(
         )
         contract_addresses = {transfer.contract_address for transfer in job}
 
-        labelled_address = [
-            label.address
-            for label in (
-                db_session.query(EthereumLabel)
-                .filter(EthereumLabel.label == NFT_LABEL)
-                .filter(EthereumLabel.address.in_(contract_addresses))
-                .all()
-            )
-        ]
+        # Database is checked only for contracts this process did not see before
+        with _erc721_cache_lock:
+            unseen_addresses = contract_addresses - _erc721_labelled_addresses
+        labelled_address: Set[str] = set()
+        if unseen_addresses:
+            labelled_address = {
+                label.address
+                for label in (
+                    db_session.query(EthereumLabel.address)
+                    .filter(EthereumLabel.label == NFT_LABEL)
+                    .filter(EthereumLabel.address.in_(unseen_addresses))
+                    .all()
+                )
+            }
+            with _erc721_cache_lock:
+                _erc721_labelled_addresses.update(labelled_address)
         unlabelled_address = [
-            address for address in contract_addresses if address not in labelled_address
+            address for address in unseen_addresses if address not in labelled_address
         ]
 
         # Add 'erc721' labels
@@ -476,140 +777,361 @@ def add_labels(
     pbar.close()
 
 
-def block_bounded_summary(
+# Size (in blocks) of segments summary partial aggregates are computed for
+SUMMARY_SEGMENT_SIZE = 10
+
+# Blocks and transactions aggregates of each segment in one pass
+SUMMARY_BLOCKS_QUERY = text(
+    """
+WITH blocks AS (
+    SELECT
+        block_number / :segment_size AS segment,
+        min(block_number) AS first_block,
+        max(block_number) AS last_block,
+        count(*) AS num_blocks,
+        min(timestamp) AS first_timestamp,
+        max(timestamp) AS last_timestamp
+    FROM ethereum_blocks
+    WHERE block_number BETWEEN :start_block AND :end_block
+    GROUP BY segment
+), transactions AS (
+    SELECT
+        ethereum_transactions.block_number / :segment_size AS segment,
+        count(*) AS num_transactions,
+        sum(ethereum_transactions.value) AS total_value
+    FROM ethereum_transactions
+        JOIN ethereum_blocks
+        ON ethereum_transactions.block_number = ethereum_blocks.block_number
+    WHERE ethereum_blocks.block_number BETWEEN :start_block AND :end_block
+    GROUP BY segment
+)
+SELECT
+    blocks.segment,
+    blocks.first_block,
+    blocks.last_block,
+    blocks.num_blocks,
+    blocks.first_timestamp,
+    blocks.last_timestamp,
+    coalesce(transactions.num_transactions, 0) AS num_transactions,
+    transactions.total_value
+FROM blocks LEFT JOIN transactions ON blocks.segment = transactions.segment
+"""
+)
+
+# NFT labels aggregates of each segment in one pass, with the last owner of each token
+# minted or transferred in segment
+SUMMARY_LABELS_QUERY = text(
+    """
+WITH nft_labels AS (
+    SELECT
+        ethereum_transactions.block_number / :segment_size AS segment,
+        ethereum_labels.label,
+        ethereum_labels.address,
+        ethereum_labels.label_data->>'tokenId' AS token_id,
+        ethereum_labels.label_data->>'to' AS owner_address,
+        ethereum_transactions.hash,
+        ethereum_transactions.value,
+        ethereum_transactions.block_number,
+        ethereum_transactions.transaction_index
+    FROM ethereum_labels
+        JOIN ethereum_transactions
+        ON ethereum_labels.transaction_hash = ethereum_transactions.hash
+        JOIN ethereum_blocks
+        ON ethereum_transactions.block_number = ethereum_blocks.block_number
+    WHERE ethereum_blocks.block_number BETWEEN :start_block AND :end_block
+        AND ethereum_labels.label IN (:mint_label, :transfer_label)
+), ranked_nft_labels AS (
+    SELECT
+        *,
+        ROW_NUMBER() OVER (
+            PARTITION BY segment, label, address, token_id
+            ORDER BY block_number DESC, transaction_index DESC, value, owner_address
+        ) AS owner_rank
+    FROM nft_labels
+)
+SELECT
+    segment,
+    count(DISTINCT hash) FILTER (WHERE label = :transfer_label) AS num_transfers,
+    sum(value) FILTER (WHERE label = :transfer_label) AS transfer_value,
+    count(*) FILTER (WHERE label = :mint_label) AS num_mints,
+    json_agg(
+        json_build_array(label, address, token_id, owner_address)
+    ) FILTER (WHERE owner_rank = 1) AS owners
+FROM ranked_nft_labels
+GROUP BY segment
+"""
+)
+
+
+@dataclass
+class NFTSummaryPartial:
+    """
+    Aggregates of NFT activity in blocks range, summaries of adjacent ranges are combined
+    with merge_summary_partials.
+    """
+
+    start_block: int
+    end_block: int
+    first_block: Optional[int] = None
+    last_block: Optional[int] = None
+    first_timestamp: Optional[int] = None
+    last_timestamp: Optional[int] = None
+    num_blocks: int = 0
+    num_transactions: int = 0
+    total_value: Optional[int] = None
+    num_transfers: int = 0
+    transfer_value: Optional[int] = None
+    num_mints: int = 0
+    # Last owner of each (contract address, token id) transferred or minted in range
+    purchasers: Dict[Tuple[str, str], str] = field(default_factory=dict)
+    minters: Dict[Tuple[str, str], str] = field(default_factory=dict)
+
+
+def _add_optional(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def merge_summary_partials(partials: List[NFTSummaryPartial]) -> NFTSummaryPartial:
+    """
+    Combines partial aggregates of adjacent blocks ranges into aggregates of whole range.
+    """
+    assert partials, "At least one summary partial is required"
+    partials = sorted(partials, key=lambda partial: partial.start_block)
+    result = NFTSummaryPartial(
+        start_block=partials[0].start_block, end_block=partials[-1].end_block
+    )
+    for partial in partials:
+        if partial.num_blocks > 0:
+            if result.first_block is None:
+                result.first_block = partial.first_block
+                result.first_timestamp = partial.first_timestamp
+            result.last_block = partial.last_block
+            result.last_timestamp = partial.last_timestamp
+        result.num_blocks += partial.num_blocks
+        # Transactions are in exactly one block, so distinct counts of disjoint ranges add up
+        result.num_transactions += partial.num_transactions
+        result.total_value = _add_optional(result.total_value, partial.total_value)
+        result.num_transfers += partial.num_transfers
+        result.transfer_value = _add_optional(
+            result.transfer_value, partial.transfer_value
+        )
+        result.num_mints += partial.num_mints
+        # Partials are ordered by blocks, owners from later range win
+        result.purchasers.update(partial.purchasers)
+        result.minters.update(partial.minters)
+    return result
+
+
+def _split_summary_segments(
+    start_block: int, end_block: int, segment_size: int
+) -> List[Tuple[int, int]]:
+    """
+    Splits blocks range to segments aligned by segment_size, first and last segments
+    are cut by range bounds.
+    """
+    segments = []
+    segment_start = start_block
+    while segment_start <= end_block:
+        segment_end = min(
+            (segment_start // segment_size + 1) * segment_size - 1, end_block
+        )
+        segments.append((segment_start, segment_end))
+        segment_start = segment_end + 1
+    return segments
+
+
+def get_summary_partials(
     db_session: Session,
     start_block: int,
     end_block: int,
-) -> Dict[str, Any]:
+    segment_size: int = SUMMARY_SEGMENT_SIZE,
+) -> List[NFTSummaryPartial]:
     """
-    Produces a summary of Ethereum NFT activity between the given start_time and end_time (inclusive).
+    Computes partial aggregates of each segment of blocks range with two queries.
     """
-    summary_id = f"nft-ethereum-start-{start_block}-end-{end_block}"
+    partials = {
+        segment_start
+        // segment_size: NFTSummaryPartial(
+            start_block=segment_start, end_block=segment_end
+        )
+        for segment_start, segment_end in _split_summary_segments(
+            start_block, end_block, segment_size
+        )
+    }
+    params = {
+        "segment_size": segment_size,
+        "start_block": start_block,
+        "end_block": end_block,
+        "mint_label": MINT_LABEL,
+        "transfer_label": TRANSFER_LABEL,
+    }
 
-    block_filter = and_(
-        EthereumBlock.block_number >= start_block,
-        EthereumBlock.block_number <= end_block,
-    )
+    for row in db_session.execute(SUMMARY_BLOCKS_QUERY, params):
+        partial = partials[row.segment]
+        partial.first_block = row.first_block
+        partial.last_block = row.last_block
+        partial.num_blocks = row.num_blocks
+        partial.first_timestamp = row.first_timestamp
+        partial.last_timestamp = row.last_timestamp
+        partial.num_transactions = row.num_transactions
+        if row.total_value is not None:
+            partial.total_value = int(row.total_value)
+
+    for row in db_session.execute(SUMMARY_LABELS_QUERY, params):
+        partial = partials[row.segment]
+        partial.num_transfers = row.num_transfers
+        if row.transfer_value is not None:
+            partial.transfer_value = int(row.transfer_value)
+        partial.num_mints = row.num_mints
+        for label, address, token_id, owner_address in row.owners:
+            owners = partial.minters if label == MINT_LABEL else partial.purchasers
+            owners[(address, token_id)] = owner_address
+
+    return [partials[segment] for segment in sorted(partials)]
+
+
+def _summary_partial_to_json(partial: NFTSummaryPartial) -> str:
+    raw_partial = asdict(partial)
+    for key in ["purchasers", "minters"]:
+        raw_partial[key] = [
+            [address, token_id, owner]
+            for (address, token_id), owner in raw_partial[key].items()
+        ]
+    return json.dumps(raw_partial)
 
-    transactions_query = (
-        db_session.query(EthereumTransaction)
-        .join(
-            EthereumBlock,
-            EthereumTransaction.block_number == EthereumBlock.block_number,
-        )
-        .filter(block_filter)
-    )
 
-    def nft_query(label: str) -> Query:
-        query = (
-            db_session.query(
-                EthereumLabel.label,
-                EthereumLabel.label_data,
-                EthereumLabel.address,
-                EthereumTransaction.hash,
-                EthereumTransaction.value,
-                EthereumBlock.block_number,
-                EthereumBlock.timestamp,
-            )
-            .join(
-                EthereumTransaction,
-                EthereumLabel.transaction_hash == EthereumTransaction.hash,
-            )
-            .join(
-                EthereumBlock,
-                EthereumTransaction.block_number == EthereumBlock.block_number,
-            )
-            .filter(block_filter)
-            .filter(EthereumLabel.label == label)
+def _summary_partial_from_json(raw: str) -> NFTSummaryPartial:
+    raw_partial = json.loads(raw)
+    for key in ["purchasers", "minters"]:
+        raw_partial[key] = {
+            (address, token_id): owner for address, token_id, owner in raw_partial[key]
+        }
+    return NFTSummaryPartial(**raw_partial)
+
+
+class NFTSummaryPartialsStore:
+    """
+    On-disk SQLite store of summary partials, so summaries of overlapping windows and
+    summaries recomputed after restart don't scan the same blocks again.
+
+    Only partials of complete segments are stored: aligned by segment size and with
+    all blocks present in database. Partials are computed from NFT labels existing at
+    that time, so blocks should be labeled before they are summarized.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summary_partials (segment_size INTEGER NOT NULL, start_block INTEGER NOT NULL, partial TEXT NOT NULL, PRIMARY KEY (segment_size, start_block))"
         )
-        return query
-
-    transfer_query = nft_query(TRANSFER_LABEL)
-    mint_query = nft_query(MINT_LABEL)
-
-    def holder_query(label: str) -> Query:
-        query = (
-            db_session.query(
-                EthereumLabel.address.label("address"),
-                EthereumLabel.label_data["to"].astext.label("owner_address"),
-                EthereumLabel.label_data["tokenId"].astext.label("token_id"),
-                EthereumTransaction.block_number.label("block_number"),
-                EthereumTransaction.transaction_index.label("transaction_index"),
-                EthereumTransaction.value.label("transfer_value"),
-            )
-            .join(
-                EthereumTransaction,
-                EthereumLabel.transaction_hash == EthereumTransaction.hash,
-            )
-            .join(
-                EthereumBlock,
-                EthereumTransaction.block_number == EthereumBlock.block_number,
-            )
-            .filter(EthereumLabel.label == label)
-            .filter(block_filter)
-            .order_by(
-                # Without "transfer_value" and "owner_address" as sort keys, the final distinct query
-                # does not seem to be deterministic.
-                # Maybe relevant Stackoverflow post: https://stackoverflow.com/a/59410440
-                text(
-                    "address, token_id, block_number desc, transaction_index desc, transfer_value, owner_address"
-                )
-            )
-            .distinct("address", "token_id")
+        self._conn.commit()
+        self.metrics = {"hits": 0, "misses": 0}
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def get_many(
+        self, segment_size: int, segments: List[Tuple[int, int]]
+    ) -> Dict[Tuple[int, int], NFTSummaryPartial]:
+        """
+        Returns stored partials of given segments by (start_block, end_block).
+        """
+        partials: Dict[Tuple[int, int], NFTSummaryPartial] = {}
+        for segment in segments:
+            row = self._conn.execute(
+                "SELECT partial FROM summary_partials WHERE segment_size = ? AND start_block = ?",
+                (segment_size, segment[0]),
+            ).fetchone()
+            if row is None:
+                continue
+            partial = _summary_partial_from_json(row[0])
+            if partial.end_block == segment[1]:
+                partials[segment] = partial
+        self.metrics["hits"] += len(partials)
+        self.metrics["misses"] += len(segments) - len(partials)
+        return partials
+
+    def save(self, segment_size: int, partials: List[NFTSummaryPartial]) -> int:
+        """
+        Stores partials of complete segments, returns number of stored partials.
+        """
+        rows = [
+            (segment_size, partial.start_block, _summary_partial_to_json(partial))
+            for partial in partials
+            if partial.start_block % segment_size == 0
+            and partial.end_block == partial.start_block + segment_size - 1
+            and partial.num_blocks == segment_size
+        ]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO summary_partials (segment_size, start_block, partial) VALUES (?, ?, ?)",
+            rows,
+        )
+        self._conn.commit()
+        return len(rows)
+
+    def prune(self, before_block: int) -> int:
+        """
+        Removes partials of segments starting before given block.
+        """
+        cursor = self._conn.execute(
+            "DELETE FROM summary_partials WHERE start_block < ?", (before_block,)
         )
-        return query
+        self._conn.commit()
+        return cursor.rowcount
 
-    purchaser_query = holder_query(TRANSFER_LABEL)
-    minter_query = holder_query(MINT_LABEL)
 
-    blocks = (
-        db_session.query(EthereumBlock)
-        .filter(block_filter)
-        .order_by(EthereumBlock.block_number.asc())
-    )
-    first_block = None
-    last_block = None
-    num_blocks = 0
-    for block in blocks:
-        if num_blocks == 0:
-            min_block = block
-        max_block = block
-        num_blocks += 1
+def block_bounded_summary(
+    db_session: Session,
+    start_block: int,
+    end_block: int,
+    partials_store: Optional[NFTSummaryPartialsStore] = None,
+    segment_size: int = SUMMARY_SEGMENT_SIZE,
+) -> Dict[str, Any]:
+    """
+    Produces a summary of Ethereum NFT activity between the given start_time and end_time (inclusive).
+
+    If partials_store is given, partial aggregates of segments found there are reused
+    and partials of new complete segments are saved to it.
+    """
+    summary_id = f"nft-ethereum-start-{start_block}-end-{end_block}"
+
+    segments = _split_summary_segments(start_block, end_block, segment_size)
+    partials: Dict[Tuple[int, int], NFTSummaryPartial] = {}
+    if partials_store is not None:
+        partials = partials_store.get_many(segment_size, segments)
+    missing_segments = [segment for segment in segments if segment not in partials]
+    # Query contiguous runs of missing segments
+    runs: List[List[Tuple[int, int]]] = []
+    for segment in missing_segments:
+        if runs and runs[-1][-1][1] + 1 == segment[0]:
+            runs[-1].append(segment)
+        else:
+            runs.append([segment])
+    for run in runs:
+        run_partials = get_summary_partials(
+            db_session, run[0][0], run[-1][1], segment_size
+        )
+        for partial in run_partials:
+            partials[(partial.start_block, partial.end_block)] = partial
+        if partials_store is not None:
+            partials_store.save(segment_size, run_partials)
+
+    partial = merge_summary_partials([partials[segment] for segment in segments])
 
     start_time = None
     end_time = None
-    if min_block is not None:
-        first_block = min_block.block_number
+    if partial.first_timestamp is not None:
         start_time = datetime.fromtimestamp(
-            min_block.timestamp, timezone.utc
+            partial.first_timestamp, timezone.utc
+        ).isoformat()
+    if partial.last_timestamp is not None:
+        end_time = datetime.fromtimestamp(
+            partial.last_timestamp, timezone.utc
         ).isoformat()
-    if max_block is not None:
-        last_block = max_block.block_number
-        end_time = datetime.fromtimestamp(max_block.timestamp, timezone.utc).isoformat()
-
-    num_transactions = transactions_query.distinct(EthereumTransaction.hash).count()
-    num_transfers = transfer_query.distinct(EthereumTransaction.hash).count()
-
-    total_value = db_session.query(
-        func.sum(transactions_query.subquery().c.value)
-    ).scalar()
-    transfer_value = db_session.query(
-        func.sum(transfer_query.subquery().c.value)
-    ).scalar()
-
-    num_minted = mint_query.count()
-
-    num_purchasers = (
-        db_session.query(purchaser_query.subquery())
-        .distinct(text("owner_address"))
-        .count()
-    )
-
-    num_minters = (
-        db_session.query(minter_query.subquery())
-        .distinct(text("owner_address"))
-        .count()
-    )
 
     result = {
         "date_range": {
@@ -620,27 +1142,32 @@ def block_bounded_summary(
         },
         SUMMARY_KEY_ID: summary_id,
         SUMMARY_KEY_ARGS: {"start": start_block, "end": end_block},
-        SUMMARY_KEY_START_BLOCK: first_block,
-        SUMMARY_KEY_END_BLOCK: last_block,
-        SUMMARY_KEY_NUM_BLOCKS: num_blocks,
-        SUMMARY_KEY_NUM_TRANSACTIONS: f"{num_transactions}",
-        SUMMARY_KEY_TOTAL_VALUE: f"{total_value}",
-        SUMMARY_KEY_NFT_TRANSFERS: f"{num_transfers}",
-        SUMMARY_KEY_NFT_TRANSFER_VALUE: f"{transfer_value}",
-        SUMMARY_KEY_NFT_MINTS: f"{num_minted}",
-        SUMMARY_KEY_NFT_PURCHASERS: f"{num_purchasers}",
-        SUMMARY_KEY_NFT_MINTERS: f"{num_minters}",
+        SUMMARY_KEY_START_BLOCK: partial.first_block,
+        SUMMARY_KEY_END_BLOCK: partial.last_block,
+        SUMMARY_KEY_NUM_BLOCKS: partial.num_blocks,
+        SUMMARY_KEY_NUM_TRANSACTIONS: f"{partial.num_transactions}",
+        SUMMARY_KEY_TOTAL_VALUE: f"{partial.total_value}",
+        SUMMARY_KEY_NFT_TRANSFERS: f"{partial.num_transfers}",
+        SUMMARY_KEY_NFT_TRANSFER_VALUE: f"{partial.transfer_value}",
+        SUMMARY_KEY_NFT_MINTS: f"{partial.num_mints}",
+        SUMMARY_KEY_NFT_PURCHASERS: f"{len(set(partial.purchasers.values()))}",
+        SUMMARY_KEY_NFT_MINTERS: f"{len(set(partial.minters.values()))}",
     }
 
     return result
 
 
-def summary(db_session: Session, start_block: int, end_block: int) -> Dict[str, Any]:
+def summary(
+    db_session: Session,
+    start_block: int,
+    end_block: int,
+    partials_store: Optional[NFTSummaryPartialsStore] = None,
+) -> Dict[str, Any]:
     """
     Produces a summary of all Ethereum NFT activity:
         From 1 hour before end_time to end_time
     """
 
-    result = block_bounded_summary(db_session, start_block, end_block)
+    result = block_bounded_summary(db_session, start_block, end_block, partials_store)
     result["crawled_at"] = datetime.utcnow().isoformat()
     return result
@@ -0,0 +1,340 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import List, Tuple
+
+from hexbytes import HexBytes
+from web3 import Web3
+
+from .ethereum import (
+    ERC721_NAME_SELECTOR,
+    SUMMARY_BLOCKS_QUERY,
+    SUMMARY_KEY_NUM_BLOCKS,
+    SUMMARY_KEY_NUM_TRANSACTIONS,
+    TRANSFER_EVENT_SIGNATURE,
+    ZERO_ADDRESS,
+    NFTContract,
+    NFTSummaryPartial,
+    NFTSummaryPartialsStore,
+    NFTTransfer,
+    block_bounded_summary,
+    decode_nft_transfer_data,
+    decode_nft_transfers,
+    merge_summary_partials,
+    resolve_erc721_contracts_info,
+)
+
+CONTRACT = Web3.toChecksumAddress("0x06012c8cf97bead5deae237070f9587f8e7a266d")
+OWNER = Web3.toChecksumAddress("0x" + "ab" * 20)
+
+
+def word(value: bytes) -> bytes:
+    return value.rjust(32, b"\x00")
+
+
+def make_log(topics, data=b"", transaction_index=0):
+    return {
+        "address": CONTRACT,
+        "topics": [TRANSFER_EVENT_SIGNATURE] + [HexBytes(topic) for topic in topics],
+        "data": HexBytes(data).hex(),
+        "transactionHash": HexBytes(word(bytes([transaction_index + 1]))),
+        "blockHash": HexBytes(word(b"\x01")),
+        "blockNumber": 1,
+        "logIndex": transaction_index,
+        "transactionIndex": transaction_index,
+    }
+
+
+class TestDecodeNFTTransfers(unittest.TestCase):
+    def setUp(self):
+        owner = HexBytes(OWNER)
+        self.logs = [
+            # ERC-721 with indexed arguments, mint
+            make_log([word(b""), word(owner), word(b"\x07")], transaction_index=0),
+            # CryptoKitties style, arguments in data
+            make_log(
+                [],
+                word(owner) + word(b"\x01" * 20) + word(b"\x08"),
+                transaction_index=1,
+            ),
+            # ERC-20 Transfer, value in data
+            make_log([word(owner), word(b"\x01" * 20)], word(b"\x10"), 2),
+            # Address with non zero padding
+            make_log([word(b"\xff" * 21), word(owner), word(b"\x09")], b"", 3),
+        ]
+
+    def test_decode(self):
+        transfers = decode_nft_transfers(self.logs)
+        self.assertListEqual(
+            transfers,
+            [
+                NFTTransfer(
+                    contract_address=CONTRACT,
+                    transfer_from=ZERO_ADDRESS,
+                    transfer_to=OWNER,
+                    tokenId=7,
+                    transfer_tx="0x" + "00" * 31 + "01",
+                    is_mint=True,
+                ),
+                NFTTransfer(
+                    contract_address=CONTRACT,
+                    transfer_from=OWNER,
+                    transfer_to=Web3.toChecksumAddress("0x" + "01" * 20),
+                    tokenId=8,
+                    transfer_tx="0x" + "00" * 31 + "02",
+                    is_mint=False,
+                ),
+            ],
+        )
+
+    def test_same_as_web3_codec(self):
+        w3 = Web3()
+        codec_transfers = [decode_nft_transfer_data(w3, log) for log in self.logs]
+        decoded = [transfer for transfer in codec_transfers if transfer is not None]
+        transfers = decode_nft_transfers(self.logs)
+        self.assertEqual(len(decoded), len(transfers))
+        for codec_transfer, transfer in zip(decoded, transfers):
+            self.assertEqual(codec_transfer.transfer_from, transfer.transfer_from)
+            self.assertEqual(codec_transfer.transfer_to, transfer.transfer_to)
+            self.assertEqual(codec_transfer.tokenId, transfer.tokenId)
+            self.assertEqual(codec_transfer.transfer_tx.hex(), transfer.transfer_tx)
+
+
+class ERC721NodeHandler(BaseHTTPRequestHandler):
+    """
+    Answers eth_call with contract address as name and symbol, reverts calls to
+    contracts with address starting with 0x00 and rate limits calls to contracts
+    with address starting with 0x0f.
+    """
+
+    requests_count = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        ERC721NodeHandler.requests_count += 1
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        response = []
+        for call in request:
+            address = call["params"][0]["to"]
+            if address.startswith("0x00"):
+                error = {"code": 3, "message": "execution reverted"}
+                response.append({"jsonrpc": "2.0", "id": call["id"], "error": error})
+                continue
+            if address.startswith("0x0f"):
+                error = {"code": -32005, "message": "rate limit exceeded"}
+                response.append({"jsonrpc": "2.0", "id": call["id"], "error": error})
+                continue
+            value = (
+                address if call["params"][0]["data"] == ERC721_NAME_SELECTOR else "S"
+            )
+            result = Web3().codec.encode_abi(["string"], [value])
+            response.append(
+                {"jsonrpc": "2.0", "id": call["id"], "result": HexBytes(result).hex()}
+            )
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestResolveERC721ContractsInfo(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), ERC721NodeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.w3 = Web3(
+            Web3.HTTPProvider(f"http://127.0.0.1:{self.server.server_address[1]}")
+        )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_resolve_and_cache(self):
+        addresses = [
+            Web3.toChecksumAddress("0x" + f"{i:02x}" * 20) for i in range(1, 6)
+        ]
+        failed_address = Web3.toChecksumAddress("0x00" + "ee" * 19)
+
+        ERC721NodeHandler.requests_count = 0
+        contracts = resolve_erc721_contracts_info(
+            self.w3, addresses + [failed_address], batch_size=2
+        )
+        self.assertEqual(ERC721NodeHandler.requests_count, 3)
+        self.assertEqual(
+            contracts[addresses[0]],
+            NFTContract(address=addresses[0], name=addresses[0], symbol="S"),
+        )
+        self.assertEqual(
+            contracts[failed_address],
+            NFTContract(address=failed_address, name=None, symbol=None),
+        )
+
+        contracts = resolve_erc721_contracts_info(self.w3, addresses + [failed_address])
+        self.assertEqual(ERC721NodeHandler.requests_count, 3)
+        self.assertEqual(len(contracts), 6)
+
+    def test_rate_limited_not_cached(self):
+        address = Web3.toChecksumAddress("0x0f" + "dd" * 19)
+
+        ERC721NodeHandler.requests_count = 0
+        contracts = resolve_erc721_contracts_info(self.w3, [address])
+        self.assertEqual(
+            contracts[address], NFTContract(address=address, name=None, symbol=None)
+        )
+
+        resolve_erc721_contracts_info(self.w3, [address])
+        self.assertEqual(ERC721NodeHandler.requests_count, 2)
+
+
+class TestMergeSummaryPartials(unittest.TestCase):
+    def test_merge(self):
+        first = NFTSummaryPartial(
+            start_block=10,
+            end_block=19,
+            first_block=10,
+            last_block=19,
+            first_timestamp=100,
+            last_timestamp=190,
+            num_blocks=10,
+            num_transactions=5,
+            total_value=7,
+            num_transfers=2,
+            transfer_value=3,
+            purchasers={("0xA", "1"): "0x1", ("0xA", "2"): "0x2"},
+            minters={("0xA", "1"): "0x3"},
+        )
+        empty = NFTSummaryPartial(start_block=20, end_block=29)
+        last = NFTSummaryPartial(
+            start_block=30,
+            end_block=35,
+            first_block=31,
+            last_block=35,
+            first_timestamp=310,
+            last_timestamp=350,
+            num_blocks=5,
+            num_transactions=1,
+            total_value=1,
+            num_mints=1,
+            minters={("0xB", "1"): "0x3"},
+            purchasers={("0xA", "1"): "0x2"},
+        )
+
+        merged = merge_summary_partials([last, empty, first])
+        self.assertEqual((merged.start_block, merged.end_block), (10, 35))
+        self.assertEqual((merged.first_block, merged.last_block), (10, 35))
+        self.assertEqual((merged.first_timestamp, merged.last_timestamp), (100, 350))
+        self.assertEqual(merged.num_blocks, 15)
+        self.assertEqual(merged.num_transactions, 6)
+        self.assertEqual(merged.total_value, 8)
+        self.assertEqual(merged.transfer_value, 3)
+        self.assertEqual((merged.num_transfers, merged.num_mints), (2, 1))
+        # Token 1 of 0xA changed owner in last range
+        self.assertSetEqual(set(merged.purchasers.values()), {"0x2"})
+        self.assertSetEqual(set(merged.minters.values()), {"0x3"})
+
+
+BlocksRow = namedtuple(
+    "BlocksRow",
+    [
+        "segment",
+        "first_block",
+        "last_block",
+        "num_blocks",
+        "first_timestamp",
+        "last_timestamp",
+        "num_transactions",
+        "total_value",
+    ],
+)
+
+
+class SummarySession:
+    """
+    Answers summary queries with one transaction in each block, blocks after
+    last_block are not crawled yet.
+    """
+
+    def __init__(self, last_block: int) -> None:
+        self.last_block = last_block
+        self.queried_ranges: List[Tuple[int, int]] = []
+
+    def execute(self, query, params):
+        if query is not SUMMARY_BLOCKS_QUERY:
+            return []
+        start_block = params["start_block"]
+        end_block = min(params["end_block"], self.last_block)
+        self.queried_ranges.append((params["start_block"], params["end_block"]))
+        segment_size = params["segment_size"]
+        rows = []
+        for segment in range(
+            start_block // segment_size, end_block // segment_size + 1
+        ):
+            first_block = max(start_block, segment * segment_size)
+            last_block = min(end_block, (segment + 1) * segment_size - 1)
+            num_blocks = last_block - first_block + 1
+            rows.append(
+                BlocksRow(
+                    segment,
+                    first_block,
+                    last_block,
+                    num_blocks,
+                    first_block * 10,
+                    last_block * 10,
+                    num_blocks,
+                    None,
+                )
+            )
+        return rows
+
+
+class TestSummaryPartialsStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.tmp_dir.name, "partials.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_reuse_complete_segments(self):
+        store = NFTSummaryPartialsStore(self.store_path)
+        db_session = SummarySession(last_block=134)
+        summary = block_bounded_summary(db_session, 105, 134, store)
+        self.assertEqual(summary[SUMMARY_KEY_NUM_BLOCKS], 30)
+        store.close()
+
+        # Only complete segments 110-119 and 120-129 are reused after restart
+        store = NFTSummaryPartialsStore(self.store_path)
+        db_session = SummarySession(last_block=200)
+        summary = block_bounded_summary(db_session, 100, 149, store)
+        self.assertListEqual(db_session.queried_ranges, [(100, 109), (130, 149)])
+        self.assertEqual(summary[SUMMARY_KEY_NUM_BLOCKS], 50)
+        self.assertEqual(summary[SUMMARY_KEY_NUM_TRANSACTIONS], "50")
+        self.assertDictEqual(store.metrics, {"hits": 2, "misses": 3})
+
+        self.assertEqual(store.prune(130), 3)
+        store.close()
+
+    def test_round_trip(self):
+        partial = NFTSummaryPartial(
+            start_block=10,
+            end_block=19,
+            first_block=10,
+            last_block=19,
+            num_blocks=10,
+            total_value=10**30,
+            purchasers={("0xA", "1"): "0x1"},
+            minters={("0xA", "2"): "0x3"},
+        )
+        store = NFTSummaryPartialsStore(self.store_path)
+        self.assertEqual(store.save(10, [partial]), 1)
+        self.assertDictEqual(store.get_many(10, [(10, 19)]), {(10, 19): partial})
+        self.assertDictEqual(store.get_many(20, [(20, 39)]), {})
+        store.close()
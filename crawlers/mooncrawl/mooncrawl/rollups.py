@@ -0,0 +1,340 @@
+"""
+Labels rollups, per address counts of labels in minute, hour and day buckets and
+distinct values of labels arguments.
+
+Crawler updates rollups in the same transaction as it inserts labels, labels written
+before that are added to rollups by backfill_rollups. Dashboards statistics read
+rollups of addresses labels which were backfilled instead of scanning labels tables.
+
+Only crawler labels have rollups, as only crawler keeps them up to date. Minute rollups
+are kept for MINUTE_ROLLUPS_RETENTION seconds, older ones are deleted by
+prune_minute_rollups.
+"""
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from moonstreamdb.models import LabelArgumentRollup, LabelCountRollup, LabelRollupState
+from psycopg2.extras import execute_values  # type: ignore
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from .blockchain import get_label_model
+from .data import AvailableBlockchainType
+from .settings import CRAWLER_LABEL
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 60 * 60
+DAY = 24 * 60 * 60
+ROLLUP_TIMESTEPS = [MINUTE, HOUR, DAY]
+
+# Minute rollups are read for start of dashboards windows, the widest window read
+# with minute precision is month (27 days)
+MINUTE_ROLLUPS_RETENTION = 28 * DAY
+
+# Arguments with distinct values kept in rollups by (label type, label name)
+ROLLUP_ARGUMENTS: Dict[Tuple[str, str], List[str]] = {("event", "Transfer"): ["to"]}
+
+CountKey = Tuple[str, str, str, int, int, str, str]
+ArgumentKey = Tuple[str, str, str, str, str, str, str]
+
+
+def minute_rollups_start(now: Optional[float] = None) -> int:
+    """
+    Returns timestamp of the earliest minute bucket kept in rollups.
+    """
+    if now is None:
+        now = time.time()
+    return int(now) - MINUTE_ROLLUPS_RETENTION
+
+
+def aggregate_rollups(
+    blockchain_type: AvailableBlockchainType,
+    label_rows: Iterable[Dict[str, Any]],
+    minutes_start: Optional[int] = None,
+) -> Tuple[Dict[CountKey, int], Set[ArgumentKey]]:
+    """
+    Returns labels counts by label_count_rollups primary key and label_argument_rollups
+    rows of label rows. Minute buckets before minutes_start are skipped.
+    """
+    blockchain = blockchain_type.value
+    counts: Dict[CountKey, int] = {}
+    arguments: Set[ArgumentKey] = set()
+    for row in label_rows:
+        label_data = row["label_data"] or {}
+        label_type = label_data.get("type")
+        label_name = label_data.get("name")
+        block_timestamp = row["block_timestamp"]
+        if (
+            row["address"] is None
+            or label_type is None
+            or label_name is None
+            or block_timestamp is None
+        ):
+            continue
+
+        for timestep in ROLLUP_TIMESTEPS:
+            bucket = block_timestamp - block_timestamp % timestep
+            if (
+                timestep == MINUTE
+                and minutes_start is not None
+                and bucket < minutes_start
+            ):
+                continue
+            count_key = (
+                blockchain,
+                row["address"],
+                row["label"],
+                timestep,
+                bucket,
+                label_type,
+                label_name,
+            )
+            counts[count_key] = counts.get(count_key, 0) + 1
+
+        for argument in ROLLUP_ARGUMENTS.get((label_type, label_name), []):
+            value = (label_data.get("args") or {}).get(argument)
+            if value is not None:
+                arguments.add(
+                    (
+                        blockchain,
+                        row["address"],
+                        row["label"],
+                        label_type,
+                        label_name,
+                        argument,
+                        str(value),
+                    )
+                )
+    return counts, arguments
+
+
+def update_rollups(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    label_rows: Iterable[Dict[str, Any]],
+) -> None:
+    """
+    Adds new label rows to rollups. Commit is left to the caller, so rollups are
+    committed together with labels.
+    """
+    counts, arguments = aggregate_rollups(
+        blockchain_type, label_rows, minute_rollups_start()
+    )
+    cursor = db_session.connection().connection.cursor()
+    # Rows are upserted in primary key order, so concurrent crawlers lock them
+    # in the same order and do not deadlock
+    if counts:
+        execute_values(
+            cursor,
+            f"""INSERT INTO {LabelCountRollup.__tablename__}
+                (blockchain, address, label, timestep, bucket, label_type, label_name, count)
+                VALUES %s
+                ON CONFLICT ON CONSTRAINT pk_{LabelCountRollup.__tablename__}
+                DO UPDATE SET count = {LabelCountRollup.__tablename__}.count + EXCLUDED.count""",
+            [key + (count,) for key, count in sorted(counts.items())],
+            page_size=1000,
+        )
+    if arguments:
+        execute_values(
+            cursor,
+            f"""INSERT INTO {LabelArgumentRollup.__tablename__}
+                (blockchain, address, label, label_type, label_name, argument, value)
+                VALUES %s ON CONFLICT DO NOTHING""",
+            sorted(arguments),
+            page_size=1000,
+        )
+
+
+def backfill_rollups(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    address: str,
+    label: str,
+) -> None:
+    """
+    Rebuilds rollups of address labels from labels table and marks them as ready to
+    be read by dashboards.
+
+    Labels table is locked against writes until transaction is committed by the caller,
+    so labels inserted by crawler are not lost or counted twice.
+
+    Raises ValueError for labels other than crawler labels, their rollups would not be
+    kept up to date.
+    """
+    if label != CRAWLER_LABEL:
+        raise ValueError(
+            f"Rollups are kept up to date only for {CRAWLER_LABEL} labels, not {label}"
+        )
+
+    label_model = get_label_model(blockchain_type)
+    labels_table = label_model.__tablename__
+    params = {
+        "blockchain": blockchain_type.value,
+        "address": address,
+        "label": label,
+    }
+
+    db_session.execute(text(f"LOCK TABLE {labels_table} IN SHARE MODE"))
+
+    db_session.query(LabelCountRollup).filter(
+        LabelCountRollup.blockchain == blockchain_type.value,
+        LabelCountRollup.address == address,
+        LabelCountRollup.label == label,
+    ).delete(synchronize_session=False)
+    db_session.query(LabelArgumentRollup).filter(
+        LabelArgumentRollup.blockchain == blockchain_type.value,
+        LabelArgumentRollup.address == address,
+        LabelArgumentRollup.label == label,
+    ).delete(synchronize_session=False)
+
+    timesteps = ", ".join(f"({timestep})" for timestep in ROLLUP_TIMESTEPS)
+    db_session.execute(
+        text(
+            f"""INSERT INTO {LabelCountRollup.__tablename__}
+                (blockchain, address, label, timestep, bucket, label_type, label_name, count)
+            SELECT
+                :blockchain,
+                address,
+                label,
+                timesteps.timestep,
+                block_timestamp - block_timestamp % timesteps.timestep,
+                label_data->>'type',
+                label_data->>'name',
+                count(*)
+            FROM {labels_table}
+            CROSS JOIN (VALUES {timesteps}) AS timesteps (timestep)
+            WHERE address = :address
+                AND label = :label
+                AND block_timestamp IS NOT NULL
+                AND label_data->>'type' IS NOT NULL
+                AND label_data->>'name' IS NOT NULL
+                AND (
+                    timesteps.timestep <> {MINUTE}
+                    OR block_timestamp - block_timestamp % {MINUTE} >= :minutes_start
+                )
+            GROUP BY 1, 2, 3, 4, 5, 6, 7"""
+        ),
+        {**params, "minutes_start": minute_rollups_start()},
+    )
+
+    for (label_type, label_name), label_arguments in ROLLUP_ARGUMENTS.items():
+        for argument in label_arguments:
+            db_session.execute(
+                text(
+                    f"""INSERT INTO {LabelArgumentRollup.__tablename__}
+                        (blockchain, address, label, label_type, label_name, argument, value)
+                    SELECT DISTINCT
+                        :blockchain,
+                        address,
+                        label,
+                        :label_type,
+                        :label_name,
+                        :argument,
+                        label_data->'args'->>:argument
+                    FROM {labels_table}
+                    WHERE address = :address
+                        AND label = :label
+                        AND label_data->>'type' = :label_type
+                        AND label_data->>'name' = :label_name
+                        AND block_timestamp IS NOT NULL
+                        AND label_data->'args'->>:argument IS NOT NULL"""
+                ),
+                {
+                    **params,
+                    "label_type": label_type,
+                    "label_name": label_name,
+                    "argument": argument,
+                },
+            )
+
+    state_statement = insert(LabelRollupState).values(**params)
+    db_session.execute(
+        state_statement.on_conflict_do_update(
+            index_elements=[
+                LabelRollupState.blockchain,
+                LabelRollupState.address,
+                LabelRollupState.label,
+            ],
+            set_={"backfilled_at": text("TIMEZONE('utc', statement_timestamp())")},
+        )
+    )
+
+
+def prune_minute_rollups(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    before: Optional[int] = None,
+) -> int:
+    """
+    Deletes minute rollups of backfilled addresses labels with buckets before given
+    timestamp, by default older than MINUTE_ROLLUPS_RETENTION. Commit is left to the
+    caller, returns number of deleted rollups.
+    """
+    if before is None:
+        before = minute_rollups_start()
+
+    states = (
+        db_session.query(LabelRollupState.address, LabelRollupState.label)
+        .filter(LabelRollupState.blockchain == blockchain_type.value)
+        .all()
+    )
+    deleted = 0
+    # Deleted by address and label to use primary key index of rollups
+    for address, label in states:
+        deleted += (
+            db_session.query(LabelCountRollup)
+            .filter(LabelCountRollup.blockchain == blockchain_type.value)
+            .filter(LabelCountRollup.address == address)
+            .filter(LabelCountRollup.label == label)
+            .filter(LabelCountRollup.timestep == MINUTE)
+            .filter(LabelCountRollup.bucket < before)
+            .delete(synchronize_session=False)
+        )
+    return deleted
+
+
+def rollups_ready(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    address: str,
+    label: str,
+) -> bool:
+    """
+    Returns True if rollups of address labels were backfilled.
+    """
+    state: Optional[Any] = (
+        db_session.query(LabelRollupState.backfilled_at)
+        .filter(LabelRollupState.blockchain == blockchain_type.value)
+        .filter(LabelRollupState.address == address)
+        .filter(LabelRollupState.label == label)
+        .one_or_none()
+    )
+    return state is not None
+
+
+def count_argument_values(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    address: str,
+    label: str,
+    label_type: str,
+    label_name: str,
+    argument: str,
+) -> int:
+    """
+    Returns number of distinct values of argument of address labels from rollups.
+    """
+    return (
+        db_session.query(LabelArgumentRollup.value)
+        .filter(LabelArgumentRollup.blockchain == blockchain_type.value)
+        .filter(LabelArgumentRollup.address == address)
+        .filter(LabelArgumentRollup.label == label)
+        .filter(LabelArgumentRollup.label_type == label_type)
+        .filter(LabelArgumentRollup.label_name == label_name)
+        .filter(LabelArgumentRollup.argument == argument)
+        .count()
+    )
@@ -52,6 +52,43 @@ except:
         f"Could not parse MOONSTREAM_CRAWL_WORKERS as int: {MOONSTREAM_CRAWL_WORKERS_RAW}"
     )
 
+# Number of contiguous block shards per block crawler worker process,
+# more shards let workers which finished early take work of slower ones
+MOONSTREAM_CRAWL_SHARDS_PER_WORKER = 4
+MOONSTREAM_CRAWL_SHARDS_PER_WORKER_RAW = os.environ.get(
+    "MOONSTREAM_CRAWL_SHARDS_PER_WORKER"
+)
+try:
+    if MOONSTREAM_CRAWL_SHARDS_PER_WORKER_RAW is not None:
+        MOONSTREAM_CRAWL_SHARDS_PER_WORKER = int(MOONSTREAM_CRAWL_SHARDS_PER_WORKER_RAW)
+except:
+    raise Exception(
+        f"Could not parse MOONSTREAM_CRAWL_SHARDS_PER_WORKER as int: {MOONSTREAM_CRAWL_SHARDS_PER_WORKER_RAW}"
+    )
+
+# Number of blocks to fetch in one JSON-RPC batch request, 1 means fetch blocks one by one
+MOONSTREAM_CRAWL_BATCH_SIZE = 1
+MOONSTREAM_CRAWL_BATCH_SIZE_RAW = os.environ.get("MOONSTREAM_CRAWL_BATCH_SIZE")
+try:
+    if MOONSTREAM_CRAWL_BATCH_SIZE_RAW is not None:
+        MOONSTREAM_CRAWL_BATCH_SIZE = int(MOONSTREAM_CRAWL_BATCH_SIZE_RAW)
+except:
+    raise Exception(
+        f"Could not parse MOONSTREAM_CRAWL_BATCH_SIZE as int: {MOONSTREAM_CRAWL_BATCH_SIZE_RAW}"
+    )
+
+MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT = 4
+MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT_RAW = os.environ.get(
+    "MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT"
+)
+try:
+    if MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT_RAW is not None:
+        MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT = int(MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT_RAW)
+except:
+    raise Exception(
+        f"Could not parse MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT as int: {MOONSTREAM_CRAWL_BATCHES_IN_FLIGHT_RAW}"
+    )
+
 # Etherscan
 MOONSTREAM_ETHERSCAN_TOKEN = os.environ.get("MOONSTREAM_ETHERSCAN_TOKEN")
 
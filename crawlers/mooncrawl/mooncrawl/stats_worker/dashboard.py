@@ -5,33 +5,49 @@ import argparse
 import hashlib
 import json
 import logging
+import math
+import os
 import time
-from datetime import datetime, timedelta
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Any, Callable, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Tuple, cast
 from uuid import UUID
 
 import boto3  # type: ignore
 from bugout.data import BugoutResource, BugoutResources
-from moonstreamdb.db import yield_db_session_ctx
-from sqlalchemy import Column, and_, distinct, func, text
+from moonstreamdb.db import (
+    RO_SessionLocal,
+    dispose_engines_after_fork,
+    yield_db_read_only_session_ctx,
+    yield_db_session_ctx,
+)
+from moonstreamdb.models import LabelCountRollup
+from sqlalchemy import Column, and_, case, distinct, func, or_, text
 from sqlalchemy.orm import Query, Session
 from sqlalchemy.sql.operators import in_op
 from web3 import Web3
 
-from ..blockchain import (
-    connect,
-    get_label_model,
-    get_transaction_model,
-)
+from ..blockchain import connect, get_label_model, get_transaction_model
 from ..data import AvailableBlockchainType
 from ..reporter import reporter
+from ..rollups import (
+    HOUR,
+    MINUTE,
+    backfill_rollups,
+    count_argument_values,
+    minute_rollups_start,
+    prune_minute_rollups,
+    rollups_ready,
+)
 from ..settings import (
     CRAWLER_LABEL,
     MOONSTREAM_ADMIN_ACCESS_TOKEN,
     MOONSTREAM_S3_SMARTCONTRACTS_ABI_PREFIX,
 )
 from ..settings import bugout_client as bc
+from .external_calls import ExternalCallsExecutor, prepare_external_calls
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -59,11 +75,12 @@ class TimeScale(Enum):
     day = "day"
 
 
-timescales_params: Dict[str, Dict[str, str]] = {
-    "year": {"timestep": "1 day", "timeformat": "YYYY-MM-DD"},
-    "month": {"timestep": "1 hours", "timeformat": "YYYY-MM-DD HH24"},
-    "week": {"timestep": "1 hours", "timeformat": "YYYY-MM-DD HH24"},
-    "day": {"timestep": "1 minutes", "timeformat": "YYYY-MM-DD HH24 MI"},
+# Timestep in seconds and format of time series points, dates are in UTC
+timescales_params: Dict[str, Dict[str, Any]] = {
+    "year": {"timestep": 24 * 60 * 60, "timeformat": "%Y-%m-%d"},
+    "month": {"timestep": 60 * 60, "timeformat": "%Y-%m-%d %H"},
+    "week": {"timestep": 60 * 60, "timeformat": "%Y-%m-%d %H"},
+    "day": {"timestep": 60, "timeformat": "%Y-%m-%d %H %M"},
 }
 
 timescales_delta: Dict[str, Dict[str, timedelta]] = {
@@ -103,158 +120,282 @@ def push_statistics(
     logger.info(f"Statistics push to bucket: s3://{bucket}/{result_key}")
 
 
-def generate_data(
+# {timescale: {(label type, label name): {date: count}}}
+TimeseriesCounts = Dict[str, Dict[Tuple[str, str], Dict[str, int]]]
+
+
+def _add_timeseries_count(
+    counts: TimeseriesCounts,
+    timescale: str,
+    metric_type: str,
+    label: str,
+    bucket: int,
+    count: int,
+) -> None:
+    label_points = counts[timescale].setdefault((metric_type, label), {})
+    date = datetime.utcfromtimestamp(bucket).strftime(
+        timescales_params[timescale]["timeformat"]
+    )
+    label_points[date] = label_points.get(date, 0) + count
+
+
+def _labels_timeseries_counts(
     db_session: Session,
     blockchain_type: AvailableBlockchainType,
     address: str,
-    timescale: str,
-    functions: List[str],
-    start: Any,
-    metric_type: str,
     crawler_label: str,
-):
+    metrics: Dict[str, List[str]],
+    starts: Dict[str, datetime],
+    end: datetime,
+) -> TimeseriesCounts:
+    """
+    Counts labels of timescales windows with single query to labels table.
 
+    Labels are counted in buckets of the finest timestep of timescales windows they
+    fall in, then buckets are rolled up to each timescale in memory.
+    """
     label_model = get_label_model(blockchain_type)
 
-    # create empty time series
-
-    time_step = timescales_params[timescale]["timestep"]
-
-    time_format = timescales_params[timescale]["timeformat"]
-
-    # if end is None:
-    end = datetime.utcnow()
-
-    time_series_subquery = db_session.query(
-        func.generate_series(
-            start,
-            end,
-            time_step,
-        ).label("timeseries_points")
-    )
-
-    time_series_subquery = time_series_subquery.subquery(name="time_series_subquery")
-
-    # get distinct tags labels in that range
-
-    label_requested = (
-        db_session.query(label_model.label_data["name"].astext.label("label"))
-        .filter(label_model.address == address)
-        .filter(label_model.label == crawler_label)
-        .filter(
-            and_(
-                label_model.label_data["type"].astext == metric_type,
-                in_op(label_model.label_data["name"].astext, functions),
-            )
+    metrics_filters = [
+        and_(
+            label_model.label_data["type"].astext == metric_type,
+            in_op(label_model.label_data["name"].astext, names),
         )
-        .distinct()
-    )
-
-    if start is not None:
-        label_requested = label_requested.filter(
-            func.to_timestamp(label_model.block_timestamp) > start
+        for metric_type, names in metrics.items()
+        if names
+    ]
+
+    # Timescales windows are nested, ordered from widest to narrowest
+    ordered_timescales = sorted(starts, key=lambda timescale: starts[timescale])
+    # Compare raw block_timestamp with integers to use index on it
+    start_timestamps = [
+        math.floor(starts[timescale].replace(tzinfo=timezone.utc).timestamp())
+        for timescale in ordered_timescales
+    ]
+    end_timestamp = math.ceil(end.replace(tzinfo=timezone.utc).timestamp())
+
+    # Label in depth windows is in first depth windows of ordered_timescales, so it is
+    # counted in bucket of the finest timestep of them
+    depth_cases = []
+    bucket_cases = []
+    for depth in range(len(ordered_timescales), 0, -1):
+        timestep = min(
+            timescales_params[timescale]["timestep"]
+            for timescale in ordered_timescales[:depth]
         )
-    if end is not None:
-        label_requested = label_requested.filter(
-            func.to_timestamp(label_model.block_timestamp) < end
+        in_window = label_model.block_timestamp > start_timestamps[depth - 1]
+        depth_cases.append((in_window, depth))
+        bucket_cases.append(
+            (
+                in_window,
+                label_model.block_timestamp - label_model.block_timestamp % timestep,
+            )
         )
 
-    label_requested = label_requested.subquery(name="label_requested")
-
-    # empty timeseries with tags
-    empty_time_series_subquery = db_session.query(
-        func.to_char(time_series_subquery.c.timeseries_points, time_format).label(
-            "timeseries_points"
-        ),
-        label_requested.c.label.label("label"),
-    )
-
-    empty_time_series_subquery = empty_time_series_subquery.subquery(
-        name="empty_time_series_subquery"
-    )
-
-    # tags count
     label_counts = (
         db_session.query(
-            func.to_char(
-                func.to_timestamp(label_model.block_timestamp), time_format
-            ).label("timeseries_points"),
+            label_model.label_data["type"].astext.label("metric_type"),
+            label_model.label_data["name"].astext.label("label_name"),
+            case(*bucket_cases).label("bucket"),
+            case(*depth_cases, else_=0).label("depth"),
             func.count(label_model.id).label("count"),
-            label_model.label_data["name"].astext.label("label"),
         )
         .filter(label_model.address == address)
         .filter(label_model.label == crawler_label)
-        .filter(
-            and_(
-                label_model.label_data["type"].astext == metric_type,
-                in_op(label_model.label_data["name"].astext, functions),
-            )
+        .filter(or_(*metrics_filters))
+        .filter(label_model.block_timestamp > start_timestamps[0])
+        .filter(label_model.block_timestamp < end_timestamp)
+        .group_by(
+            text("metric_type"), text("label_name"), text("bucket"), text("depth")
         )
     )
 
-    if start is not None:
-        label_counts = label_counts.filter(
-            func.to_timestamp(label_model.block_timestamp) > start
-        )
-    if end is not None:
-        label_counts = label_counts.filter(
-            func.to_timestamp(label_model.block_timestamp) < end
-        )
+    counts: TimeseriesCounts = {timescale: {} for timescale in starts}
+    for metric_type, label, bucket, depth, count in label_counts:
+        for timescale in ordered_timescales[:depth]:
+            _add_timeseries_count(counts, timescale, metric_type, label, bucket, count)
+    return counts
 
-    # split grafics
 
-    label_counts_subquery = (
-        label_counts.group_by(
-            text("timeseries_points"), label_model.label_data["name"].astext
+def _rollups_timeseries_counts(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    address: str,
+    crawler_label: str,
+    metrics: Dict[str, List[str]],
+    starts: Dict[str, datetime],
+    end: datetime,
+) -> TimeseriesCounts:
+    """
+    Counts labels of timescales windows with single query to labels rollups.
+
+    Each window is read from rollups of its timestep, except first bucket which is
+    only partially in window and is read from minute rollups, so window start is
+    precise to minute. Windows starting before minute rollups retention start are
+    precise to hour.
+    """
+    metrics_filters = [
+        and_(
+            LabelCountRollup.label_type == metric_type,
+            LabelCountRollup.label_name.in_(names),
         )
-        .order_by(text("timeseries_points desc"))
-        .subquery(name="label_counts")
-    )
+        for metric_type, names in metrics.items()
+        if names
+    ]
+
+    end_timestamp = math.ceil(end.replace(tzinfo=timezone.utc).timestamp())
+    minutes_start = minute_rollups_start()
+    # (timestep, first bucket, last bucket) ranges of rollups of each timescale
+    timescales_ranges: Dict[str, List[Tuple[int, int, int]]] = {}
+    for timescale, start in starts.items():
+        timestep = timescales_params[timescale]["timestep"]
+        start_timestamp = math.floor(start.replace(tzinfo=timezone.utc).timestamp())
+        first_full_bucket = start_timestamp - start_timestamp % timestep + timestep
+        start_timestep = MINUTE
+        if start_timestamp - start_timestamp % MINUTE < minutes_start:
+            start_timestep = min(HOUR, timestep)
+        timescales_ranges[timescale] = [
+            (
+                start_timestep,
+                start_timestamp - start_timestamp % start_timestep,
+                first_full_bucket,
+            ),
+            (timestep, first_full_bucket, end_timestamp),
+        ]
+    ranges = {
+        timestep_range
+        for timestep_ranges in timescales_ranges.values()
+        for timestep_range in timestep_ranges
+    }
 
-    # Join empty tags_time_series with tags count eg apply tags counts to time series.
-    labels_time_series = (
+    label_counts = (
         db_session.query(
-            empty_time_series_subquery.c.timeseries_points.label("timeseries_points"),
-            empty_time_series_subquery.c.label.label("label"),
-            func.coalesce(label_counts_subquery.c.count.label("count"), 0),
+            LabelCountRollup.timestep,
+            LabelCountRollup.bucket,
+            LabelCountRollup.label_type,
+            LabelCountRollup.label_name,
+            LabelCountRollup.count,
         )
-        .join(
-            label_counts_subquery,
-            and_(
-                empty_time_series_subquery.c.label == label_counts_subquery.c.label,
-                empty_time_series_subquery.c.timeseries_points
-                == label_counts_subquery.c.timeseries_points,
-            ),
-            isouter=True,
+        .filter(LabelCountRollup.blockchain == blockchain_type.value)
+        .filter(LabelCountRollup.address == address)
+        .filter(LabelCountRollup.label == crawler_label)
+        .filter(or_(*metrics_filters))
+        .filter(
+            or_(
+                *[
+                    and_(
+                        LabelCountRollup.timestep == timestep,
+                        LabelCountRollup.bucket >= first_bucket,
+                        LabelCountRollup.bucket < last_bucket,
+                    )
+                    for timestep, first_bucket, last_bucket in ranges
+                ]
+            )
         )
-        .order_by(text("timeseries_points DESC"))
     )
 
-    response_labels: Dict[Any, Any] = {}
+    counts: TimeseriesCounts = {timescale: {} for timescale in starts}
+    for timestep, bucket, metric_type, label, count in label_counts:
+        for timescale, timestep_ranges in timescales_ranges.items():
+            for range_timestep, first_bucket, last_bucket in timestep_ranges:
+                if range_timestep == timestep and first_bucket <= bucket < last_bucket:
+                    _add_timeseries_count(
+                        counts, timescale, metric_type, label, bucket, count
+                    )
+                    break
+    return counts
 
-    for created_date, label, count in labels_time_series:
 
-        if not response_labels.get(label):
-            response_labels[label] = []
+def generate_timeseries(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    address: str,
+    crawler_label: str,
+    metrics: Dict[str, List[str]],
+    timescales: List[str],
+    end: Optional[datetime] = None,
+) -> Dict[str, Dict[str, Dict[str, List[Dict[str, Any]]]]]:
+    """
+    Generates time series of labels counts for all timescales with single query.
 
-        response_labels[label].append({"date": created_date, "count": count})
+    metrics maps label type (tx_call, event) to requested labels names. Returns
+    {timescale: {label type: {label name: [{"date": ..., "count": ...}, ...]}}}
+    with points in descending order.
+
+    Counts are read from labels rollups if they were backfilled for address labels,
+    otherwise from labels table.
+    """
+    if end is None:
+        end = datetime.utcnow()
 
-    return response_labels
+    response: Dict[str, Dict[str, Dict[str, List[Dict[str, Any]]]]] = {
+        timescale: {metric_type: {} for metric_type in metrics}
+        for timescale in timescales
+    }
+    if not any(metrics.values()) or not timescales:
+        return response
 
+    starts = {
+        timescale: end - timescales_delta[timescale]["timedelta"]
+        for timescale in timescales
+    }
 
-def cast_to_python_type(evm_type: str) -> Callable:
-    if evm_type.startswith(("uint", "int")):
-        return int
-    elif evm_type.startswith("bytes"):
-        return bytes
-    elif evm_type == "string":
-        return str
-    elif evm_type == "address":
-        return Web3.toChecksumAddress
-    elif evm_type == "bool":
-        return bool
+    if rollups_ready(db_session, blockchain_type, address, crawler_label):
+        counts = _rollups_timeseries_counts(
+            db_session, blockchain_type, address, crawler_label, metrics, starts, end
+        )
     else:
-        raise ValueError(f"Cannot convert to python type {evm_type}")
+        counts = _labels_timeseries_counts(
+            db_session, blockchain_type, address, crawler_label, metrics, starts, end
+        )
+
+    for timescale in timescales:
+        timestep = timedelta(seconds=timescales_params[timescale]["timestep"])
+        time_format = timescales_params[timescale]["timeformat"]
+        # Empty time series, points are unique dates of window
+        dates: Dict[str, None] = {}
+        point = starts[timescale]
+        while point <= end:
+            dates[point.strftime(time_format)] = None
+            point += timestep
+        timeseries_dates = sorted(dates, reverse=True)
+
+        for (metric_type, label), label_points in counts[timescale].items():
+            response[timescale][metric_type][label] = [
+                {"date": date, "count": label_points.get(date, 0)}
+                for date in timeseries_dates
+            ]
+
+    return response
+
+
+def generate_dashboard_timeseries(
+    db_session: Session,
+    blockchain_type: AvailableBlockchainType,
+    address: str,
+    crawler_label: str,
+    methods: List[str],
+    events: List[str],
+    timescales: List[str],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns methods calls and events time series of dashboard for each of timescales.
+    """
+    timeseries = generate_timeseries(
+        db_session=db_session,
+        blockchain_type=blockchain_type,
+        address=address,
+        crawler_label=crawler_label,
+        metrics={"tx_call": methods, "event": events},
+        timescales=timescales,
+    )
+    return {
+        timescale: {
+            "methods": timescale_series["tx_call"],
+            "events": timescale_series["event"],
+        }
+        for timescale, timescale_series in timeseries.items()
+    }
 
 
 def get_unique_address(
@@ -263,6 +404,17 @@ def get_unique_address(
     address: str,
     crawler_label: str,
 ):
+    if rollups_ready(db_session, blockchain_type, address, crawler_label):
+        return count_argument_values(
+            db_session,
+            blockchain_type,
+            address,
+            crawler_label,
+            label_type="event",
+            label_name="Transfer",
+            argument="to",
+        )
+
     label_model = get_label_model(blockchain_type)
 
     return (
@@ -340,67 +492,17 @@ def process_external(
     abi_external_calls: List[Dict[str, Any]], blockchain: AvailableBlockchainType
 ):
     """
-    Request all required external data
-    TODO:(Andrey) Check posibility do it via AsyncHttpProvider(not supported for some of middlewares).
+    Request all required external data with single batch of calls.
     """
+    external_calls = prepare_external_calls(abi_external_calls)
+    if not external_calls:
+        return []
 
-    extention_data = []
-
-    external_calls = []
-
-    for external_call in abi_external_calls:
-        try:
-            func_input_abi = []
-            input_args = []
-            for func_input in external_call["inputs"]:
-                func_input_abi.append(
-                    {"name": func_input["name"], "type": func_input["type"]}
-                )
-                input_args.append(
-                    cast_to_python_type(func_input["type"])(func_input["value"])
-                )
-
-            func_abi = [
-                {
-                    "name": external_call["name"],
-                    "inputs": func_input_abi,
-                    "outputs": external_call["outputs"],
-                    "type": "function",
-                    "stateMutability": "view",
-                }
-            ]
-
-            external_calls.append(
-                {
-                    "display_name": external_call["display_name"],
-                    "address": Web3.toChecksumAddress(external_call["address"]),
-                    "name": external_call["name"],
-                    "abi": func_abi,
-                    "input_args": input_args,
-                }
-            )
-        except Exception as e:
-            logger.error(f"Error processing external call: {e}")
-
-    if external_calls:
-        web3_client = connect(blockchain)
-
-    for extcall in external_calls:
-        try:
-            contract = web3_client.eth.contract(
-                address=extcall["address"], abi=extcall["abi"]
-            )
-            response = contract.functions[extcall["name"]](
-                *extcall["input_args"]
-            ).call()
-
-            extention_data.append(
-                {"display_name": extcall["display_name"], "value": response}
-            )
-        except Exception as e:
-            logger.error(f"Failed to call {extcall['name']} error: {e}")
-
-    return extention_data
+    external_calls_executor = ExternalCallsExecutor(connect(blockchain))
+    return [
+        {"display_name": external_call.display_name, "value": value}
+        for external_call, value in external_calls_executor.call(external_calls)
+    ]
 
 
 def get_count(
@@ -434,19 +536,27 @@ def generate_web3_metrics(
     address: str,
     crawler_label: str,
     abi_json: Any,
+    external_data: Optional[List[Dict[str, Any]]] = None,
 ) -> List[Any]:
     """
     Generate stats for cards components
+
+    external_data is results of ABI external calls if they were already made.
     """
 
     extention_data = []
 
-    abi_external_calls = [item for item in abi_json if item["type"] == "external_call"]
+    if external_data is None:
+        abi_external_calls = [
+            item for item in abi_json if item["type"] == "external_call"
+        ]
 
-    extention_data = process_external(
-        abi_external_calls=abi_external_calls,
-        blockchain=blockchain_type,
-    )
+        extention_data = process_external(
+            abi_external_calls=abi_external_calls,
+            blockchain=blockchain_type,
+        )
+    else:
+        extention_data = list(external_data)
 
     extention_data.append(
         {
@@ -500,193 +610,405 @@ def generate_web3_metrics(
     return extention_data
 
 
-def stats_generate_handler(args: argparse.Namespace):
+class AbiCache:
     """
-    Start crawler with generate.
+    Subscriptions ABIs by S3 ETag, so ABI shared by subscriptions or unchanged since previous
+    run (with cache_dir) is not downloaded again.
     """
-    blockchain_type = AvailableBlockchainType(args.blockchain)
 
-    with yield_db_session_ctx() as db_session:
+    def __init__(self, s3_client: Any, cache_dir: Optional[str] = None) -> None:
+        self.s3_client = s3_client
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._abis: Dict[str, Any] = {}
+        self.metrics = {"memory_hits": 0, "disk_hits": 0, "downloads": 0}
+
+    def _cache_path(self, etag: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f"{etag}.json")
+
+    def get(self, bucket: str, key: str) -> Tuple[str, Any]:
+        """
+        Returns ETag and parsed ABI of S3 object.
+        """
+        head = self.s3_client.head_object(Bucket=bucket, Key=key)
+        etag = head["ETag"].strip('"')
+        abi_json = self._abis.get(etag)
+        if abi_json is not None:
+            self.metrics["memory_hits"] += 1
+            return etag, abi_json
+
+        cache_path = self._cache_path(etag)
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, "r") as ifp:
+                abi_json = json.load(ifp)
+            self.metrics["disk_hits"] += 1
+        else:
+            abi = self.s3_client.get_object(Bucket=bucket, Key=key)
+            # Object could be replaced after head request
+            etag = abi["ETag"].strip('"')
+            cache_path = self._cache_path(etag)
+            abi_body = abi["Body"].read()
+            abi_json = json.loads(abi_body)
+            if cache_path is not None:
+                with open(cache_path, "wb") as ofp:
+                    ofp.write(abi_body)
+            self.metrics["downloads"] += 1
+
+        self._abis[etag] = abi_json
+        return etag, abi_json
+
+
+@dataclass
+class StatsJob:
+    """
+    Statistics of contract shared by all dashboards subscriptions in targets.
+    """
 
-        start_time = time.time()
+    address: str
+    crawler_label: str
+    methods: List[str]
+    events: List[str]
+    abi_json: Any
+    # (dashboard, subscription) pairs to push statistics for
+    targets: List[Tuple[BugoutResource, BugoutResource]] = field(default_factory=list)
+    # Results of ABI external calls, made for all jobs at once
+    external_data: Optional[List[Dict[str, Any]]] = None
 
-        dashboard_resources: BugoutResources = bc.list_resources(
-            token=MOONSTREAM_ADMIN_ACCESS_TOKEN,
-            params={"type": BUGOUT_RESOURCE_TYPE_DASHBOARD},
-            timeout=10,
+
+# Database session opened once per stats worker process, see _init_stats_worker
+_worker_db_session: Optional[Session] = None
+
+
+def _init_stats_worker() -> None:
+    """
+    Open read only database session for stats worker process.
+    """
+    global _worker_db_session
+
+    dispose_engines_after_fork()
+    _worker_db_session = RO_SessionLocal()
+
+
+def _web3_metrics_task(
+    blockchain_type: AvailableBlockchainType, job: StatsJob
+) -> Tuple[List[Any], float]:
+    assert _worker_db_session is not None, "Stats worker is not initialized"
+    started_at = time.time()
+    try:
+        extention_data = generate_web3_metrics(
+            db_session=_worker_db_session,
+            events=job.events,
+            blockchain_type=blockchain_type,
+            address=job.address,
+            crawler_label=job.crawler_label,
+            abi_json=job.abi_json,
+            external_data=job.external_data,
+        )
+    finally:
+        _worker_db_session.rollback()
+    return extention_data, time.time() - started_at
+
+
+def _timeseries_task(
+    blockchain_type: AvailableBlockchainType, job: StatsJob, timescales: List[str]
+) -> Tuple[Dict[str, Dict[str, Any]], float]:
+    assert _worker_db_session is not None, "Stats worker is not initialized"
+    started_at = time.time()
+    try:
+        timeseries = generate_dashboard_timeseries(
+            db_session=_worker_db_session,
+            blockchain_type=blockchain_type,
+            address=job.address,
+            crawler_label=job.crawler_label,
+            methods=job.methods,
+            events=job.events,
+            timescales=timescales,
         )
+    finally:
+        _worker_db_session.rollback()
+    return timeseries, time.time() - started_at
 
-        logger.info(f"Amount of dashboards: {len(dashboard_resources.resources)}")
 
-        # get all subscriptions
-        available_subscriptions: List[BugoutResource] = []
+def stats_generate_handler(args: argparse.Namespace):
+    """
+    Start crawler with generate.
 
-        for subscription_type in subscription_ids_by_blockchain[args.blockchain]:
+    Dashboards subscriptions with the same contract, ABI and requested methods and events
+    share statistics, which are generated by process pool of args.workers processes.
+    """
+    blockchain_type = AvailableBlockchainType(args.blockchain)
+    timescales = [timescale.value for timescale in TimeScale]
 
-            # Create subscriptions dict for get subscriptions by id.
-            blockchain_subscriptions: BugoutResources = bc.list_resources(
-                token=MOONSTREAM_ADMIN_ACCESS_TOKEN,
-                params={
-                    "type": BUGOUT_RESOURCE_TYPE_SUBSCRIPTION,
-                    "subscription_type_id": subscription_type,
-                },
-                timeout=10,
-            )
-            available_subscriptions.extend(blockchain_subscriptions.resources)
+    start_time = time.time()
+    # Wall time of each stage and total time spent by workers on each kind of task
+    timings: Dict[str, float] = {}
+    stage_started_at = time.time()
 
-        subscription_by_id = {
-            str(blockchain_subscription.id): blockchain_subscription
-            for blockchain_subscription in available_subscriptions
-        }
+    dashboard_resources: BugoutResources = bc.list_resources(
+        token=MOONSTREAM_ADMIN_ACCESS_TOKEN,
+        params={"type": BUGOUT_RESOURCE_TYPE_DASHBOARD},
+        timeout=10,
+    )
 
-        logger.info(f"Amount of blockchain subscriptions: {len(subscription_by_id)}")
+    logger.info(f"Amount of dashboards: {len(dashboard_resources.resources)}")
 
-        s3_client = boto3.client("s3")
+    # get all subscriptions
+    available_subscriptions: List[BugoutResource] = []
 
-        subscriptions_count = 0
+    for subscription_type in subscription_ids_by_blockchain[args.blockchain]:
 
-        for dashboard in dashboard_resources.resources:
+        # Create subscriptions dict for get subscriptions by id.
+        blockchain_subscriptions: BugoutResources = bc.list_resources(
+            token=MOONSTREAM_ADMIN_ACCESS_TOKEN,
+            params={
+                "type": BUGOUT_RESOURCE_TYPE_SUBSCRIPTION,
+                "subscription_type_id": subscription_type,
+            },
+            timeout=10,
+        )
+        available_subscriptions.extend(blockchain_subscriptions.resources)
 
-            for dashboard_subscription_filters in dashboard.resource_data[
-                "subscription_settings"
-            ]:
+    subscription_by_id = {
+        str(blockchain_subscription.id): blockchain_subscription
+        for blockchain_subscription in available_subscriptions
+    }
 
-                try:
-                    subscription_id = dashboard_subscription_filters["subscription_id"]
+    logger.info(f"Amount of blockchain subscriptions: {len(subscription_by_id)}")
+    timings["resources"] = time.time() - stage_started_at
+
+    def report_error(err: Exception, dashboard_id: Any, subscription_id: str) -> None:
+        reporter.error_report(
+            err,
+            [
+                "dashboard",
+                "statistics",
+                f"blockchain:{args.blockchain}" f"subscriptions:{subscription_id}",
+                f"dashboard:{dashboard_id}",
+            ],
+        )
+        logger.error(err)
 
-                    if subscription_id not in subscription_by_id:
-                        # Meen it's are different blockchain type
-                        continue
+    # Read ABIs and group dashboards subscriptions with the same statistics
+    stage_started_at = time.time()
+    s3_client = boto3.client("s3")
+    abi_cache = AbiCache(s3_client, args.abi_cache_dir)
+    jobs: Dict[Tuple[str, str, str, Tuple[str, ...], Tuple[str, ...]], StatsJob] = {}
+    subscriptions_count = 0
 
-                    subscriptions_count += 1
-                    extention_data = []
+    for dashboard in dashboard_resources.resources:
 
-                    # The resulting object whivh be pushed to S3
-                    s3_data_object: Dict[str, Any] = {}
+        for dashboard_subscription_filters in dashboard.resource_data[
+            "subscription_settings"
+        ]:
 
-                    address = subscription_by_id[subscription_id].resource_data[
-                        "address"
-                    ]
+            try:
+                subscription_id = dashboard_subscription_filters["subscription_id"]
 
-                    crawler_label = CRAWLER_LABEL
+                if subscription_id not in subscription_by_id:
+                    # Meen it's are different blockchain type
+                    continue
 
-                    if address in ("0xdC0479CC5BbA033B3e7De9F178607150B3AbCe1f",):
-                        crawler_label = "moonworm"
+                subscriptions_count += 1
+                subscription = subscription_by_id[subscription_id]
 
-                    # Read required events, functions and web3_call form ABI
-                    if not subscription_by_id[subscription_id].resource_data["abi"]:
-                        methods = []
-                        events = []
-                        abi_json = {}
+                address = subscription.resource_data["address"]
 
-                    else:
-                        bucket = subscription_by_id[subscription_id].resource_data[
-                            "bucket"
-                        ]
-                        key = subscription_by_id[subscription_id].resource_data[
-                            "s3_path"
-                        ]
-                        abi = s3_client.get_object(
-                            Bucket=bucket,
-                            Key=key,
-                        )
-                        abi_json = json.loads(abi["Body"].read())
-                        methods = generate_list_of_names(
-                            type="function",
-                            subscription_filters=dashboard_subscription_filters,
-                            read_abi=dashboard_subscription_filters["all_methods"],
-                            abi_json=abi_json,
-                        )
-                        events = generate_list_of_names(
-                            type="event",
-                            subscription_filters=dashboard_subscription_filters,
-                            read_abi=dashboard_subscription_filters["all_events"],
-                            abi_json=abi_json,
-                        )
-
-                    extention_data = generate_web3_metrics(
-                        db_session=db_session,
-                        events=events,
-                        blockchain_type=blockchain_type,
-                        address=address,
-                        crawler_label=crawler_label,
-                        abi_json=abi_json,
-                    )
+                crawler_label = CRAWLER_LABEL
 
-                    # Generate blocks state information
-                    current_blocks_state = get_blocks_state(
-                        db_session=db_session, blockchain_type=blockchain_type
-                    )
+                if address in ("0xdC0479CC5BbA033B3e7De9F178607150B3AbCe1f",):
+                    crawler_label = "moonworm"
 
-                    for timescale in [timescale.value for timescale in TimeScale]:
+                # Read required events, functions and web3_call form ABI
+                abi_etag = ""
+                if not subscription.resource_data["abi"]:
+                    methods = []
+                    events = []
+                    abi_json: Any = {}
 
-                        start_date = (
-                            datetime.utcnow() - timescales_delta[timescale]["timedelta"]
-                        )
+                else:
+                    abi_etag, abi_json = abi_cache.get(
+                        subscription.resource_data["bucket"],
+                        subscription.resource_data["s3_path"],
+                    )
+                    methods = generate_list_of_names(
+                        type="function",
+                        subscription_filters=dashboard_subscription_filters,
+                        read_abi=dashboard_subscription_filters["all_methods"],
+                        abi_json=abi_json,
+                    )
+                    events = generate_list_of_names(
+                        type="event",
+                        subscription_filters=dashboard_subscription_filters,
+                        read_abi=dashboard_subscription_filters["all_events"],
+                        abi_json=abi_json,
+                    )
 
-                        logger.info(f"Timescale: {timescale}")
+                job_key = (
+                    address,
+                    crawler_label,
+                    abi_etag,
+                    tuple(methods),
+                    tuple(events),
+                )
+                if job_key not in jobs:
+                    jobs[job_key] = StatsJob(
+                        address=address,
+                        crawler_label=crawler_label,
+                        methods=methods,
+                        events=events,
+                        abi_json=abi_json,
+                    )
+                jobs[job_key].targets.append((dashboard, subscription))
+            except Exception as err:
+                report_error(err, dashboard.id, subscription_id)
 
-                        s3_data_object["web3_metric"] = extention_data
+    logger.info(
+        f"Generating {len(jobs)} unique statistics for {subscriptions_count} dashboards subscriptions, "
+        f"ABIs cache: {abi_cache.metrics}"
+    )
+    timings["abis"] = time.time() - stage_started_at
 
+    # Generate blocks state information
+    stage_started_at = time.time()
+    with yield_db_read_only_session_ctx() as db_session:
+        current_blocks_state = get_blocks_state(
+            db_session=db_session, blockchain_type=blockchain_type
+        )
+    timings["blocks_state"] = time.time() - stage_started_at
+
+    # Make external calls of all jobs at the same block in batches
+    stage_started_at = time.time()
+    jobs_list = list(jobs.values())
+    jobs_external_calls = [
+        prepare_external_calls(
+            [item for item in job.abi_json if item["type"] == "external_call"]
+        )
+        for job in jobs_list
+    ]
+    if any(jobs_external_calls):
+        try:
+            external_calls_executor = ExternalCallsExecutor(connect(blockchain_type))
+            external_calls_executor.fetch(
+                [
+                    external_call
+                    for job_external_calls in jobs_external_calls
+                    for external_call in job_external_calls
+                ]
+            )
+            logger.info(
+                f"Made external calls at block {external_calls_executor.block_number}: "
+                f"{external_calls_executor.metrics}"
+            )
+            for job, job_external_calls in zip(jobs_list, jobs_external_calls):
+                job.external_data = [
+                    {"display_name": external_call.display_name, "value": value}
+                    for external_call, value in external_calls_executor.call(
+                        job_external_calls
+                    )
+                ]
+        except Exception as err:
+            reporter.error_report(
+                err,
+                ["dashboard", "statistics", f"blockchain:{args.blockchain}"],
+            )
+            logger.error(f"Failed to make external calls: {err}")
+            for job in jobs_list:
+                job.external_data = []
+    else:
+        for job in jobs_list:
+            job.external_data = []
+    timings["external_calls"] = time.time() - stage_started_at
+
+    stage_started_at = time.time()
+    web3_metrics: Dict[int, List[Any]] = {}
+    timeseries: Dict[int, Dict[str, Dict[str, Any]]] = {}
+    failed_jobs: Dict[int, Exception] = {}
+    timings["web3_metrics_tasks"] = 0
+    timings["timeseries_tasks"] = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=_init_stats_worker
+    ) as executor:
+        # Futures of jobs web3 metrics (True) and timeseries (False) tasks
+        futures: Dict[Future, Tuple[int, bool]] = {}
+        for job_index, job in enumerate(jobs_list):
+            futures[executor.submit(_web3_metrics_task, blockchain_type, job)] = (
+                job_index,
+                True,
+            )
+            futures[
+                executor.submit(_timeseries_task, blockchain_type, job, timescales)
+            ] = (job_index, False)
+
+        for future in as_completed(futures):
+            job_index, is_web3_metrics = futures[future]
+            error = future.exception()
+            if error is not None:
+                failed_jobs[job_index] = cast(Exception, error)
+                continue
+            result, task_time = future.result()
+            if is_web3_metrics:
+                web3_metrics[job_index] = result
+                timings["web3_metrics_tasks"] += task_time
+            else:
+                timeseries[job_index] = result
+                timings["timeseries_tasks"] += task_time
+    timings["generate"] = time.time() - stage_started_at
+
+    stage_started_at = time.time()
+    for job_index, job in enumerate(jobs_list):
+        for dashboard, subscription in job.targets:
+            if job_index in failed_jobs:
+                report_error(failed_jobs[job_index], dashboard.id, str(subscription.id))
+                continue
+            try:
+                for timescale in timescales:
+                    s3_data_object: Dict[str, Any] = {
+                        "web3_metric": web3_metrics[job_index],
                         # Write state of blocks in database
-                        s3_data_object["blocks_state"] = current_blocks_state
-
+                        "blocks_state": current_blocks_state,
                         # TODO(Andrey): Remove after https://github.com/bugout-dev/moonstream/issues/524
-                        s3_data_object["generic"] = {}
-
-                        # Generate functions call timeseries
-                        functions_calls_data = generate_data(
-                            db_session=db_session,
-                            blockchain_type=blockchain_type,
-                            address=address,
-                            timescale=timescale,
-                            functions=methods,
-                            start=start_date,
-                            metric_type="tx_call",
-                            crawler_label=crawler_label,
-                        )
-                        s3_data_object["methods"] = functions_calls_data
-
-                        # Generte events timeseries
-                        events_data = generate_data(
-                            db_session=db_session,
-                            blockchain_type=blockchain_type,
-                            address=address,
-                            timescale=timescale,
-                            functions=events,
-                            start=start_date,
-                            metric_type="event",
-                            crawler_label=crawler_label,
-                        )
-                        s3_data_object["events"] = events_data
-
-                        # Push data to S3 bucket
-                        push_statistics(
-                            statistics_data=s3_data_object,
-                            subscription=subscription_by_id[subscription_id],
-                            timescale=timescale,
-                            bucket=bucket,
-                            dashboard_id=dashboard.id,
-                        )
-                except Exception as err:
-                    db_session.rollback()
-                    reporter.error_report(
-                        err,
-                        [
-                            "dashboard",
-                            "statistics",
-                            f"blockchain:{args.blockchain}"
-                            f"subscriptions:{subscription_id}",
-                            f"dashboard:{dashboard.id}",
-                        ],
-                    )
-                    logger.error(err)
+                        "generic": {},
+                        **timeseries[job_index][timescale],
+                    }
 
-        reporter.custom_report(
-            title=f"Dashboard stats generated.",
-            content=f"Generate statistics for {args.blockchain}. \n Generation time: {time.time() - start_time}. \n Total amount of dashboards: {len(dashboard_resources.resources)}. Generate stats for {subscriptions_count}.",
-            tags=["dashboard", "statistics", f"blockchain:{args.blockchain}"],
+                    # Push data to S3 bucket
+                    push_statistics(
+                        statistics_data=s3_data_object,
+                        subscription=subscription,
+                        timescale=timescale,
+                        bucket=subscription.resource_data["bucket"],
+                        dashboard_id=dashboard.id,
+                    )
+            except Exception as err:
+                report_error(err, dashboard.id, str(subscription.id))
+    timings["push"] = time.time() - stage_started_at
+
+    stage_started_at = time.time()
+    try:
+        with yield_db_session_ctx() as db_session:
+            pruned = prune_minute_rollups(db_session, blockchain_type)
+            db_session.commit()
+        logger.info(f"Pruned {pruned} minute rollups")
+    except Exception as err:
+        reporter.error_report(
+            err, ["dashboard", "statistics", f"blockchain:{args.blockchain}"]
         )
+        logger.error(f"Failed to prune minute rollups: {err}")
+    timings["prune_rollups"] = time.time() - stage_started_at
+
+    timings_report = "\n".join(
+        f" - {stage}: {stage_time:.2f}s" for stage, stage_time in timings.items()
+    )
+    logger.info(f"Statistics generation timings:\n{timings_report}")
+
+    reporter.custom_report(
+        title=f"Dashboard stats generated.",
+        content=f"Generate statistics for {args.blockchain}. \n Generation time: {time.time() - start_time}. \n Total amount of dashboards: {len(dashboard_resources.resources)}. Generate stats for {subscriptions_count}. \n Unique statistics: {len(jobs)}, failed: {len(failed_jobs)}. \n Stages timings:\n{timings_report}",
+        tags=["dashboard", "statistics", f"blockchain:{args.blockchain}"],
+    )
 
 
 def stats_generate_api_task(
@@ -777,11 +1099,18 @@ def stats_generate_api_task(
                     db_session=db_session, blockchain_type=blockchain_type
                 )
 
-                for timescale in timescales:
+                # Generate functions calls and events timeseries
+                timeseries = generate_dashboard_timeseries(
+                    db_session=db_session,
+                    blockchain_type=blockchain_type,
+                    address=address,
+                    crawler_label=crawler_label,
+                    methods=methods,
+                    events=events,
+                    timescales=timescales,
+                )
 
-                    start_date = (
-                        datetime.utcnow() - timescales_delta[timescale]["timedelta"]
-                    )
+                for timescale in timescales:
 
                     logger.info(f"Timescale: {timescale}")
 
@@ -793,31 +1122,8 @@ def stats_generate_api_task(
                     # TODO(Andrey): Remove after https://github.com/bugout-dev/moonstream/issues/524
                     s3_data_object["generic"] = {}
 
-                    # Generate functions call timeseries
-                    functions_calls_data = generate_data(
-                        db_session=db_session,
-                        blockchain_type=blockchain_type,
-                        address=address,
-                        timescale=timescale,
-                        functions=methods,
-                        start=start_date,
-                        metric_type="tx_call",
-                        crawler_label=crawler_label,
-                    )
-                    s3_data_object["methods"] = functions_calls_data
-
-                    # Generate events timeseries
-                    events_data = generate_data(
-                        db_session=db_session,
-                        blockchain_type=blockchain_type,
-                        address=address,
-                        timescale=timescale,
-                        functions=events,
-                        start=start_date,
-                        metric_type="event",
-                        crawler_label=crawler_label,
-                    )
-                    s3_data_object["events"] = events_data
+                    s3_data_object["methods"] = timeseries[timescale]["methods"]
+                    s3_data_object["events"] = timeseries[timescale]["events"]
 
                     # push data to S3 bucket
                     push_statistics(
@@ -840,6 +1146,39 @@ def stats_generate_api_task(
                 logger.error(err)
 
 
+def rollups_backfill_handler(args: argparse.Namespace) -> None:
+    """
+    Builds labels rollups of addresses from crawler labels, after that dashboards
+    statistics of these addresses are read from rollups which crawler keeps up to date.
+    """
+    blockchain_type = AvailableBlockchainType(args.blockchain)
+    label_model = get_label_model(blockchain_type)
+
+    with yield_db_session_ctx() as db_session:
+        addresses = args.addresses
+        if not addresses:
+            addresses = [
+                address
+                for (address,) in db_session.query(label_model.address)
+                .filter(label_model.label == CRAWLER_LABEL)
+                .distinct()
+                if address is not None
+            ]
+        logger.info(f"Backfilling rollups of {len(addresses)} addresses")
+
+        for address in addresses:
+            started_at = time.time()
+            try:
+                backfill_rollups(db_session, blockchain_type, address, CRAWLER_LABEL)
+                db_session.commit()
+            except Exception:
+                db_session.rollback()
+                raise
+            logger.info(
+                f"Backfilled rollups of {address} in {time.time() - started_at:.2f}s"
+            )
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Command Line Interface")
     parser.set_defaults(func=lambda _: parser.print_help())
@@ -857,8 +1196,38 @@ def main() -> None:
         required=True,
         help=f"Available blockchain types: {[member.value for member in AvailableBlockchainType]}",
     )
+    parser_generate.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=4,
+        help="Number of processes generating statistics",
+    )
+    parser_generate.add_argument(
+        "--abi-cache-dir",
+        type=str,
+        default=None,
+        help="(Optional) Directory to keep subscriptions ABIs in between runs, ABIs are downloaded again only if changed",
+    )
     parser_generate.set_defaults(func=stats_generate_handler)
 
+    parser_rollups = subcommands.add_parser(
+        "backfill-rollups", description="Build labels rollups of addresses"
+    )
+    parser_rollups.add_argument(
+        "--blockchain",
+        required=True,
+        help=f"Available blockchain types: {[member.value for member in AvailableBlockchainType]}",
+    )
+    parser_rollups.add_argument(
+        "--address",
+        dest="addresses",
+        action="append",
+        default=[],
+        help="Address to build rollups for, can be passed multiple times (default: all labelled addresses)",
+    )
+    parser_rollups.set_defaults(func=rollups_backfill_handler)
+
     args = parser.parse_args()
     args.func(args)
 
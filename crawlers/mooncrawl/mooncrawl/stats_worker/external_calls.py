@@ -0,0 +1,263 @@
+"""
+Evaluates dashboards external calls (view functions of contracts described in
+subscriptions ABIs) in batches.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, cast
+
+from hexbytes import HexBytes
+from web3 import Web3
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3.types import ABIFunction
+
+from ..blockchain import BatchRequestError, make_batch_request
+
+logger = logging.getLogger(__name__)
+
+# Multicall3 has the same address in Ethereum and Polygon, https://github.com/mds1/multicall
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL3_TRY_AGGREGATE_SELECTOR = Web3.keccak(
+    text="tryAggregate(bool,(address,bytes)[])"
+)[:4]
+
+# Encodes and decodes calls, does not need connection to node
+_codec_web3 = Web3()
+
+
+def cast_to_python_type(evm_type: str) -> Callable:
+    if evm_type.startswith(("uint", "int")):
+        return int
+    elif evm_type.startswith("bytes"):
+        return bytes
+    elif evm_type == "string":
+        return str
+    elif evm_type == "address":
+        return Web3.toChecksumAddress
+    elif evm_type == "bool":
+        return bool
+    else:
+        raise ValueError(f"Cannot convert to python type {evm_type}")
+
+
+@dataclass(frozen=True)
+class ExternalCall:
+    display_name: str
+    address: str
+    name: str
+    call_data: str
+    output_types: Tuple[str, ...]
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """
+        Identical calls of different dashboards have the same key.
+        """
+        return (self.address, self.call_data)
+
+
+def prepare_external_calls(
+    abi_external_calls: List[Dict[str, Any]]
+) -> List[ExternalCall]:
+    """
+    Encodes external_call items of subscription ABI, items which could not be
+    encoded are skipped.
+    """
+    external_calls = []
+    for external_call in abi_external_calls:
+        try:
+            func_input_abi = []
+            input_args = []
+            for func_input in external_call["inputs"]:
+                func_input_abi.append(
+                    {"name": func_input["name"], "type": func_input["type"]}
+                )
+                input_args.append(
+                    cast_to_python_type(func_input["type"])(func_input["value"])
+                )
+
+            func_abi = {
+                "name": external_call["name"],
+                "inputs": func_input_abi,
+                "outputs": external_call["outputs"],
+                "type": "function",
+                "stateMutability": "view",
+            }
+            contract = _codec_web3.eth.contract(abi=[func_abi])
+
+            external_calls.append(
+                ExternalCall(
+                    display_name=external_call["display_name"],
+                    address=Web3.toChecksumAddress(external_call["address"]),
+                    name=external_call["name"],
+                    call_data=contract.encodeABI(
+                        fn_name=external_call["name"], args=input_args
+                    ),
+                    output_types=tuple(
+                        get_abi_output_types(cast(ABIFunction, func_abi))
+                    ),
+                )
+            )
+        except Exception as e:
+            logger.error(f"Error processing external call: {e}")
+
+    return external_calls
+
+
+class ExternalCallsExecutor:
+    """
+    Evaluates external calls at block pinned on creation, identical calls are made
+    once and their results are cached.
+
+    Calls are aggregated in Multicall3 tryAggregate calls of batch_size calls, which are
+    sent to node in single JSON-RPC batch. If Multicall3 is not available at pinned block,
+    calls are sent as single JSON-RPC batch of eth_call.
+    """
+
+    def __init__(
+        self,
+        web3_client: Web3,
+        block_number: Optional[int] = None,
+        batch_size: int = 100,
+    ) -> None:
+        assert batch_size > 0, "batch_size must be greater than 0"
+        self.web3_client = web3_client
+        if block_number is None:
+            block_number = web3_client.eth.block_number
+        self.block_number = block_number
+        self.batch_size = batch_size
+
+        # Raw results by call key, None for failed calls
+        self._results: Dict[Tuple[str, str], Optional[bytes]] = {}
+        self._multicall_available: Optional[bool] = None
+        self.metrics = {"unique_calls": 0, "requests": 0}
+
+    def _eth_calls(self, params_list: List[List[Any]]) -> List[Optional[bytes]]:
+        try:
+            self.metrics["requests"] += 1
+            raw_results = make_batch_request(
+                self.web3_client, "eth_call", params_list, allow_errors=True
+            )
+            return [
+                HexBytes(raw_result) if raw_result is not None else None
+                for raw_result in raw_results
+            ]
+        except BatchRequestError as e:
+            logger.warning(f"Sending eth_call requests one by one: {e}")
+
+        results: List[Optional[bytes]] = []
+        for transaction, _ in params_list:
+            self.metrics["requests"] += 1
+            try:
+                results.append(
+                    HexBytes(self.web3_client.eth.call(transaction, self.block_number))
+                )
+            except Exception:
+                results.append(None)
+        return results
+
+    def _multicall(self, keys: List[Tuple[str, str]]) -> List[Optional[bytes]]:
+        params_list = []
+        for i in range(0, len(keys), self.batch_size):
+            aggregate_args = _codec_web3.codec.encode_abi(
+                ["bool", "(address,bytes)[]"],
+                [
+                    False,
+                    [
+                        (address, HexBytes(call_data))
+                        for address, call_data in keys[i : i + self.batch_size]
+                    ],
+                ],
+            )
+            params_list.append(
+                [
+                    {
+                        "to": MULTICALL3_ADDRESS,
+                        "data": HexBytes(
+                            MULTICALL3_TRY_AGGREGATE_SELECTOR + aggregate_args
+                        ).hex(),
+                    },
+                    hex(self.block_number),
+                ]
+            )
+
+        results: List[Optional[bytes]] = []
+        for raw_result in self._eth_calls(params_list):
+            if not raw_result:
+                raise Exception("Multicall3 call failed")
+            (aggregate_results,) = _codec_web3.codec.decode_abi(
+                ["(bool,bytes)[]"], raw_result
+            )
+            results.extend(
+                return_data if success else None
+                for success, return_data in aggregate_results
+            )
+        return results
+
+    def fetch(self, external_calls: List[ExternalCall]) -> None:
+        """
+        Makes calls which are not in cache yet.
+        """
+        keys = list(
+            {
+                external_call.key: None
+                for external_call in external_calls
+                if external_call.key not in self._results
+            }
+        )
+        if not keys:
+            return
+        self.metrics["unique_calls"] += len(keys)
+
+        raw_results: Optional[List[Optional[bytes]]] = None
+        if self._multicall_available is not False:
+            try:
+                raw_results = self._multicall(keys)
+                self._multicall_available = True
+            except Exception as e:
+                logger.warning(
+                    f"Multicall3 is not available at block {self.block_number}, making calls directly: {e}"
+                )
+                self._multicall_available = False
+        if raw_results is None:
+            raw_results = self._eth_calls(
+                [
+                    [{"to": address, "data": call_data}, hex(self.block_number)]
+                    for address, call_data in keys
+                ]
+            )
+
+        self._results.update(zip(keys, raw_results))
+
+    def call(
+        self, external_calls: List[ExternalCall]
+    ) -> List[Tuple[ExternalCall, Any]]:
+        """
+        Returns (call, value) of successful calls in order of external_calls. Values
+        are decoded the same way as web3 contract function call() does it.
+        """
+        self.fetch(external_calls)
+
+        values = []
+        for external_call in external_calls:
+            raw_result = self._results.get(external_call.key)
+            try:
+                if raw_result is None:
+                    raise Exception("call reverted")
+                decoded = _codec_web3.codec.decode_abi(
+                    external_call.output_types, raw_result
+                )
+                normalized = map_abi_data(
+                    BASE_RETURN_NORMALIZERS, external_call.output_types, decoded
+                )
+            except Exception as e:
+                logger.error(f"Failed to call {external_call.name} error: {e}")
+                continue
+            values.append(
+                (
+                    external_call,
+                    normalized[0] if len(normalized) == 1 else normalized,
+                )
+            )
+        return values
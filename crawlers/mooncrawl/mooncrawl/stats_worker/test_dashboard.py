@@ -0,0 +1,261 @@
+import io
+import json
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from moonstreamdb.db import yield_db_session_ctx
+from moonstreamdb.models import EthereumLabel
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from ..data import AvailableBlockchainType
+from ..rollups import backfill_rollups
+from ..settings import CRAWLER_LABEL
+from .dashboard import (
+    AbiCache,
+    _labels_timeseries_counts,
+    generate_timeseries,
+    timescales_delta,
+)
+
+ADDRESS = "0xTestGenerateTimeseries"
+TIMESCALES = ["year", "month", "week", "day"]
+METRICS = {"tx_call": ["transfer"], "event": ["Transfer"]}
+END = datetime(2022, 3, 10, 12, 30, 30)
+
+
+class S3Client:
+    """
+    Serves ABIs from dict of S3 keys to (ETag, ABI) and counts downloads.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.downloads = 0
+
+    def head_object(self, Bucket, Key):
+        return {"ETag": f'"{self.objects[Key][0]}"'}
+
+    def get_object(self, Bucket, Key):
+        self.downloads += 1
+        etag, abi = self.objects[Key]
+        return {
+            "ETag": f'"{etag}"',
+            "Body": io.BytesIO(json.dumps(abi).encode("utf-8")),
+        }
+
+
+class TestAbiCache(unittest.TestCase):
+    def test_download_once_per_etag(self):
+        abi = [{"type": "function", "name": "transfer"}]
+        s3_client = S3Client({"a/abi.json": ("e1", abi), "b/abi.json": ("e1", abi)})
+        with tempfile.TemporaryDirectory() as cache_dir:
+            abi_cache = AbiCache(s3_client, cache_dir)
+            self.assertEqual(abi_cache.get("bucket", "a/abi.json"), ("e1", abi))
+            self.assertEqual(abi_cache.get("bucket", "b/abi.json"), ("e1", abi))
+            self.assertEqual(s3_client.downloads, 1)
+
+            # Next run reads unchanged ABI from disk
+            self.assertEqual(
+                AbiCache(s3_client, cache_dir).get("bucket", "a/abi.json"), ("e1", abi)
+            )
+            self.assertEqual(s3_client.downloads, 1)
+
+            s3_client.objects["a/abi.json"] = ("e2", [])
+            self.assertEqual(abi_cache.get("bucket", "a/abi.json"), ("e2", []))
+            self.assertEqual(s3_client.downloads, 2)
+
+
+def add_labels(
+    db_session: Session,
+    labels: List[Tuple[str, str, datetime]],
+    label: str = CRAWLER_LABEL,
+) -> None:
+    for label_type, label_name, moment in labels:
+        db_session.add(
+            EthereumLabel(
+                label=label,
+                address=ADDRESS,
+                block_number=1,
+                block_timestamp=int(moment.replace(tzinfo=timezone.utc).timestamp()),
+                label_data={"type": label_type, "name": label_name},
+            )
+        )
+    db_session.flush()
+
+
+class TestGenerateTimeseries(unittest.TestCase):
+    def setUp(self):
+        try:
+            with yield_db_session_ctx() as db_session:
+                db_session.execute(text("SELECT 1"))
+        except OperationalError:
+            self.skipTest("Database is not available")
+
+    def test_labels_buckets(self):
+        day_start = END - timescales_delta["day"]["timedelta"]
+        with yield_db_session_ctx() as db_session:
+            add_labels(
+                db_session,
+                [
+                    ("event", "Transfer", END - timedelta(seconds=10)),
+                    ("event", "Transfer", datetime(2022, 3, 10, 12, 29, 59)),
+                    # Window start and end are not in window
+                    ("event", "Transfer", day_start),
+                    ("event", "Transfer", END),
+                    ("event", "Transfer", day_start + timedelta(seconds=1)),
+                    ("event", "Transfer", datetime(2022, 3, 1)),
+                    ("event", "Transfer", datetime(2021, 6, 1, 23, 59, 59)),
+                    ("tx_call", "transfer", datetime(2022, 3, 10, 1, 2, 3)),
+                    # Not requested labels
+                    ("event", "Approval", END - timedelta(seconds=10)),
+                ],
+            )
+            add_labels(
+                db_session,
+                [("event", "Transfer", END - timedelta(seconds=10))],
+                label="moonworm",
+            )
+
+            counts = _labels_timeseries_counts(
+                db_session,
+                AvailableBlockchainType.ETHEREUM,
+                ADDRESS,
+                CRAWLER_LABEL,
+                METRICS,
+                {
+                    timescale: END - timescales_delta[timescale]["timedelta"]
+                    for timescale in TIMESCALES
+                },
+                END,
+            )
+            db_session.rollback()
+
+        self.assertDictEqual(
+            counts,
+            {
+                "day": {
+                    ("event", "Transfer"): {
+                        "2022-03-10 12 30": 1,
+                        "2022-03-10 12 29": 1,
+                        "2022-03-09 12 30": 1,
+                    },
+                    ("tx_call", "transfer"): {"2022-03-10 01 02": 1},
+                },
+                "week": {
+                    ("event", "Transfer"): {"2022-03-10 12": 2, "2022-03-09 12": 2},
+                    ("tx_call", "transfer"): {"2022-03-10 01": 1},
+                },
+                "month": {
+                    ("event", "Transfer"): {
+                        "2022-03-10 12": 2,
+                        "2022-03-09 12": 2,
+                        "2022-03-01 00": 1,
+                    },
+                    ("tx_call", "transfer"): {"2022-03-10 01": 1},
+                },
+                "year": {
+                    ("event", "Transfer"): {
+                        "2022-03-10": 2,
+                        "2022-03-09": 2,
+                        "2022-03-01": 1,
+                        "2021-06-01": 1,
+                    },
+                    ("tx_call", "transfer"): {"2022-03-10": 1},
+                },
+            },
+        )
+
+    def test_zero_filled_timeseries(self):
+        with yield_db_session_ctx() as db_session:
+            add_labels(
+                db_session,
+                [
+                    ("event", "Transfer", END - timedelta(seconds=10)),
+                    ("event", "Transfer", datetime(2022, 3, 1)),
+                ],
+            )
+            timeseries = generate_timeseries(
+                db_session,
+                AvailableBlockchainType.ETHEREUM,
+                ADDRESS,
+                CRAWLER_LABEL,
+                METRICS,
+                TIMESCALES,
+                end=END,
+            )
+            db_session.rollback()
+
+        # Points of each timestep from window start to end, both included, gaps are zeros
+        for timescale, points_count, last_date, counts in [
+            ("year", 366, "2021-03-10", {"2022-03-10": 1, "2022-03-01": 1}),
+            (
+                "month",
+                27 * 24 + 1,
+                "2022-02-11 12",
+                {"2022-03-10 12": 1, "2022-03-01 00": 1},
+            ),
+            ("week", 6 * 24 + 1, "2022-03-04 12", {"2022-03-10 12": 1}),
+            ("day", 24 * 60 + 1, "2022-03-09 12 30", {"2022-03-10 12 30": 1}),
+        ]:
+            self.assertDictEqual(timeseries[timescale]["tx_call"], {})
+            points = timeseries[timescale]["event"]["Transfer"]
+            self.assertEqual(len(points), points_count)
+            self.assertEqual(points[-1]["date"], last_date)
+            dates = [point["date"] for point in points]
+            self.assertListEqual(dates, sorted(set(dates), reverse=True))
+            self.assertEqual(points[0]["date"], next(iter(counts)))
+            self.assertDictEqual(
+                {point["date"]: point["count"] for point in points if point["count"]},
+                counts,
+            )
+
+    def test_rollups_match_labels(self):
+        end = datetime.utcnow().replace(second=30, microsecond=0)
+        with yield_db_session_ctx() as db_session:
+            add_labels(
+                db_session,
+                [
+                    ("event", "Transfer", end - timedelta(seconds=10)),
+                    ("event", "Transfer", end - timedelta(minutes=5)),
+                    ("event", "Transfer", end - timedelta(hours=23)),
+                    ("event", "Transfer", end - timedelta(days=3)),
+                    ("event", "Transfer", end - timedelta(days=20)),
+                    ("event", "Transfer", end - timedelta(days=200)),
+                    ("tx_call", "transfer", end - timedelta(hours=2)),
+                ],
+            )
+            labels_timeseries = generate_timeseries(
+                db_session,
+                AvailableBlockchainType.ETHEREUM,
+                ADDRESS,
+                CRAWLER_LABEL,
+                METRICS,
+                TIMESCALES,
+                end=end,
+            )
+            backfill_rollups(
+                db_session, AvailableBlockchainType.ETHEREUM, ADDRESS, CRAWLER_LABEL
+            )
+            rollups_timeseries = generate_timeseries(
+                db_session,
+                AvailableBlockchainType.ETHEREUM,
+                ADDRESS,
+                CRAWLER_LABEL,
+                METRICS,
+                TIMESCALES,
+                end=end,
+            )
+            db_session.rollback()
+
+        self.assertDictEqual(rollups_timeseries, labels_timeseries)
+        self.assertEqual(
+            sum(
+                point["count"]
+                for point in labels_timeseries["year"]["event"]["Transfer"]
+            ),
+            6,
+        )
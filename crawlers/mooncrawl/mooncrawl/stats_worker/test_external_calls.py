@@ -0,0 +1,156 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import List
+
+from hexbytes import HexBytes
+from web3 import Web3
+
+from .external_calls import (
+    MULTICALL3_ADDRESS,
+    MULTICALL3_TRY_AGGREGATE_SELECTOR,
+    ExternalCallsExecutor,
+    prepare_external_calls,
+)
+
+BLOCK_NUMBER = 100
+CONTRACT = Web3.toChecksumAddress("0x" + "11" * 20)
+REVERTING_CONTRACT = Web3.toChecksumAddress("0x" + "00" * 20)
+
+
+def evaluate(address: str, call_data: bytes):
+    """
+    double(uint256) view returns argument multiplied by 2.
+    """
+    if address.lower() == REVERTING_CONTRACT.lower():
+        return None
+    (value,) = Web3().codec.decode_abi(["uint256"], call_data[4:])
+    return Web3().codec.encode_abi(["uint256"], [value * 2])
+
+
+class NodeHandler(BaseHTTPRequestHandler):
+    """
+    Answers eth_call at BLOCK_NUMBER and Multicall3 tryAggregate if multicall is True.
+    """
+
+    multicall = True
+    requests: List[str] = []
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, request):
+        method = request["method"]
+        NodeHandler.requests.append(method)
+        if method == "eth_blockNumber":
+            return {"result": hex(BLOCK_NUMBER)}
+
+        transaction, block = request["params"]
+        assert block == hex(BLOCK_NUMBER)
+        call_data = HexBytes(transaction["data"])
+        if transaction["to"] == MULTICALL3_ADDRESS:
+            if not NodeHandler.multicall:
+                return {"result": "0x"}
+            assert call_data[:4] == MULTICALL3_TRY_AGGREGATE_SELECTOR
+            _, calls = Web3().codec.decode_abi(
+                ["bool", "(address,bytes)[]"], call_data[4:]
+            )
+            results = []
+            for address, data in calls:
+                result = evaluate(address, data)
+                results.append((result is not None, result or b""))
+            encoded = Web3().codec.encode_abi(["(bool,bytes)[]"], [results])
+            return {"result": HexBytes(encoded).hex()}
+
+        result = evaluate(transaction["to"], call_data)
+        if result is None:
+            return {"error": {"code": 3, "message": "execution reverted"}}
+        return {"result": HexBytes(result).hex()}
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if isinstance(request, list):
+            NodeHandler.requests.append("batch")
+            response = [
+                {"jsonrpc": "2.0", "id": item["id"], **self.respond(item)}
+                for item in request
+            ]
+        else:
+            response = {
+                "jsonrpc": "2.0",
+                "id": request["id"],
+                **self.respond(request),
+            }
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def external_call(display_name, address, value):
+    return {
+        "type": "external_call",
+        "display_name": display_name,
+        "address": address,
+        "name": "double",
+        "inputs": [{"name": "value", "type": "uint256", "value": value}],
+        "outputs": [{"name": "", "type": "uint256"}],
+    }
+
+
+class TestExternalCallsExecutor(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), NodeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.web3 = Web3(
+            Web3.HTTPProvider(f"http://127.0.0.1:{self.server.server_address[1]}")
+        )
+        NodeHandler.requests = []
+        self.external_calls = prepare_external_calls(
+            [
+                external_call("first", CONTRACT, 1),
+                external_call("second", CONTRACT, 2),
+                # Same call in other dashboard
+                external_call("first again", CONTRACT.lower(), "1"),
+                external_call("reverted", REVERTING_CONTRACT, 3),
+                {"type": "external_call", "name": "broken"},
+            ]
+        )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def check_values(self, executor):
+        values = executor.call(self.external_calls)
+        self.assertListEqual(
+            [(call.display_name, value) for call, value in values],
+            [("first", 2), ("second", 4), ("first again", 2)],
+        )
+        self.assertEqual(executor.metrics["unique_calls"], 3)
+
+    def test_multicall(self):
+        NodeHandler.multicall = True
+        executor = ExternalCallsExecutor(self.web3, batch_size=2)
+        self.check_values(executor)
+        # Block number and one batch with two Multicall3 calls
+        self.assertListEqual(
+            NodeHandler.requests,
+            ["eth_blockNumber", "batch", "eth_call", "eth_call"],
+        )
+
+        # Results are cached at pinned block
+        self.check_values(executor)
+        self.assertEqual(len(NodeHandler.requests), 4)
+
+    def test_eth_call_batch(self):
+        NodeHandler.multicall = False
+        executor = ExternalCallsExecutor(self.web3, block_number=BLOCK_NUMBER)
+        self.check_values(executor)
+        self.assertListEqual(
+            NodeHandler.requests,
+            ["batch", "eth_call", "batch"] + ["eth_call"] * 3,
+        )
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from .block_timestamps import BlockTimestampsCache
+from .data import AvailableBlockchainType
+
+
+class TestBlockTimestampsCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.tmp_dir.name, "timestamps.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_least_recently_used_evicted(self):
+        cache = BlockTimestampsCache(AvailableBlockchainType.ETHEREUM, max_size=2)
+        cache._remember({1: 101, 2: 102})
+        cache.get_many(None, [1])
+        cache._remember({3: 103})
+        self.assertListEqual(list(cache._timestamps), [1, 3])
+
+    def test_store_survives_restart(self):
+        cache = BlockTimestampsCache(
+            AvailableBlockchainType.ETHEREUM, store_path=self.store_path
+        )
+        cache._save_to_store({1: 101, 2: 102})
+        cache.close()
+
+        cache = BlockTimestampsCache(
+            AvailableBlockchainType.ETHEREUM, store_path=self.store_path
+        )
+        self.assertDictEqual(cache.get_many(None, [1, 2]), {1: 101, 2: 102})
+        self.assertEqual(cache.metrics["store_hits"], 2)
+        self.assertEqual(len(cache), 2)
+        cache.close()
+
+    def test_missing_without_web3(self):
+        cache = BlockTimestampsCache(AvailableBlockchainType.ETHEREUM)
+        with self.assertRaises(ValueError):
+            cache.get(None, 1)
+
+    def test_missing_left_out_without_web3_lookup(self):
+        cache = BlockTimestampsCache(AvailableBlockchainType.ETHEREUM)
+        cache._remember({1: 101})
+        self.assertDictEqual(cache.get_many(None, [1, 2], use_web3=False), {1: 101})
@@ -0,0 +1,232 @@
+import json
+import multiprocessing
+import threading
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, List
+
+from moonstreamdb.db import yield_db_session_ctx
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from web3 import Web3
+
+from . import blockchain
+from .data import AvailableBlockchainType
+
+
+class TestMergeBlocksRanges(unittest.TestCase):
+    def test_merge_empty(self):
+        self.assertListEqual(blockchain.merge_blocks_ranges([]), [])
+
+    def test_merge_adjacent_and_overlapping(self):
+        self.assertListEqual(
+            blockchain.merge_blocks_ranges([(10, 12), (1, 3), (4, 4), (11, 15)]),
+            [(1, 4), (10, 15)],
+        )
+
+    def test_merge_keeps_gaps(self):
+        self.assertListEqual(
+            blockchain.merge_blocks_ranges([(7, 7), (1, 5)]),
+            [(1, 5), (7, 7)],
+        )
+
+
+class NodeHandler(BaseHTTPRequestHandler):
+    """
+    Answers eth_getBlockByNumber batches in reversed order, fails calls for block 0xbad
+    and rejects whole batch if reject_batch is True.
+    """
+
+    reject_batch = False
+    payloads: List[Any] = []
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, request):
+        block_number = request["params"][0]
+        if block_number == "0xbad":
+            return {"error": {"code": -32000, "message": "header not found"}}
+        return {
+            "result": {
+                "number": block_number,
+                "hash": "0x" + "ab" * 32,
+                "transactions": [],
+            }
+        }
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        NodeHandler.payloads.append(payload)
+        if NodeHandler.reject_batch:
+            response = {
+                "jsonrpc": "2.0",
+                "id": None,
+                "error": {"code": -32600, "message": "batch too large"},
+            }
+        else:
+            response = [
+                {"jsonrpc": "2.0", "id": item["id"], **self.respond(item)}
+                for item in reversed(payload)
+            ]
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestBatchRequest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), NodeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.web3 = Web3(
+            Web3.HTTPProvider(f"http://127.0.0.1:{self.server.server_address[1]}")
+        )
+        NodeHandler.reject_batch = False
+        NodeHandler.payloads = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_results_ordered_by_id(self):
+        results = blockchain.make_batch_request(
+            self.web3,
+            "eth_getBlockByNumber",
+            [["0x1", False], ["0x2", False], ["0x3", False]],
+        )
+        self.assertListEqual(
+            [result["number"] for result in results], ["0x1", "0x2", "0x3"]
+        )
+        self.assertEqual(len(NodeHandler.payloads), 1)
+        self.assertListEqual(
+            [item["id"] for item in NodeHandler.payloads[0]], [0, 1, 2]
+        )
+
+    def test_empty_batch(self):
+        self.assertListEqual(
+            blockchain.make_batch_request(self.web3, "eth_getBlockByNumber", []), []
+        )
+        self.assertListEqual(NodeHandler.payloads, [])
+
+    def test_failed_call(self):
+        params_list = [["0x1", False], ["0xbad", False]]
+        with self.assertRaises(blockchain.BatchRequestError):
+            blockchain.make_batch_request(
+                self.web3, "eth_getBlockByNumber", params_list
+            )
+
+        results = blockchain.make_batch_request(
+            self.web3, "eth_getBlockByNumber", params_list, allow_errors=True
+        )
+        self.assertEqual(results[0]["number"], "0x1")
+        self.assertIsNone(results[1])
+
+    def test_rejected_batch(self):
+        NodeHandler.reject_batch = True
+        with self.assertRaises(blockchain.BatchRequestError):
+            blockchain.make_batch_request(
+                self.web3,
+                "eth_getBlockByNumber",
+                [["0x1", False]],
+                allow_errors=True,
+            )
+
+    def test_not_http_provider(self):
+        web3 = Web3(Web3.IPCProvider("/nonexistent.ipc"))
+        with self.assertRaises(blockchain.BatchRequestError):
+            blockchain.make_batch_request(web3, "eth_getBlockByNumber", [["0x1"]])
+
+    def test_get_blocks_batch(self):
+        blocks = blockchain.get_blocks_batch(
+            self.web3, AvailableBlockchainType.ETHEREUM, [5, 3, 4]
+        )
+        self.assertListEqual([block["number"] for block in blocks], [5, 3, 4])
+        self.assertListEqual(NodeHandler.payloads[0][0]["params"], [hex(5), False])
+
+
+def select_one() -> int:
+    with yield_db_session_ctx() as db_session:
+        return db_session.execute(text("SELECT 1")).scalar()
+
+
+class TestCrawlBlocksWorker(unittest.TestCase):
+    def setUp(self):
+        try:
+            select_one()
+        except OperationalError:
+            self.skipTest("Database is not available")
+
+    def test_parent_pool_survives_worker(self):
+        # Parent connection is returned to pool and inherited by forked worker
+        with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=blockchain._init_crawl_blocks_worker,
+            initargs=(AvailableBlockchainType.ETHEREUM,),
+        ) as executor:
+            self.assertEqual(executor.submit(select_one).result(), 1)
+
+        self.assertEqual(select_one(), 1)
+
+
+class TestCopyRows(unittest.TestCase):
+    def test_copy_value(self):
+        self.assertEqual(blockchain._copy_value(None), "\\N")
+        self.assertEqual(blockchain._copy_value(12), "12")
+        self.assertEqual(blockchain._copy_value("None"), "None")
+        self.assertEqual(blockchain._copy_value("a\\b\tc\nd\re"), "a\\\\b\\tc\\nd\\re")
+
+    def test_copy_rows_round_trip(self):
+        try:
+            select_one()
+        except OperationalError:
+            self.skipTest("Database is not available")
+
+        rows = [
+            {"id": 1, "data": "tab\tnew line\nback\\slash", "value": 10**30},
+            {"id": 2, "data": None, "value": None},
+            {"id": 3, "data": "\\N", "value": 0},
+        ]
+        with yield_db_session_ctx() as db_session:
+            db_session.execute(
+                text(
+                    "CREATE TEMPORARY TABLE copy_test "
+                    "(id INTEGER PRIMARY KEY, data TEXT, value NUMERIC(78)) "
+                    "ON COMMIT DROP"
+                )
+            )
+            cursor = db_session.connection().connection.cursor()
+            columns = ["id", "data", "value"]
+            inserted = blockchain._copy_rows_into_table(
+                cursor, "copy_test", columns, rows
+            )
+            self.assertEqual(inserted, 3)
+
+            # Existing rows are skipped
+            inserted = blockchain._copy_rows_into_table(
+                cursor,
+                "copy_test",
+                columns,
+                rows[:1] + [{"id": 4, "data": "", "value": 1}],
+            )
+            self.assertEqual(inserted, 1)
+            self.assertEqual(
+                blockchain._copy_rows_into_table(cursor, "copy_test", columns, []), 0
+            )
+
+            cursor.execute("SELECT id, data, value FROM copy_test ORDER BY id")
+            self.assertListEqual(
+                [(row[0], row[1], row[2]) for row in cursor.fetchall()],
+                [
+                    (1, rows[0]["data"], 10**30),
+                    (2, None, None),
+                    (3, "\\N", 0),
+                    (4, "", 1),
+                ],
+            )
+            cursor.close()
+            db_session.rollback()
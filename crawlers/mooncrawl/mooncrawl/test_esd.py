@@ -0,0 +1,105 @@
+import json
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import List
+from urllib.parse import parse_qs, urlparse
+
+from .esd import (
+    ESDCrawlError,
+    fetch_new_signatures,
+    fetch_page,
+    iterate_signature_pages,
+)
+
+PAGE_SIZE = 10
+NUM_SIGNATURES = 95
+FIRST_CREATED_AT = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def signature(signature_id: int):
+    created_at = FIRST_CREATED_AT + timedelta(hours=signature_id)
+    return {
+        "id": signature_id,
+        "text_signature": f"f{signature_id}()",
+        "hex_signature": f"0x{signature_id:08x}",
+        "created_at": created_at.isoformat().replace("+00:00", "Z"),
+    }
+
+
+class ESDHandler(BaseHTTPRequestHandler):
+    """
+    Serves NUM_SIGNATURES signatures like 4byte.directory API does.
+    """
+
+    requested_pages: List[int] = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        page = int(query["page"][0])
+        ESDHandler.requested_pages.append(page)
+        ids = list(range(1, NUM_SIGNATURES + 1))
+        if query["ordering"][0].startswith("-"):
+            ids.reverse()
+        page_ids = ids[(page - 1) * PAGE_SIZE : page * PAGE_SIZE]
+        if not page_ids:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = json.dumps(
+            {
+                "count": NUM_SIGNATURES,
+                "next": None if page * PAGE_SIZE >= NUM_SIGNATURES else "next",
+                "previous": None,
+                "results": [signature(signature_id) for signature_id in page_ids],
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestESDCrawler(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), ESDHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/signatures/"
+        ESDHandler.requested_pages = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_all_pages(self):
+        pages = dict(iterate_signature_pages(self.url, num_workers=3))
+        self.assertListEqual(sorted(pages), list(range(1, 11)))
+        ids = [row["id"] for rows in pages.values() for row in rows]
+        self.assertListEqual(sorted(ids), list(range(1, NUM_SIGNATURES + 1)))
+        self.assertEqual(
+            pages[1][0]["created_at"], FIRST_CREATED_AT + timedelta(hours=1)
+        )
+
+    def test_resume_from_page(self):
+        pages = dict(iterate_signature_pages(self.url, start_page=8, num_workers=3))
+        self.assertListEqual(sorted(pages), [8, 9, 10])
+        # Only first page is requested to get number of pages
+        self.assertListEqual(sorted(ESDHandler.requested_pages), [1, 8, 9, 10])
+
+    def test_new_signatures(self):
+        since = FIRST_CREATED_AT + timedelta(hours=72)
+        rows = fetch_new_signatures(self.url, since, num_workers=2)
+        self.assertListEqual(
+            sorted(row["id"] for row in rows), list(range(73, NUM_SIGNATURES + 1))
+        )
+        self.assertListEqual(sorted(ESDHandler.requested_pages), [1, 2, 3])
+
+    def test_missing_page(self):
+        with self.assertRaises(ESDCrawlError):
+            fetch_page(self.url, 11, "id", attempts=1)
@@ -0,0 +1,129 @@
+import unittest
+
+from moonstreamdb.db import yield_db_session_ctx
+from moonstreamdb.models import LabelCountRollup, LabelRollupState
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from .data import AvailableBlockchainType
+from .rollups import (
+    DAY,
+    HOUR,
+    MINUTE,
+    aggregate_rollups,
+    backfill_rollups,
+    prune_minute_rollups,
+)
+
+
+def label_row(label_type, name, block_timestamp, args=None):
+    return {
+        "label": "moonworm-alpha",
+        "address": "0xA",
+        "block_timestamp": block_timestamp,
+        "label_data": {"type": label_type, "name": name, "args": args or {}},
+    }
+
+
+class TestAggregateRollups(unittest.TestCase):
+    def test_aggregate(self):
+        counts, arguments = aggregate_rollups(
+            AvailableBlockchainType.POLYGON,
+            [
+                label_row("event", "Transfer", DAY + 61, {"to": "0x1"}),
+                label_row("event", "Transfer", DAY + 119, {"to": "0x1"}),
+                label_row("event", "Transfer", DAY + HOUR, {"to": "0x2"}),
+                label_row("tx_call", "mint", DAY + 5),
+                label_row("tx_call", "mint", None),
+            ],
+        )
+
+        key = ("polygon", "0xA", "moonworm-alpha")
+        self.assertEqual(counts[key + (MINUTE, DAY + 60, "event", "Transfer")], 2)
+        self.assertEqual(counts[key + (MINUTE, DAY + HOUR, "event", "Transfer")], 1)
+        self.assertEqual(counts[key + (HOUR, DAY, "event", "Transfer")], 2)
+        self.assertEqual(counts[key + (HOUR, DAY + HOUR, "event", "Transfer")], 1)
+        self.assertEqual(counts[key + (DAY, DAY, "event", "Transfer")], 3)
+        self.assertEqual(counts[key + (DAY, DAY, "tx_call", "mint")], 1)
+        self.assertEqual(len(counts), 8)
+        self.assertSetEqual(
+            arguments,
+            {
+                key + ("event", "Transfer", "to", "0x1"),
+                key + ("event", "Transfer", "to", "0x2"),
+            },
+        )
+
+    def test_aggregate_minutes_start(self):
+        counts, _ = aggregate_rollups(
+            AvailableBlockchainType.POLYGON,
+            [
+                label_row("tx_call", "mint", DAY + 59),
+                label_row("tx_call", "mint", DAY + 61),
+            ],
+            minutes_start=DAY + 1,
+        )
+
+        key = ("polygon", "0xA", "moonworm-alpha")
+        self.assertDictEqual(
+            counts,
+            {
+                key + (MINUTE, DAY + 60, "tx_call", "mint"): 1,
+                key + (HOUR, DAY, "tx_call", "mint"): 2,
+                key + (DAY, DAY, "tx_call", "mint"): 2,
+            },
+        )
+
+
+class TestBackfillRollups(unittest.TestCase):
+    def test_not_crawler_label(self):
+        with self.assertRaises(ValueError):
+            backfill_rollups(None, AvailableBlockchainType.POLYGON, "0xA", "moonworm")  # type: ignore
+
+
+class TestPruneMinuteRollups(unittest.TestCase):
+    def test_prune(self):
+        try:
+            with yield_db_session_ctx() as db_session:
+                db_session.execute(text("SELECT 1"))
+        except OperationalError:
+            self.skipTest("Database is not available")
+
+        blockchain_type = AvailableBlockchainType.POLYGON
+        with yield_db_session_ctx() as db_session:
+            for address in ["0xTestPruneA", "0xTestPruneB"]:
+                db_session.add(
+                    LabelRollupState(
+                        blockchain=blockchain_type.value,
+                        address=address,
+                        label="moonworm-alpha",
+                    )
+                )
+                for timestep, bucket in [(MINUTE, DAY), (MINUTE, 2 * DAY), (HOUR, 0)]:
+                    db_session.add(
+                        LabelCountRollup(
+                            blockchain=blockchain_type.value,
+                            address=address,
+                            label="moonworm-alpha",
+                            timestep=timestep,
+                            bucket=bucket,
+                            label_type="tx_call",
+                            label_name="mint",
+                            count=1,
+                        )
+                    )
+            db_session.flush()
+
+            self.assertEqual(
+                prune_minute_rollups(db_session, blockchain_type, 2 * DAY), 2
+            )
+            buckets = (
+                db_session.query(LabelCountRollup.timestep, LabelCountRollup.bucket)
+                .filter(LabelCountRollup.address == "0xTestPruneA")
+                .order_by(LabelCountRollup.timestep)
+                .all()
+            )
+            self.assertListEqual(
+                [tuple(bucket) for bucket in buckets], [(MINUTE, 2 * DAY), (HOUR, 0)]
+            )
+            db_session.rollback()
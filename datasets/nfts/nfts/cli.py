@@ -1,5 +1,6 @@
 import argparse
 import contextlib
+import json
 import logging
 import os
 import sqlite3
@@ -11,17 +12,7 @@ from moonstreamdb.db import yield_db_session_ctx
 from .enrich import EthereumBatchloader, enrich
 from .data import EventType, event_types, nft_event, BlockBounds
 from .datastore import setup_database, import_data, filter_data
-from .derive import (
-    current_owners,
-    current_market_values,
-    current_values_distribution,
-    transfer_statistics_by_address,
-    quantile_generating,
-    mint_holding_times,
-    ownership_transitions,
-    transfer_holding_times,
-    transfers_mints_connection_table,
-)
+from .derive import DERIVE_STAGES, benchmark_derive, run_derive_pipeline
 from .materialize import create_dataset
 
 
@@ -29,17 +20,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-derive_functions = {
-    "current_owners": current_owners,
-    "current_market_values": current_market_values,
-    "current_values_distribution": current_values_distribution,
-    "mint_holding_times": mint_holding_times,
-    "ownership_transitions": ownership_transitions,
-    "quantile_generating": quantile_generating,
-    "transfer_holding_times": transfer_holding_times,
-    "transfers_mints_connection_table": transfers_mints_connection_table,
-    "transfer_statistics_by_address": transfer_statistics_by_address,
-}
+derive_functions = {stage.name: stage.function for stage in DERIVE_STAGES}
 
 
 def handle_initdb(args: argparse.Namespace) -> None:
@@ -77,13 +58,9 @@ def handle_filter_data(args: argparse.Namespace) -> None:
             end_time=args.end_time,
         )
         print("Filtering end.")
-        for index, function_name in enumerate(derive_functions.keys()):
-            print(
-                f"Derive process {function_name} {index+1}/{len(derive_functions.keys())}"
-            )
-            derive_functions[function_name](source_conn)
 
-        # Apply derive to new data
+    # Apply derive to new data
+    run_derive_pipeline(sqlite_path)
 
 
 def handle_materialize(args: argparse.Namespace) -> None:
@@ -108,12 +85,19 @@ def handle_materialize(args: argparse.Namespace) -> None:
             event_type,
             bounds,
             args.batch_size,
+            args.page_size,
+            args.count,
         )
 
 
 def handle_enrich(args: argparse.Namespace) -> None:
 
-    batch_loader = EthereumBatchloader(jsonrpc_url=args.jsonrpc)
+    batch_loader = EthereumBatchloader(
+        jsonrpc_url=args.jsonrpc,
+        chunk_size=args.rpc_batch_size,
+        max_workers=args.max_workers,
+        max_retries=args.retries,
+    )
 
     logger.info(f"Enriching NFT events in datastore: {args.datastore}")
 
@@ -134,19 +118,27 @@ def handle_enrich(args: argparse.Namespace) -> None:
 
 
 def handle_derive(args: argparse.Namespace) -> None:
-    with contextlib.closing(sqlite3.connect(args.datastore)) as moonstream_datastore:
-        calling_functions = []
-        if not args.derive_functions:
-            calling_functions.extend(derive_functions.keys())
-        else:
-            calling_functions.extend(args.derive_functions)
-
-        for function_name in calling_functions:
-            if function_name in calling_functions:
-                derive_functions[function_name](moonstream_datastore)
+    statuses = run_derive_pipeline(
+        args.datastore,
+        args.derive_functions,
+        workers=args.workers,
+        force=args.force,
+    )
+    failed = [name for name, status in statuses.items() if status == "failed"]
+    blocked = [name for name, status in statuses.items() if status == "blocked"]
+    if failed or blocked:
+        raise Exception(
+            f"Derive stages failed: {failed}, blocked by failed stages: {blocked}"
+        )
     logger.info("Done!")
 
 
+def handle_benchmark_derive(args: argparse.Namespace) -> None:
+    with contextlib.closing(sqlite3.connect(args.datastore)) as moonstream_datastore:
+        results = benchmark_derive(moonstream_datastore, args.repeats)
+    print(json.dumps(results, indent=2))
+
+
 def main() -> None:
     """
     "nfts" command handler.
@@ -211,6 +203,17 @@ def main() -> None:
         default=1000,
         help="Number of events to process per batch",
     )
+    parser_materialize.add_argument(
+        "--page-size",
+        type=int,
+        default=100000,
+        help="Number of labels to read from database per keyset page",
+    )
+    parser_materialize.add_argument(
+        "--count",
+        action="store_true",
+        help="Count labels before export to show progress towards total (takes additional scan of labels)",
+    )
     parser_materialize.set_defaults(func=handle_materialize)
 
     parser_derive = subcommands.add_parser(
@@ -229,8 +232,39 @@ def main() -> None:
         nargs="+",
         help=f"Functions wich will call from derive module availabel {list(derive_functions.keys())}",
     )
+    parser_derive.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of independent derive functions to run concurrently",
+    )
+    parser_derive.add_argument(
+        "--force",
+        action="store_true",
+        help="Derive tables even if their inputs did not change since the last run",
+    )
     parser_derive.set_defaults(func=handle_derive)
 
+    parser_benchmark_derive = subcommands.add_parser(
+        "benchmark-derive",
+        description="Compare derive of current owners, market values and quantiles against legacy Python aggregates",
+    )
+    parser_benchmark_derive.add_argument(
+        "-d",
+        "--datastore",
+        required=True,
+        help="Path to SQLite database representing the dataset",
+    )
+    parser_benchmark_derive.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=3,
+        help="Number of runs of each implementation, the fastest one is reported",
+    )
+    parser_benchmark_derive.set_defaults(func=handle_benchmark_derive)
+
     parser_import_data = subcommands.add_parser(
         "import-data",
         description="Import data from another source NFTs dataset datastore. This operation is performed per table, and replaces the existing table in the target datastore.",
@@ -309,6 +343,24 @@ def main() -> None:
         default=1000,
         help="Number of events to process per batch",
     )
+    parser_enrich.add_argument(
+        "--rpc-batch-size",
+        type=int,
+        default=100,
+        help="Maximum number of requests in one JSON-RPC batch",
+    )
+    parser_enrich.add_argument(
+        "--max-workers",
+        type=int,
+        default=4,
+        help="Number of JSON-RPC batches sent to node concurrently",
+    )
+    parser_enrich.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Number of retries of failed JSON-RPC requests",
+    )
     parser_enrich.set_defaults(func=handle_enrich)
 
     args = parser.parse_args()
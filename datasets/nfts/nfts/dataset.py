@@ -1,16 +1,19 @@
 """
 Functions to access various data in the NFTs dataset.
 """
+import logging
+import os
 import sqlite3
 from typing import List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 import scipy.sparse
-from tqdm import tqdm
 
 from .datastore import event_tables, EventType
 
+logger = logging.getLogger(__name__)
+
 # TODO(zomglings): Make it so that table names are parametrized by importable variables. The way
 # things are now, we have to be very careful if we ever rename a table in our dataset. We should
 # also propagate the name change here.
@@ -98,7 +101,9 @@ Load this matrix as follows:
 >>> indexed_addresses, transitions = ds.load_ownership_transitions()
 
 - "indexed_addresses" is a list denoting the address that each index (row/column) in the matrix represents.
-- "transitions" is a numpy ndarray containing the matrix, with source addresses on the row axis and target addresses on the column axis.
+- "transitions" is a scipy.sparse CSR matrix, with source addresses on the row axis and target addresses on the column axis.
+
+Loaded matrices are cached in .npz files next to the SQLite database and are rebuilt when the {OWNERSHIP_TRANSITIONS} table changes.
 """
 }
 
@@ -134,10 +139,14 @@ This dataset consists of the following dataframes:"""
 
 
 class FromSQLite:
-    def __init__(self, datafile: str) -> None:
+    def __init__(self, datafile: str, cache_matrices: bool = True) -> None:
         """
         Initialize an NFTs dataset instance by connecting it to a SQLite database containing the data.
+
+        If cache_matrices is True, matrices are cached in .npz files next to the database.
         """
+        self.datafile = datafile
+        self.cache_matrices = cache_matrices and datafile != ":memory:"
         self.conn = sqlite3.connect(datafile)
         self.ownership_transitions: Optional[
             Tuple[List[str], scipy.sparse.spmatrix]
@@ -158,6 +167,71 @@ class FromSQLite:
         df = pd.read_sql_query(f"SELECT * FROM {name};", self.conn)
         return df
 
+    def _matrix_cache_path(self, name: str) -> str:
+        return f"{self.datafile}.{name}.npz"
+
+    def _ownership_transitions_fingerprint(self) -> np.ndarray:
+        """
+        Identifies contents of ownership_transitions table, cached matrices with another
+        fingerprint are stale. Modification times of database files make the cache stale
+        on any write to the database, even if table sizes stay the same.
+        """
+        cur = self.conn.cursor()
+        count, total = cur.execute(
+            f"SELECT count(*), total(num_transitions) FROM {OWNERSHIP_TRANSITIONS};"
+        ).fetchone()
+        modified_at = [
+            os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+            for path in (self.datafile, f"{self.datafile}-wal")
+        ]
+        return np.array([count, int(total), *modified_at], dtype=np.int64)
+
+    def _load_cached_matrix(
+        self, name: str, fingerprint: np.ndarray
+    ) -> Optional[Tuple[List[str], scipy.sparse.csr_matrix]]:
+        path = self._matrix_cache_path(name)
+        if not self.cache_matrices or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as cached:
+                if not np.array_equal(cached["fingerprint"], fingerprint):
+                    return None
+                matrix = scipy.sparse.csr_matrix(
+                    (cached["data"], cached["indices"], cached["indptr"]),
+                    shape=tuple(cached["shape"]),
+                )
+                addresses = cached["addresses"].tolist()
+        except Exception as e:
+            logger.warning(f"Could not load cached matrix {path}: {e}")
+            return None
+        return addresses, matrix
+
+    def _save_cached_matrix(
+        self,
+        name: str,
+        fingerprint: np.ndarray,
+        addresses: List[str],
+        matrix: scipy.sparse.csr_matrix,
+    ) -> None:
+        if not self.cache_matrices:
+            return
+        path = self._matrix_cache_path(name)
+        try:
+            # np.savez appends .npz to file names without it, so the temporary file keeps it
+            temporary_path = f"{path}.tmp.npz"
+            np.savez(
+                temporary_path,
+                fingerprint=fingerprint,
+                addresses=np.array(addresses, dtype=str),
+                data=matrix.data,
+                indices=matrix.indices,
+                indptr=matrix.indptr,
+                shape=np.array(matrix.shape),
+            )
+            os.replace(temporary_path, path)
+        except Exception as e:
+            logger.warning(f"Could not cache matrix {path}: {e}")
+
     def load_ownership_transitions(
         self, force: bool = False
     ) -> Tuple[List[str], scipy.sparse.spmatrix]:
@@ -169,30 +243,46 @@ class FromSQLite:
         """
         if self.ownership_transitions is not None and not force:
             return self.ownership_transitions
-        cur = self.conn.cursor()
-        address_indexes_query = """
-WITH all_addresses AS (
-    SELECT from_address AS address FROM ownership_transitions
-    UNION
-    SELECT to_address AS address FROM ownership_transitions
-)
-SELECT DISTINCT(all_addresses.address) AS address FROM all_addresses ORDER BY address ASC;
-"""
-        addresses = [row[0] for row in cur.execute(address_indexes_query)]
-        num_addresses = len(addresses)
-        address_indexes = {address: i for i, address in enumerate(addresses)}
 
-        adjacency_matrix = scipy.sparse.dok_matrix((num_addresses, num_addresses))
-        adjacency_query = "SELECT from_address, to_address, num_transitions FROM ownership_transitions;"
+        fingerprint = self._ownership_transitions_fingerprint()
+        if not force:
+            cached = self._load_cached_matrix(OWNERSHIP_TRANSITIONS, fingerprint)
+            if cached is not None:
+                self.ownership_transitions = cached
+                return self.ownership_transitions
 
-        rows = cur.execute(adjacency_query)
-        for from_address, to_address, num_transitions in tqdm(
-            rows, desc="Ownership transitions (adjacency matrix)"
-        ):
-            from_index = address_indexes[from_address]
-            to_index = address_indexes[to_address]
-            adjacency_matrix[from_index, to_index] = num_transitions
+        edges = pd.read_sql_query(
+            f"SELECT from_address, to_address, num_transitions FROM {OWNERSHIP_TRANSITIONS};",
+            self.conn,
+        )
+        num_edges = len(edges)
+
+        # Addresses are indexed in ascending order, factorize also maps each endpoint of
+        # each edge to the index of its address. It gives the same result as np.unique with
+        # return_inverse=True, but hashes strings instead of sorting all of them.
+        address_indexes, addresses_index = pd.factorize(
+            np.concatenate(
+                [
+                    edges["from_address"].to_numpy(dtype=object),
+                    edges["to_address"].to_numpy(dtype=object),
+                ]
+            ),
+            sort=True,
+        )
+        addresses = list(addresses_index)
+        num_addresses = len(addresses)
 
+        adjacency_matrix = scipy.sparse.csr_matrix(
+            (
+                edges["num_transitions"].to_numpy(dtype=np.float64),
+                (address_indexes[:num_edges], address_indexes[num_edges:]),
+            ),
+            shape=(num_addresses, num_addresses),
+        )
+
+        self._save_cached_matrix(
+            OWNERSHIP_TRANSITIONS, fingerprint, addresses, adjacency_matrix
+        )
         self.ownership_transitions = (addresses, adjacency_matrix)
         return self.ownership_transitions
 
@@ -207,22 +297,32 @@ SELECT DISTINCT(all_addresses.address) AS address FROM all_addresses ORDER BY ad
         if self.ownership_transition_probabilities is not None and not force:
             return self.ownership_transition_probabilities
 
+        name = f"{OWNERSHIP_TRANSITIONS}_probabilities"
+        fingerprint = self._ownership_transitions_fingerprint()
+        if not force:
+            cached = self._load_cached_matrix(name, fingerprint)
+            if cached is not None:
+                self.ownership_transition_probabilities = cached
+                return self.ownership_transition_probabilities
+
         addresses, adjacency_matrix = self.load_ownership_transitions(force)
 
         # Sum of the entries in each row:
         # https://docs.scipy.org/doc/scipy/reference/generated/scipy.sparse.spmatrix.sum.html#scipy.sparse.spmatrix.sum
-        row_sums = adjacency_matrix.sum(axis=1)
-
-        # Convert adjacency matrix to matrix of transition probabilities.
-        # We cannot do this by simply dividing transition_probabilites /= row_sums because that tries
-        # to coerce the matrix into a dense numpy ndarray and requires terabytes of memory.
-        transition_probabilities = adjacency_matrix.copy()
-        for i, j in zip(*transition_probabilities.nonzero()):
-            transition_probabilities[i, j] = (
-                transition_probabilities[i, j] / row_sums[i]
-            )
+        row_sums = np.asarray(adjacency_matrix.sum(axis=1)).ravel()
+
+        # Convert adjacency matrix to matrix of transition probabilities by multiplying it by diagonal
+        # matrix of inverse row sums from the left, which keeps it sparse. Dividing
+        # transition_probabilites /= row_sums tries to coerce the matrix into a dense numpy ndarray
+        # and requires terabytes of memory.
+        inverse_row_sums = np.zeros_like(row_sums)
+        np.divide(1.0, row_sums, out=inverse_row_sums, where=row_sums != 0)
+        transition_probabilities = scipy.sparse.csr_matrix(
+            scipy.sparse.diags(inverse_row_sums) @ adjacency_matrix
+        )
 
         # Now we identify and remove burn addresses from this data.
 
+        self._save_cached_matrix(name, fingerprint, addresses, transition_probabilities)
         self.ownership_transition_probabilities = (addresses, transition_probabilities)
         return self.ownership_transition_probabilities
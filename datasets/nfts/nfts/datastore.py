@@ -4,7 +4,8 @@ a datastore for a Moonstream NFTs dataset.
 """
 import logging
 import sqlite3
-from typing import Any, cast, List, Tuple, Optional
+from datetime import datetime
+from typing import Any, cast, Dict, List, Tuple, Optional
 
 from tqdm import tqdm
 
@@ -36,6 +37,35 @@ CREATE_CHECKPOINT_TABLE_QUERY = """CREATE TABLE IF NOT EXISTS checkpoint
     );
 """
 
+# Key (created_at, id) of last label of each event type written to datastore
+CREATE_EXPORT_CURSOR_TABLE_QUERY = """CREATE TABLE IF NOT EXISTS export_cursor
+    (
+        event_type TEXT NOT NULL PRIMARY KEY,
+        created_at TEXT NOT NULL,
+        label_id TEXT NOT NULL
+    );
+"""
+
+# Enrich caches of data resolved through JSON-RPC, transaction values are stored as text
+# because they do not fit into SQLite INTEGER
+CREATE_TRANSACTIONS_CACHE_TABLE_QUERY = """CREATE TABLE IF NOT EXISTS transactions_cache
+    (
+        transaction_hash TEXT NOT NULL PRIMARY KEY,
+        block_number INTEGER NOT NULL,
+        transaction_value TEXT NOT NULL
+    );
+"""
+
+CREATE_BLOCKS_CACHE_TABLE_QUERY = """CREATE TABLE IF NOT EXISTS blocks_cache
+    (
+        block_number INTEGER NOT NULL PRIMARY KEY,
+        timestamp INTEGER NOT NULL
+    );
+"""
+
+# Stays below default SQLite limit of 999 host parameters
+CACHE_LOOKUP_CHUNK_SIZE = 500
+
 
 def create_events_table_query(event_type: EventType) -> str:
     creation_query = f"""
@@ -203,6 +233,9 @@ def setup_database(conn: sqlite3.Connection) -> None:
     cur.execute(create_events_table_query(EventType.TRANSFER))
     cur.execute(create_events_table_query(EventType.MINT))
     cur.execute(CREATE_CHECKPOINT_TABLE_QUERY)
+    cur.execute(CREATE_EXPORT_CURSOR_TABLE_QUERY)
+    cur.execute(CREATE_TRANSACTIONS_CACHE_TABLE_QUERY)
+    cur.execute(CREATE_BLOCKS_CACHE_TABLE_QUERY)
 
     conn.commit()
 
@@ -284,6 +317,116 @@ INSERT INTO checkpoint (
     conn.commit()
 
 
+def get_export_cursor(
+    conn: sqlite3.Connection, event_type: EventType
+) -> Optional[Tuple[datetime, str]]:
+    """
+    Returns (created_at, id) of last label of event type written to datastore.
+    """
+    cur = conn.cursor()
+    # Datastores created before export cursor was introduced do not have the table
+    cur.execute(CREATE_EXPORT_CURSOR_TABLE_QUERY)
+    cur.execute(
+        "SELECT created_at, label_id FROM export_cursor WHERE event_type = ?",
+        [event_type.value],
+    )
+    for created_at, label_id in cur:
+        return datetime.fromisoformat(created_at), label_id
+    return None
+
+
+def set_export_cursor(
+    conn: sqlite3.Connection,
+    event_type: EventType,
+    created_at: datetime,
+    label_id: str,
+    commit: bool = True,
+) -> None:
+    cur = conn.cursor()
+    cur.execute(CREATE_EXPORT_CURSOR_TABLE_QUERY)
+    cur.execute(
+        "REPLACE INTO export_cursor (event_type, created_at, label_id) VALUES (?, ?, ?)",
+        [event_type.value, created_at.isoformat(), label_id],
+    )
+    if commit:
+        conn.commit()
+
+
+def setup_enrich_cache(conn: sqlite3.Connection) -> None:
+    """
+    Creates enrich cache tables in datastores created before they were introduced.
+    """
+    cur = conn.cursor()
+    cur.execute(CREATE_TRANSACTIONS_CACHE_TABLE_QUERY)
+    cur.execute(CREATE_BLOCKS_CACHE_TABLE_QUERY)
+    conn.commit()
+
+
+def get_cached_transactions(
+    conn: sqlite3.Connection, transaction_hashes: List[str]
+) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns (value, block_number) of cached transactions by transaction hash.
+    """
+    cur = conn.cursor()
+    transactions: Dict[str, Tuple[int, int]] = {}
+    for i in range(0, len(transaction_hashes), CACHE_LOOKUP_CHUNK_SIZE):
+        chunk = transaction_hashes[i : i + CACHE_LOOKUP_CHUNK_SIZE]
+        cur.execute(
+            f"""SELECT transaction_hash, transaction_value, block_number FROM transactions_cache
+            WHERE transaction_hash IN ({", ".join("?" * len(chunk))})""",
+            chunk,
+        )
+        for transaction_hash, value, block_number in cur:
+            transactions[transaction_hash] = (int(value), block_number)
+    return transactions
+
+
+def insert_cached_transactions(
+    conn: sqlite3.Connection,
+    transactions: Dict[str, Tuple[int, int]],
+    commit: bool = True,
+) -> None:
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT OR IGNORE INTO transactions_cache (transaction_hash, transaction_value, block_number) VALUES (?, ?, ?)",
+        [
+            (transaction_hash, str(value), block_number)
+            for transaction_hash, (value, block_number) in transactions.items()
+        ],
+    )
+    if commit:
+        conn.commit()
+
+
+def get_cached_block_timestamps(
+    conn: sqlite3.Connection, block_numbers: List[int]
+) -> Dict[int, int]:
+    cur = conn.cursor()
+    timestamps: Dict[int, int] = {}
+    for i in range(0, len(block_numbers), CACHE_LOOKUP_CHUNK_SIZE):
+        chunk = block_numbers[i : i + CACHE_LOOKUP_CHUNK_SIZE]
+        cur.execute(
+            f"""SELECT block_number, timestamp FROM blocks_cache
+            WHERE block_number IN ({", ".join("?" * len(chunk))})""",
+            chunk,
+        )
+        timestamps.update(cur)
+    return timestamps
+
+
+def insert_cached_block_timestamps(
+    conn: sqlite3.Connection, timestamps: Dict[int, int], commit: bool = True
+) -> None:
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT OR IGNORE INTO blocks_cache (block_number, timestamp) VALUES (?, ?)",
+        list(timestamps.items()),
+    )
+    if commit:
+        conn.commit()
+
+
 def insert_address_metadata(
     conn: sqlite3.Connection, metadata_list: List[NFTMetadata]
 ) -> None:
@@ -308,11 +451,14 @@ INSERT INTO nfts (
         raise e
 
 
-def insert_events(conn: sqlite3.Connection, events: List[NFTEvent]) -> None:
+def insert_events(
+    conn: sqlite3.Connection, events: List[NFTEvent], commit: bool = True
+) -> None:
     """
     Inserts the given events into the appropriate events table in the given SQLite database.
 
-    This method works with batches of events.
+    This method works with batches of events. With commit=False the caller commits the
+    transaction, e.g. together with export cursor.
     """
     cur = conn.cursor()
     try:
@@ -331,7 +477,8 @@ def insert_events(conn: sqlite3.Connection, events: List[NFTEvent]) -> None:
         cur.executemany(insert_events_query(EventType.TRANSFER), transfers)
         cur.executemany(insert_events_query(EventType.MINT), mints)
 
-        conn.commit()
+        if commit:
+            conn.commit()
     except Exception as e:
         logger.error(f"FAILED TO SAVE :{events}")
         conn.rollback()
@@ -434,6 +581,11 @@ def import_data(
         delete_checkpoints(target_conn, event_type, commit=False)
         insert_checkpoint(target_conn, event_type, source_offset)
 
+    if event_type != EventType.ERC721:
+        source_cursor = get_export_cursor(source_conn, event_type)
+        if source_cursor is not None:
+            set_export_cursor(target_conn, event_type, *source_cursor)
+
 
 def filter_data(
     sqlite_db: sqlite3.Connection,
@@ -5,18 +5,44 @@ For example:
 - Current owner of each token
 - Current value of each token
 """
+import contextlib
+import hashlib
+import json
 import logging
 import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+# Mints and transfers of all tokens
+ALL_EVENTS_QUERY = """
+    SELECT nft_address, token_id, to_address, transaction_value, block_number, 0 AS event_order, rowid AS event_rowid FROM mints
+    UNION ALL
+    SELECT nft_address, token_id, to_address, transaction_value, block_number, 1 AS event_order, rowid AS event_rowid FROM transfers
+"""
+
+# Orders events of ALL_EVENTS_QUERY from the latest one: by block number, transfers after mints
+# of the same block and then by order of insertion into datastore, which does not keep log
+# indexes. Events with unknown block number (not enriched yet) are the latest ones.
+LATEST_EVENTS_ORDER = """
+    CASE WHEN typeof(block_number) = 'integer' THEN block_number END DESC NULLS FIRST,
+    event_order DESC,
+    event_rowid DESC
+"""
+
 
 class LastValue:
     """
     Stores the last seen value in a given column. This is meant to be used as an aggregate function.
-    We use it, for example, to get the current owner of an NFT (inside a given window of time).
+
+    Derived relations are built with native SQLite aggregates now, custom aggregates are kept
+    for queries which use them and for benchmark_derive.
     """
 
     def __init__(self):
@@ -81,31 +107,113 @@ def ensure_custom_aggregate_functions(conn: sqlite3.Connection) -> None:
     conn.create_function("quantile_25", 1, QuantileFunction(25))
 
 
-def current_owners(conn: sqlite3.Connection) -> None:
+def quantile_edges(num_quantiles: int) -> List[float]:
     """
-    Requires a connection to a dataset in which the raw data (esp. transfers) has already been
-    loaded.
+    Upper edges of quantiles accumulated the same way as QuantileFunction does it, so values
+    on edges fall into the same quantiles.
     """
-    ensure_custom_aggregate_functions(conn)
-    drop_existing_current_owners_query = "DROP TABLE IF EXISTS current_owners;"
-    current_owners_query = """
-    CREATE TABLE current_owners AS
-        SELECT nft_address, token_id, last_value(to_address) AS owner FROM
+    divider = 1 / num_quantiles
+    edges = [divider]
+    while edges[-1] <= 1:
+        edges.append(edges[-1] + divider)
+    return edges
+
+
+def quantile_expression(value: str, num_quantiles: int) -> str:
+    """
+    SQL expression which evaluates the same quantile as QuantileFunction for value expression,
+    without calling back into Python for each row.
+    """
+    cases = " ".join(
+        f"WHEN {value} <= {edge!r} THEN {edge!r}"
+        for edge in quantile_edges(num_quantiles)
+        if edge <= 1
+    )
+    # QuantileFunction caps quantiles above 1 to integer 1
+    return f"CASE {cases} ELSE 1 END"
+
+
+def current_owners_query() -> str:
+    return f"""
+        SELECT nft_address, token_id, owner FROM
         (
-            SELECT * FROM mints
-            UNION ALL
-            SELECT * FROM transfers
+            SELECT
+                nft_address,
+                token_id,
+                to_address AS owner,
+                ROW_NUMBER() OVER (
+                    PARTITION BY nft_address, token_id ORDER BY {LATEST_EVENTS_ORDER}
+                ) AS event_number
+            FROM ({ALL_EVENTS_QUERY})
         )
-        GROUP BY nft_address, token_id;"""
+        WHERE event_number = 1"""
+
+
+def current_market_values_query() -> str:
+    # Events with nonzero value go first, so an event without it is picked only if token has
+    # no nonzero values and then market value is 0
+    return f"""
+        SELECT
+            nft_address,
+            token_id,
+            CASE WHEN has_value THEN transaction_value ELSE 0 END AS market_value
+        FROM
+        (
+            SELECT
+                nft_address,
+                token_id,
+                transaction_value,
+                has_value,
+                ROW_NUMBER() OVER (
+                    PARTITION BY nft_address, token_id
+                    ORDER BY has_value DESC, {LATEST_EVENTS_ORDER}
+                ) AS event_number
+            FROM
+            (
+                SELECT
+                    *,
+                    typeof(transaction_value) IN ('integer', 'real')
+                        AND transaction_value != 0 AS has_value
+                FROM ({ALL_EVENTS_QUERY})
+            )
+        )
+        WHERE event_number = 1"""
+
+
+def derive_table(conn: sqlite3.Connection, table_name: str, select_query: str) -> None:
+    """
+    Replaces table with result of select query.
+
+    Query runs into temporary table of the connection first, so the datastore is locked for
+    writes only while the result is copied into it. Derive stages running on other connections
+    to the datastore in WAL mode compute their tables at the same time, and the old table stays
+    in place if the query fails.
+    """
+    staging_table = f"temp.derive_{table_name}"
     cur = conn.cursor()
     try:
-        cur.execute(drop_existing_current_owners_query)
-        cur.execute(current_owners_query)
+        cur.execute(f"DROP TABLE IF EXISTS {staging_table};")
+        cur.execute(f"CREATE TABLE {staging_table} AS {select_query};")
+        conn.commit()
+        cur.execute("BEGIN IMMEDIATE;")
+        cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+        cur.execute(f"CREATE TABLE {table_name} AS SELECT * FROM {staging_table};")
         conn.commit()
     except Exception as e:
         conn.rollback()
-        logger.error("Could not create derived dataset: current_owners")
+        logger.error(f"Could not create derived dataset: {table_name}")
         logger.error(e)
+        raise
+    finally:
+        cur.execute(f"DROP TABLE IF EXISTS {staging_table};")
+
+
+def current_owners(conn: sqlite3.Connection) -> None:
+    """
+    Requires a connection to a dataset in which the raw data (esp. transfers) has already been
+    loaded.
+    """
+    derive_table(conn, "current_owners", current_owners_query())
 
 
 def current_market_values(conn: sqlite3.Connection) -> None:
@@ -113,39 +221,14 @@ def current_market_values(conn: sqlite3.Connection) -> None:
     Requires a connection to a dataset in which the raw data (esp. transfers) has already been
     loaded.
     """
-    ensure_custom_aggregate_functions(conn)
-    drop_existing_current_market_values_query = (
-        "DROP TABLE IF EXISTS current_market_values;"
-    )
-    current_market_values_query = """
-    CREATE TABLE current_market_values AS
-        SELECT nft_address, token_id, last_nonzero_value(transaction_value) AS market_value FROM
-        (
-            SELECT * FROM mints
-            UNION ALL
-            SELECT * FROM transfers
-        )
-        GROUP BY nft_address, token_id;"""
-    cur = conn.cursor()
-    try:
-        cur.execute(drop_existing_current_market_values_query)
-        cur.execute(current_market_values_query)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error("Could not create derived dataset: current_market_values")
+    derive_table(conn, "current_market_values", current_market_values_query())
 
 
 def current_values_distribution(conn: sqlite3.Connection) -> None:
     """
     Requires a connection to a dataset in which current_market_values has already been loaded.
     """
-    ensure_custom_aggregate_functions(conn)
-    drop_existing_values_distribution_query = (
-        "DROP TABLE IF EXISTS market_values_distribution;"
-    )
     current_values_distribution_query = """
-        CREATE TABLE market_values_distribution AS
         select
             current_market_values.nft_address as address,
             current_market_values.token_id as token_id,
@@ -160,28 +243,16 @@ def current_values_distribution(conn: sqlite3.Connection) -> None:
                     current_market_values
                 group by
                     nft_address
-            ) as max_values on current_market_values.nft_address = max_values.nft_address;
+            ) as max_values on current_market_values.nft_address = max_values.nft_address
     """
-    cur = conn.cursor()
-    try:
-        cur.execute(drop_existing_values_distribution_query)
-        cur.execute(current_values_distribution_query)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error("Could not create derived dataset: current_values_distribution")
-        logger.error(e)
+    derive_table(conn, "market_values_distribution", current_values_distribution_query)
 
 
 def transfer_statistics_by_address(conn: sqlite3.Connection) -> None:
     """
     Create transfer in and transfer out for each address.
     """
-    drop_existing_transfer_statistics_by_address_query = (
-        "DROP TABLE IF EXISTS transfer_statistics_by_address;"
-    )
     transfer_statistics_by_address_query = """
-        CREATE TABLE transfer_statistics_by_address AS
         SELECT
             address,
             sum(transfer_out) as transfers_out,
@@ -204,97 +275,66 @@ def transfer_statistics_by_address(conn: sqlite3.Connection) -> None:
                     transfers
             )
         group by
-            address;
+            address
         """
-    cur = conn.cursor()
-    try:
-        cur.execute(drop_existing_transfer_statistics_by_address_query)
-        cur.execute(transfer_statistics_by_address_query)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error("Could not create derived dataset: transfer_statistics_by_address")
-        logger.error(e)
+    derive_table(
+        conn, "transfer_statistics_by_address", transfer_statistics_by_address_query
+    )
+
+
+RELATIVE_MARKET_VALUES_QUERY = """
+    select
+        current_market_values.nft_address as address,
+        COALESCE(
+            CAST(current_market_values.market_value as REAL) / max_values.max_value,
+            0
+        ) as relative_value
+    from
+        current_market_values
+        inner join (
+            select
+                current_market_values.nft_address,
+                max(market_value) as max_value
+            from
+                current_market_values
+            group by
+                current_market_values.nft_address
+        ) as max_values on current_market_values.nft_address = max_values.nft_address
+"""
+
+
+def quantiles_query(num_quantiles: int, relative_values_table: str) -> str:
+    return f"""
+        select
+            address,
+            CAST({quantile_expression("COALESCE(relative_value, 0)", num_quantiles)} as TEXT) as quantiles,
+            relative_value
+        from {relative_values_table}"""
 
 
 def quantile_generating(conn: sqlite3.Connection):
     """
     Create quantile wich depends on setted on class defenition
     """
-    ensure_custom_aggregate_functions(conn)
-    drop_calculate_10_quantiles = (
-        "DROP TABLE IF EXISTS transfer_values_quantile_10_distribution_per_address;"
-    )
-    calculate_10_quantiles = """
-    CREATE TABLE transfer_values_quantile_10_distribution_per_address AS
-    select
-            cumulate.address as address,
-            CAST(quantile_10(cumulate.relative_value) as TEXT) as quantiles,
-            cumulate.relative_value as relative_value
-        from
-        (
-                select
-                    current_market_values.nft_address as address,
-                    COALESCE(
-                        CAST(current_market_values.market_value as REAL) / max_values.max_value,
-                        0
-                    ) as relative_value
-                from
-                    current_market_values
-                    inner join (
-                        select
-                            current_market_values.nft_address,
-                            max(market_value) as max_value
-                        from
-                            current_market_values
-                        group by
-                            current_market_values.nft_address
-                    ) as max_values on current_market_values.nft_address = max_values.nft_address
-        ) as cumulate
-    """
-    drop_calculate_25_quantiles = (
-        "DROP TABLE IF EXISTS transfer_values_quantile_25_distribution_per_address;"
-    )
-    calculate_25_quantiles = """
-    CREATE TABLE transfer_values_quantile_25_distribution_per_address AS
-    select
-            cumulate.address as address,
-            CAST(quantile_25(cumulate.relative_value) as TEXT) as quantiles,
-            cumulate.relative_value as relative_value
-        from
-        (
-                select
-                    current_market_values.nft_address as address,
-                    COALESCE(
-                        CAST(current_market_values.market_value as REAL) / max_values.max_value,
-                        0
-                    ) as relative_value
-                from
-                    current_market_values
-                    inner join (
-                        select
-                            current_market_values.nft_address,
-                            max(market_value) as max_value
-                        from
-                            current_market_values
-                        group by
-                            current_market_values.nft_address
-                    ) as max_values on current_market_values.nft_address = max_values.nft_address
-        ) as cumulate
-    """
     cur = conn.cursor()
     try:
-        print("Creating transfer_values_quantile_10_distribution_per_address")
-        cur.execute(drop_calculate_10_quantiles)
-        cur.execute(calculate_10_quantiles)
-        print("Creating transfer_values_quantile_25_distribution_per_address")
-        cur.execute(drop_calculate_25_quantiles)
-        cur.execute(calculate_25_quantiles)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error("Could not create derived dataset: quantile_generating")
-        logger.error(e)
+        # Relative values are computed once for all quantile tables
+        cur.execute("DROP TABLE IF EXISTS temp.relative_market_values;")
+        cur.execute(
+            f"CREATE TABLE temp.relative_market_values AS {RELATIVE_MARKET_VALUES_QUERY};"
+        )
+        for num_quantiles in (10, 25):
+            table_name = (
+                f"transfer_values_quantile_{num_quantiles}_distribution_per_address"
+            )
+            logger.info(f"Creating {table_name}")
+            derive_table(
+                conn,
+                table_name,
+                quantiles_query(num_quantiles, "temp.relative_market_values"),
+            )
+    finally:
+        cur.execute("DROP TABLE IF EXISTS temp.relative_market_values;")
 
 
 def transfers_mints_connection_table(conn: sqlite3.Connection):
@@ -302,77 +342,33 @@ def transfers_mints_connection_table(conn: sqlite3.Connection):
     Create cinnection transfers and mints
     """
 
-    drop_transfers_mints_connection = "DROP TABLE IF EXISTS transfers_mints;"
+    # As-of join: each transfer is connected to the latest mint of its token at or before the
+    # transfer, found by seek in mints_token_timestamp index instead of joining all mints of token
     transfers_mints_connection = """
-    CREATE TABLE transfers_mints as
     select
         transfers.event_id as transfer_id,
-        mints.mint_id as mint_id
+        mints.event_id as mint_id
     from
         transfers
-        inner join (
+        inner join mints on mints.nft_address = transfers.nft_address
+        and mints.token_id = transfers.token_id
+        and mints.timestamp = (
             select
-                Max(posable_mints.mints_time) as mint_time,
-                posable_mints.transfer_id as transfer_id
-            from
-                (
-                    select
-                        mint_id,
-                        mints.timestamp as mints_time,
-                        transfers.token_id,
-                        transfers.timestamp,
-                        transfers.event_id as transfer_id
-                    from
-                        transfers
-                        inner join (
-                            select
-                                mints.event_id as mint_id,
-                                mints.nft_address,
-                                mints.token_id,
-                                mints.timestamp
-                            from
-                                mints
-                            group by
-                                mints.nft_address,
-                                mints.token_id,
-                                mints.timestamp
-                        ) as mints on transfers.nft_address = mints.nft_address
-                        and transfers.token_id = mints.token_id
-                        and mints.timestamp <= transfers.timestamp
-                ) as posable_mints
-            group by
-                posable_mints.transfer_id
-        ) as mint_time on mint_time.transfer_id = transfers.event_id
-        inner join (
-            select
-                mints.event_id as mint_id,
-                mints.nft_address,
-                mints.token_id,
-                mints.timestamp
+                max(previous_mints.timestamp)
             from
-                mints
-        ) as mints on transfers.nft_address = mints.nft_address
-        and transfers.token_id = mints.token_id
-        and mints.timestamp = mint_time.mint_time;
-    """
-    cur = conn.cursor()
-    try:
-        cur.execute(drop_transfers_mints_connection)
-        cur.execute(transfers_mints_connection)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(
-            "Could not create derived dataset: transfers_mints_connection_table"
+                mints as previous_mints
+            where
+                previous_mints.nft_address = transfers.nft_address
+                and previous_mints.token_id = transfers.token_id
+                and previous_mints.timestamp <= transfers.timestamp
         )
-        logger.error(e)
+    """
+    derive_table(conn, "transfers_mints", transfers_mints_connection)
 
 
 def mint_holding_times(conn: sqlite3.Connection):
 
-    drop_mints_holding_table = "DROP TABLE IF EXISTS mint_holding_times;"
     mints_holding_table = """
-    CREATE TABLE mint_holding_times AS
     SELECT
         days_after_minted.days as days,
         count(*) as num_holds
@@ -401,26 +397,16 @@ def mint_holding_times(conn: sqlite3.Connection):
                         transfers_mints.mint_id
                 ) as firsts_transfers on firsts_transfers.mint_id = mints.event_id
         ) as days_after_minted
-    group by days;
+    group by days
     """
-    cur = conn.cursor()
-    try:
-        cur.execute(drop_mints_holding_table)
-        cur.execute(mints_holding_table)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error("Could not create derived dataset: mint_holding_times")
-        logger.error(e)
+    derive_table(conn, "mint_holding_times", mints_holding_table)
 
 
 def transfer_holding_times(conn: sqlite3.Connection):
     """
     Create distributions of holding times beetween transfers
     """
-    drop_transfer_holding_times = "DROP TABLE IF EXISTS transfer_holding_times;"
     transfer_holding_times = """
-    CREATE TABLE transfer_holding_times AS
     select days_beetween.days as days, count(*) as num_holds
         from (SELECT
             middle.address,
@@ -444,17 +430,9 @@ def transfer_holding_times(conn: sqlite3.Connection):
         where
             LEAD is not Null
         ) as days_beetween
-        group by days;
+        group by days
     """
-    cur = conn.cursor()
-    try:
-        cur.execute(drop_transfer_holding_times)
-        cur.execute(transfer_holding_times)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error("Could not create derived dataset: transfer_holding_times")
-        logger.error(e)
+    derive_table(conn, "transfer_holding_times", transfer_holding_times)
 
 
 def ownership_transitions(conn: sqlite3.Connection) -> None:
@@ -468,10 +446,8 @@ def ownership_transitions(conn: sqlite3.Connection) -> None:
     - current_owners
     """
     table_name = "ownership_transitions"
-    drop_ownership_transitions = f"DROP TABLE IF EXISTS {table_name};"
     # TODO(zomglings): Adding transaction_value below causes integer overflow. Might be worth trying MEAN instead of SUM for value transferred.
-    create_ownership_transitions = f"""
-CREATE TABLE {table_name} AS
+    create_ownership_transitions = """
 WITH transitions(from_address, to_address, transition) AS (
     SELECT current_owners.owner as from_address, current_owners.owner as to_address, 1 as transition FROM current_owners
     UNION ALL
@@ -481,14 +457,393 @@ SELECT
     transitions.from_address,
     transitions.to_address,
     sum(transitions.transition) as num_transitions
-FROM transitions GROUP BY transitions.from_address, transitions.to_address;
+FROM transitions GROUP BY transitions.from_address, transitions.to_address
 """
+    derive_table(conn, table_name, create_ownership_transitions)
+
+
+LEGACY_CURRENT_OWNERS_QUERY = """
+    CREATE TABLE {table_name} AS
+        SELECT nft_address, token_id, last_value(to_address) AS owner FROM
+        (
+            SELECT * FROM mints
+            UNION ALL
+            SELECT * FROM transfers
+        )
+        GROUP BY nft_address, token_id;"""
+
+LEGACY_CURRENT_MARKET_VALUES_QUERY = """
+    CREATE TABLE {table_name} AS
+        SELECT nft_address, token_id, last_nonzero_value(transaction_value) AS market_value FROM
+        (
+            SELECT * FROM mints
+            UNION ALL
+            SELECT * FROM transfers
+        )
+        GROUP BY nft_address, token_id;"""
+
+LEGACY_QUANTILES_QUERY = """
+    CREATE TABLE {table_name} AS
+        select
+            cumulate.address as address,
+            CAST(quantile_{num_quantiles}(cumulate.relative_value) as TEXT) as quantiles,
+            cumulate.relative_value as relative_value
+        from ({relative_values_query}) as cumulate"""
+
+
+def _differing_rows(conn: sqlite3.Connection, first: str, second: str) -> int:
     cur = conn.cursor()
-    try:
-        cur.execute(drop_ownership_transitions)
-        cur.execute(create_ownership_transitions)
+    cur.execute(
+        f"""SELECT count(*) FROM (
+            SELECT * FROM (SELECT * FROM {first} EXCEPT SELECT * FROM {second})
+            UNION ALL
+            SELECT * FROM (SELECT * FROM {second} EXCEPT SELECT * FROM {first})
+        );"""
+    )
+    return cur.fetchone()[0]
+
+
+def benchmark_derive(
+    conn: sqlite3.Connection, repeats: int = 1
+) -> Dict[str, Dict[str, float]]:
+    """
+    Measures derive of current_owners, current_market_values and quantiles against custom Python
+    aggregates and functions they replaced.
+
+    Both implementations write to temporary tables which are dropped afterwards, so datastore is
+    left unchanged. Quantiles are computed from current_market_values table of datastore.
+    differing_rows counts rows which are in result of one implementation only, owners and
+    market values of legacy implementation depend on row order chosen by SQLite.
+    """
+    ensure_custom_aggregate_functions(conn)
+    cur = conn.cursor()
+
+    def execute_query(query: str, table_name: str, **kwargs: Any) -> None:
+        cur.execute(query.format(table_name=table_name, **kwargs))
+
+    def create_quantiles(num_quantiles: int, table_name: str) -> None:
+        cur.execute(
+            f"CREATE TABLE {table_name} AS "
+            + quantiles_query(num_quantiles, f"({RELATIVE_MARKET_VALUES_QUERY})")
+        )
+
+    benchmarks: List[Tuple[str, Callable[[str], None], Callable[[str], None]]] = [
+        (
+            "current_owners",
+            partial(execute_query, LEGACY_CURRENT_OWNERS_QUERY),
+            partial(
+                execute_query, "CREATE TABLE {table_name} AS " + current_owners_query()
+            ),
+        ),
+        (
+            "current_market_values",
+            partial(execute_query, LEGACY_CURRENT_MARKET_VALUES_QUERY),
+            partial(
+                execute_query,
+                "CREATE TABLE {table_name} AS " + current_market_values_query(),
+            ),
+        ),
+    ]
+    for num_quantiles in (10, 25):
+        benchmarks.append(
+            (
+                f"quantile_{num_quantiles}",
+                partial(
+                    execute_query,
+                    LEGACY_QUANTILES_QUERY,
+                    num_quantiles=num_quantiles,
+                    relative_values_query=RELATIVE_MARKET_VALUES_QUERY,
+                ),
+                partial(create_quantiles, num_quantiles),
+            )
+        )
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, legacy_derive, derive in benchmarks:
+        legacy_table = f"temp.benchmark_legacy_{name}"
+        table = f"temp.benchmark_{name}"
+        timings: Dict[str, List[float]] = {"legacy_seconds": [], "seconds": []}
+        try:
+            for _ in range(repeats):
+                for key, table_name, derive_function in (
+                    ("legacy_seconds", legacy_table, legacy_derive),
+                    ("seconds", table, derive),
+                ):
+                    cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+                    started_at = time.perf_counter()
+                    derive_function(table_name)
+                    timings[key].append(time.perf_counter() - started_at)
+            differing_rows = _differing_rows(conn, legacy_table, table)
+        finally:
+            cur.execute(f"DROP TABLE IF EXISTS {legacy_table};")
+            cur.execute(f"DROP TABLE IF EXISTS {table};")
+            conn.commit()
+
+        legacy_seconds = min(timings["legacy_seconds"])
+        seconds = min(timings["seconds"])
+        results[name] = {
+            "legacy_seconds": legacy_seconds,
+            "seconds": seconds,
+            "speedup": legacy_seconds / seconds if seconds > 0 else float("inf"),
+            "differing_rows": differing_rows,
+        }
+        logger.info(f"Derive benchmark for {name}: {results[name]}")
+
+    return results
+
+
+@dataclass
+class DeriveStage:
+    """
+    Derive function with tables it reads and tables it creates.
+    """
+
+    name: str
+    function: Callable[[sqlite3.Connection], None]
+    inputs: List[str]
+    outputs: List[str]
+    # Indexes created on outputs for stages which read them
+    indexes: List[str] = field(default_factory=list)
+
+
+# Stages in order in which they run sequentially
+DERIVE_STAGES = [
+    DeriveStage(
+        name="current_owners",
+        function=current_owners,
+        inputs=["mints", "transfers"],
+        outputs=["current_owners"],
+    ),
+    DeriveStage(
+        name="current_market_values",
+        function=current_market_values,
+        inputs=["mints", "transfers"],
+        outputs=["current_market_values"],
+        indexes=[
+            "CREATE INDEX IF NOT EXISTS current_market_values_address ON current_market_values (nft_address, market_value);"
+        ],
+    ),
+    DeriveStage(
+        name="current_values_distribution",
+        function=current_values_distribution,
+        inputs=["current_market_values"],
+        outputs=["market_values_distribution"],
+    ),
+    DeriveStage(
+        name="quantile_generating",
+        function=quantile_generating,
+        inputs=["current_market_values"],
+        outputs=[
+            "transfer_values_quantile_10_distribution_per_address",
+            "transfer_values_quantile_25_distribution_per_address",
+        ],
+    ),
+    DeriveStage(
+        name="transfer_statistics_by_address",
+        function=transfer_statistics_by_address,
+        inputs=["transfers"],
+        outputs=["transfer_statistics_by_address"],
+    ),
+    DeriveStage(
+        name="transfers_mints_connection_table",
+        function=transfers_mints_connection_table,
+        inputs=["mints", "transfers"],
+        outputs=["transfers_mints"],
+    ),
+    DeriveStage(
+        name="mint_holding_times",
+        function=mint_holding_times,
+        inputs=["mints", "transfers", "transfers_mints"],
+        outputs=["mint_holding_times"],
+    ),
+    DeriveStage(
+        name="transfer_holding_times",
+        function=transfer_holding_times,
+        inputs=["transfers"],
+        outputs=["transfer_holding_times"],
+    ),
+    DeriveStage(
+        name="ownership_transitions",
+        function=ownership_transitions,
+        inputs=["transfers", "current_owners"],
+        outputs=["ownership_transitions"],
+    ),
+]
+
+# Covering indexes of raw tables for windows by token and as-of join of transfers to mints
+DERIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS mints_token_timestamp ON mints (nft_address, token_id, timestamp, event_id);",
+    "CREATE INDEX IF NOT EXISTS transfers_token_timestamp ON transfers (nft_address, token_id, timestamp);",
+]
+
+CREATE_DERIVE_STATE_TABLE_QUERY = """CREATE TABLE IF NOT EXISTS derive_state
+    (
+        stage TEXT NOT NULL PRIMARY KEY,
+        signature TEXT NOT NULL,
+        derived_at INTEGER NOT NULL
+    );
+"""
+
+# Seconds to wait for write lock held by other derive stage
+DERIVE_CONNECTION_TIMEOUT = 600
+
+
+def _connect(datastore: str) -> sqlite3.Connection:
+    return sqlite3.connect(datastore, timeout=DERIVE_CONNECTION_TIMEOUT)
+
+
+def _table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;", [table_name]
+    )
+    return cur.fetchone() is not None
+
+
+def _stage_signature(
+    conn: sqlite3.Connection, stage: DeriveStage, producers: Dict[str, DeriveStage]
+) -> str:
+    """
+    Identifies inputs of stage. Raw tables are identified by number of rows and largest rowid,
+    which change on inserts, deletes and replaces of events (but not on in-place updates).
+    Derived tables are identified by signature of stage which created them.
+    """
+    cur = conn.cursor()
+    input_signatures: Dict[str, Any] = {}
+    for table_name in stage.inputs:
+        if not _table_exists(conn, table_name):
+            input_signatures[table_name] = None
+            continue
+        producer = producers.get(table_name)
+        if producer is not None:
+            cur.execute(
+                "SELECT signature FROM derive_state WHERE stage = ?;", [producer.name]
+            )
+            row = cur.fetchone()
+            if row is not None:
+                input_signatures[table_name] = row[0]
+                continue
+        cur.execute(f"SELECT count(*), max(rowid) FROM {table_name};")
+        input_signatures[table_name] = list(cur.fetchone())
+
+    return hashlib.sha256(
+        json.dumps(input_signatures, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _run_stage(
+    datastore: str,
+    stage: DeriveStage,
+    producers: Dict[str, DeriveStage],
+    force: bool,
+) -> str:
+    """
+    Runs stage on its own connection to datastore, returns "derived" or "skipped" if inputs of
+    stage did not change since it was derived last time.
+    """
+    with contextlib.closing(_connect(datastore)) as conn:
+        cur = conn.cursor()
+        signature = _stage_signature(conn, stage, producers)
+        if not force and all(
+            _table_exists(conn, table_name) for table_name in stage.outputs
+        ):
+            cur.execute(
+                "SELECT signature FROM derive_state WHERE stage = ?;", [stage.name]
+            )
+            row = cur.fetchone()
+            if row is not None and row[0] == signature:
+                return "skipped"
+
+        started_at = time.perf_counter()
+        stage.function(conn)
+        for index_query in stage.indexes:
+            cur.execute(index_query)
+        cur.execute(
+            "REPLACE INTO derive_state (stage, signature, derived_at) VALUES (?, ?, ?);",
+            [stage.name, signature, int(time.time())],
+        )
         conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Could not create derived dataset: {table_name}")
-        logger.error(e)
+        logger.info(
+            f"Derived {stage.name} in {time.perf_counter() - started_at:.2f} seconds"
+        )
+        return "derived"
+
+
+def run_derive_pipeline(
+    datastore: str,
+    stage_names: Optional[List[str]] = None,
+    workers: int = 4,
+    force: bool = False,
+) -> Dict[str, str]:
+    """
+    Runs derive stages (all of them by default) on datastore, each stage starts as soon as stages
+    which create its inputs are finished. Up to workers independent stages run concurrently on
+    separate connections, datastore is switched to WAL mode so they read while others write.
+
+    Stages whose inputs did not change since the last run are skipped unless force is True.
+    Returns status of each stage: "derived", "skipped", "failed" or "blocked" (stage creating
+    its input failed).
+    """
+    assert workers > 0, "workers must be greater than 0"
+    stages = DERIVE_STAGES
+    if stage_names is not None:
+        unknown_stages = set(stage_names) - {stage.name for stage in DERIVE_STAGES}
+        if unknown_stages:
+            raise ValueError(f"Unknown derive stages: {sorted(unknown_stages)}")
+        stages = [stage for stage in DERIVE_STAGES if stage.name in stage_names]
+
+    producers = {
+        table_name: stage for stage in DERIVE_STAGES for table_name in stage.outputs
+    }
+    # Dependencies on stages which do not run are satisfied by tables already in datastore
+    dependencies = {
+        stage.name: {
+            producers[table_name].name
+            for table_name in stage.inputs
+            if table_name in producers and producers[table_name] in stages
+        }
+        for stage in stages
+    }
+
+    with contextlib.closing(_connect(datastore)) as conn:
+        cur = conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL;")
+        cur.execute(CREATE_DERIVE_STATE_TABLE_QUERY)
+        for index_query in DERIVE_INDEXES:
+            cur.execute(index_query)
+        conn.commit()
+
+    statuses: Dict[str, str] = {}
+    pending = list(stages)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running: Dict[Future, DeriveStage] = {}
+        while pending or running:
+            for stage in list(pending):
+                if any(
+                    statuses.get(dependency) in ("failed", "blocked")
+                    for dependency in dependencies[stage.name]
+                ):
+                    statuses[stage.name] = "blocked"
+                    pending.remove(stage)
+                elif all(
+                    dependency in statuses for dependency in dependencies[stage.name]
+                ):
+                    running[
+                        executor.submit(_run_stage, datastore, stage, producers, force)
+                    ] = stage
+                    pending.remove(stage)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    statuses[stage.name] = future.result()
+                except Exception as e:
+                    logger.error(f"Derive stage {stage.name} failed: {e}")
+                    statuses[stage.name] = "failed"
+
+    for stage in stages:
+        logger.info(f"Derive stage {stage.name}: {statuses[stage.name]}")
+    return statuses
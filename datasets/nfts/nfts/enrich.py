@@ -1,18 +1,26 @@
 import logging
 import sqlite3
-from typing import Any, cast, Iterator, List, Optional, Set
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, cast, Dict, Iterator, List, Optional, Set, Tuple
 import json
 
 from tqdm import tqdm
 import requests
+from requests.adapters import HTTPAdapter
 
 from .data import BlockBounds, EventType, NFTEvent, event_types
 from .datastore import (
+    get_cached_block_timestamps,
+    get_cached_transactions,
     get_checkpoint_offset,
     get_events_for_enrich,
     insert_address_metadata,
+    insert_cached_block_timestamps,
+    insert_cached_transactions,
     insert_checkpoint,
     insert_events,
+    setup_enrich_cache,
     update_events_batch,
 )
 
@@ -21,57 +29,60 @@ logger = logging.getLogger(__name__)
 
 
 class EthereumBatchloader:
-    def __init__(self, jsonrpc_url) -> None:
+    """
+    Sends JSON-RPC requests to node in batches of at most chunk_size requests, up to
+    max_workers batches are in flight at a time over pooled HTTP connections.
+
+    Requests which failed, whole batch or single items of batch, are retried up to
+    max_retries times.
+    """
+
+    def __init__(
+        self,
+        jsonrpc_url,
+        chunk_size: int = 100,
+        max_workers: int = 4,
+        max_retries: int = 3,
+        timeout: int = 60,
+    ) -> None:
+        assert chunk_size > 0, "chunk_size must be greater than 0"
+        assert max_workers > 0, "max_workers must be greater than 0"
         self.jsonrpc_url = jsonrpc_url
-        self.message_number = 0
-        self.commands: List[Any] = []
-        self.requests_banch: List[Any] = []
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def load_blocks(self, block_list: List[int], with_transactions: bool):
         """
         Request list of blocks
         """
-        rpc = [
-            {
-                "jsonrpc": "2.0",
-                "id": index,
-                "method": "eth_getBlockByNumber",
-                "params": params_single,
-            }
-            for index, params_single in enumerate(
-                [[hex(block_number), with_transactions] for block_number in block_list]
-            )
-        ]
-        response = self.send_json_message(rpc)
-        return response
+        return self.send_requests(
+            "eth_getBlockByNumber",
+            [[hex(block_number), with_transactions] for block_number in block_list],
+        )
 
     def load_transactions(self, transaction_hashes: List[str]):
         """
         Request list of transactions
         """
-
-        rpc = [
-            {
-                "jsonrpc": "2.0",
-                "method": "eth_getTransactionByHash",
-                "id": index,
-                "params": [tx_hash],
-            }
-            for index, tx_hash in enumerate(transaction_hashes)
-        ]
-        response = self.send_json_message(rpc)
-        return response
+        return self.send_requests(
+            "eth_getTransactionByHash",
+            [[tx_hash] for tx_hash in transaction_hashes],
+        )
 
     def send_message(self, payload):
         headers = {"Content-Type": "application/json"}
 
-        try:
-            r = requests.post(
-                self.jsonrpc_url, headers=headers, data=payload, timeout=300
-            )
-        except Exception as e:
-            print(e)
-            raise e
+        r = self.session.post(
+            self.jsonrpc_url, headers=headers, data=payload, timeout=self.timeout
+        )
+        r.raise_for_status()
         return r
 
     def send_json_message(self, message):
@@ -80,13 +91,72 @@ class EthereumBatchloader:
         response = raw_response.json()
         return response
 
+    def _send_chunk(self, rpc: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """
+        Returns successful responses of batch by request id.
+        """
+        try:
+            response = self.send_json_message(rpc)
+        except Exception as e:
+            logger.warning(f"JSON-RPC batch of {len(rpc)} requests failed: {e}")
+            return {}
+        if not isinstance(response, list):
+            logger.warning(f"Unexpected JSON-RPC batch response: {response}")
+            return {}
+        return {
+            result["id"]: result
+            for result in response
+            if result.get("error") is None and result.get("result") is not None
+        }
+
+    def send_requests(self, method: str, params_list: List[List[Any]]):
+        """
+        Returns successful responses in order of params_list, requests which failed
+        after all retries are logged and left out.
+        """
+        rpc = [
+            {"jsonrpc": "2.0", "method": method, "id": index, "params": params}
+            for index, params in enumerate(params_list)
+        ]
+        responses: Dict[int, Dict[str, Any]] = {}
+        pending = rpc
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    logger.info(
+                        f"Retrying {len(pending)} {method} requests, attempt {attempt}"
+                    )
+                    time.sleep(min(2 ** (attempt - 1), 10))
+                chunks = [
+                    pending[i : i + self.chunk_size]
+                    for i in range(0, len(pending), self.chunk_size)
+                ]
+                for chunk_responses in executor.map(self._send_chunk, chunks):
+                    responses.update(chunk_responses)
+                pending = [
+                    request for request in pending if request["id"] not in responses
+                ]
+                if not pending:
+                    break
+
+        if pending:
+            logger.error(
+                f"Failed to get {len(pending)} of {len(rpc)} {method} responses"
+            )
+        return [responses[index] for index in sorted(responses)]
+
 
 def enrich_from_web3(
     nft_events: List[NFTEvent],
     batch_loader: EthereumBatchloader,
+    datastore_conn: Optional[sqlite3.Connection] = None,
 ) -> List[NFTEvent]:
     """
     Adds block number, value, timestamp from web3 if they are None (because that transaction is missing in db)
+
+    If datastore_conn is given, transactions and blocks already resolved are read from its
+    enrich cache and new ones are added to it (commit is left to the caller). Events which
+    could not be resolved are left as they are.
     """
     transactions_to_query = set()
     indices_to_update: List[int] = []
@@ -101,35 +171,70 @@ def enrich_from_web3(
 
     if len(transactions_to_query) == 0:
         return nft_events
-    logger.info("Calling JSON RPC API")
-    jsonrpc_transactions_response = batch_loader.load_transactions(
-        list(transactions_to_query)
-    )
 
-    transactions_map = {
-        result["result"]["hash"]: (
-            int(result["result"]["value"], 16),
-            int(result["result"]["blockNumber"], 16),
+    transactions_map: Dict[str, Tuple[int, int]] = {}
+    if datastore_conn is not None:
+        transactions_map = get_cached_transactions(
+            datastore_conn, list(transactions_to_query)
         )
-        for result in jsonrpc_transactions_response
-    }
+    transactions_to_load = [
+        transaction_hash
+        for transaction_hash in transactions_to_query
+        if transaction_hash not in transactions_map
+    ]
+    if transactions_to_load:
+        logger.info(
+            f"Calling JSON RPC API for {len(transactions_to_load)} transactions"
+        )
+        loaded_transactions = {
+            result["result"]["hash"]: (
+                int(result["result"]["value"], 16),
+                int(result["result"]["blockNumber"], 16),
+            )
+            for result in batch_loader.load_transactions(transactions_to_load)
+            if result["result"].get("blockNumber") is not None
+        }
+        if datastore_conn is not None:
+            insert_cached_transactions(
+                datastore_conn, loaded_transactions, commit=False
+            )
+        transactions_map.update(loaded_transactions)
 
-    blocks_to_query: Set[int] = set()
-    for index in indices_to_update:
-        nft_events[index].value, nft_events[index].block_number = transactions_map[
-            nft_events[index].transaction_hash
-        ]
-        blocks_to_query.add(cast(int, nft_events[index].block_number))
+    blocks_to_query: Set[int] = {
+        transactions_map[transaction_hash][1]
+        for transaction_hash in transactions_to_query
+        if transaction_hash in transactions_map
+    }
 
     if len(blocks_to_query) == 0:
         return nft_events
-    jsonrpc_blocks_response = batch_loader.load_blocks(list(blocks_to_query), False)
-    blocks_map = {
-        int(result["result"]["number"], 16): int(result["result"]["timestamp"], 16)
-        for result in jsonrpc_blocks_response
-    }
+
+    blocks_map: Dict[int, int] = {}
+    if datastore_conn is not None:
+        blocks_map = get_cached_block_timestamps(datastore_conn, list(blocks_to_query))
+    blocks_to_load = [
+        block_number
+        for block_number in blocks_to_query
+        if block_number not in blocks_map
+    ]
+    if blocks_to_load:
+        logger.info(f"Calling JSON RPC API for {len(blocks_to_load)} blocks")
+        loaded_blocks = {
+            int(result["result"]["number"], 16): int(result["result"]["timestamp"], 16)
+            for result in batch_loader.load_blocks(blocks_to_load, False)
+        }
+        if datastore_conn is not None:
+            insert_cached_block_timestamps(datastore_conn, loaded_blocks, commit=False)
+        blocks_map.update(loaded_blocks)
+
+    # Events are updated only if both transaction and block were resolved, so the rest
+    # are still selected for enrich on next run
     for index in indices_to_update:
-        nft_events[index].timestamp = blocks_map[cast(int, nft_event.block_number)]
+        transaction = transactions_map.get(nft_events[index].transaction_hash)
+        if transaction is None or transaction[1] not in blocks_map:
+            continue
+        nft_events[index].value, nft_events[index].block_number = transaction
+        nft_events[index].timestamp = blocks_map[transaction[1]]
 
     return nft_events
 
@@ -140,6 +245,7 @@ def enrich(
     batch_loader: EthereumBatchloader,
     batch_size: int = 1000,
 ) -> None:
+    setup_enrich_cache(datastore_conn)
     events = get_events_for_enrich(datastore_conn, event_type)
     events_batch = []
     for event in tqdm(events, f"Processing events for {event_type.value} event type"):
@@ -149,6 +255,7 @@ def enrich(
             enriched_events = enrich_from_web3(
                 events_batch,
                 batch_loader,
+                datastore_conn,
             )
             update_events_batch(datastore_conn, enriched_events)
             events_batch = []
@@ -157,5 +264,6 @@ def enrich(
     enriched_events = enrich_from_web3(
         events_batch,
         batch_loader,
+        datastore_conn,
     )
     update_events_batch(datastore_conn, enriched_events)
@@ -1,5 +1,7 @@
 import logging
 import sqlite3
+import uuid
+from datetime import datetime
 from typing import Any, cast, Iterator, List, Optional, Set
 import json
 
@@ -8,7 +10,7 @@ from moonstreamdb.models import (
     EthereumTransaction,
     EthereumBlock,
 )
-from sqlalchemy import or_, and_
+from sqlalchemy import and_, literal, or_, tuple_
 from sqlalchemy.orm import Session
 from tqdm import tqdm
 from web3 import Web3
@@ -17,15 +19,36 @@ import requests
 from .data import BlockBounds, EventType, NFTEvent, NFTMetadata, event_types
 from .datastore import (
     get_checkpoint_offset,
+    get_export_cursor,
     insert_address_metadata,
     insert_checkpoint,
     insert_events,
+    set_export_cursor,
 )
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _legacy_offset_created_at(
+    db_session: Session, event_type: EventType, offset: int
+) -> Optional[datetime]:
+    """
+    Checkpoints written before export cursor store offset in the list of distinct
+    created_at of labels, returns created_at at this offset.
+    """
+    row = (
+        db_session.query(EthereumLabel.created_at)
+        .filter(EthereumLabel.label == event_type.value)
+        .distinct(EthereumLabel.created_at)
+        .order_by(EthereumLabel.created_at.asc())
+        .offset(offset)
+        .limit(1)
+        .one_or_none()
+    )
+    return row[0] if row is not None else None
+
+
 def add_events(
     datastore_conn: sqlite3.Connection,
     db_session: Session,
@@ -33,17 +56,22 @@ def add_events(
     initial_offset=0,
     bounds: Optional[BlockBounds] = None,
     batch_size: int = 10,
+    page_size: int = 100000,
+    count_labels: bool = False,
 ) -> None:
-    raw_created_at_list = (
-        db_session.query(EthereumLabel.created_at)
-        .filter(EthereumLabel.label == event_type.value)
-        .order_by(EthereumLabel.created_at.asc())
-        .distinct(EthereumLabel.created_at)
-    ).all()
+    """
+    Streams labels of event type into datastore in keyset pages ordered by
+    (created_at, id).
+
+    Key of last written label is stored in export_cursor table in the same transaction
+    as each batch of events, so interrupted export resumes right after it.
+
+    If count_labels is True, labels are counted before export to show progress
+    towards total, it takes additional scan of labels.
+    """
+    assert batch_size > 0, "batch_size must be greater than 0"
+    assert page_size > 0, "page_size must be greater than 0"
 
-    created_at_list = [
-        created_at[0] for created_at in raw_created_at_list[initial_offset:]
-    ]
     query = (
         db_session.query(
             EthereumLabel.id,
@@ -54,6 +82,7 @@ def add_events(
             EthereumTransaction.value,
             EthereumTransaction.block_number,
             EthereumBlock.timestamp,
+            EthereumLabel.created_at,
         )
         .filter(EthereumLabel.label == event_type.value)
         .outerjoin(
@@ -64,9 +93,6 @@ def add_events(
             EthereumBlock,
             EthereumTransaction.block_number == EthereumBlock.block_number,
         )
-        .order_by(
-            EthereumLabel.created_at.asc(),
-        )
     )
     if bounds is not None:
         time_filters = [EthereumTransaction.block_number >= bounds.starting_block]
@@ -76,20 +102,72 @@ def add_events(
 
         query = query.filter(or_(*bounds_filters))
 
-    pbar = tqdm(total=(len(raw_created_at_list)))
-    pbar.set_description(f"Processing created ats")
-    pbar.update(initial_offset)
-    batch_start = 0
-    batch_end = batch_start + batch_size
-    while batch_start <= len(created_at_list):
+    cursor_created_at: Optional[datetime] = None
+    cursor_id: Optional[str] = None
+    export_cursor = get_export_cursor(datastore_conn, event_type)
+    if export_cursor is not None:
+        cursor_created_at, cursor_id = export_cursor
+        logger.info(
+            f"Resuming {event_type.value} export after label {cursor_id} created at {cursor_created_at}"
+        )
+    elif initial_offset > 0:
+        # Labels at legacy checkpoint created_at are written again, datastore ignores
+        # events which it already has
+        cursor_created_at = _legacy_offset_created_at(
+            db_session, event_type, initial_offset
+        )
+        if cursor_created_at is None:
+            logger.info(f"Checkpoint offset {initial_offset} is past the last label")
+            return
+        logger.info(
+            f"Resuming {event_type.value} export from labels created at {cursor_created_at}"
+        )
 
-        events = query.filter(
-            EthereumLabel.created_at.in_(created_at_list[batch_start : batch_end + 1])
-        ).all()
-        if not events:
-            continue
+    total: Optional[int] = None
+    if count_labels:
+        total_query = query
+        if cursor_created_at is not None:
+            total_query = total_query.filter(
+                EthereumLabel.created_at >= cursor_created_at
+            )
+        total = total_query.count()
+    pbar = tqdm(total=total)
+    pbar.set_description(f"Processing {event_type.value} labels")
 
-        raw_events_batch = []
+    def write_batch(raw_events_batch: List[NFTEvent], last_created_at, last_id) -> None:
+        insert_events(datastore_conn, raw_events_batch, commit=False)
+        set_export_cursor(
+            datastore_conn, event_type, last_created_at, last_id, commit=False
+        )
+        datastore_conn.commit()
+        pbar.update(len(raw_events_batch))
+
+    while True:
+        page_query = query
+        if cursor_created_at is not None and cursor_id is not None:
+            page_query = page_query.filter(
+                tuple_(EthereumLabel.created_at, EthereumLabel.id)
+                > tuple_(
+                    literal(cursor_created_at, EthereumLabel.created_at.type),
+                    literal(uuid.UUID(cursor_id), EthereumLabel.id.type),
+                )
+            )
+        elif cursor_created_at is not None:
+            page_query = page_query.filter(
+                EthereumLabel.created_at >= cursor_created_at
+            )
+        page_query = (
+            page_query.order_by(
+                EthereumLabel.created_at.asc(),
+                EthereumLabel.id.asc(),
+            )
+            .limit(page_size)
+            .execution_options(stream_results=True)
+            .yield_per(batch_size)
+        )
+
+        page_rows = 0
+        raw_events_batch: List[NFTEvent] = []
         for (
             event_id,
             label,
@@ -99,7 +177,10 @@ def add_events(
             value,
             block_number,
             timestamp,
-        ) in events:
+            created_at,
+        ) in page_query:
+            page_rows += 1
+            cursor_created_at, cursor_id = created_at, str(event_id)
             raw_event = NFTEvent(
                 event_id=event_id,
                 event_type=event_types[label],
@@ -113,15 +194,17 @@ def add_events(
                 timestamp=timestamp,
             )
             raw_events_batch.append(raw_event)
+            if len(raw_events_batch) >= batch_size:
+                write_batch(raw_events_batch, cursor_created_at, cursor_id)
+                raw_events_batch = []
+
+        if raw_events_batch:
+            write_batch(raw_events_batch, cursor_created_at, cursor_id)
+
+        if page_rows < page_size:
+            break
 
-        logger.info(f"Adding {len(raw_events_batch)} to database")
-        insert_events(
-            datastore_conn, raw_events_batch
-        )  # TODO REMOVED WEB3 enrich, since node is down
-        insert_checkpoint(datastore_conn, event_type, batch_end + initial_offset)
-        pbar.update(batch_end - batch_start + 1)
-        batch_start = batch_end + 1
-        batch_end = min(batch_end + batch_size, len(created_at_list))
+    pbar.close()
 
 
 def create_dataset(
@@ -130,6 +213,8 @@ def create_dataset(
     event_type: EventType,
     bounds: Optional[BlockBounds] = None,
     batch_size: int = 10,
+    page_size: int = 100000,
+    count_labels: bool = False,
 ) -> None:
     """
     Creates Moonstream NFTs dataset in the given SQLite datastore.
@@ -151,6 +236,8 @@ def create_dataset(
             offset,
             bounds,
             batch_size,
+            page_size,
+            count_labels,
         )
 
 
@@ -0,0 +1,71 @@
+"""Unique indexes for moonworm labels
+
+Revision ID: 1f90ae29fea0
+Revises: f991fc7493c8
+Create Date: 2022-03-02 12:14:36.120871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "1f90ae29fea0"
+down_revision = "f991fc7493c8"
+branch_labels = None
+depends_on = None
+
+
+LABELS_TABLES = ["ethereum_labels", "polygon_labels"]
+
+
+# Events are identified by (transaction_hash, log_index), transaction calls by
+# transaction_hash. Legacy event labels without log_index are kept as is.
+MOONWORM_EVENTS_WHERE = "label = 'moonworm-alpha' AND log_index IS NOT NULL"
+MOONWORM_CALLS_WHERE = (
+    "label = 'moonworm-alpha' AND log_index IS NULL AND label_data->>'type' = 'tx_call'"
+)
+
+
+def upgrade():
+    for table_name in LABELS_TABLES:
+        # Remove duplicates written before labels uniqueness was checked by database
+        for partition_columns, where in [
+            ("transaction_hash, log_index", MOONWORM_EVENTS_WHERE),
+            ("transaction_hash", MOONWORM_CALLS_WHERE),
+        ]:
+            op.execute(
+                f"""DELETE FROM {table_name} WHERE id IN (
+                    SELECT id FROM (
+                        SELECT
+                            id,
+                            ROW_NUMBER() OVER (
+                                PARTITION BY {partition_columns}
+                                ORDER BY created_at
+                            ) AS duplicate_number
+                        FROM {table_name}
+                        WHERE {where} AND transaction_hash IS NOT NULL
+                    ) AS labels
+                    WHERE duplicate_number > 1
+                )"""
+            )
+        op.create_index(
+            f"ix_{table_name}_moonworm_events_unique",
+            table_name,
+            ["transaction_hash", "log_index"],
+            unique=True,
+            postgresql_where=sa.text(MOONWORM_EVENTS_WHERE),
+        )
+        op.create_index(
+            f"ix_{table_name}_moonworm_calls_unique",
+            table_name,
+            ["transaction_hash"],
+            unique=True,
+            postgresql_where=sa.text(MOONWORM_CALLS_WHERE),
+        )
+
+
+def downgrade():
+    for table_name in LABELS_TABLES:
+        op.drop_index(f"ix_{table_name}_moonworm_calls_unique", table_name=table_name)
+        op.drop_index(f"ix_{table_name}_moonworm_events_unique", table_name=table_name)
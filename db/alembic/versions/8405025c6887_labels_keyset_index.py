@@ -0,0 +1,31 @@
+"""Index for keyset pagination of labels
+
+Revision ID: 8405025c6887
+Revises: 8d9c1b2e4f73
+Create Date: 2022-03-21 11:04:52.190318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8405025c6887"
+down_revision = "8d9c1b2e4f73"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_ethereum_labels_label_created_at_id",
+        "ethereum_labels",
+        ["label", "created_at", "id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_ethereum_labels_label_created_at_id", table_name="ethereum_labels"
+    )
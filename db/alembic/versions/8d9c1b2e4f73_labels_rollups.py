@@ -0,0 +1,81 @@
+"""Labels rollups for dashboards statistics
+
+Revision ID: 8d9c1b2e4f73
+Revises: 1f90ae29fea0
+Create Date: 2022-03-14 10:21:08.512347
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8d9c1b2e4f73"
+down_revision = "1f90ae29fea0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "label_count_rollups",
+        sa.Column("blockchain", sa.VARCHAR(length=128), nullable=False),
+        sa.Column("address", sa.VARCHAR(length=256), nullable=False),
+        sa.Column("label", sa.VARCHAR(length=256), nullable=False),
+        sa.Column("timestep", sa.Integer(), nullable=False),
+        sa.Column("bucket", sa.BigInteger(), nullable=False),
+        sa.Column("label_type", sa.VARCHAR(length=256), nullable=False),
+        sa.Column("label_name", sa.Text(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "blockchain",
+            "address",
+            "label",
+            "timestep",
+            "bucket",
+            "label_type",
+            "label_name",
+            name=op.f("pk_label_count_rollups"),
+        ),
+    )
+    op.create_table(
+        "label_argument_rollups",
+        sa.Column("blockchain", sa.VARCHAR(length=128), nullable=False),
+        sa.Column("address", sa.VARCHAR(length=256), nullable=False),
+        sa.Column("label", sa.VARCHAR(length=256), nullable=False),
+        sa.Column("label_type", sa.VARCHAR(length=256), nullable=False),
+        sa.Column("label_name", sa.Text(), nullable=False),
+        sa.Column("argument", sa.VARCHAR(length=256), nullable=False),
+        sa.Column("value", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "blockchain",
+            "address",
+            "label",
+            "label_type",
+            "label_name",
+            "argument",
+            "value",
+            name=op.f("pk_label_argument_rollups"),
+        ),
+    )
+    op.create_table(
+        "label_rollup_states",
+        sa.Column("blockchain", sa.VARCHAR(length=128), nullable=False),
+        sa.Column("address", sa.VARCHAR(length=256), nullable=False),
+        sa.Column("label", sa.VARCHAR(length=256), nullable=False),
+        sa.Column(
+            "backfilled_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("TIMEZONE('utc', statement_timestamp())"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint(
+            "blockchain", "address", "label", name=op.f("pk_label_rollup_states")
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("label_rollup_states")
+    op.drop_table("label_argument_rollups")
+    op.drop_table("label_count_rollups")
@@ -91,3 +91,14 @@ def yield_db_read_only_session() -> Session:
 
 
 yield_db_read_only_session_ctx = contextmanager(yield_db_read_only_session)
+
+
+def dispose_engines_after_fork() -> None:
+    """
+    Drops connections which forked worker process inherited from pools of parent
+    process, workers open their own connections.
+
+    Connections are dropped without closing them, parent process still uses them.
+    """
+    engine.dispose(close=False)
+    RO_engine.dispose(close=False)
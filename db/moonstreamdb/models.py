@@ -5,6 +5,7 @@ from sqlalchemy import (
     BigInteger,
     Column,
     DateTime,
+    Index,
     Integer,
     ForeignKey,
     MetaData,
@@ -13,7 +14,7 @@ from sqlalchemy import (
     VARCHAR,
 )
 from sqlalchemy.dialects.postgresql import JSONB, UUID
-from sqlalchemy.sql import expression
+from sqlalchemy.sql import expression, text
 from sqlalchemy.ext.compiler import compiles
 
 """
@@ -154,6 +155,29 @@ class EthereumLabel(Base):  # type: ignore
         DateTime(timezone=True), server_default=utcnow(), nullable=False
     )
 
+    __table_args__ = (
+        # Moonworm crawler writes one label per event log and per transaction call,
+        # legacy event labels without log_index are not unique
+        Index(
+            "ix_ethereum_labels_moonworm_events_unique",
+            "transaction_hash",
+            "log_index",
+            unique=True,
+            postgresql_where=text("label = 'moonworm-alpha' AND log_index IS NOT NULL"),
+        ),
+        Index(
+            "ix_ethereum_labels_moonworm_calls_unique",
+            "transaction_hash",
+            unique=True,
+            postgresql_where=text(
+                "label = 'moonworm-alpha' AND log_index IS NULL "
+                "AND label_data->>'type' = 'tx_call'"
+            ),
+        ),
+        # Keyset pagination of labels by (created_at, id) in NFTs dataset export
+        Index("ix_ethereum_labels_label_created_at_id", "label", "created_at", "id"),
+    )
+
 
 class PolygonBlock(Base):  # type: ignore
     __tablename__ = "polygon_blocks"
@@ -260,6 +284,27 @@ class PolygonLabel(Base):  # type: ignore
         DateTime(timezone=True), server_default=utcnow(), nullable=False
     )
 
+    __table_args__ = (
+        # Moonworm crawler writes one label per event log and per transaction call,
+        # legacy event labels without log_index are not unique
+        Index(
+            "ix_polygon_labels_moonworm_events_unique",
+            "transaction_hash",
+            "log_index",
+            unique=True,
+            postgresql_where=text("label = 'moonworm-alpha' AND log_index IS NOT NULL"),
+        ),
+        Index(
+            "ix_polygon_labels_moonworm_calls_unique",
+            "transaction_hash",
+            unique=True,
+            postgresql_where=text(
+                "label = 'moonworm-alpha' AND log_index IS NULL "
+                "AND label_data->>'type' = 'tx_call'"
+            ),
+        ),
+    )
+
 
 class ESDFunctionSignature(Base):  # type: ignore
     """
@@ -308,3 +353,54 @@ class OpenSeaCrawlingState(Base):  # type: ignore
     )
 
     total_count = Column(Integer, nullable=False)
+
+
+class LabelCountRollup(Base):  # type: ignore
+    """
+    Number of labels of address by label_data type and name in time buckets of
+    timestep seconds, bucket is timestamp of bucket start.
+
+    Rollups of crawler labels are updated by crawler in the same transaction as labels.
+    """
+
+    __tablename__ = "label_count_rollups"
+
+    blockchain = Column(VARCHAR(128), primary_key=True, nullable=False)
+    address = Column(VARCHAR(256), primary_key=True, nullable=False)
+    label = Column(VARCHAR(256), primary_key=True, nullable=False)
+    timestep = Column(Integer, primary_key=True, nullable=False)
+    bucket = Column(BigInteger, primary_key=True, nullable=False)
+    label_type = Column(VARCHAR(256), primary_key=True, nullable=False)
+    label_name = Column(Text, primary_key=True, nullable=False)
+    count = Column(BigInteger, nullable=False)
+
+
+class LabelArgumentRollup(Base):  # type: ignore
+    """
+    Distinct values of label_data argument of address labels with given type and name.
+    """
+
+    __tablename__ = "label_argument_rollups"
+
+    blockchain = Column(VARCHAR(128), primary_key=True, nullable=False)
+    address = Column(VARCHAR(256), primary_key=True, nullable=False)
+    label = Column(VARCHAR(256), primary_key=True, nullable=False)
+    label_type = Column(VARCHAR(256), primary_key=True, nullable=False)
+    label_name = Column(Text, primary_key=True, nullable=False)
+    argument = Column(VARCHAR(256), primary_key=True, nullable=False)
+    value = Column(Text, primary_key=True, nullable=False)
+
+
+class LabelRollupState(Base):  # type: ignore
+    """
+    Addresses labels with rollups built from all existing labels.
+    """
+
+    __tablename__ = "label_rollup_states"
+
+    blockchain = Column(VARCHAR(128), primary_key=True, nullable=False)
+    address = Column(VARCHAR(256), primary_key=True, nullable=False)
+    label = Column(VARCHAR(256), primary_key=True, nullable=False)
+    backfilled_at = Column(
+        DateTime(timezone=True), server_default=utcnow(), nullable=False
+    )